@@ -28,6 +28,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     
     # Third party apps
     'rest_framework',
@@ -42,6 +43,7 @@ INSTALLED_APPS = [
     'purchase_requests',
     'documents',
     'notifications',
+    'vendors',
 ]
 
 MIDDLEWARE = [
@@ -55,6 +57,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'organizations.middleware.OrganizationMiddleware',
+    'documents.middleware.RateLimitMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -229,6 +232,55 @@ cloudinary.config(
 # Google Gemini API Configuration
 GEMINI_API_KEY = config('GEMINI_API_KEY', default='')
 
+# Document extraction executor (concurrent model calls per worker process)
+DOCUMENT_EXTRACTION_CONCURRENCY = config('DOCUMENT_EXTRACTION_CONCURRENCY', default=8, cast=int)
+DOCUMENT_EXTRACTION_TIMEOUT = config('DOCUMENT_EXTRACTION_TIMEOUT', default=120, cast=float)
+
+# Rendered POs larger than this are uploaded in chunks of this size
+PO_UPLOAD_CHUNK_SIZE = config('PO_UPLOAD_CHUNK_SIZE', default=6 * 1024 * 1024, cast=int)
+
+# PO numbers each process reserves at a time; unused ones show up as gaps
+PO_NUMBER_BLOCK_SIZE = config('PO_NUMBER_BLOCK_SIZE', default=20, cast=int)
+
+# Process pool size for batch PO rendering (0 renders inline in the worker)
+PO_BATCH_WORKERS = config('PO_BATCH_WORKERS', default=2, cast=int)
+
+# Spool multipart uploads to UPLOAD_SPOOL_DIR (shared with the workers) and answer 202;
+# a worker pushes them to storage, so request latency does not depend on the provider
+ASYNC_UPLOADS = config('ASYNC_UPLOADS', default=False, cast=bool)
+UPLOAD_SPOOL_DIR = config('UPLOAD_SPOOL_DIR', default=str(MEDIA_ROOT / 'spool'))
+
+# Document storage: 'cloudinary', or 'local' to keep files under STORAGE_LOCAL_ROOT (served at /files/)
+STORAGE_BACKEND = config('STORAGE_BACKEND', default='cloudinary')
+STORAGE_LOCAL_ROOT = config('STORAGE_LOCAL_ROOT', default=str(MEDIA_ROOT / 'documents'))
+STORAGE_LOCAL_BASE_URL = config('STORAGE_LOCAL_BASE_URL', default='http://localhost:8000')
+# Internal nginx location mapped to STORAGE_LOCAL_ROOT; when set, files are sent with X-Accel-Redirect
+STORAGE_LOCAL_ACCEL_REDIRECT = config('STORAGE_LOCAL_ACCEL_REDIRECT', default='')
+
+# Direct-to-storage uploads: 'cloudinary', or 'local' for an upload endpoint in front of STORAGE_BACKEND
+DIRECT_UPLOAD_BACKEND = config('DIRECT_UPLOAD_BACKEND', default='cloudinary')
+# Seconds a client has from signing an upload to recording it
+DIRECT_UPLOAD_TTL = config('DIRECT_UPLOAD_TTL', default=900, cast=int)
+
+# Uploads are probed before anything decodes them: PDFs by page count, images by pixels
+UPLOAD_MAX_PDF_PAGES = config('UPLOAD_MAX_PDF_PAGES', default=100, cast=int)
+UPLOAD_MAX_IMAGE_PIXELS = config('UPLOAD_MAX_IMAGE_PIXELS', default=50_000_000, cast=int)
+
+# Image uploads are made upright, downscaled to this many DPI of an A4 page, re-encoded
+# and stripped of metadata before storage and extraction; IMAGE_KEEP_ORIGINAL stores the
+# uploaded file as well (under originals/)
+IMAGE_NORMALIZE = config('IMAGE_NORMALIZE', default=True, cast=bool)
+IMAGE_NORMALIZE_DPI = config('IMAGE_NORMALIZE_DPI', default=200, cast=int)
+IMAGE_NORMALIZE_FORMAT = config('IMAGE_NORMALIZE_FORMAT', default='JPEG')
+IMAGE_NORMALIZE_QUALITY = config('IMAGE_NORMALIZE_QUALITY', default=85, cast=int)
+IMAGE_KEEP_ORIGINAL = config('IMAGE_KEEP_ORIGINAL', default=False, cast=bool)
+
+# Resumable chunked uploads (/api/upload-sessions/), assembled under UPLOAD_SPOOL_DIR
+CHUNKED_UPLOAD_MAX_MB = config('CHUNKED_UPLOAD_MAX_MB', default=50, cast=int)
+CHUNKED_UPLOAD_CHUNK_SIZE = config('CHUNKED_UPLOAD_CHUNK_SIZE', default=5 * 1024 * 1024, cast=int)
+# Seconds an open session may sit idle before it expires and purge_upload_sessions removes it
+CHUNKED_UPLOAD_TTL = config('CHUNKED_UPLOAD_TTL', default=24 * 3600, cast=int)
+
 
 # Redis Configuration
 CACHES = {
@@ -239,6 +291,35 @@ CACHES = {
 }
 
 
+# Rate limits for external APIs (token buckets shared by all workers)
+RATE_LIMIT_BACKEND = config('RATE_LIMIT_BACKEND', default='redis')
+RATE_LIMIT_REDIS_URL = config('RATE_LIMIT_REDIS_URL', default=config('REDIS_URL', default='redis://127.0.0.1:6379/1'))
+RATE_LIMIT_BURST_SECONDS = config('RATE_LIMIT_BURST_SECONDS', default=5, cast=float)
+RATE_LIMIT_MAX_WAIT = config('RATE_LIMIT_MAX_WAIT', default=120, cast=float)
+# Web requests answer 429 instead of waiting longer than this
+RATE_LIMIT_REQUEST_MAX_WAIT = config('RATE_LIMIT_REQUEST_MAX_WAIT', default=2, cast=float)
+# Bearer token Prometheus sends to /metrics; the endpoint is disabled when empty
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+RATE_LIMITS = {
+    'gemini': {
+        'global': config('GEMINI_RATE_LIMIT', default='60/m'),
+        'organization': config('GEMINI_ORG_RATE_LIMIT', default='20/m'),
+    },
+    'cloudinary': {
+        'global': config('CLOUDINARY_RATE_LIMIT', default='300/m'),
+        'organization': config('CLOUDINARY_ORG_RATE_LIMIT', default='100/m'),
+    },
+}
+
+
+# Retry / circuit breaker policy for document tasks
+TASK_RETRY_MAX = config('TASK_RETRY_MAX', default=5, cast=int)
+TASK_RETRY_BACKOFF_BASE = config('TASK_RETRY_BACKOFF_BASE', default=5, cast=float)
+TASK_RETRY_BACKOFF_MAX = config('TASK_RETRY_BACKOFF_MAX', default=600, cast=float)
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = config('CIRCUIT_BREAKER_FAILURE_THRESHOLD', default=5, cast=int)
+CIRCUIT_BREAKER_RECOVERY_TIMEOUT = config('CIRCUIT_BREAKER_RECOVERY_TIMEOUT', default=60, cast=float)
+
+
 # Celery Configuration
 CELERY_BROKER_URL = config('CELERY_BROKER_URL', default='redis://127.0.0.1:6379/0')
 CELERY_RESULT_BACKEND = config('CELERY_RESULT_BACKEND', default='redis://127.0.0.1:6379/0')
@@ -247,6 +328,26 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+# PDF rendering is CPU-bound; keep it off the worker that runs extraction and email
+PO_TASK_QUEUE = config('PO_TASK_QUEUE', default='po')
+# Per-document extraction waits on the model; a threads-pool worker overlaps those waits
+EXTRACTION_TASK_QUEUE = config('EXTRACTION_TASK_QUEUE', default='extraction')
+CELERY_TASK_ROUTES = {
+    'documents.tasks.generate_purchase_order_task': {'queue': PO_TASK_QUEUE},
+    'documents.tasks.generate_purchase_orders_task': {'queue': PO_TASK_QUEUE},
+    'documents.tasks.process_proforma_task': {'queue': EXTRACTION_TASK_QUEUE},
+    'documents.tasks.process_receipt_task': {'queue': EXTRACTION_TASK_QUEUE},
+}
+
+# Users on digest delivery get their queued notifications in one email per interval
+NOTIFICATION_DIGEST_INTERVAL = config('NOTIFICATION_DIGEST_INTERVAL', default=3600, cast=int)
+CELERY_BEAT_SCHEDULE = {
+    'send-notification-digests': {
+        'task': 'notifications.tasks.send_notification_digests_task',
+        'schedule': NOTIFICATION_DIGEST_INTERVAL,
+    },
+}
+
 
 # Email Configuration
 EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.smtp.EmailBackend')
@@ -296,6 +397,15 @@ if 'test' in sys.argv or 'pytest' in sys.argv[0]:
     # Disable email sending in tests
     EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
     
+    # Keep rate limit buckets and circuit breaker state in-process (no Redis needed)
+    RATE_LIMIT_BACKEND = 'local'
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+    TASK_RETRY_BACKOFF_BASE = 0
+    
     # Disable migrations for faster tests (optional, can be enabled if needed)
     # class DisableMigrations:
     #     def __contains__(self, item):
@@ -4,13 +4,17 @@ URL configuration for config project.
 from django.contrib import admin
 from django.urls import path, include
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
-from .views import health_check
+from .views import health_check, metrics
+from documents.views import stored_file
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('health', health_check, name='health'),
+    path('metrics', metrics, name='metrics'),
+    path('files/<path:name>', stored_file, name='stored-file'),
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
     path('api/docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
     path('api/auth/', include('users.urls')),
     path('api/', include('purchase_requests.urls')),
+    path('api/', include('vendors.urls')),
 ]
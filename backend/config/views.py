@@ -1,10 +1,13 @@
 """
 Health check view for monitoring and Docker health checks.
 """
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import AllowAny
+import hmac
+from django.conf import settings
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.permissions import AllowAny, BasePermission
 from rest_framework.response import Response
 from rest_framework import status
+from django.http import HttpResponse
 
 
 @api_view(['GET'])
@@ -20,3 +23,29 @@ def health_check(request):
         status=status.HTTP_200_OK
     )
 
+
+
+class HasMetricsToken(BasePermission):
+    """Request carries `Authorization: Bearer <METRICS_TOKEN>`"""
+
+    def has_permission(self, request, view):
+        token = settings.METRICS_TOKEN
+        header = request.headers.get('Authorization', '')
+        return bool(token) and hmac.compare_digest(header.encode(), f'Bearer {token}'.encode())
+
+
+@api_view(['GET'])
+@authentication_classes([])
+@permission_classes([HasMetricsToken])
+def metrics(request):
+    """
+    Prometheus-style metrics endpoint.
+    Exposes rate limiter counters, including total throttle wait time
+    per external dependency. Requires the METRICS_TOKEN bearer token,
+    so quota usage is not published on the public API host.
+    """
+    from documents.rate_limit import get_rate_limit_metrics, format_prometheus_metrics
+    return HttpResponse(
+        format_prometheus_metrics(get_rate_limit_metrics()),
+        content_type='text/plain; version=0.0.4'
+    )
@@ -1,3 +1,19 @@
 from django.contrib import admin
+from .models import FailedTask
 
-# Register your models here.
+
+@admin.register(FailedTask)
+class FailedTaskAdmin(admin.ModelAdmin):
+    list_display = ['task_name', 'status', 'error_class', 'retries', 'is_permanent', 'created_at']
+    list_filter = ['status', 'task_name', 'is_permanent', 'created_at']
+    search_fields = ['task_name', 'task_id', 'error_message']
+    readonly_fields = ['created_at', 'replayed_at', 'replay_count']
+    actions = ['replay_tasks']
+
+    @admin.action(description='Replay selected failed tasks')
+    def replay_tasks(self, request, queryset):
+        replayed = 0
+        for failed_task in queryset.exclude(status=FailedTask.Status.DISCARDED):
+            failed_task.replay()
+            replayed += 1
+        self.message_user(request, f"Replayed {replayed} task(s)")
@@ -0,0 +1,286 @@
+"""
+Duplicate proforma and receipt detection
+
+At upload time, before any model call, the file is hashed (SHA-256 of
+the bytes, plus a 64-bit difference hash for images) and looked up
+against the organization's earlier uploads: identical bytes are exact
+duplicates, images within NEAR_DUPLICATE_DISTANCE bits are near
+duplicates (rescans, recompressions, screenshots). After extraction the
+invoice number, vendor, date and total are indexed as well, which
+catches the same invoice arriving as a different file.
+
+Exact duplicates also let extraction reuse the earlier result instead of
+calling the model again.
+"""
+import hashlib
+import logging
+import re
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from dateutil import parser as date_parser
+from django.db.models import Q
+from PIL import Image, UnidentifiedImageError
+from purchase_requests.models import Document, DocumentFingerprint, PurchaseRequest
+
+from .matching import to_number
+
+logger = logging.getLogger(__name__)
+
+# Largest Hamming distance between perceptual hashes treated as the same image;
+# with four 16-bit bands, pairs up to 3 bits apart are guaranteed to share a band
+NEAR_DUPLICATE_DISTANCE = 3
+HASH_SIZE = 8
+BAND_BITS = 16
+BANDS = 64 // BAND_BITS
+IMAGE_CONTENT_TYPES = {'image/jpeg', 'image/jpg', 'image/png', 'image/webp'}
+
+_INVOICE_NUMBER_RE = re.compile(r'[^A-Z0-9]+')
+
+
+@dataclass
+class UploadFingerprint:
+    content_hash: str
+    perceptual_hash: Optional[int] = None
+
+
+def content_hash(file) -> str:
+    """SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    file.seek(0)
+    chunks = file.chunks() if hasattr(file, 'chunks') else iter(lambda: file.read(64 * 1024), b'')
+    for chunk in chunks:
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def perceptual_hash(file) -> Optional[int]:
+    """
+    64-bit difference hash (dHash) of an image
+
+    The image is reduced to 9x8 grayscale and each bit records whether a
+    pixel is brighter than its right neighbour, so the hash survives
+    rescaling, recompression and small brightness changes.
+
+    Returns:
+        Hash as a signed 64-bit integer (fits a BigIntegerField), or None
+        if the file is not a readable image
+    """
+    try:
+        file.seek(0)
+        with Image.open(file) as image:
+            image.draft('L', (HASH_SIZE * 4, HASH_SIZE * 4))
+            pixels = list(image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS).getdata())
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+    finally:
+        file.seek(0)
+
+    value = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            right = pixels[row * (HASH_SIZE + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return ((a ^ b) & ((1 << 64) - 1)).bit_count()
+
+
+def hash_bands(value: int) -> List[int]:
+    """Split a 64-bit hash into BANDS unsigned integers"""
+    value &= (1 << 64) - 1
+    mask = (1 << BAND_BITS) - 1
+    return [(value >> (BAND_BITS * i)) & mask for i in range(BANDS)]
+
+
+def fingerprint_upload(file) -> UploadFingerprint:
+    """Hash an uploaded file; images also get a perceptual hash"""
+    return fingerprint_file(file, getattr(file, 'content_type', None))
+
+
+def fingerprint_file(file, content_type: Optional[str]) -> UploadFingerprint:
+    """Hash a file of the given content type"""
+    fingerprint = UploadFingerprint(content_hash=content_hash(file))
+    if content_type in IMAGE_CONTENT_TYPES:
+        fingerprint.perceptual_hash = perceptual_hash(file)
+    return fingerprint
+
+
+def find_duplicates(organization_id, fingerprint: UploadFingerprint, exclude_request_id=None) -> List[Dict[str, Any]]:
+    """
+    Earlier uploads in the organization with the same or a similar file
+
+    One indexed query: content hash equality OR any perceptual hash band
+    equal; band candidates are then confirmed by Hamming distance.
+
+    Returns:
+        List of {'kind': 'exact'|'near', 'request', 'document_type',
+        'file_url', 'distance'} dicts, exact matches first
+    """
+    query = Q(content_hash=fingerprint.content_hash)
+    if fingerprint.perceptual_hash is not None:
+        for i, band in enumerate(hash_bands(fingerprint.perceptual_hash)):
+            query |= Q(**{f'phash_band_{i}': band})
+
+    candidates = DocumentFingerprint.objects.filter(query, organization_id=organization_id)
+    if exclude_request_id is not None:
+        candidates = candidates.exclude(request_id=exclude_request_id)
+
+    matches, seen = [], set()
+    for candidate in candidates.values('request_id', 'document_type', 'file_url', 'content_hash', 'perceptual_hash'):
+        if candidate['content_hash'] == fingerprint.content_hash:
+            kind, distance = 'exact', 0
+        elif fingerprint.perceptual_hash is not None and candidate['perceptual_hash'] is not None:
+            distance = hamming_distance(candidate['perceptual_hash'], fingerprint.perceptual_hash)
+            if distance > NEAR_DUPLICATE_DISTANCE:
+                continue
+            kind = 'near'
+        else:
+            continue
+        key = (candidate['request_id'], candidate['document_type'], kind)
+        if key in seen:
+            continue
+        seen.add(key)
+        matches.append({
+            'kind': kind,
+            'request': str(candidate['request_id']),
+            'document_type': candidate['document_type'],
+            'file_url': candidate['file_url'],
+            'distance': distance,
+        })
+    return sorted(matches, key=lambda m: m['distance'])
+
+
+def record_upload(request: PurchaseRequest, document_type: str, file_url: str,
+                  fingerprint: UploadFingerprint) -> DocumentFingerprint:
+    """
+    Look up duplicates of an upload and store its fingerprint
+
+    Args:
+        request: Request the file was uploaded to
+        document_type: PROFORMA or RECEIPT
+        file_url: Stored file URL
+        fingerprint: Result of fingerprint_upload
+
+    Returns:
+        The new DocumentFingerprint, with `duplicates` filled in
+    """
+    duplicates = find_duplicates(request.organization_id, fingerprint, exclude_request_id=request.id)
+    bands = hash_bands(fingerprint.perceptual_hash) if fingerprint.perceptual_hash is not None else [None] * BANDS
+    record = DocumentFingerprint.objects.create(
+        organization_id=request.organization_id,
+        request=request,
+        document_type=document_type,
+        file_url=file_url,
+        content_hash=fingerprint.content_hash,
+        perceptual_hash=fingerprint.perceptual_hash,
+        duplicates=duplicates,
+        **{f'phash_band_{i}': band for i, band in enumerate(bands)}
+    )
+    if duplicates:
+        found = ', '.join(f"{d['kind']} {d['request']}" for d in duplicates)
+        logger.warning(f"{document_type} uploaded to request {request.id} duplicates {found}")
+    return record
+
+
+def normalize_invoice_number(value: Any) -> str:
+    """'inv-00123 ' -> 'INV00123'"""
+    return _INVOICE_NUMBER_RE.sub('', str(value or '').upper())[:100]
+
+
+def parse_document_date(value: Any) -> Optional[date]:
+    """Lenient parse of an extracted date; None if unreadable"""
+    text = str(value or '').strip()
+    if not text:
+        return None
+    try:
+        return date_parser.parse(text, dayfirst=False, fuzzy=True).date()
+    except (ValueError, OverflowError):
+        return None
+
+
+def record_extraction(request_id, document_type: str, file_url: str, extracted_data: Dict[str, Any],
+                      vendor=None) -> Optional[DocumentFingerprint]:
+    """
+    Index the identifying fields of an extracted upload and flag uploads
+    of the same invoice as other files
+
+    Returns:
+        The updated DocumentFingerprint, or None if the upload was never
+        fingerprinted (e.g. uploaded before duplicate detection existed)
+    """
+    record = DocumentFingerprint.objects.filter(
+        request_id=request_id, document_type=document_type, file_url=file_url
+    ).order_by('-created_at').first()
+    if record is None:
+        return None
+
+    record.invoice_number = normalize_invoice_number(extracted_data.get('invoice_number'))
+    record.vendor = vendor
+    record.document_date = parse_document_date(extracted_data.get('date'))
+    total = to_number(extracted_data.get('total_amount'))
+    record.total_amount = Decimal(str(round(total, 2))) if 0 < total < 1e10 else None
+
+    if vendor is not None:
+        same_invoice = Q()
+        if record.invoice_number:
+            same_invoice |= Q(invoice_number=record.invoice_number)
+        if record.document_date and record.total_amount:
+            same_invoice |= Q(document_date=record.document_date, total_amount=record.total_amount)
+        if same_invoice:
+            known = {(d['request'], d['document_type']) for d in record.duplicates}
+            matches = DocumentFingerprint.objects.filter(
+                same_invoice, organization_id=record.organization_id, vendor=vendor,
+                document_type=document_type
+            ).exclude(request_id=record.request_id).values(
+                'request_id', 'document_type', 'file_url', 'invoice_number'
+            )
+            for match in matches:
+                key = (str(match['request_id']), match['document_type'])
+                if key in known:
+                    continue
+                known.add(key)
+                record.duplicates.append({
+                    'kind': 'invoice_number' if match['invoice_number'] == record.invoice_number
+                    and record.invoice_number else 'vendor_date_total',
+                    'request': key[0],
+                    'document_type': match['document_type'],
+                    'file_url': match['file_url'],
+                    'distance': None,
+                })
+
+    record.save(update_fields=['invoice_number', 'vendor', 'document_date', 'total_amount', 'duplicates'])
+    return record
+
+
+def cached_extraction(request_id, document_type: str, file_url: str) -> Optional[Dict[str, Any]]:
+    """
+    Extracted data of an earlier byte-identical upload, if any
+
+    Lets extraction tasks skip the model call for exact duplicates.
+    """
+    record = DocumentFingerprint.objects.filter(
+        request_id=request_id, document_type=document_type, file_url=file_url
+    ).order_by('-created_at').first()
+    if record is None:
+        return None
+
+    earlier = DocumentFingerprint.objects.filter(
+        organization_id=record.organization_id,
+        content_hash=record.content_hash,
+        document_type=document_type,
+    ).exclude(id=record.id).values_list('request_id', 'file_url')
+    for other_request_id, other_url in earlier:
+        document = Document.objects.filter(
+            request_id=other_request_id, document_type=document_type, file_url=other_url
+        ).order_by('-created_at').values_list('extracted_data', flat=True).first()
+        if document:
+            # Validation results belong to the other request's PO
+            return {key: value for key, value in document.items() if key != 'validation'}
+    return None
@@ -0,0 +1,278 @@
+"""
+Asyncio-based extraction executor
+
+A Celery prefork worker normally handles one document at a time and sits
+idle while the model call is in flight. The executor runs many extractions
+concurrently inside a single worker process, bounded by a configurable
+concurrency limit, with a per-call timeout and cooperative cancellation.
+
+Batch runs (extract_documents_batch_task, reextract_documents) drive their
+own executor. Per-document tasks submit into one long-lived executor per
+process (shared_executor) whose event loop runs on a background thread, so
+a threads-pool worker overlaps the model calls of all its running tasks.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ExtractionJob:
+    """A single document to extract"""
+    request_id: str
+    document_type: str
+    file_url: str
+    organization_id: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, str]:
+        return {
+            'request_id': self.request_id,
+            'document_type': self.document_type,
+            'file_url': self.file_url,
+            'organization_id': self.organization_id,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, str]) -> 'ExtractionJob':
+        return cls(
+            request_id=str(data['request_id']),
+            document_type=data['document_type'],
+            file_url=data['file_url'],
+            organization_id=data.get('organization_id'),
+        )
+
+
+@dataclass
+class ExtractionResult:
+    """Outcome of one extraction job"""
+    job: ExtractionJob
+    data: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    exception: Optional[BaseException] = None
+    timed_out: bool = False
+    cancelled: bool = False
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and not self.timed_out and not self.cancelled
+
+
+@dataclass
+class ExtractionStats:
+    """Aggregate counters for a batch run"""
+    submitted: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    timed_out: int = 0
+    cancelled: int = 0
+    elapsed: float = 0.0
+    errors: List[str] = field(default_factory=list)
+
+    def record(self, result: ExtractionResult):
+        if result.ok:
+            self.succeeded += 1
+        elif result.cancelled:
+            self.cancelled += 1
+        elif result.timed_out:
+            self.timed_out += 1
+        else:
+            self.failed += 1
+            self.errors.append(f"{result.job.request_id}: {result.error}")
+
+
+class AsyncExtractionExecutor:
+    """
+    Run document extractions concurrently with bounded parallelism
+
+    Jobs are pulled lazily from the input iterable by a fixed pool of
+    worker coroutines, so pushing thousands of documents through the
+    executor never materialises more than `concurrency` calls at once.
+    """
+
+    def __init__(self, processor=None, concurrency: int = None, timeout: float = None):
+        """
+        Args:
+            processor: Object exposing aextract_proforma_data/aextract_receipt_data
+                (defaults to GeminiDocumentProcessor, created lazily)
+            concurrency: Maximum number of in-flight extractions
+            timeout: Per-call timeout in seconds
+        """
+        self._processor = processor
+        self.concurrency = max(1, concurrency or settings.DOCUMENT_EXTRACTION_CONCURRENCY)
+        self.timeout = timeout or settings.DOCUMENT_EXTRACTION_TIMEOUT
+        self._cancelled = False
+        self._in_flight: set = set()
+
+    @property
+    def processor(self):
+        if self._processor is None:
+            from .services import GeminiDocumentProcessor
+            self._processor = GeminiDocumentProcessor()
+        return self._processor
+
+    def _extractor_for(self, document_type: str):
+        from purchase_requests.models import Document
+        if document_type == Document.DocumentType.PROFORMA:
+            return self.processor.aextract_proforma_data
+        if document_type == Document.DocumentType.RECEIPT:
+            return self.processor.aextract_receipt_data
+        raise ValueError(f"Unsupported document type for extraction: {document_type}")
+
+    def cancel(self):
+        """Stop pulling new jobs and cancel every in-flight extraction"""
+        self._cancelled = True
+        for task in list(self._in_flight):
+            task.cancel()
+
+    async def submit(self, job: ExtractionJob) -> ExtractionResult:
+        """Extract a single document, honouring the per-call timeout"""
+        started = time.monotonic()
+        result = ExtractionResult(job=job)
+        if self._cancelled:
+            result.cancelled = True
+            return result
+        try:
+            extractor = self._extractor_for(job.document_type)
+            task = asyncio.ensure_future(
+                extractor(job.file_url, organization_id=job.organization_id)
+            )
+            self._in_flight.add(task)
+            try:
+                result.data = await asyncio.wait_for(task, timeout=self.timeout)
+            finally:
+                self._in_flight.discard(task)
+        except asyncio.TimeoutError as e:
+            result.timed_out = True
+            result.error = f"Extraction timed out after {self.timeout}s"
+            result.exception = e
+        except asyncio.CancelledError:
+            result.cancelled = True
+            result.error = "Extraction cancelled"
+        except Exception as e:
+            result.error = str(e)
+            result.exception = e
+        result.elapsed = time.monotonic() - started
+        return result
+
+    async def map(
+        self,
+        jobs: Iterable[ExtractionJob],
+        on_result: Optional[Callable[[ExtractionResult], None]] = None,
+    ) -> ExtractionStats:
+        """
+        Push every job through the executor
+
+        Args:
+            jobs: Any iterable of ExtractionJob (may be a lazy generator)
+            on_result: Synchronous callback invoked once per finished job. It
+                runs through sync_to_async so it may use the Django ORM.
+
+        Returns:
+            ExtractionStats for the run
+        """
+        stats = ExtractionStats()
+        started = time.monotonic()
+        job_iter = iter(jobs)
+        callback = sync_to_async(on_result, thread_sensitive=True) if on_result else None
+
+        async def worker():
+            while not self._cancelled:
+                try:
+                    job = next(job_iter)
+                except StopIteration:
+                    return
+                stats.submitted += 1
+                result = await self.submit(job)
+                stats.record(result)
+                if callback is not None:
+                    try:
+                        await callback(result)
+                    except Exception as e:
+                        logger.error(f"Error handling extraction result for request {job.request_id}: {str(e)}")
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        stats.elapsed = time.monotonic() - started
+        return stats
+
+    def run(
+        self,
+        jobs: Iterable[ExtractionJob],
+        on_result: Optional[Callable[[ExtractionResult], None]] = None,
+    ) -> ExtractionStats:
+        """Synchronous entry point for Celery tasks and management commands"""
+        return asyncio.run(self.map(jobs, on_result=on_result))
+
+    def run_one(self, job: ExtractionJob) -> ExtractionResult:
+        """Extract a single document synchronously through the executor"""
+        return asyncio.run(self.submit(job))
+
+
+class SharedExtractionExecutor:
+    """
+    A long-lived executor whose event loop runs on a daemon thread
+
+    Any thread may hand it a job with run_one and block on the result while
+    the loop keeps every other caller's extraction in flight. At most
+    `concurrency` extractions run at once across all callers.
+    """
+
+    def __init__(self, executor: AsyncExtractionExecutor = None):
+        """
+        Args:
+            executor: Executor to run jobs through (defaults to a new
+                AsyncExtractionExecutor)
+        """
+        self.executor = executor or AsyncExtractionExecutor()
+        self._slots = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name='extraction-executor', daemon=True
+        )
+        self._thread.start()
+
+    async def _submit(self, job: ExtractionJob) -> ExtractionResult:
+        # Created on the loop thread, so it binds to this loop
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.executor.concurrency)
+        async with self._slots:
+            return await self.executor.submit(job)
+
+    def run_one(self, job: ExtractionJob) -> ExtractionResult:
+        """Extract a single document on the shared loop, blocking the caller"""
+        return asyncio.run_coroutine_threadsafe(self._submit(job), self._loop).result()
+
+    def close(self):
+        """Stop the loop thread"""
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+_shared_lock = threading.Lock()
+_shared: Optional[SharedExtractionExecutor] = None
+_shared_pid: Optional[int] = None
+
+
+def shared_executor() -> SharedExtractionExecutor:
+    """
+    The process-wide executor used by per-document extraction tasks
+
+    Created on first use and again after a fork, since the loop thread does
+    not survive into prefork child processes.
+    """
+    global _shared, _shared_pid
+    with _shared_lock:
+        if _shared is None or _shared_pid != os.getpid():
+            _shared = SharedExtractionExecutor()
+            _shared_pid = os.getpid()
+        return _shared
@@ -0,0 +1,156 @@
+"""
+Image normalization
+
+Receipts arrive as full-resolution phone photos, several MB each, most of
+it resolution and metadata no one reads. Before an image is stored (and
+again before a stored image is sent to the model) it is:
+
+    - turned upright from its EXIF orientation
+    - downscaled so the long edge is IMAGE_NORMALIZE_DPI dots per inch of
+      an A4 page (2338 px at 200 DPI), decoding JPEGs at reduced size
+    - flattened to RGB or grayscale and re-encoded as IMAGE_NORMALIZE_FORMAT
+    - written without EXIF, GPS, ICC or XMP metadata
+
+With IMAGE_KEEP_ORIGINAL the uploaded file is also stored, under
+original_name() of the normalized file. PDFs and unreadable files are
+left alone.
+"""
+import logging
+import os
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Optional
+
+from django.conf import settings
+from PIL import Image, ImageOps, UnidentifiedImageError
+from PIL.ExifTags import Base as ExifTag
+
+from .duplicates import IMAGE_CONTENT_TYPES
+from .storage import get_storage, guess_content_type
+
+logger = logging.getLogger(__name__)
+
+# Long edge of an A4 page
+PAGE_INCHES = 11.69
+FORMATS = {
+    'JPEG': ('image/jpeg', '.jpg'),
+    'WEBP': ('image/webp', '.webp'),
+}
+
+
+@dataclass
+class NormalizedImage:
+    content: bytes
+    content_type: str
+    extension: str
+    width: int
+    height: int
+    original_size: int
+
+
+def max_edge() -> int:
+    """Longest edge in pixels a normalized image may have"""
+    return round(PAGE_INCHES * settings.IMAGE_NORMALIZE_DPI)
+
+
+def normalize_image(file) -> Optional[NormalizedImage]:
+    """
+    Normalize an image file
+
+    Args:
+        file: Readable binary file, left at position 0
+
+    Returns:
+        The normalized image, or None if the file is not a readable image
+        or is already normalized (upright, small enough, target format,
+        no metadata)
+    """
+    target_format = settings.IMAGE_NORMALIZE_FORMAT.upper()
+    content_type, extension = FORMATS[target_format]
+    limit = max_edge()
+    try:
+        file.seek(0, 2)
+        original_size = file.tell()
+        file.seek(0)
+        with Image.open(file) as image:
+            oriented = image.getexif().get(ExifTag.Orientation, 1) != 1
+            oversized = max(image.size) > limit
+            has_metadata = any(key in image.info for key in ('exif', 'icc_profile', 'xmp'))
+            if not (oriented or oversized or has_metadata or image.format != target_format):
+                return None
+
+            # JPEG decodes straight to a reduced scale (DCT scaling): far less work for phone photos
+            image.draft('RGB', (limit, limit))
+            normalized = ImageOps.exif_transpose(image)
+            normalized.thumbnail((limit, limit), Image.LANCZOS)
+            normalized = flatten(normalized)
+
+            out = BytesIO()
+            normalized.save(out, target_format, quality=settings.IMAGE_NORMALIZE_QUALITY, optimize=True)
+    except (UnidentifiedImageError, OSError, ValueError, Image.DecompressionBombError):
+        return None
+    finally:
+        file.seek(0)
+
+    if out.tell() >= original_size and not (oriented or has_metadata):
+        # Re-encoding gained nothing and there is nothing to strip
+        return None
+    return NormalizedImage(
+        content=out.getvalue(),
+        content_type=content_type,
+        extension=extension,
+        width=normalized.width,
+        height=normalized.height,
+        original_size=original_size,
+    )
+
+
+def flatten(image: Image.Image) -> Image.Image:
+    """RGB (alpha composited onto white) or grayscale, for formats without alpha"""
+    if image.mode in ('L', 'RGB'):
+        return image
+    if image.mode in ('1', 'I', 'I;16', 'F'):
+        return image.convert('L')
+    if image.mode == 'P' or image.mode.endswith('A') or 'transparency' in image.info:
+        rgba = image.convert('RGBA')
+        background = Image.new('RGB', rgba.size, 'white')
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def original_name(name: str) -> str:
+    """Storage name of the original kept for a normalized file: a/b/x.jpg -> a/b/originals/x"""
+    folder, filename = os.path.split(name)
+    return f'{folder}/originals/{os.path.splitext(filename)[0]}'
+
+
+def put_document(file, name: str, organization_id: Optional[str] = None) -> str:
+    """
+    Store an uploaded proforma or receipt, normalizing images first
+
+    Args:
+        file: Readable binary file
+        name: Storage name; its extension gives the content type, and is
+            replaced by the normalized format's
+        organization_id: Organization the upload is rate limited under
+
+    Returns:
+        URL of the stored file
+    """
+    storage = get_storage()
+    normalized = None
+    if settings.IMAGE_NORMALIZE and guess_content_type(name) in IMAGE_CONTENT_TYPES:
+        normalized = normalize_image(file)
+    if normalized is None:
+        return storage.put(file, name, organization_id=organization_id)
+
+    root, extension = os.path.splitext(name)
+    normalized_name = f'{root}{normalized.extension}'
+    if settings.IMAGE_KEEP_ORIGINAL:
+        storage.put(file, f'{original_name(normalized_name)}{extension}', organization_id=organization_id)
+    logger.info(
+        f"Normalized {name} to {normalized.width}x{normalized.height} {normalized.content_type}: "
+        f"{normalized.original_size} -> {len(normalized.content)} bytes"
+    )
+    return storage.put(BytesIO(normalized.content), normalized_name, organization_id=organization_id)
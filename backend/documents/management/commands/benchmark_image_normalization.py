@@ -0,0 +1,119 @@
+"""
+Benchmark image normalization
+
+Normalizes receipt photos (the given files, or synthetic phone photos of
+a printed receipt with camera EXIF) and reports bytes stored before and
+after, the base64 payload sent to the model, and normalization time.
+With --extract it also times a receipt extraction call on the original
+and on the normalized image (needs GEMINI_API_KEY; charges the API).
+"""
+import random
+import statistics
+import time
+from io import BytesIO
+
+from PIL import Image, ImageDraw, ImageFilter
+from PIL.ExifTags import Base as ExifTag
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from documents.images import max_edge, normalize_image
+from documents.schemas import ReceiptData
+from documents.services import GEMINI_MODEL, RECEIPT_PROMPT, GeminiDocumentProcessor
+
+
+def synthetic_receipt(width: int, height: int, rng: random.Random) -> bytes:
+    """A receipt photographed on a desk: text on paper, sensor noise, turned upright via EXIF"""
+    image = Image.new('RGB', (width, height), (96, 80, 64))
+    paper = Image.new('RGB', (int(width * 0.45), int(height * 0.9)), (246, 244, 238))
+    draw = ImageDraw.Draw(paper)
+    line_height = max(paper.height // 60, 10)
+    for y in range(line_height, paper.height - line_height, line_height):
+        text = f"{rng.choice(['ITEM', 'QTY', 'TOTAL', 'VAT'])} {rng.randint(1, 99)} x {rng.uniform(1, 500):.2f}"
+        draw.text((line_height, y), text, fill=(20, 20, 20), font_size=line_height * 0.8)
+    image.paste(paper, ((image.width - paper.width) // 2, (image.height - paper.height) // 2))
+    noise = Image.effect_noise(image.size, 12).convert('RGB')
+    image = Image.blend(image, noise, 0.08).filter(ImageFilter.GaussianBlur(0.6))
+
+    exif = Image.Exif()
+    exif[ExifTag.Make] = 'Phone'
+    exif[ExifTag.Orientation] = 6
+    out = BytesIO()
+    image.save(out, 'JPEG', quality=92, exif=exif.tobytes())
+    return out.getvalue()
+
+
+class Command(BaseCommand):
+    help = 'Benchmark image normalization (byte reduction, time, extraction latency)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', help='Image files (default: synthetic receipt photos)')
+        parser.add_argument('--count', type=int, default=10, help='Synthetic photos')
+        parser.add_argument('--width', type=int, default=4032, help='Synthetic photo width')
+        parser.add_argument('--height', type=int, default=3024, help='Synthetic photo height')
+        parser.add_argument('--extract', action='store_true', help='Also time extraction calls')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if options['files']:
+            originals = []
+            for path in options['files']:
+                with open(path, 'rb') as file:
+                    originals.append(file.read())
+        else:
+            if options['count'] < 1:
+                raise CommandError('--count must be positive')
+            rng = random.Random(options['seed'])
+            originals = [synthetic_receipt(options['width'], options['height'], rng)
+                         for _ in range(options['count'])]
+
+        results = []
+        for original in originals:
+            start = time.perf_counter()
+            normalized = normalize_image(BytesIO(original))
+            elapsed = time.perf_counter() - start
+            results.append((original, normalized, elapsed))
+
+        normalized_count = sum(1 for _, normalized, _ in results if normalized)
+        before = sum(len(original) for original, _, _ in results)
+        after = sum(len(normalized.content) if normalized else len(original) for original, normalized, _ in results)
+        self.stdout.write(
+            f"{len(results)} images, {normalized_count} normalized to <= {max_edge()} px "
+            f"({settings.IMAGE_NORMALIZE_DPI} DPI, {settings.IMAGE_NORMALIZE_FORMAT} q{settings.IMAGE_NORMALIZE_QUALITY})"
+        )
+        self.stdout.write(f"{'stored':<16} {before / len(results) / 1024:>9.1f} KiB -> "
+                          f"{after / len(results) / 1024:>8.1f} KiB  ({100 * (1 - after / before):.1f}% smaller)")
+        self.stdout.write(f"{'base64 payload':<16} {before * 4 / 3 / len(results) / 1024:>9.1f} KiB -> "
+                          f"{after * 4 / 3 / len(results) / 1024:>8.1f} KiB")
+        times = [elapsed * 1000 for _, _, elapsed in results]
+        self.stdout.write(f"{'normalize':<16} median {statistics.median(times):.1f} ms, max {max(times):.1f} ms")
+
+        if options['extract']:
+            self.time_extraction(results)
+
+    def time_extraction(self, results):
+        """Median latency of one receipt extraction call, original vs normalized"""
+        try:
+            processor = GeminiDocumentProcessor()
+        except ValueError as e:
+            raise CommandError(str(e))
+        config = processor._generation_config(ReceiptData)
+
+        def extract(content: bytes, mime_type: str) -> float:
+            start = time.perf_counter()
+            processor.client.models.generate_content(
+                model=GEMINI_MODEL, contents=processor._build_contents(RECEIPT_PROMPT, content, mime_type), config=config
+            )
+            return time.perf_counter() - start
+
+        original_times, normalized_times = [], []
+        for original, normalized, _ in results:
+            original_times.append(extract(original, Image.open(BytesIO(original)).get_format_mimetype()))
+            if normalized:
+                normalized_times.append(extract(normalized.content, normalized.content_type))
+            else:
+                normalized_times.append(original_times[-1])
+        original_median = statistics.median(original_times)
+        normalized_median = statistics.median(normalized_times)
+        self.stdout.write(f"{'extraction':<16} median {original_median:.2f}s -> {normalized_median:.2f}s "
+                          f"({original_median / normalized_median:.2f}x)")
@@ -0,0 +1,71 @@
+"""
+Benchmark rendering of very large purchase orders
+
+Reports render time, peak Python heap (tracemalloc) and PDF size per
+line count, optionally against the single-table layout (all lines in one
+table) that chunked rendering replaced. No database access.
+"""
+import random
+import time
+import tracemalloc
+import uuid
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.core.management.base import BaseCommand, CommandError
+from documents import po_generator
+from organizations.models import Organization
+from purchase_requests.models import PurchaseRequest
+
+from .benchmark_line_matching import synthetic_po
+
+
+class Command(BaseCommand):
+    help = 'Benchmark time and peak memory of rendering large purchase orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, nargs='+', default=[10, 1000, 10000],
+                            help='PO sizes to benchmark')
+        parser.add_argument('--compare-single-table', action='store_true',
+                            help='Also render each size as one table (slow for large POs)')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if any(n < 0 for n in options['lines']):
+            raise CommandError('--lines must be non-negative')
+
+        organization = Organization(id=1, name='Benchmark', settings={})
+        modes = [('chunked', po_generator.ITEM_CHUNK_ROWS)]
+        if options['compare_single_table']:
+            modes.append(('single table', 10 ** 9))
+
+        self.stdout.write(f"{'lines':>7} {'mode':<13} {'seconds':>8} {'lines/s':>9} {'peak MiB':>9} {'PDF KiB':>8}")
+        for lines in options['lines']:
+            rng = random.Random(options['seed'])
+            items = synthetic_po(lines, rng)
+            for item in items:
+                item['total'] = round(item['quantity'] * item['unit_price'], 2)
+            po_data = {'vendor_name': 'Acme', 'items': items, 'currency': 'USD',
+                       'total_amount': sum(item['total'] for item in items)}
+            request = PurchaseRequest(id=uuid.uuid4(), organization=organization, title='Benchmark',
+                                      description='Large synthetic purchase order', amount=Decimal('1.00'))
+
+            for mode, chunk_rows in modes:
+                with patch.object(po_generator, 'ITEM_CHUNK_ROWS', chunk_rows):
+                    start = time.perf_counter()
+                    pdf = po_generator.render_purchase_order(request, po_data)
+                    elapsed = time.perf_counter() - start
+                    pdf.seek(0, 2)
+                    size = pdf.tell()
+                    pdf.close()
+
+                    # Separate run: tracemalloc slows allocation-heavy code down
+                    tracemalloc.start()
+                    po_generator.render_purchase_order(request, po_data).close()
+                    _, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+
+                self.stdout.write(
+                    f"{lines:>7} {mode:<13} {elapsed:>8.3f} {lines / elapsed if elapsed else 0:>9.0f} "
+                    f"{peak / 2 ** 20:>9.1f} {size / 1024:>8.1f}"
+                )
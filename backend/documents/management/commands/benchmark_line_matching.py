@@ -0,0 +1,99 @@
+"""
+Benchmark the line-item matcher on large synthetic invoices
+
+Each run builds a PO, derives a receipt from it by shuffling the lines,
+dropping some, perturbing descriptions and changing a few quantities,
+and reports time, candidate pairs, block sizes and match quality.
+"""
+import random
+import time
+from django.core.management.base import BaseCommand, CommandError
+from documents.matching import MatchConfig, match_line_items
+
+PRODUCTS = [
+    'steel', 'bolt', 'washer', 'cable', 'paper', 'toner', 'chair', 'desk', 'lamp', 'drill',
+    'hinge', 'bracket', 'monitor', 'keyboard', 'adapter', 'battery', 'filter', 'valve', 'pump', 'sensor',
+]
+QUALIFIERS = [
+    'black', 'white', 'large', 'small', 'heavy', 'duty', 'm8', 'm10', '2m', '5m',
+    'a4', 'a3', 'usb', 'hdmi', 'led', 'oak', 'metal', 'plastic', 'pro', 'mini',
+]
+
+
+def synthetic_po(lines: int, rng: random.Random) -> list:
+    return [
+        {
+            'description': ' '.join(rng.sample(PRODUCTS, 2) + rng.sample(QUALIFIERS, 2)) + f' ref{rng.randint(1, lines)}',
+            'quantity': rng.randint(1, 100),
+            'unit_price': round(rng.uniform(0.5, 900), 2),
+        }
+        for _ in range(lines)
+    ]
+
+
+def derive_receipt(po: list, rng: random.Random, drop: float, noise: float, quantity_changes: float):
+    """Return (receipt, expected left->right mapping)"""
+    kept = [i for i in range(len(po)) if rng.random() >= drop]
+    rng.shuffle(kept)
+    receipt, expected = [], {}
+    for j, i in enumerate(kept):
+        line = dict(po[i])
+        words = line['description'].split()
+        if rng.random() < noise:
+            # Drop one word and swap two, like OCR/vendor rewording
+            words.pop(rng.randrange(len(words)))
+            a, b = rng.randrange(len(words)), rng.randrange(len(words))
+            words[a], words[b] = words[b], words[a]
+        line['description'] = ' '.join(words)
+        if rng.random() < quantity_changes:
+            line['quantity'] = max(0, line['quantity'] - rng.randint(1, 3))
+        receipt.append(line)
+        expected[i] = j
+    return receipt, expected
+
+
+class Command(BaseCommand):
+    help = 'Benchmark order-independent line-item matching on synthetic invoices'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, nargs='+', default=[100, 1000, 5000, 20000],
+                            help='Invoice sizes to benchmark')
+        parser.add_argument('--drop', type=float, default=0.02, help='Share of PO lines missing from the receipt')
+        parser.add_argument('--noise', type=float, default=0.3, help='Share of receipt lines with reworded descriptions')
+        parser.add_argument('--quantity-changes', type=float, default=0.02,
+                            help='Share of receipt lines with a different quantity')
+        parser.add_argument('--max-block-size', type=int, help='Override MatchConfig.max_block_size')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if any(n < 1 for n in options['lines']):
+            raise CommandError('--lines must be positive')
+
+        config = MatchConfig()
+        if options['max_block_size']:
+            config.max_block_size = options['max_block_size']
+
+        self.stdout.write(
+            f"{'lines':>7} {'seconds':>8} {'lines/s':>9} {'pairs':>8} {'blocks':>7} "
+            f"{'max blk':>7} {'matched':>8} {'partial':>8} {'unm PO':>7} {'unm rcpt':>8} {'precision':>9}"
+        )
+        for lines in options['lines']:
+            rng = random.Random(options['seed'])
+            po = synthetic_po(lines, rng)
+            receipt, expected = derive_receipt(
+                po, rng, options['drop'], options['noise'], options['quantity_changes']
+            )
+
+            start = time.perf_counter()
+            result = match_line_items(po, receipt, config)
+            elapsed = time.perf_counter() - start
+
+            pairs = result.pairs
+            correct = sum(1 for p in pairs if expected.get(p.left_index) == p.right_index)
+            precision = correct / len(pairs) if pairs else 1.0
+            self.stdout.write(
+                f"{lines:>7} {elapsed:>8.3f} {lines / elapsed if elapsed else 0:>9.0f} "
+                f"{result.candidate_pairs:>8} {result.blocks:>7} {result.largest_block:>7} "
+                f"{len(result.matched):>8} {len(result.partial):>8} {len(result.unmatched_left):>7} "
+                f"{len(result.unmatched_right):>8} {precision:>9.3f}"
+            )
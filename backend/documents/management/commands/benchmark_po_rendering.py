@@ -0,0 +1,109 @@
+"""
+Benchmark purchase order rendering throughput
+
+Renders synthetic POs with a template compiled per PO (building styles
+and fetching the logo every time) and with the cached compiled template,
+and reports POs per second for each. Logos are served from a local HTTP
+server; no database access.
+"""
+import random
+import threading
+import time
+import uuid
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+from PIL import Image
+
+from django.core.management.base import BaseCommand, CommandError
+from documents.po_generator import POTemplate, clear_po_template_cache, get_po_template
+from organizations.models import Organization
+from purchase_requests.models import PurchaseRequest
+
+from .benchmark_line_matching import synthetic_po
+
+
+def serve_logo() -> ThreadingHTTPServer:
+    """Serve a generated PNG logo on an ephemeral local port"""
+    buffer = BytesIO()
+    Image.new('RGB', (600, 200), (30, 90, 160)).save(buffer, 'PNG')
+    logo = buffer.getvalue()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(logo)))
+            self.end_headers()
+            self.wfile.write(logo)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Command(BaseCommand):
+    help = 'Benchmark purchase order PDF rendering (POs per second)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=200, help='POs to render per mode')
+        parser.add_argument('--lines', type=int, default=15, help='Line items per PO')
+        parser.add_argument('--organizations', type=int, default=5, help='Distinct branding configurations')
+        parser.add_argument('--no-logo', action='store_true', help='Brand without a logo')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if options['count'] < 1 or options['lines'] < 0 or options['organizations'] < 1:
+            raise CommandError('--count and --organizations must be positive, --lines non-negative')
+
+        rng = random.Random(options['seed'])
+        server = None if options['no_logo'] else serve_logo()
+        logo_url = f"http://127.0.0.1:{server.server_address[1]}/logo.png" if server else ''
+        organizations = [
+            Organization(id=i + 1, name=f'Org {i}', settings={'po_branding': {
+                'company_name': f'Org {i} Ltd', 'address': f'{i} Main Street\nNairobi',
+                'primary_color': f'#{rng.randint(0, 0xFFFFFF):06x}', 'terms': 'Net 30', 'logo_url': logo_url,
+            }})
+            for i in range(options['organizations'])
+        ]
+        jobs = []
+        for i in range(options['count']):
+            request = PurchaseRequest(
+                id=uuid.UUID(int=rng.getrandbits(128)), organization=organizations[i % len(organizations)],
+                title='Benchmark', description='Synthetic purchase order', amount=Decimal('1000.00')
+            )
+            items = synthetic_po(options['lines'], rng)
+            for item in items:
+                item['total'] = round(item['quantity'] * item['unit_price'], 2)
+            jobs.append((request, {'vendor_name': 'Acme', 'items': items, 'currency': 'USD',
+                                   'total_amount': sum(item['total'] for item in items)}))
+
+        def run(render):
+            start = time.perf_counter()
+            size = 0
+            for request, po_data in jobs:
+                size += len(render(request, po_data).getvalue())
+            return time.perf_counter() - start, size / len(jobs)
+
+        try:
+            compiled, _ = run(
+                lambda request, po_data: POTemplate(request.organization.po_branding).render(request, po_data)
+            )
+            clear_po_template_cache()
+            cached, average_size = run(
+                lambda request, po_data: get_po_template(request.organization).render(request, po_data)
+            )
+        finally:
+            if server:
+                server.shutdown()
+
+        count = options['count']
+        self.stdout.write(f"{count} POs x {options['lines']} lines, {options['organizations']} organizations, "
+                          f"avg {average_size / 1024:.1f} KiB")
+        self.stdout.write(f"{'compile per PO':<18} {count / compiled:>8.1f} POs/s  {compiled * 1000 / count:>7.2f} ms/PO")
+        self.stdout.write(f"{'cached template':<18} {count / cached:>8.1f} POs/s  {cached * 1000 / count:>7.2f} ms/PO")
+        self.stdout.write(f"speedup {compiled / cached:.2f}x; 10,000 POs in about {10000 * cached / count:.0f}s per worker")
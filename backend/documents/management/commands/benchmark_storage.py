@@ -0,0 +1,59 @@
+"""
+Benchmark document storage throughput
+
+Puts, reads back (hashing every byte, as duplicate detection does) and
+deletes --count files of --size KiB through the configured storage
+backend. With STORAGE_BACKEND=local this runs fully offline; against
+Cloudinary it also charges the upload rate limit.
+"""
+import hashlib
+import os
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from documents.storage import get_storage, storage_name
+
+
+class Command(BaseCommand):
+    help = 'Benchmark put/read/delete throughput of the configured document storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=200, help='Files to store')
+        parser.add_argument('--size', type=int, default=512, help='File size in KiB')
+
+    def handle(self, *args, **options):
+        if options['count'] < 1 or options['size'] < 1:
+            raise CommandError('--count and --size must be positive')
+
+        storage = get_storage()
+        content = os.urandom(options['size'] * 1024)
+        names = [storage_name('benchmark', '.pdf') for _ in range(options['count'])]
+        total_mib = len(content) * len(names) / 1024 / 1024
+        self.stdout.write(f"{settings.STORAGE_BACKEND}: {len(names)} files x {options['size']} KiB")
+
+        try:
+            start = time.perf_counter()
+            for name in names:
+                storage.put(BytesIO(content), name)
+            self._report('put', start, len(names), total_mib)
+
+            start = time.perf_counter()
+            for name in names:
+                digest = hashlib.sha256()
+                with storage.open(name) as file:
+                    for chunk in iter(lambda: file.read(64 * 1024), b''):
+                        digest.update(chunk)
+            self._report('read', start, len(names), total_mib)
+        finally:
+            start = time.perf_counter()
+            for name in names:
+                storage.delete(name)
+            self._report('delete', start, len(names), total_mib)
+
+    def _report(self, operation, start, count, total_mib):
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"  {operation:<6} {count / elapsed:>8.0f} files/s {total_mib / elapsed:>8.1f} MiB/s"
+        )
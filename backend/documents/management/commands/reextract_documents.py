@@ -0,0 +1,127 @@
+"""
+Backfill or re-run model extraction for stored proformas and receipts
+
+Jobs are streamed from the database in chunks and pushed through the
+AsyncExtractionExecutor, either inline in this process or as
+extract_documents_batch_task chunks on the Celery queue.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from purchase_requests.models import PurchaseRequest, Document
+from documents.executor import AsyncExtractionExecutor, ExtractionJob
+from documents.tasks import extract_documents_batch_task, store_extraction_result
+
+
+class Command(BaseCommand):
+    help = 'Backfill or re-run document extraction through the async extraction executor'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--type',
+            choices=['proforma', 'receipt', 'all'],
+            default='all',
+            help='Which documents to extract'
+        )
+        parser.add_argument('--organization', help='Only extract documents for this organization ID')
+        parser.add_argument(
+            '--missing-only',
+            action='store_true',
+            help='Skip requests that already have an extracted document of that type'
+        )
+        parser.add_argument('--chunk-size', type=int, default=200, help='Jobs per chunk')
+        parser.add_argument('--concurrency', type=int, help='In-flight extractions per chunk')
+        parser.add_argument('--timeout', type=float, help='Per-call timeout in seconds')
+        parser.add_argument('--limit', type=int, help='Stop after this many documents')
+        parser.add_argument(
+            '--enqueue',
+            action='store_true',
+            help='Send chunks to Celery instead of extracting in this process'
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        document_types = []
+        if options['type'] in ('proforma', 'all'):
+            document_types.append(Document.DocumentType.PROFORMA)
+        if options['type'] in ('receipt', 'all'):
+            document_types.append(Document.DocumentType.RECEIPT)
+
+        executor = None
+        if not options['enqueue']:
+            executor = AsyncExtractionExecutor(
+                concurrency=options['concurrency'],
+                timeout=options['timeout']
+            )
+
+        totals = {'submitted': 0, 'succeeded': 0, 'failed': 0, 'timed_out': 0}
+        for chunk in self._iter_chunks(document_types, options):
+            if options['enqueue']:
+                extract_documents_batch_task.delay(
+                    [job.to_dict() for job in chunk],
+                    concurrency=options['concurrency'],
+                    timeout=options['timeout']
+                )
+                totals['submitted'] += len(chunk)
+                self.stdout.write(f"Enqueued {len(chunk)} documents ({totals['submitted']} total)")
+                continue
+
+            stats = executor.run(chunk, on_result=store_extraction_result)
+            totals['submitted'] += stats.submitted
+            totals['succeeded'] += stats.succeeded
+            totals['failed'] += stats.failed
+            totals['timed_out'] += stats.timed_out
+            rate = stats.submitted / stats.elapsed if stats.elapsed else 0
+            self.stdout.write(
+                f"Chunk done: {stats.succeeded}/{stats.submitted} succeeded "
+                f"in {stats.elapsed:.1f}s ({rate:.1f} docs/s)"
+            )
+            for error in stats.errors:
+                self.stderr.write(f"  {error}")
+
+        if options['enqueue']:
+            self.stdout.write(self.style.SUCCESS(f"Enqueued {totals['submitted']} documents"))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Extracted {totals['succeeded']}/{totals['submitted']} documents "
+                f"({totals['failed']} failed, {totals['timed_out']} timed out)"
+            ))
+
+    def _iter_chunks(self, document_types, options):
+        """Yield lists of ExtractionJob, reading request rows in chunks"""
+        chunk_size = options['chunk_size']
+        limit = options['limit']
+        emitted = 0
+        chunk = []
+
+        for document_type in document_types:
+            url_field = (
+                'proforma_file_url'
+                if document_type == Document.DocumentType.PROFORMA
+                else 'receipt_file_url'
+            )
+            queryset = PurchaseRequest.objects.exclude(
+                **{f'{url_field}__isnull': True}
+            ).exclude(**{url_field: ''})
+            if options['organization']:
+                queryset = queryset.filter(organization_id=options['organization'])
+            if options['missing_only']:
+                queryset = queryset.exclude(documents__document_type=document_type)
+
+            rows = queryset.order_by('created_at').values_list('id', url_field, 'organization_id')
+            for request_id, file_url, organization_id in rows.iterator(chunk_size=chunk_size):
+                if limit is not None and emitted >= limit:
+                    break
+                chunk.append(ExtractionJob(
+                    request_id=str(request_id),
+                    document_type=document_type,
+                    file_url=file_url,
+                    organization_id=str(organization_id)
+                ))
+                emitted += 1
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+
+        if chunk:
+            yield chunk
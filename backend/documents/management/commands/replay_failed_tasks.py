@@ -0,0 +1,50 @@
+"""
+Replay document tasks from the FailedTask dead-letter store
+"""
+from django.core.management.base import BaseCommand
+from documents.models import FailedTask
+
+
+class Command(BaseCommand):
+    help = 'Re-enqueue failed document tasks recorded in the dead-letter store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help='FailedTask IDs (default: all FAILED)')
+        parser.add_argument('--task', help='Only replay this task name')
+        parser.add_argument(
+            '--include-permanent',
+            action='store_true',
+            help='Also replay failures classified as permanent'
+        )
+        parser.add_argument('--limit', type=int, help='Replay at most this many tasks')
+        parser.add_argument('--dry-run', action='store_true', help='List tasks without replaying')
+
+    def handle(self, *args, **options):
+        queryset = FailedTask.objects.filter(status=FailedTask.Status.FAILED).order_by('created_at')
+        if options['ids']:
+            queryset = queryset.filter(id__in=options['ids'])
+        if options['task']:
+            queryset = queryset.filter(task_name=options['task'])
+        if not options['include_permanent']:
+            queryset = queryset.filter(is_permanent=False)
+        if options['limit']:
+            queryset = queryset[:options['limit']]
+
+        replayed = 0
+        for failed_task in queryset:
+            self.stdout.write(
+                f"{failed_task.id}: {failed_task.task_name}{tuple(failed_task.args)} "
+                f"- {failed_task.error_class}: {failed_task.error_message[:120]}"
+            )
+            if options['dry_run']:
+                continue
+            try:
+                failed_task.replay()
+                replayed += 1
+            except Exception as e:
+                self.stderr.write(f"  replay failed: {str(e)}")
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('Dry run: nothing was replayed'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Replayed {replayed} task(s)"))
@@ -0,0 +1,70 @@
+"""
+Re-run receipt validation after tolerances or matching rules change
+
+Works entirely from stored extraction results: no model calls are made.
+Use --dry-run to print what would change without writing anything.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from purchase_requests.models import PurchaseRequest
+from documents.revalidation import ReceiptRevalidator
+
+
+class Command(BaseCommand):
+    help = 'Re-validate stored receipts against their PO and request items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organization', help='Only re-validate requests of this organization ID')
+        parser.add_argument('--status', choices=PurchaseRequest.Status.values,
+                            help='Only re-validate requests in this status')
+        parser.add_argument('--chunk-size', type=int, default=200, help='Requests per chunk')
+        parser.add_argument('--workers', type=int,
+                            help='Worker processes (default: CPU count; 0 runs inline)')
+        parser.add_argument('--dry-run', action='store_true', help='Report differences without writing')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+        if options['workers'] is not None and options['workers'] < 0:
+            raise CommandError('--workers must not be negative')
+
+        queryset = PurchaseRequest.objects.all()
+        if options['organization']:
+            queryset = queryset.filter(organization_id=options['organization'])
+        if options['status']:
+            queryset = queryset.filter(status=options['status'])
+
+        dry_run = options['dry_run']
+        revalidator = ReceiptRevalidator(
+            workers=options['workers'],
+            chunk_size=options['chunk_size'],
+            dry_run=dry_run,
+            on_progress=self._progress,
+            on_diff=self._diff if dry_run else None,
+        )
+        stats = revalidator.run(queryset)
+
+        verb = 'Would change' if dry_run else 'Changed'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {stats.changed} of {stats.receipts} receipts "
+            f"({stats.skipped} skipped without a PO) in {stats.elapsed:.1f}s"
+        ))
+        for transition, count in sorted(stats.status_changes.items()):
+            self.stdout.write(f"  {transition}: {count}")
+
+    def _progress(self, stats):
+        rate = stats.receipts / stats.elapsed if stats.elapsed else 0
+        self.stderr.write(
+            f"{stats.requests} requests, {stats.receipts} receipts, {stats.changed} changed "
+            f"({rate:.0f} receipts/s)"
+        )
+
+    def _diff(self, diff):
+        old_status, new_status = diff['status']
+        status = f" status {old_status} -> {new_status}" if old_status != new_status else ''
+        changes = ' '.join(
+            [f"+{t}" for t in diff['added']] + [f"-{t}" for t in diff['removed']]
+        )
+        self.stdout.write(
+            f"request {diff['request_id']} receipt {diff['document_id']}: "
+            f"valid {diff['was_valid']} -> {diff['is_valid']}{status} {changes}".rstrip()
+        )
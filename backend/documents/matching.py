@@ -0,0 +1,362 @@
+"""
+Order-independent line-item matching between two documents
+
+Lines are paired by description similarity and quantity/price closeness
+instead of list position, so a missing or reordered line only affects
+itself.
+
+- Blocking: an inverted token index proposes candidate pairs that share
+  an informative token, probing the rarest tokens first, and each line
+  keeps only its best `max_candidates` edges. The candidate graph splits into small connected
+  blocks, which keeps the work far below O(n*m).
+- Assignment: every block is solved optimally with the Hungarian
+  algorithm; blocks larger than `max_block_size` fall back to greedy
+  best-score-first matching.
+- Residual pass: lines left over are paired when their quantity and unit
+  price agree. The pair counts as matched only when one of the lines has
+  no readable description; two readable descriptions that did not pair
+  are reported as a partial pair with `description_ok` False.
+"""
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .schemas import coerce_number
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+STOPWORDS = frozenset({
+    'a', 'an', 'and', 'the', 'of', 'for', 'with', 'in', 'on', 'to', 'x', 'pcs', 'pc',
+    'ea', 'each', 'unit', 'units', 'qty', 'no',
+})
+
+
+def tokenize(description: Any) -> frozenset:
+    """Lowercase description tokens without stopwords"""
+    text = str(description or '').lower()
+    return frozenset(t for t in TOKEN_RE.findall(text) if t not in STOPWORDS)
+
+
+def to_number(value: Any) -> float:
+    """Lenient numeric coercion; unreadable amounts count as 0"""
+    try:
+        return coerce_number(value)
+    except ValueError:
+        return 0.0
+
+
+def relative_difference(a: float, b: float) -> float:
+    """|a - b| relative to the larger magnitude (0 when both are 0)"""
+    scale = max(abs(a), abs(b))
+    return abs(a - b) / scale if scale else 0.0
+
+
+@dataclass
+class MatchConfig:
+    """Thresholds for pairing and for classifying a pair as matched or partial"""
+
+    min_description_similarity: float = 0.3
+    quantity_tolerance: float = 0.01
+    quantity_relative_tolerance: float = 0.0
+    price_tolerance: float = 0.05
+    max_candidates: int = 10
+    max_block_size: int = 150
+    max_token_frequency: float = 0.2
+    description_weight: float = 0.6
+
+    @classmethod
+    def from_tolerances(cls, tolerances: Dict[str, float]) -> 'MatchConfig':
+        """Build a config from Organization.match_tolerances"""
+        return cls(
+            quantity_tolerance=tolerances['absolute'],
+            quantity_relative_tolerance=tolerances['quantity'],
+            price_tolerance=tolerances['unit_price'],
+        )
+
+
+@dataclass
+class Line:
+    index: int
+    description: str
+    quantity: float
+    unit_price: float
+    tokens: frozenset
+
+    @classmethod
+    def from_item(cls, index: int, item: Dict[str, Any]) -> 'Line':
+        return cls(
+            index=index,
+            description=str(item.get('description') or ''),
+            quantity=to_number(item.get('quantity')),
+            unit_price=to_number(item.get('unit_price')),
+            tokens=tokenize(item.get('description')),
+        )
+
+
+@dataclass
+class LinePair:
+    """One paired line; `status` is 'matched' or 'partial'"""
+    left_index: int
+    right_index: int
+    description_similarity: float
+    score: float
+    quantity_ok: bool
+    price_ok: bool
+    status: str
+    description_ok: bool = True
+
+
+@dataclass
+class MatchResult:
+    matched: List[LinePair] = field(default_factory=list)
+    partial: List[LinePair] = field(default_factory=list)
+    unmatched_left: List[int] = field(default_factory=list)
+    unmatched_right: List[int] = field(default_factory=list)
+    blocks: int = 0
+    largest_block: int = 0
+    candidate_pairs: int = 0
+
+    @property
+    def pairs(self) -> List[LinePair]:
+        return self.matched + self.partial
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'matched': [asdict(p) for p in self.matched],
+            'partial': [asdict(p) for p in self.partial],
+            'unmatched_left': self.unmatched_left,
+            'unmatched_right': self.unmatched_right,
+        }
+
+
+def hungarian(cost: List[List[float]]) -> List[Tuple[int, int]]:
+    """
+    Minimum-cost assignment for a rectangular cost matrix
+
+    Shortest augmenting path formulation, O(n^2 * m) for n <= m rows.
+
+    Returns:
+        (row, column) pairs, one per row of the smaller dimension
+    """
+    n = len(cost)
+    if n == 0:
+        return []
+    m = len(cost[0])
+    if n > m:
+        transposed = [[cost[i][j] for i in range(n)] for j in range(m)]
+        return [(i, j) for j, i in hungarian(transposed)]
+
+    inf = float('inf')
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    p = [0] * (m + 1)
+    way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [inf] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            row = cost[i0 - 1]
+            delta = inf
+            j1 = 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = row[j - 1] - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    return [(p[j] - 1, j - 1) for j in range(1, m + 1) if p[j]]
+
+
+class LineItemMatcher:
+    """Pair the lines of two documents independently of their order"""
+
+    def __init__(self, config: Optional[MatchConfig] = None):
+        self.config = config or MatchConfig()
+
+    def _score(self, left: Line, right: Line) -> Tuple[float, float]:
+        """Return (score, description similarity) for a candidate pair"""
+        union = len(left.tokens | right.tokens)
+        similarity = len(left.tokens & right.tokens) / union if union else 0.0
+        closeness = 1 - (
+            min(1.0, relative_difference(left.quantity, right.quantity))
+            + min(1.0, relative_difference(left.unit_price, right.unit_price))
+        ) / 2
+        weight = self.config.description_weight
+        return weight * similarity + (1 - weight) * closeness, similarity
+
+    def _candidates(self, left: List[Line], right: List[Line]) -> Dict[Tuple[int, int], Tuple[float, float]]:
+        """Candidate edges from the inverted token index"""
+        index = defaultdict(list)
+        for line in right:
+            for token in line.tokens:
+                index[token].append(line.index)
+
+        # Tokens present on a large share of lines ("service", "fee") do not
+        # discriminate and would collapse everything into one block
+        max_postings = max(5, int(len(right) * self.config.max_token_frequency))
+
+        # Rarest tokens first: they are the most selective, and probing stops
+        # once enough candidates are collected
+        budget = self.config.max_candidates * 5
+
+        edges = {}
+        for line in left:
+            shared = set()
+            postings_by_rarity = sorted(
+                (index[token] for token in line.tokens if token in index),
+                key=len
+            )
+            for postings in postings_by_rarity:
+                if len(postings) > max_postings:
+                    break
+                if shared and len(shared) + len(postings) > budget:
+                    break
+                shared.update(postings)
+            scored = []
+            for j in shared:
+                score, similarity = self._score(line, right[j])
+                if similarity >= self.config.min_description_similarity:
+                    scored.append((score, similarity, j))
+            scored.sort(reverse=True)
+            for score, similarity, j in scored[:self.config.max_candidates]:
+                edges[(line.index, j)] = (score, similarity)
+        return edges
+
+    @staticmethod
+    def _blocks(edges) -> List[Tuple[List[int], List[int], List[Tuple[int, int]]]]:
+        """Connected components of the bipartite candidate graph, with their edges"""
+        parent = {}
+
+        def find(node):
+            parent.setdefault(node, node)
+            while parent[node] != node:
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+            return node
+
+        for i, j in edges:
+            a, b = find(('L', i)), find(('R', j))
+            if a != b:
+                parent[a] = b
+
+        components = defaultdict(lambda: ([], [], []))
+        for node in list(parent):
+            side, idx = node
+            components[find(node)][0 if side == 'L' else 1].append(idx)
+        for i, j in edges:
+            components[find(('L', i))][2].append((i, j))
+        return list(components.values())
+
+    def _assign_block(self, rows: List[int], cols: List[int], block_edges, edges) -> List[Tuple[int, int]]:
+        if len(rows) + len(cols) > self.config.max_block_size:
+            # Greedy best-first keeps pathological blocks bounded
+            taken_rows, taken_cols, pairs = set(), set(), []
+            for i, j in sorted(block_edges, key=lambda e: edges[e][0], reverse=True):
+                if i not in taken_rows and j not in taken_cols:
+                    taken_rows.add(i)
+                    taken_cols.add(j)
+                    pairs.append((i, j))
+            return pairs
+
+        # Non-edges cost more than leaving both lines unmatched
+        cost = [[-edges[(i, j)][0] if (i, j) in edges else 1.0 for j in cols] for i in rows]
+        return [
+            (rows[r], cols[c]) for r, c in hungarian(cost)
+            if (rows[r], cols[c]) in edges
+        ]
+
+    def _pair(self, left: Line, right: Line, score: float, similarity: float,
+              description_ok: bool = True) -> LinePair:
+        quantity_ok = abs(left.quantity - right.quantity) <= max(
+            self.config.quantity_tolerance,
+            self.config.quantity_relative_tolerance * abs(left.quantity)
+        )
+        price_ok = (
+            left.unit_price <= 0
+            or abs(left.unit_price - right.unit_price) / left.unit_price <= self.config.price_tolerance
+        )
+        return LinePair(
+            left_index=left.index,
+            right_index=right.index,
+            description_similarity=round(similarity, 4),
+            score=round(score, 4),
+            quantity_ok=quantity_ok,
+            price_ok=price_ok,
+            status='matched' if quantity_ok and price_ok and description_ok else 'partial',
+            description_ok=description_ok,
+        )
+
+    def match(self, left_items: List[Dict[str, Any]], right_items: List[Dict[str, Any]]) -> MatchResult:
+        """
+        Match two lists of line items
+
+        Args:
+            left_items: Reference lines (e.g. the PO)
+            right_items: Lines to check (e.g. the receipt)
+
+        Returns:
+            MatchResult with matched/partial pairs and unmatched indexes
+        """
+        left = [Line.from_item(i, item) for i, item in enumerate(left_items)]
+        right = [Line.from_item(j, item) for j, item in enumerate(right_items)]
+        edges = self._candidates(left, right)
+        blocks = self._blocks(edges)
+
+        result = MatchResult(candidate_pairs=len(edges), blocks=len(blocks))
+        assigned = []
+        for rows, cols, block_edges in blocks:
+            result.largest_block = max(result.largest_block, len(rows) + len(cols))
+            for i, j in self._assign_block(rows, cols, block_edges, edges):
+                score, similarity = edges[(i, j)]
+                assigned.append(self._pair(left[i], right[j], score, similarity))
+
+        # Residual pass on amounts for lines the descriptions could not pair
+        used_left = {p.left_index for p in assigned}
+        used_right = {p.right_index for p in assigned}
+        by_amount = defaultdict(list)
+        for line in right:
+            if line.index not in used_right:
+                by_amount[(round(line.quantity, 2), round(line.unit_price, 2))].append(line.index)
+        for line in left:
+            if line.index in used_left:
+                continue
+            bucket = by_amount.get((round(line.quantity, 2), round(line.unit_price, 2)))
+            if bucket:
+                j = bucket.pop(0)
+                score, similarity = self._score(line, right[j])
+                # Equal amounts only vouch for lines without a readable description
+                description_ok = not line.tokens or not right[j].tokens
+                assigned.append(self._pair(line, right[j], score, similarity, description_ok))
+                used_left.add(line.index)
+                used_right.add(j)
+
+        for pair in sorted(assigned, key=lambda p: p.left_index):
+            (result.matched if pair.status == 'matched' else result.partial).append(pair)
+        result.unmatched_left = [line.index for line in left if line.index not in used_left]
+        result.unmatched_right = [line.index for line in right if line.index not in used_right]
+        return result
+
+
+def match_line_items(left_items, right_items, config: Optional[MatchConfig] = None) -> MatchResult:
+    """Match two lists of line items with the default matcher"""
+    return LineItemMatcher(config).match(left_items, right_items)
@@ -0,0 +1,36 @@
+import math
+from django.conf import settings
+from django.http import JsonResponse
+from .rate_limit import RateLimitExceeded, max_wait_limit
+
+# What a throttled caller is told, by rate limiter name
+THROTTLED_DETAIL = {
+    'cloudinary': 'Too many uploads for your organization right now. Please try again shortly.',
+    'gemini': 'Too many documents are being processed for your organization right now. Please try again shortly.',
+}
+
+class RateLimitMiddleware:
+    """
+    Keep external API throttling from holding web workers
+
+    Rate limiter waits during a request are capped at
+    RATE_LIMIT_REQUEST_MAX_WAIT; a caller still throttled after that gets
+    429 Too Many Requests with a Retry-After header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with max_wait_limit(settings.RATE_LIMIT_REQUEST_MAX_WAIT):
+            return self.get_response(request)
+
+    def process_exception(self, request, exception):
+        if not isinstance(exception, RateLimitExceeded):
+            return None
+        detail = THROTTLED_DETAIL.get(
+            exception.limiter, 'Too many requests for your organization right now. Please try again shortly.'
+        )
+        response = JsonResponse({'detail': detail}, status=429)
+        response['Retry-After'] = str(max(1, math.ceil(exception.retry_after or 1)))
+        return response
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.8 on 2026-10-19 08:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FailedTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_name', models.CharField(max_length=255)),
+                ('task_id', models.CharField(blank=True, max_length=255)),
+                ('args', models.JSONField(default=list)),
+                ('kwargs', models.JSONField(default=dict)),
+                ('error_class', models.CharField(max_length=255)),
+                ('error_message', models.TextField(blank=True)),
+                ('traceback', models.TextField(blank=True)),
+                ('retries', models.IntegerField(default=0)),
+                ('is_permanent', models.BooleanField(default=False, help_text='Failure was classified as permanent (not retried)')),
+                ('status', models.CharField(choices=[('FAILED', 'Failed'), ('REPLAYED', 'Replayed'), ('DISCARDED', 'Discarded')], default='FAILED', max_length=20)),
+                ('replay_count', models.IntegerField(default=0)),
+                ('replayed_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'task_name'], name='documents_f_status_21f329_idx')],
+            },
+        ),
+    ]
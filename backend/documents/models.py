@@ -1,3 +1,55 @@
+from celery import current_app
 from django.db import models
+from django.utils import timezone
 
-# Create your models here.
+
+class FailedTask(models.Model):
+    """Dead-letter record for a document task that could not complete"""
+
+    class Status(models.TextChoices):
+        FAILED = 'FAILED', 'Failed'
+        REPLAYED = 'REPLAYED', 'Replayed'
+        DISCARDED = 'DISCARDED', 'Discarded'
+
+    task_name = models.CharField(max_length=255)
+    task_id = models.CharField(max_length=255, blank=True)
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    error_class = models.CharField(max_length=255)
+    error_message = models.TextField(blank=True)
+    traceback = models.TextField(blank=True)
+    retries = models.IntegerField(default=0)
+    is_permanent = models.BooleanField(
+        default=False,
+        help_text="Failure was classified as permanent (not retried)"
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=Status.choices,
+        default=Status.FAILED
+    )
+    replay_count = models.IntegerField(default=0)
+    replayed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'task_name']),
+        ]
+
+    def __str__(self):
+        return f"{self.task_name} - {self.get_status_display()}"
+
+    def replay(self):
+        """Re-enqueue the original task with its original arguments"""
+        task = current_app.tasks.get(self.task_name)
+        if task is not None:
+            result = task.apply_async(args=self.args, kwargs=self.kwargs)
+        else:
+            result = current_app.send_task(self.task_name, args=self.args, kwargs=self.kwargs)
+        self.status = self.Status.REPLAYED
+        self.replay_count += 1
+        self.replayed_at = timezone.now()
+        self.save(update_fields=['status', 'replay_count', 'replayed_at'])
+        return result
@@ -0,0 +1,280 @@
+"""
+Batch purchase order generation
+
+Rendering a PO is pure CPU work on a snapshot of the request, its
+organization branding and the PO data, so a batch is fanned out to a
+process pool: each worker keeps its own compiled template cache and
+writes the PDF to a temp file, and the parent uploads and stores each PO
+as soon as it is rendered, overlapping the uploads with the rendering of
+the rest. Requests whose current PO was rendered from the same inputs
+are skipped (see po_render_key). Used for bulk approvals and by the
+regenerate_pos command after a template change.
+"""
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from decimal import Decimal
+from itertools import islice
+from tempfile import NamedTemporaryFile
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from organizations.models import Organization
+from purchase_requests.models import Document, PurchaseRequest
+from purchase_requests.po_numbers import assign_po_number
+
+from .po_generator import TEMPLATE_VERSION, get_po_template, po_render_key
+from .tasks import get_po_data, store_purchase_order, upload_purchase_order
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class POBatchStats:
+    requests: int = 0
+    generated: int = 0
+    cached: int = 0
+    skipped: int = 0
+    failed: List[str] = field(default_factory=list)
+    render_seconds: List[float] = field(default_factory=list)
+    upload_seconds: List[float] = field(default_factory=list)
+    bytes: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """Generated POs per second of wall time"""
+        return self.generated / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'requests': self.requests,
+            'generated': self.generated,
+            'cached': self.cached,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'elapsed': self.elapsed,
+            'throughput': self.throughput,
+            'render_p50': percentile(self.render_seconds, 0.5),
+            'render_p95': percentile(self.render_seconds, 0.95),
+        }
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile; 0.0 for no values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def render_po_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Render one PO snapshot into a temp file (runs in a worker process)
+
+    Args:
+        payload: request_id, po_number, title, description, amount,
+            organization_id, organization_name, organization_settings and
+            po_data
+
+    Returns:
+        request_id with the temp file path, its size and the render time.
+        The caller deletes the file.
+    """
+    start = time.perf_counter()
+    organization = Organization(
+        id=payload['organization_id'], name=payload['organization_name'],
+        settings=payload['organization_settings']
+    )
+    request = PurchaseRequest(
+        id=payload['request_id'], po_number=payload['po_number'], organization=organization,
+        title=payload['title'], description=payload['description'], amount=Decimal(payload['amount'])
+    )
+    with NamedTemporaryFile(suffix='.pdf', delete=False) as output:
+        try:
+            get_po_template(organization).render(request, payload['po_data'], output)
+        except Exception:
+            output.close()
+            os.unlink(output.name)
+            raise
+        size = output.seek(0, os.SEEK_END)
+    return {
+        'request_id': payload['request_id'],
+        'path': output.name,
+        'bytes': size,
+        'render_seconds': time.perf_counter() - start,
+    }
+
+
+class PurchaseOrderBatch:
+    """
+    Render a batch of POs in a process pool, then upload and store them
+
+    Args:
+        workers: Process pool size (default: CPU count); 0 renders inline
+        chunk_size: Requests loaded and submitted per round
+        regenerate: Render each request's PO from the data of its latest
+            PO document instead of from get_po_data
+        force: Render even when the current PO is up to date
+        dry_run: Render only; nothing is uploaded or saved
+        on_result: Called with request_id, render_seconds, upload_seconds
+            and bytes of each generated PO
+        on_progress: Called with the running POBatchStats after each chunk
+    """
+
+    def __init__(self, workers: Optional[int] = None, chunk_size: int = 100, regenerate: bool = False,
+                 force: bool = False, dry_run: bool = False, on_result: Optional[Callable] = None,
+                 on_progress: Optional[Callable] = None):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.regenerate = regenerate
+        self.force = force
+        self.dry_run = dry_run
+        self.on_result = on_result
+        self.on_progress = on_progress
+
+    def _payloads(self, request_ids: List, stats: POBatchStats) -> tuple:
+        """Snapshot everything the workers need to render these requests"""
+        requests = {
+            request.id: request
+            for request in PurchaseRequest.objects.filter(id__in=request_ids).select_related(
+                'organization'
+            ).prefetch_related('items')
+        }
+        po_docs = Document.objects.filter(request_id__in=request_ids, document_type=Document.DocumentType.PO)
+        current_keys = dict(
+            po_docs.filter(template_version=TEMPLATE_VERSION).values_list('request_id', 'render_key')
+        )
+        existing = {}
+        if self.regenerate:
+            for doc in po_docs.order_by('request_id', '-created_at').values('request_id', 'extracted_data'):
+                existing.setdefault(doc['request_id'], doc['extracted_data'])
+
+        payloads, meta = [], {}
+        for request_id, request in requests.items():
+            if self.regenerate:
+                po_data = existing.get(request_id)
+            else:
+                try:
+                    po_data = get_po_data(request)
+                except Exception as e:
+                    logger.error(f"Could not load PO data for request {request_id}: {str(e)}")
+                    stats.failed.append(str(request_id))
+                    continue
+            if not po_data:
+                stats.skipped += 1
+                continue
+            if not self.dry_run:
+                assign_po_number(request)
+            render_key = po_render_key(request, po_data)
+            if not self.force and current_keys.get(request_id) == render_key:
+                stats.cached += 1
+                continue
+
+            organization = request.organization
+            payloads.append({
+                'request_id': request_id,
+                'po_number': request.po_number,
+                'title': request.title,
+                'description': request.description,
+                'amount': str(request.amount),
+                'organization_id': organization.id,
+                'organization_name': organization.name,
+                'organization_settings': organization.settings,
+                'po_data': po_data,
+            })
+            meta[request_id] = {
+                'request': request,
+                'po_data': po_data,
+                'render_key': render_key,
+            }
+        # IDs that no longer exist
+        stats.skipped += len({str(i) for i in request_ids} - {str(i) for i in requests})
+        return payloads, meta
+
+    def _store(self, rendered: Dict[str, Any], meta: Dict, stats: POBatchStats):
+        """Upload a rendered PO and point its request at it"""
+        info = meta[rendered['request_id']]
+        request = info['request']
+        start = time.perf_counter()
+        try:
+            if not self.dry_run:
+                po_file_url = upload_purchase_order(
+                    open(rendered['path'], 'rb'), str(request.organization_id), info['render_key']
+                )
+                store_purchase_order(request, info['po_data'], po_file_url, info['render_key'])
+        finally:
+            os.unlink(rendered['path'])
+        upload_seconds = time.perf_counter() - start
+
+        stats.generated += 1
+        stats.bytes += rendered['bytes']
+        stats.render_seconds.append(rendered['render_seconds'])
+        stats.upload_seconds.append(upload_seconds)
+        if self.on_result:
+            self.on_result({
+                'request_id': str(request.id),
+                'render_seconds': rendered['render_seconds'],
+                'upload_seconds': upload_seconds,
+                'bytes': rendered['bytes'],
+            })
+
+    def _rendered(self, pool, payloads: List[Dict], stats: POBatchStats) -> Iterable[Dict]:
+        """Rendered POs in completion order; render failures are recorded and skipped"""
+        if pool is None:
+            futures = None
+            results = ((payload, None) for payload in payloads)
+        else:
+            futures = {pool.submit(render_po_payload, payload): payload for payload in payloads}
+            results = ((futures[future], future) for future in as_completed(futures))
+
+        for payload, future in results:
+            try:
+                yield future.result() if future is not None else render_po_payload(payload)
+            except Exception as e:
+                logger.error(f"Error rendering PO for request {payload['request_id']}: {str(e)}")
+                stats.failed.append(str(payload['request_id']))
+
+    def run(self, request_ids: Iterable) -> POBatchStats:
+        """
+        Generate POs for every request in `request_ids`
+
+        A failure to render, upload or store one PO is logged and recorded
+        in stats.failed; the rest of the batch carries on.
+
+        Args:
+            request_ids: PurchaseRequest IDs (any iterable, consumed in chunks)
+
+        Returns:
+            POBatchStats for the run
+        """
+        stats = POBatchStats()
+        start = time.monotonic()
+        pool = ProcessPoolExecutor(max_workers=self.workers) if self.workers != 0 else None
+        request_ids = iter(request_ids)
+        try:
+            while chunk := list(islice(request_ids, self.chunk_size)):
+                payloads, meta = self._payloads(chunk, stats)
+                for rendered in self._rendered(pool, payloads, stats):
+                    try:
+                        self._store(rendered, meta, stats)
+                    except Exception as e:
+                        logger.error(f"Error storing PO for request {rendered['request_id']}: {str(e)}")
+                        stats.failed.append(str(rendered['request_id']))
+
+                stats.requests += len(chunk)
+                stats.elapsed = time.monotonic() - start
+                if self.on_progress:
+                    self.on_progress(stats)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        stats.elapsed = time.monotonic() - start
+        logger.info(
+            f"PO batch {'(dry run) ' if self.dry_run else ''}finished: {stats.generated}/{stats.requests} "
+            f"generated, {stats.cached} up to date, {stats.skipped} skipped, {len(stats.failed)} failed "
+            f"in {stats.elapsed:.1f}s ({stats.throughput:.1f} POs/s, render p50 {percentile(stats.render_seconds, 0.5) * 1000:.0f} ms)"
+        )
+        return stats
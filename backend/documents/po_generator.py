@@ -1,138 +1,466 @@
+"""
+Purchase order PDF rendering
+
+Styles, table styles, fonts and an organization's branding (logo,
+address, default terms, colors) are compiled once into a POTemplate and
+cached per worker process, keyed by organization and a digest of its
+branding settings, so changing the settings recompiles on next use and
+rendering a PO only lays out its own data.
+"""
+import hashlib
+import json
+import logging
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime
 from io import BytesIO
-from reportlab.lib.pagesizes import letter
+from tempfile import SpooledTemporaryFile
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+from xml.sax.saxutils import escape
+
+import requests
+from PIL import Image
+from reportlab import rl_config
 from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
 from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_CENTER, TA_RIGHT
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase.pdfdoc import PDFArray, PDFName, PDFStream
+from reportlab.pdfgen.canvas import Canvas
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+from organizations.models import DEFAULT_PO_BRANDING
 from purchase_requests.models import PurchaseRequest
-from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Bump after a layout change: invalidates cached templates and rendered POs
+TEMPLATE_VERSION = 1
+TEMPLATE_CACHE_SIZE = 256
+# Line items per table; see POTemplate._item_tables
+ITEM_CHUNK_ROWS = 100
+# Rendered POs stay in memory up to this size, then spill to a temp file
+SPOOL_MAX_BYTES = 5 * 1024 * 1024
+LOGO_TIMEOUT = 5
+LOGO_MAX_BYTES = 2 * 1024 * 1024
+# Printed logo box (width, height) in points
+LOGO_BOX = (1.6 * inch, 0.6 * inch)
+
+# Page streams are Flate-compressed either way; the extra ASCII85 layer
+# only grows the file and, without reportlab's C accelerator, is a large
+# share of render time
+rl_config.useA85 = 0
+
+# Standard PDF fonts need no embedding; (regular, bold)
+FONTS = {
+    'Helvetica': ('Helvetica', 'Helvetica-Bold'),
+    'Times-Roman': ('Times-Roman', 'Times-Bold'),
+    'Courier': ('Courier', 'Courier-Bold'),
+}
+
+
+def branding_version(branding: Dict[str, str]) -> str:
+    """Digest identifying a branding configuration"""
+    payload = json.dumps({'v': TEMPLATE_VERSION, **branding}, sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+def po_render_key(request: PurchaseRequest, po_data: dict) -> str:
+    """
+    Digest of everything a rendered PO depends on
+
+    Covers the request fields printed on the PO (including its PO number),
+    its line items, the PO data, the organization's branding and
+    TEMPLATE_VERSION. The print date is left out on purpose: re-running
+    generation for unchanged inputs returns the PO already issued.
+
+    Returns:
+        SHA-256 hex digest
+    """
+    payload = json.dumps({
+        'request': str(request.id),
+        'po_number': request.po_number,
+        'amount': str(request.amount),
+        'description': request.description,
+        'items': [
+            [item.description, str(item.quantity), str(item.unit_price)]
+            for item in request.items.all()
+        ],
+        'po_data': po_data,
+        'branding': branding_version(request.organization.po_branding),
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _color(value: str, default: str):
+    try:
+        return colors.HexColor(value)
+    except (ValueError, TypeError):
+        return colors.HexColor(default)
+
+
+def _load_logo(url: str) -> Optional[ImageReader]:
+    """
+    Fetch, decode and downscale a logo once; a broken logo never fails a PO
+
+    The logo is embedded in every PDF, so it is reduced to twice its
+    printed size here instead of re-compressing the full-size image per PO.
+    The download is streamed and abandoned past LOGO_MAX_BYTES.
+    """
+    if not url:
+        return None
+    try:
+        with requests.get(url, timeout=LOGO_TIMEOUT, stream=True) as response:
+            response.raise_for_status()
+            if int(response.headers.get('Content-Length') or 0) > LOGO_MAX_BYTES:
+                raise ValueError(f"logo larger than {LOGO_MAX_BYTES} bytes")
+            content = BytesIO()
+            for block in response.iter_content(chunk_size=64 * 1024):
+                content.write(block)
+                if content.tell() > LOGO_MAX_BYTES:
+                    raise ValueError(f"logo larger than {LOGO_MAX_BYTES} bytes")
+        content.seek(0)
+        with Image.open(content) as image:
+            image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+            image.thumbnail((int(LOGO_BOX[0] / inch * 144), int(LOGO_BOX[1] / inch * 144)))
+        return ImageReader(image)
+    except Exception as e:
+        logger.warning(f"Could not load PO logo {url}: {str(e)}")
+        return None
+
+
+class PageCompressingCanvas(Canvas):
+    """
+    Canvas that compresses each page's content stream as the page ends
+
+    reportlab keeps every finished page as uncompressed text until the
+    document is saved, even with pageCompression (which only compresses at
+    save); compressing at page end keeps a few KiB per page instead, which
+    is what bounds memory on long POs.
+
+    This relies on reportlab's page internals (checked against the version
+    pinned in requirements.txt). If they change, pages are left to the
+    pageCompression=1 the document is built with: the output stays
+    correct, only the memory bound is lost.
+    """
+    _compress_pages = True
+
+    def showPage(self):
+        super().showPage()
+        if not PageCompressingCanvas._compress_pages:
+            return
+        try:
+            self._compress_last_page()
+        except (AttributeError, IndexError, TypeError) as e:
+            PageCompressingCanvas._compress_pages = False
+            logger.warning(f"Per-page PO compression unavailable, compressing at save: {str(e)}")
+
+    def _compress_last_page(self):
+        page = self._doc.Pages.pages[-1]
+        if isinstance(page.stream, str) and page.stream and not page.Contents:
+            contents = PDFStream(content=zlib.compress(page.stream.encode('utf8')))
+            contents.dictionary['Filter'] = PDFArray([PDFName('FlateDecode')])
+            page.Contents = contents
+            page.stream = None
+
+
+class FlowableStream:
+    """
+    The list interface DocTemplate.build needs, over a flowable iterator
+
+    build() only ever looks at and edits the front of its flowable list
+    (pop the next flowable, push back the unplaced part of a split), so
+    flowables are pulled from the iterator as layout reaches them and
+    dropped once drawn; a long PO never has its whole story in memory.
+    """
+
+    def __init__(self, head: Iterable, tail: Iterator):
+        self._buffer = list(head)
+        self._tail = tail
+
+    def _fill(self, size: int):
+        while len(self._buffer) < size:
+            flowable = next(self._tail, None)
+            if flowable is None:
+                return
+            self._buffer.append(flowable)
+
+    def __len__(self):
+        # Never more than is actually there; build() loops until empty
+        if not self._buffer:
+            self._fill(1)
+        return len(self._buffer)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            if key.stop is not None:
+                self._fill(key.stop)
+        else:
+            self._fill(key + 1)
+        return self._buffer[key]
+
+    def __setitem__(self, key, value):
+        self._buffer[key] = value
+
+    def __delitem__(self, key):
+        del self._buffer[key]
+
+    def insert(self, index: int, flowable):
+        self._buffer.insert(index, flowable)
+
+
+class POTemplate:
+    """
+    A purchase order layout compiled for one branding configuration
+
+    Immutable after construction, so one instance is shared by every PO
+    of the organization rendered in this process.
+    """
+
+    def __init__(self, branding: Dict[str, str]):
+        self.branding = {**DEFAULT_PO_BRANDING, **branding}
+        self.version = branding_version(self.branding)
+        self.font, self.bold_font = FONTS.get(self.branding['font'], FONTS['Helvetica'])
+        primary = _color(self.branding['primary_color'], DEFAULT_PO_BRANDING['primary_color'])
+        header = _color(self.branding['header_color'], DEFAULT_PO_BRANDING['header_color'])
+        stripe = _color(self.branding['stripe_color'], DEFAULT_PO_BRANDING['stripe_color'])
+
+        styles = getSampleStyleSheet()
+        self.title_style = ParagraphStyle(
+            'POTitle',
+            parent=styles['Heading1'],
+            fontName=self.bold_font,
+            fontSize=24,
+            textColor=primary,
+            spaceAfter=30,
+            alignment=TA_CENTER
+        )
+        self.body_style = ParagraphStyle('POBody', parent=styles['Normal'], fontName=self.font)
+
+        self.info_style = TableStyle([
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('FONTNAME', (0, 0), (-1, -1), self.font),
+            ('FONTNAME', (0, 0), (0, -1), self.bold_font),
+            ('FONTSIZE', (0, 0), (-1, -1), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+        ])
+        self.vendor_style = TableStyle([
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('FONTNAME', (0, 0), (-1, -1), self.font),
+            ('FONTNAME', (0, 0), (0, -1), self.bold_font),
+            ('FONTSIZE', (0, 0), (-1, -1), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+        ])
+        self.items_style = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), header),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('ALIGN', (1, 0), (1, -1), 'CENTER'),
+            ('ALIGN', (2, 0), (-1, -1), 'RIGHT'),
+            ('FONTNAME', (0, 0), (-1, -1), self.font),
+            ('FONTNAME', (0, 0), (-1, 0), self.bold_font),
+            ('FONTSIZE', (0, 0), (-1, 0), 12),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('BACKGROUND', (0, 1), (-1, -2), stripe),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+            ('FONTNAME', (0, -1), (-1, -1), self.bold_font),
+            ('FONTSIZE', (0, -1), (-1, -1), 12),
+            ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
+        ])
+        # Same layout for chunks followed by more lines: no total row
+        self.items_chunk_style = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), header),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('ALIGN', (1, 0), (1, -1), 'CENTER'),
+            ('ALIGN', (2, 0), (-1, -1), 'RIGHT'),
+            ('FONTNAME', (0, 0), (-1, -1), self.font),
+            ('FONTNAME', (0, 0), (-1, 0), self.bold_font),
+            ('FONTSIZE', (0, 0), (-1, 0), 12),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('BACKGROUND', (0, 1), (-1, -1), stripe),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ])
+        self.items_col_widths = [3 * inch, 1 * inch, 1.5 * inch, 1.5 * inch]
+
+        self.logo = _load_logo(self.branding['logo_url'])
+        self.letterhead = [
+            line for line in [self.branding['company_name'], *self.branding['address'].splitlines()]
+            if line.strip()
+        ]
+
+    def _draw_letterhead(self, canvas, doc):
+        """Logo and company address on every page"""
+        if not self.logo and not self.letterhead:
+            return
+        canvas.saveState()
+        top = doc.pagesize[1] - 0.5 * inch
+        if self.logo:
+            width, height = self.logo.getSize()
+            scale = min(LOGO_BOX[0] / width, LOGO_BOX[1] / height)
+            canvas.drawImage(self.logo, doc.leftMargin, top - height * scale,
+                             width=width * scale, height=height * scale, mask='auto')
+        canvas.setFont(self.font, 8)
+        right = doc.pagesize[0] - doc.rightMargin
+        for i, line in enumerate(self.letterhead):
+            canvas.drawRightString(right, top - 8 - i * 10, line)
+        canvas.restoreState()
+
+    def render(self, request: PurchaseRequest, po_data: dict, output=None):
+        """
+        Render one purchase order
+
+        Args:
+            request: PurchaseRequest instance
+            po_data: Dictionary with PO data (vendor, items, etc.)
+            output: Writable binary file object (default: a new BytesIO)
+
+        Returns:
+            `output`, rewound to the start
+        """
+        output = output if output is not None else BytesIO()
+        # POs generated before sequential numbering carry the request ID prefix
+        po_number = request.po_number or f"PO-{request.id.hex[:8].upper()}"
+        doc = SimpleDocTemplate(output, pagesize=letter, title=po_number, pageCompression=1)
+        story = []
+
+        story.append(Paragraph("PURCHASE ORDER", self.title_style))
+        story.append(Spacer(1, 0.3 * inch))
+
+        po_info_table = Table([
+            ['PO Number:', po_number],
+            ['Date:', datetime.now().strftime("%B %d, %Y")],
+            ['Request ID:', str(request.id)]
+        ], colWidths=[2 * inch, 4 * inch])
+        po_info_table.setStyle(self.info_style)
+        story.append(po_info_table)
+        story.append(Spacer(1, 0.3 * inch))
+
+        vendor_table = Table([
+            ['Vendor:', po_data.get('vendor_name', 'N/A')],
+            ['Address:', po_data.get('vendor_address', '')],
+            ['Email:', po_data.get('vendor_email', '')]
+        ], colWidths=[1.5 * inch, 4.5 * inch])
+        vendor_table.setStyle(self.vendor_style)
+        story.append(vendor_table)
+        story.append(Spacer(1, 0.3 * inch))
+
+        total_amount = po_data.get('total_amount', request.amount)
+        currency = po_data.get('currency', 'USD')
+        total_row = ['TOTAL', '', '', f"{currency} ${float(total_amount):.2f}"]
+
+        def tail():
+            yield from self._item_tables(po_data.get('items', []), total_row)
+            yield Spacer(1, 0.3 * inch)
+
+            # Extracted terms win over the organization's default terms
+            terms = po_data.get('terms', '') or self.branding['terms']
+            if terms:
+                yield Paragraph(f"<b>Terms:</b> {escape(terms)}", self.body_style)
+                yield Spacer(1, 0.2 * inch)
+
+            yield Paragraph(f"<b>Description:</b> {escape(request.description)}", self.body_style)
+
+        doc.build(
+            FlowableStream(story, tail()),
+            onFirstPage=self._draw_letterhead, onLaterPages=self._draw_letterhead,
+            canvasmaker=PageCompressingCanvas
+        )
+        output.seek(0)
+        return output
+
+    def _item_tables(self, items: Iterable[dict], total_row: list):
+        """
+        Line items as a sequence of ITEM_CHUNK_ROWS-row tables
+
+        Each chunk is a splittable table repeating the header row on every
+        page it spans. Laying out one table per chunk keeps reportlab's row
+        measuring and page splitting linear in the number of lines; a single
+        table is re-split (and copied) once per page.
+        """
+        header = ['Description', 'Quantity', 'Unit Price', 'Total']
+        rows = []
+        for item in items:
+            rows.append([
+                item.get('description', ''),
+                str(item.get('quantity', 0)),
+                f"${item.get('unit_price', 0):.2f}",
+                f"${item.get('total', 0):.2f}"
+            ])
+            if len(rows) == ITEM_CHUNK_ROWS:
+                table = Table([header, *rows], colWidths=self.items_col_widths, repeatRows=1)
+                table.setStyle(self.items_chunk_style)
+                yield table
+                rows = []
+
+        table = Table([header, *rows, total_row], colWidths=self.items_col_widths, repeatRows=1)
+        table.setStyle(self.items_style)
+        yield table
+
+
+_templates: "OrderedDict[Tuple, POTemplate]" = OrderedDict()
+_templates_lock = threading.Lock()
+
+
+def get_po_template(organization) -> POTemplate:
+    """
+    Compiled template for an organization, from the per-process cache
+
+    Keyed by organization and branding digest, so a settings change
+    compiles a new template and the stale one ages out of the LRU.
+    """
+    branding = organization.po_branding
+    key = (organization.id, branding_version(branding))
+    with _templates_lock:
+        template = _templates.get(key)
+        if template is not None:
+            _templates.move_to_end(key)
+            return template
+
+    # Compiled outside the lock: a logo fetch must not stall other organizations
+    template = POTemplate(branding)
+    with _templates_lock:
+        _templates[key] = template
+        while len(_templates) > TEMPLATE_CACHE_SIZE:
+            _templates.popitem(last=False)
+    return template
+
+
+def clear_po_template_cache():
+    with _templates_lock:
+        _templates.clear()
+
+
+def render_purchase_order(request: PurchaseRequest, po_data: dict) -> SpooledTemporaryFile:
+    """
+    Render a purchase order into a spooled temporary file
+
+    Small POs never touch the disk; large ones spill to a temp file past
+    SPOOL_MAX_BYTES instead of growing an in-memory buffer. The caller
+    closes the file (uploading it with cloudinary's upload_large does).
+
+    Returns:
+        SpooledTemporaryFile positioned at the start
+    """
+    output = SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, suffix='.pdf')
+    try:
+        return get_po_template(request.organization).render(request, po_data, output)
+    except Exception:
+        output.close()
+        raise
 
 
 def generate_purchase_order_pdf(request: PurchaseRequest, po_data: dict) -> BytesIO:
     """
     Generate Purchase Order PDF
-    
+
     Args:
         request: PurchaseRequest instance
         po_data: Dictionary with PO data (vendor, items, etc.)
-    
+
     Returns:
         BytesIO buffer with PDF content
     """
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
-    story = []
-    
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        textColor=colors.HexColor('#1a1a1a'),
-        spaceAfter=30,
-        alignment=TA_CENTER
-    )
-    
-    # Title
-    story.append(Paragraph("PURCHASE ORDER", title_style))
-    story.append(Spacer(1, 0.3*inch))
-    
-    # PO Number and Date
-    po_number = f"PO-{request.id.hex[:8].upper()}"
-    po_date = datetime.now().strftime("%B %d, %Y")
-    
-    po_info_data = [
-        ['PO Number:', po_number],
-        ['Date:', po_date],
-        ['Request ID:', str(request.id)]
-    ]
-    
-    po_info_table = Table(po_info_data, colWidths=[2*inch, 4*inch])
-    po_info_table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (0, -1), 'LEFT'),
-        ('ALIGN', (1, 0), (1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-    ]))
-    story.append(po_info_table)
-    story.append(Spacer(1, 0.3*inch))
-    
-    # Vendor Information
-    vendor_name = po_data.get('vendor_name', 'N/A')
-    vendor_address = po_data.get('vendor_address', '')
-    vendor_email = po_data.get('vendor_email', '')
-    
-    vendor_data = [
-        ['Vendor:', vendor_name],
-        ['Address:', vendor_address],
-        ['Email:', vendor_email]
-    ]
-    
-    vendor_table = Table(vendor_data, colWidths=[1.5*inch, 4.5*inch])
-    vendor_table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (0, -1), 'LEFT'),
-        ('ALIGN', (1, 0), (1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-    ]))
-    story.append(vendor_table)
-    story.append(Spacer(1, 0.3*inch))
-    
-    # Items Table
-    items = po_data.get('items', [])
-    items_data = [['Description', 'Quantity', 'Unit Price', 'Total']]
-    
-    for item in items:
-        items_data.append([
-            item.get('description', ''),
-            str(item.get('quantity', 0)),
-            f"${item.get('unit_price', 0):.2f}",
-            f"${item.get('total', 0):.2f}"
-        ])
-    
-    # Add total row
-    total_amount = po_data.get('total_amount', request.amount)
-    currency = po_data.get('currency', 'USD')
-    items_data.append([
-        'TOTAL',
-        '',
-        '',
-        f"{currency} ${float(total_amount):.2f}"
-    ])
-    
-    items_table = Table(items_data, colWidths=[3*inch, 1*inch, 1.5*inch, 1.5*inch])
-    items_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('ALIGN', (1, 0), (1, -1), 'CENTER'),
-        ('ALIGN', (2, 0), (-1, -1), 'RIGHT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -2), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, -1), (-1, -1), 12),
-        ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
-    ]))
-    story.append(items_table)
-    story.append(Spacer(1, 0.3*inch))
-    
-    # Terms
-    terms = po_data.get('terms', '')
-    if terms:
-        story.append(Paragraph(f"<b>Terms:</b> {terms}", styles['Normal']))
-        story.append(Spacer(1, 0.2*inch))
-    
-    # Description
-    story.append(Paragraph(f"<b>Description:</b> {request.description}", styles['Normal']))
-    
-    # Build PDF
-    doc.build(story)
-    buffer.seek(0)
-    return buffer
-
+    return get_po_template(request.organization).render(request, po_data)
@@ -0,0 +1,334 @@
+"""
+Cluster-wide token-bucket rate limiting for external API calls
+
+Every Celery worker process shares the same Gemini and Cloudinary quotas.
+Buckets live in Redis and are updated by a single Lua script, so a call
+only proceeds once it holds a token from *every* bucket that applies to it
+(the global bucket and the caller's organization bucket). When a bucket is
+empty the caller sleeps for exactly the refill time instead of hammering
+the provider and collecting 429s.
+
+Rates are configured in settings.RATE_LIMITS using DRF-style strings:
+
+    RATE_LIMITS = {
+        'gemini': {'global': '60/m', 'organization': '20/m'},
+    }
+"""
+import asyncio
+import contextvars
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'ratelimit'
+
+_PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a token could not be acquired within max_wait"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None, limiter: Optional[str] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.limiter = limiter
+
+
+# Default max_wait for the current context (see max_wait_limit)
+_max_wait = contextvars.ContextVar('rate_limit_max_wait', default=None)
+
+
+@contextmanager
+def max_wait_limit(seconds: float):
+    """
+    Cap how long acquire() blocks by default within this block
+
+    Used on the HTTP request path, where a throttled caller should get a
+    429 quickly instead of holding a web worker for RATE_LIMIT_MAX_WAIT.
+    """
+    token = _max_wait.set(seconds)
+    try:
+        yield
+    finally:
+        _max_wait.reset(token)
+
+
+def default_max_wait() -> float:
+    """max_wait used when acquire() is not given one"""
+    limit = _max_wait.get()
+    return settings.RATE_LIMIT_MAX_WAIT if limit is None else limit
+
+
+@dataclass(frozen=True)
+class Bucket:
+    """A token bucket: `rate` tokens per second, holding at most `capacity`"""
+    key: str
+    rate: float
+    capacity: float
+
+
+def parse_rate(rate: str) -> Optional[float]:
+    """
+    Parse a DRF-style rate string ("60/m", "5/s", "1000/h") into tokens/second
+
+    Returns None for an empty value, which disables the bucket.
+    """
+    if not rate:
+        return None
+    num, period = rate.split('/')
+    return int(num) / _PERIODS[period.strip()[0].lower()]
+
+
+# KEYS: bucket keys. ARGV: requested, then (rate_per_ms, capacity) per key.
+# Returns 0 when tokens were taken from every bucket, otherwise the number of
+# milliseconds until the emptiest bucket can satisfy the request. Nothing is
+# taken unless all buckets have enough, so waiting never leaks tokens.
+TOKEN_BUCKET_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + tonumber(t[2]) / 1000
+local requested = tonumber(ARGV[1])
+local wait = 0
+local levels = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local capacity = tonumber(ARGV[i * 2 + 1])
+    local data = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(data[1]) or capacity
+    local ts = tonumber(data[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    levels[i] = tokens
+    if tokens < requested then
+        wait = math.max(wait, (requested - tokens) / rate)
+    end
+end
+if wait > 0 then
+    return math.ceil(wait)
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local capacity = tonumber(ARGV[i * 2 + 1])
+    redis.call('HSET', key, 'tokens', levels[i] - requested, 'ts', now)
+    redis.call('PEXPIRE', key, math.ceil(capacity / rate) + 1000)
+end
+return 0
+"""
+
+
+class RedisBucketBackend:
+    """Token buckets shared by every process through Redis"""
+
+    def __init__(self, url: str):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self._script = self.client.register_script(TOKEN_BUCKET_LUA)
+
+    def take(self, buckets: List[Bucket], tokens: float) -> float:
+        """Try to take tokens; return 0 on success or seconds to wait"""
+        args = [tokens]
+        for bucket in buckets:
+            args.extend([bucket.rate / 1000.0, bucket.capacity])
+        wait_ms = self._script(keys=[bucket.key for bucket in buckets], args=args)
+        return int(wait_ms) / 1000.0
+
+    def record(self, name: str, waited: float, throttled: bool):
+        key = f'{KEY_PREFIX}:metrics:{name}'
+        pipe = self.client.pipeline()
+        pipe.hincrby(key, 'acquired', 1)
+        if throttled:
+            pipe.hincrby(key, 'throttled', 1)
+            pipe.hincrbyfloat(key, 'wait_seconds', waited)
+        pipe.execute()
+
+    def metrics(self, name: str) -> Dict[str, float]:
+        raw = self.client.hgetall(f'{KEY_PREFIX}:metrics:{name}')
+        return {key.decode(): float(value) for key, value in raw.items()}
+
+
+class LocalBucketBackend:
+    """In-process token buckets (tests, single-process deployments)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._levels: Dict[str, tuple] = {}
+        self._metrics: Dict[str, Dict[str, float]] = {}
+
+    def take(self, buckets: List[Bucket], tokens: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            levels = []
+            for bucket in buckets:
+                level, ts = self._levels.get(bucket.key, (bucket.capacity, now))
+                level = min(bucket.capacity, level + (now - ts) * bucket.rate)
+                levels.append(level)
+                if level < tokens:
+                    wait = max(wait, (tokens - level) / bucket.rate)
+            if wait > 0:
+                return wait
+            for bucket, level in zip(buckets, levels):
+                self._levels[bucket.key] = (level - tokens, now)
+            return 0.0
+
+    def record(self, name: str, waited: float, throttled: bool):
+        with self._lock:
+            metrics = self._metrics.setdefault(name, {'acquired': 0, 'throttled': 0, 'wait_seconds': 0.0})
+            metrics['acquired'] += 1
+            if throttled:
+                metrics['throttled'] += 1
+                metrics['wait_seconds'] += waited
+
+    def metrics(self, name: str) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._metrics.get(name, {}))
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Return the configured bucket backend (one per process)"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if settings.RATE_LIMIT_BACKEND == 'redis':
+                    _backend = RedisBucketBackend(settings.RATE_LIMIT_REDIS_URL)
+                else:
+                    _backend = LocalBucketBackend()
+    return _backend
+
+
+class RateLimiter:
+    """
+    Acquire tokens for one external dependency
+
+    Usage:
+        get_rate_limiter('gemini').acquire(organization_id=org_id)
+    """
+
+    def __init__(self, name: str, backend=None):
+        self.name = name
+        self._backend = backend
+
+    @property
+    def backend(self):
+        return self._backend or get_backend()
+
+    def buckets(self, organization_id: Optional[str] = None) -> List[Bucket]:
+        """Buckets that apply to a call, from settings.RATE_LIMITS"""
+        limits = settings.RATE_LIMITS.get(self.name, {})
+        burst = settings.RATE_LIMIT_BURST_SECONDS
+        buckets = []
+        global_rate = parse_rate(limits.get('global'))
+        if global_rate:
+            buckets.append(Bucket(
+                key=f'{KEY_PREFIX}:{self.name}:global',
+                rate=global_rate,
+                capacity=max(1.0, global_rate * burst)
+            ))
+        org_rate = parse_rate(limits.get('organization'))
+        if org_rate and organization_id:
+            buckets.append(Bucket(
+                key=f'{KEY_PREFIX}:{self.name}:org:{organization_id}',
+                rate=org_rate,
+                capacity=max(1.0, org_rate * burst)
+            ))
+        return buckets
+
+    def _next_wait(self, buckets, tokens, waited, max_wait) -> float:
+        wait = self.backend.take(buckets, tokens)
+        if wait <= 0:
+            self.backend.record(self.name, waited, throttled=waited > 0)
+            if waited > 0:
+                logger.info(f"Rate limiter '{self.name}' throttled call for {waited:.2f}s")
+            return 0.0
+        if waited + wait > max_wait:
+            self.backend.record(self.name, waited, throttled=True)
+            raise RateLimitExceeded(
+                f"Rate limit for '{self.name}' not available within {max_wait}s",
+                retry_after=wait,
+                limiter=self.name
+            )
+        # Small jitter so throttled workers do not wake up in lock-step
+        return wait + random.uniform(0, min(wait, 0.1))
+
+    def acquire(self, organization_id: Optional[str] = None, tokens: float = 1,
+                max_wait: Optional[float] = None) -> float:
+        """
+        Block until tokens are available in every applicable bucket
+
+        Returns:
+            Seconds spent waiting
+
+        Raises:
+            RateLimitExceeded: If the wait would exceed max_wait
+        """
+        buckets = self.buckets(organization_id)
+        if not buckets:
+            return 0.0
+        max_wait = default_max_wait() if max_wait is None else max_wait
+        waited = 0.0
+        while True:
+            sleep_for = self._next_wait(buckets, tokens, waited, max_wait)
+            if not sleep_for:
+                return waited
+            time.sleep(sleep_for)
+            waited += sleep_for
+
+    async def aacquire(self, organization_id: Optional[str] = None, tokens: float = 1,
+                       max_wait: Optional[float] = None) -> float:
+        """Async variant of acquire that yields to the event loop while throttled"""
+        buckets = self.buckets(organization_id)
+        if not buckets:
+            return 0.0
+        max_wait = default_max_wait() if max_wait is None else max_wait
+        waited = 0.0
+        while True:
+            sleep_for = await asyncio.to_thread(self._next_wait, buckets, tokens, waited, max_wait)
+            if not sleep_for:
+                return waited
+            await asyncio.sleep(sleep_for)
+            waited += sleep_for
+
+
+def get_rate_limiter(name: str) -> RateLimiter:
+    """Return the rate limiter for an external dependency"""
+    return RateLimiter(name)
+
+
+def get_rate_limit_metrics() -> Dict[str, Dict[str, float]]:
+    """Throttle counters for every configured limiter"""
+    backend = get_backend()
+    return {name: backend.metrics(name) for name in settings.RATE_LIMITS}
+
+
+def format_prometheus_metrics(metrics: Dict[str, Dict[str, float]]) -> str:
+    """Render limiter counters in the Prometheus text exposition format"""
+    lines = [
+        '# HELP ratelimit_acquired_total Calls that acquired a rate limit token',
+        '# TYPE ratelimit_acquired_total counter',
+    ]
+    lines += [f'ratelimit_acquired_total{{limiter="{name}"}} {values.get("acquired", 0):g}'
+              for name, values in metrics.items()]
+    lines += [
+        '# HELP ratelimit_throttled_total Calls that had to wait for a token',
+        '# TYPE ratelimit_throttled_total counter',
+    ]
+    lines += [f'ratelimit_throttled_total{{limiter="{name}"}} {values.get("throttled", 0):g}'
+              for name, values in metrics.items()]
+    lines += [
+        '# HELP ratelimit_wait_seconds_total Time spent waiting for rate limit tokens',
+        '# TYPE ratelimit_wait_seconds_total counter',
+    ]
+    lines += [f'ratelimit_wait_seconds_total{{limiter="{name}"}} {values.get("wait_seconds", 0):g}'
+              for name, values in metrics.items()]
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,248 @@
+"""
+Shared resilience layer for document tasks
+
+- classify_error() separates transient failures (timeouts, 429/5xx, open
+  circuits) from permanent ones (missing rows, bad input, 4xx)
+- backoff_delay() is exponential backoff with full jitter
+- CircuitBreaker keeps per-dependency state in the shared cache so every
+  worker fails fast while a dependency is down
+- ResilientTask is a Celery base class that retries retryable errors with
+  backoff and writes exhausted or permanent failures to the FailedTask
+  dead-letter table, from where they can be replayed
+"""
+import logging
+import random
+import time
+import traceback
+from contextlib import contextmanager
+
+import requests
+from celery import Task
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+
+from .rate_limit import RateLimitExceeded
+from .schemas import ExtractionParseError
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE = 'retryable'
+PERMANENT = 'permanent'
+
+RETRYABLE_HTTP_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+
+class RetryableError(Exception):
+    """Explicitly transient failure"""
+
+
+class PermanentError(Exception):
+    """Explicitly permanent failure; never retried"""
+
+
+class CircuitOpenError(RetryableError):
+    """Raised without calling the dependency while its circuit is open"""
+
+
+def _classify_one(exc: BaseException):
+    """Classify a single exception, or return None if it is not conclusive"""
+    if isinstance(exc, PermanentError):
+        return PERMANENT
+    if isinstance(exc, RetryableError):
+        return RETRYABLE
+    if isinstance(exc, (RateLimitExceeded, TimeoutError, ConnectionError,
+                        requests.ConnectionError, requests.Timeout)):
+        return RETRYABLE
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        return RETRYABLE if exc.response.status_code in RETRYABLE_HTTP_STATUSES else PERMANENT
+
+    try:
+        from google.genai import errors as genai_errors
+        if isinstance(exc, genai_errors.APIError):
+            return RETRYABLE if exc.code in RETRYABLE_HTTP_STATUSES else PERMANENT
+    except ImportError:
+        pass
+
+    try:
+        import cloudinary.exceptions as cloudinary_errors
+        if isinstance(exc, (cloudinary_errors.RateLimited, cloudinary_errors.GeneralError)):
+            return RETRYABLE
+        if isinstance(exc, cloudinary_errors.Error):
+            return PERMANENT
+    except ImportError:
+        pass
+
+    if isinstance(exc, (ObjectDoesNotExist, ExtractionParseError,
+                        ValueError, TypeError, KeyError, AttributeError)):
+        return PERMANENT
+    return None
+
+
+def classify_error(exc: BaseException) -> str:
+    """
+    Classify an exception as RETRYABLE or PERMANENT
+
+    Wrapped exceptions (``raise Exception(...)`` inside an ``except``
+    block) are classified by walking the cause/context chain. Unknown
+    errors default to RETRYABLE so a document is never dropped on the
+    first unexpected failure; retries are capped by max_retries.
+    """
+    seen = set()
+    current = exc
+    while current is not None and id(current) not in seen:
+        seen.add(id(current))
+        kind = _classify_one(current)
+        if kind is not None:
+            return kind
+        current = current.__cause__ or current.__context__
+    return RETRYABLE
+
+
+def backoff_delay(attempt: int, base: float = None, cap: float = None) -> float:
+    """Exponential backoff with full jitter: uniform(0, min(cap, base * 2**attempt))"""
+    base = settings.TASK_RETRY_BACKOFF_BASE if base is None else base
+    cap = settings.TASK_RETRY_BACKOFF_MAX if cap is None else cap
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    Cache-backed circuit breaker for one external dependency
+
+    closed    -> calls go through; retryable failures are counted
+    open      -> after `failure_threshold` failures calls fail fast with
+                 CircuitOpenError for `recovery_timeout` seconds
+    half-open -> after the timeout one trial call is let through; success
+                 closes the circuit, failure re-opens it
+    """
+
+    def __init__(self, name: str, failure_threshold: int = None, recovery_timeout: float = None):
+        self.name = name
+        self.failure_threshold = failure_threshold or settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD
+        self.recovery_timeout = recovery_timeout or settings.CIRCUIT_BREAKER_RECOVERY_TIMEOUT
+
+    def _key(self, suffix: str) -> str:
+        return f'circuit:{self.name}:{suffix}'
+
+    @property
+    def state(self) -> str:
+        opened_at = cache.get(self._key('opened_at'))
+        if opened_at is None:
+            return 'closed'
+        if time.time() - opened_at < self.recovery_timeout:
+            return 'open'
+        return 'half-open'
+
+    def before_call(self):
+        """Raise CircuitOpenError if the dependency should not be called"""
+        opened_at = cache.get(self._key('opened_at'))
+        if opened_at is None:
+            return
+        remaining = self.recovery_timeout - (time.time() - opened_at)
+        if remaining > 0:
+            raise CircuitOpenError(f"Circuit '{self.name}' is open; retry in {remaining:.0f}s")
+        # Half-open: exactly one worker gets the trial call
+        if not cache.add(self._key('trial'), 1, timeout=self.recovery_timeout):
+            raise CircuitOpenError(f"Circuit '{self.name}' is half-open; trial call in progress")
+
+    def record_success(self):
+        cache.delete_many([self._key('failures'), self._key('opened_at'), self._key('trial')])
+
+    def record_failure(self):
+        key = self._key('failures')
+        cache.add(key, 0, timeout=self.recovery_timeout * 10)
+        failures = cache.incr(key)
+        if failures >= self.failure_threshold:
+            if cache.get(self._key('opened_at')) is None:
+                logger.warning(f"Circuit '{self.name}' opened after {failures} failures")
+            cache.set(self._key('opened_at'), time.time(), timeout=self.recovery_timeout * 10)
+        cache.delete(self._key('trial'))
+
+    @contextmanager
+    def guard(self):
+        """
+        Wrap a call to the dependency
+
+        Only retryable errors count against the circuit; a 400 from bad
+        input says nothing about the dependency's health.
+        """
+        self.before_call()
+        try:
+            yield
+        except Exception as exc:
+            if classify_error(exc) == RETRYABLE:
+                self.record_failure()
+            raise
+        else:
+            self.record_success()
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """Return the circuit breaker for an external dependency"""
+    return CircuitBreaker(name)
+
+
+class ResilientTask(Task):
+    """
+    Celery base task with classified retries and a dead-letter store
+
+    Retryable errors are retried with exponential backoff and jitter up to
+    max_retries. Permanent errors, and retryable ones that exhaust their
+    retries, are recorded as FailedTask rows for later replay.
+    """
+    abstract = True
+    max_retries = None
+
+    def _max_retries(self) -> int:
+        return settings.TASK_RETRY_MAX if self.max_retries is None else self.max_retries
+
+    def will_retry(self, exc: BaseException) -> bool:
+        """Whether a failure with `exc` in the current attempt will be retried"""
+        return classify_error(exc) == RETRYABLE and (self.request.retries or 0) < self._max_retries()
+
+    def __call__(self, *args, **kwargs):
+        try:
+            return super().__call__(*args, **kwargs)
+        except Exception as exc:
+            max_retries = self._max_retries()
+            retries = self.request.retries or 0
+            if self.will_retry(exc):
+                if self.request.is_eager:
+                    # Eager apply() re-raises Retry instead of re-running the
+                    # task, so retry inline (without sleeping)
+                    return self.apply(args=args, kwargs=kwargs, retries=retries + 1, throw=True).get()
+                countdown = backoff_delay(retries)
+                logger.warning(
+                    f"{self.name} failed ({str(exc)}); retry {retries + 1}/"
+                    f"{max_retries} in {countdown:.1f}s"
+                )
+                raise self.retry(exc=exc, countdown=countdown, max_retries=max_retries)
+            record_failed_task(self, exc, self.request.id, args, kwargs)
+            exc._dead_lettered = True
+            raise
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        # Failures raised outside __call__ (e.g. time limits) still get a row
+        if not getattr(exc, '_dead_lettered', False):
+            record_failed_task(self, exc, task_id, args, kwargs, einfo)
+        super().on_failure(exc, task_id, args, kwargs, einfo)
+
+
+def record_failed_task(task, exc, task_id, args, kwargs, einfo=None):
+    """Write a dead-letter row; never let bookkeeping mask the real error"""
+    from .models import FailedTask
+    try:
+        FailedTask.objects.create(
+            task_name=task.name,
+            task_id=task_id or '',
+            args=list(args or []),
+            kwargs=dict(kwargs or {}),
+            error_class=f'{type(exc).__module__}.{type(exc).__name__}',
+            error_message=str(exc)[:2000],
+            traceback=str(einfo) if einfo else ''.join(traceback.format_exception(exc)),
+            retries=task.request.retries or 0,
+            is_permanent=classify_error(exc) == PERMANENT,
+        )
+    except Exception as e:
+        logger.error(f"Could not record failed task {task.name}[{task_id}]: {str(e)}")
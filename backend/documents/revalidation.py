@@ -0,0 +1,289 @@
+"""
+Re-run receipt validation over stored extraction results
+
+Used after tolerances or matching rules change. Receipts are streamed
+per chunk of requests together with their PO data, request items and
+organization tolerances; validation is pure CPU work on that snapshot,
+so it is fanned out to a process pool, and the results are written back
+with one bulk update per chunk. No model calls are made.
+"""
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from django.db import transaction
+from organizations.models import Organization
+from purchase_requests.models import Document, PurchaseRequest, RequestItem
+from vendors.services import confirmed_aliases, same_confirmed_vendor
+
+from .services import GeminiDocumentProcessor
+from .tasks import stored_verdict
+from .three_way import three_way_match
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RevalidationStats:
+    requests: int = 0
+    receipts: int = 0
+    skipped: int = 0
+    changed: int = 0
+    status_changes: Dict[str, int] = field(default_factory=dict)
+    elapsed: float = 0.0
+
+
+def revalidate_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Validate one receipt snapshot (runs in a worker process)
+
+    Args:
+        payload: document_id, receipt_data, po_data, same_vendor,
+            request_items, amount and tolerances
+
+    Returns:
+        document_id with the new validation result and match report
+    """
+    validation = GeminiDocumentProcessor.validate_receipt_against_po(
+        payload['receipt_data'], payload['po_data'], payload['tolerances'],
+        same_vendor=payload.get('same_vendor', False)
+    )
+    match_report = three_way_match(
+        payload['po_data'],
+        payload['receipt_data'],
+        payload['request_items'],
+        requested_amount=payload['amount'],
+        tolerances=payload['tolerances']
+    )
+    return {
+        'document_id': payload['document_id'],
+        'validation': validation,
+        'match_report': match_report,
+        'is_valid': validation['is_valid'] and match_report['is_valid'],
+    }
+
+
+def discrepancy_types(validation: Optional[Dict[str, Any]]) -> set:
+    return {d.get('type') for d in (validation or {}).get('discrepancies', [])}
+
+
+def next_status(current: str, is_valid: bool, already_reported: bool = False) -> str:
+    """
+    Status implied by the latest receipt; only APPROVED <-> DISCREPANCY moves
+
+    Like store_receipt_result, a discrepancy that was already reported is
+    not flagged again, so one someone has since resolved stays resolved.
+    """
+    if not is_valid and not already_reported and current == PurchaseRequest.Status.APPROVED:
+        return PurchaseRequest.Status.DISCREPANCY
+    if is_valid and current == PurchaseRequest.Status.DISCREPANCY:
+        return PurchaseRequest.Status.APPROVED
+    return current
+
+
+def _chunks(iterable: Iterable, size: int):
+    chunk = []
+    for value in iterable:
+        chunk.append(value)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class ReceiptRevalidator:
+    """
+    Stream receipts in chunks, validate them in a process pool and apply
+    the results
+
+    Args:
+        workers: Process pool size; 0 validates inline in this process
+        chunk_size: Requests per chunk (one read and one write round per chunk)
+        dry_run: Compute and report differences without writing
+        on_progress: Called with the running RevalidationStats after each chunk
+        on_diff: Called with a dict describing each receipt whose result changed
+    """
+
+    def __init__(self, workers: Optional[int] = None, chunk_size: int = 200, dry_run: bool = False,
+                 on_progress: Optional[Callable] = None, on_diff: Optional[Callable] = None):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.on_progress = on_progress
+        self.on_diff = on_diff
+
+    def _payloads(self, request_ids: List) -> tuple:
+        """Load everything needed to validate the receipts of these requests"""
+        requests = {
+            r['id']: r for r in PurchaseRequest.objects.filter(id__in=request_ids).values(
+                'id', 'status', 'amount', 'organization_id'
+            )
+        }
+        tolerances = {
+            org.id: org.match_tolerances
+            for org in Organization.objects.filter(id__in={r['organization_id'] for r in requests.values()})
+        }
+        po_data = {}
+        for doc in Document.objects.filter(
+            request_id__in=request_ids, document_type=Document.DocumentType.PO
+        ).order_by('request_id', '-created_at').values('request_id', 'extracted_data', 'vendor_id'):
+            po_data.setdefault(doc['request_id'], doc)
+        items = {}
+        for item in RequestItem.objects.filter(request_id__in=request_ids).values(
+            'id', 'request_id', 'description', 'quantity', 'unit_price', 'total'
+        ):
+            items.setdefault(item.pop('request_id'), []).append({
+                **item,
+                'quantity': float(item['quantity']),
+                'unit_price': float(item['unit_price']),
+                'total': float(item['total']),
+            })
+
+        receipts = Document.objects.filter(
+            request_id__in=request_ids, document_type=Document.DocumentType.RECEIPT
+        ).order_by('request_id', '-created_at').values(
+            'id', 'request_id', 'extracted_data', 'match_report', 'vendor_id'
+        )
+
+        receipts = list(receipts)
+        aliases = confirmed_aliases(
+            (requests[receipt['request_id']]['organization_id'], name)
+            for receipt in receipts if receipt['request_id'] in po_data
+            for name in (
+                receipt['extracted_data'].get('seller_name'),
+                po_data[receipt['request_id']]['extracted_data'].get('vendor_name'),
+            )
+        )
+
+        payloads, meta, skipped, seen = [], {}, 0, set()
+        for receipt in receipts:
+            request_id = receipt['request_id']
+            if request_id not in po_data:
+                skipped += 1
+                continue
+            request = requests[request_id]
+            po_doc = po_data[request_id]
+            old_validation = receipt['extracted_data'].get('validation')
+            receipt_data = {k: v for k, v in receipt['extracted_data'].items() if k != 'validation'}
+            payloads.append({
+                'document_id': receipt['id'],
+                'receipt_data': receipt_data,
+                'po_data': po_doc['extracted_data'],
+                'same_vendor': (
+                    receipt['vendor_id'] is not None and receipt['vendor_id'] == po_doc['vendor_id']
+                    and same_confirmed_vendor(
+                        request['organization_id'], receipt_data.get('seller_name'),
+                        po_doc['extracted_data'].get('vendor_name'), aliases
+                    )
+                ),
+                'request_items': items.get(request_id, []),
+                'amount': float(request['amount']),
+                'tolerances': tolerances.get(request['organization_id']),
+            })
+            meta[receipt['id']] = {
+                'request_id': request_id,
+                'receipt_data': receipt_data,
+                'old_validation': old_validation,
+                'was_valid': stored_verdict(old_validation, receipt['match_report']),
+                # Ordered newest first: the first receipt seen decides the status
+                'latest': request_id not in seen,
+            }
+            seen.add(request_id)
+        return payloads, meta, requests, skipped
+
+    def _apply(self, results: List[Dict], meta: Dict, requests: Dict, stats: RevalidationStats):
+        documents, status_updates = [], {}
+        for result in results:
+            info = meta[result['document_id']]
+            old = info['old_validation'] or {}
+            request = requests[info['request_id']]
+            old_types, new_types = discrepancy_types(old), discrepancy_types(result['validation'])
+            new_status = request['status']
+            if info['latest']:
+                already_reported = not info['was_valid'] and not (new_types - old_types)
+                new_status = next_status(request['status'], result['is_valid'], already_reported)
+                if new_status != request['status']:
+                    status_updates.setdefault((request['status'], new_status), []).append(request['id'])
+
+            changed = info['was_valid'] != result['is_valid'] or old_types != new_types
+            if changed or new_status != request['status']:
+                stats.changed += 1
+                if self.on_diff:
+                    self.on_diff({
+                        'document_id': result['document_id'],
+                        'request_id': str(request['id']),
+                        'was_valid': info['was_valid'],
+                        'is_valid': result['is_valid'],
+                        'added': sorted(t for t in new_types - old_types if t),
+                        'removed': sorted(t for t in old_types - new_types if t),
+                        'status': (request['status'], new_status),
+                    })
+            documents.append(Document(
+                id=result['document_id'],
+                extracted_data={**info['receipt_data'], 'validation': result['validation']},
+                match_report=result['match_report'],
+            ))
+
+        if self.dry_run:
+            for (old_status, new_status), ids in status_updates.items():
+                self._count_transition(stats, old_status, new_status, len(ids))
+            return
+        with transaction.atomic():
+            Document.objects.bulk_update(documents, ['extracted_data', 'match_report'], batch_size=500)
+            for (old_status, new_status), ids in status_updates.items():
+                # Only requests still in the status read before validating: an
+                # approval, rejection or manual resolution since then wins
+                updated = PurchaseRequest.objects.filter(id__in=ids, status=old_status).update(status=new_status)
+                self._count_transition(stats, old_status, new_status, updated)
+
+    @staticmethod
+    def _count_transition(stats: RevalidationStats, old_status: str, new_status: str, count: int):
+        if count:
+            transition = f"{old_status}->{new_status}"
+            stats.status_changes[transition] = stats.status_changes.get(transition, 0) + count
+
+    def run(self, queryset=None) -> RevalidationStats:
+        """
+        Re-validate the receipts of every request in `queryset`
+
+        Args:
+            queryset: PurchaseRequest queryset to limit the run (default: all)
+
+        Returns:
+            RevalidationStats for the run
+        """
+        queryset = queryset if queryset is not None else PurchaseRequest.objects.all()
+        request_ids = queryset.filter(
+            documents__document_type=Document.DocumentType.RECEIPT
+        ).distinct().order_by('id').values_list('id', flat=True)
+
+        stats = RevalidationStats()
+        start = time.monotonic()
+        pool = ProcessPoolExecutor(max_workers=self.workers) if self.workers != 0 else None
+        try:
+            for chunk in _chunks(request_ids.iterator(chunk_size=self.chunk_size), self.chunk_size):
+                payloads, meta, requests, skipped = self._payloads(chunk)
+                if pool is not None:
+                    results = list(pool.map(revalidate_payload, payloads, chunksize=16))
+                else:
+                    results = [revalidate_payload(payload) for payload in payloads]
+                self._apply(results, meta, requests, stats)
+
+                stats.requests += len(chunk)
+                stats.receipts += len(payloads)
+                stats.skipped += skipped
+                stats.elapsed = time.monotonic() - start
+                if self.on_progress:
+                    self.on_progress(stats)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        logger.info(
+            f"Receipt revalidation {'(dry run) ' if self.dry_run else ''}finished: "
+            f"{stats.receipts} receipts, {stats.changed} changed, status changes {stats.status_changes}"
+        )
+        return stats
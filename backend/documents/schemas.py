@@ -0,0 +1,227 @@
+"""
+Pydantic schemas for model extraction payloads
+
+The schemas are sent to Gemini as the response schema so the model returns
+constrained JSON, and are used again on the way in to validate the answer
+and coerce numbers such as "1,200.50" or "$15" into floats.
+"""
+import ast
+import json
+import re
+from typing import Any, Dict, List, Type
+
+from pydantic import BaseModel, ValidationError, field_validator
+
+
+class ExtractionParseError(Exception):
+    """Raised when a model response cannot be turned into a valid payload"""
+
+    def __init__(self, message: str, raw_text: str = ''):
+        super().__init__(message)
+        self.raw_text = raw_text
+
+
+_NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+
+
+def coerce_number(value: Any) -> float:
+    """Coerce model output like "1,200.50", "$15" or None into a float"""
+    if value is None or value == '':
+        return 0.0
+    if isinstance(value, bool):
+        return float(value)
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).replace(',', '').replace(' ', '')
+    # Accounting negatives, e.g. "(12.00)"
+    negative = text.startswith('(') and text.endswith(')')
+    match = _NUMBER_RE.search(text)
+    if not match:
+        raise ValueError(f"Not a number: {value!r}")
+    number = float(match.group())
+    return -abs(number) if negative else number
+
+
+def coerce_text(value: Any) -> str:
+    """Coerce optional text fields to a string"""
+    if value is None:
+        return ''
+    return str(value).strip()
+
+
+class LineItem(BaseModel):
+    """A single extracted line"""
+    description: str = ''
+    quantity: float = 0
+    unit_price: float = 0
+    total: float = 0
+
+    @field_validator('description', mode='before')
+    @classmethod
+    def _coerce_description(cls, value):
+        return coerce_text(value)
+
+    @field_validator('quantity', 'unit_price', 'total', mode='before')
+    @classmethod
+    def _coerce_numbers(cls, value):
+        return coerce_number(value)
+
+
+class ProformaData(BaseModel):
+    """Extracted proforma invoice"""
+    vendor_name: str = ''
+    vendor_address: str = ''
+    vendor_email: str = ''
+    invoice_number: str = ''
+    items: List[LineItem] = []
+    total_amount: float = 0
+    currency: str = ''
+    terms: str = ''
+    validity: str = ''
+
+    @field_validator(
+        'vendor_name', 'vendor_address', 'vendor_email', 'invoice_number', 'currency', 'terms', 'validity',
+        mode='before'
+    )
+    @classmethod
+    def _coerce_text(cls, value):
+        return coerce_text(value)
+
+    @field_validator('total_amount', mode='before')
+    @classmethod
+    def _coerce_total(cls, value):
+        return coerce_number(value)
+
+    @field_validator('items', mode='before')
+    @classmethod
+    def _coerce_items(cls, value):
+        return value or []
+
+
+class ReceiptData(BaseModel):
+    """Extracted receipt"""
+    seller_name: str = ''
+    seller_address: str = ''
+    invoice_number: str = ''
+    items: List[LineItem] = []
+    total_amount: float = 0
+    currency: str = ''
+    date: str = ''
+    payment_method: str = ''
+
+    @field_validator(
+        'seller_name', 'seller_address', 'invoice_number', 'currency', 'date', 'payment_method',
+        mode='before'
+    )
+    @classmethod
+    def _coerce_text(cls, value):
+        return coerce_text(value)
+
+    @field_validator('total_amount', mode='before')
+    @classmethod
+    def _coerce_total(cls, value):
+        return coerce_number(value)
+
+    @field_validator('items', mode='before')
+    @classmethod
+    def _coerce_items(cls, value):
+        return value or []
+
+
+def _strip_defaults(node: Any) -> Any:
+    if isinstance(node, dict):
+        return {key: _strip_defaults(value) for key, value in node.items() if key != 'default'}
+    if isinstance(node, list):
+        return [_strip_defaults(value) for value in node]
+    return node
+
+
+def response_schema(schema: Type[BaseModel]) -> Dict[str, Any]:
+    """
+    JSON schema for GenerateContentConfig.response_schema
+
+    The Gemini API rejects default values in response schemas, so they are
+    stripped here; the pydantic defaults still apply when validating.
+    """
+    return _strip_defaults(schema.model_json_schema())
+
+
+_FENCE_RE = re.compile(r'```(?:json)?\s*(.*?)```', re.DOTALL | re.IGNORECASE)
+_TRAILING_COMMA_RE = re.compile(r',\s*([}\]])')
+
+
+def _strip_fences(text: str) -> str:
+    match = _FENCE_RE.search(text)
+    return match.group(1).strip() if match else text.strip()
+
+
+def _outermost_object(text: str) -> str:
+    start = text.find('{')
+    end = text.rfind('}')
+    if start == -1 or end <= start:
+        return text
+    return text[start:end + 1]
+
+
+def repair_json(text: str) -> Dict[str, Any]:
+    """
+    Best-effort local repair of a malformed JSON answer
+
+    Handles the usual formatting problems (markdown fences anywhere in the
+    text, prose around the object, smart quotes, trailing commas and
+    Python-style literals) without another model call.
+
+    Raises:
+        ValueError: If the text still cannot be parsed
+    """
+    candidate = _outermost_object(_strip_fences(text))
+    candidate = (
+        candidate.replace('“', '"').replace('”', '"')
+        .replace('‘', "'").replace('’', "'")
+    )
+    candidate = _TRAILING_COMMA_RE.sub(r'\1', candidate)
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError:
+        pass
+    # Single quotes / True / None: parse as a Python literal
+    try:
+        value = ast.literal_eval(candidate)
+    except (ValueError, SyntaxError) as e:
+        raise ValueError(f"Unrepairable JSON: {str(e)}")
+    if not isinstance(value, dict):
+        raise ValueError("Extracted payload is not an object")
+    return value
+
+
+def parse_extraction(text: str, schema: Type[BaseModel]) -> Dict[str, Any]:
+    """
+    Parse and validate a model answer against an extraction schema
+
+    Args:
+        text: Raw response text
+        schema: ProformaData or ReceiptData
+
+    Returns:
+        Validated payload as a plain dict
+
+    Raises:
+        ExtractionParseError: If the text cannot be parsed or validated,
+            carrying the raw text so callers can attempt a repair
+    """
+    text = (text or '').strip()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        try:
+            data = repair_json(text)
+        except ValueError as e:
+            raise ExtractionParseError(str(e), raw_text=text)
+
+    if not isinstance(data, dict):
+        raise ExtractionParseError("Extracted payload is not an object", raw_text=text)
+
+    try:
+        return schema.model_validate(data).model_dump()
+    except ValidationError as e:
+        raise ExtractionParseError(f"Schema validation failed: {str(e)}", raw_text=text)
@@ -1,8 +1,81 @@
-import json
-import requests
-from typing import Dict, Any, Optional
+import asyncio
+import base64
+import logging
+from io import BytesIO
+from typing import Dict, Any, Optional, Tuple, Type
 from django.conf import settings
 from google import genai
+from google.genai import types
+from pydantic import BaseModel
+from organizations.models import DEFAULT_MATCH_TOLERANCES
+from vendors.services import vendor_names_match
+from .matching import MatchConfig, match_line_items
+from .rate_limit import get_rate_limiter
+from .resilience import get_circuit_breaker
+from .duplicates import IMAGE_CONTENT_TYPES
+from .images import normalize_image
+from .storage import read_url
+from .schemas import (
+    ExtractionParseError, ProformaData, ReceiptData, parse_extraction, response_schema
+)
+
+logger = logging.getLogger(__name__)
+
+
+GEMINI_MODEL = "gemini-2.0-flash-exp"
+
+PROFORMA_PROMPT = """
+Analyze this proforma invoice document and extract the following information in JSON format:
+{
+    "vendor_name": "name of the vendor/company",
+    "vendor_address": "vendor address if available",
+    "vendor_email": "vendor email if available",
+    "invoice_number": "proforma/invoice number if available",
+    "items": [
+        {
+            "description": "item description",
+            "quantity": number,
+            "unit_price": number,
+            "total": number
+        }
+    ],
+    "total_amount": number,
+    "currency": "currency code",
+    "terms": "payment terms if mentioned",
+    "validity": "validity period if mentioned"
+}
+
+Extract all items and their details. Return only valid JSON.
+"""
+
+RECEIPT_PROMPT = """
+Analyze this receipt document and extract the following information in JSON format:
+{
+    "seller_name": "name of the seller/vendor",
+    "seller_address": "seller address if available",
+    "invoice_number": "receipt/invoice number if available",
+    "items": [
+        {
+            "description": "item description",
+            "quantity": number,
+            "unit_price": number,
+            "total": number
+        }
+    ],
+    "total_amount": number,
+    "currency": "currency code",
+    "date": "purchase date if available",
+    "payment_method": "payment method if mentioned"
+}
+
+Extract all items and their details. Return only valid JSON.
+"""
+
+REPAIR_PROMPT = """
+The following text was meant to be a single JSON object but is malformed.
+Return the same data as valid JSON matching the response schema.
+Do not add, drop or change any values.
+"""
 
 
 class GeminiDocumentProcessor:
@@ -17,232 +90,230 @@ class GeminiDocumentProcessor:
         import os
         os.environ['GEMINI_API_KEY'] = api_key
         self.client = genai.Client()
+        self.rate_limiter = get_rate_limiter('gemini')
+        self.circuit_breaker = get_circuit_breaker('gemini')
     
-    def extract_proforma_data(self, file_url: str) -> Dict[str, Any]:
+    def extract_proforma_data(self, file_url: str, organization_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Extract data from proforma invoice
         
         Args:
             file_url: URL of the proforma file (Cloudinary URL)
+            organization_id: Organization whose rate limit bucket is charged
         
         Returns:
             Dictionary with extracted data: vendor, items, prices, terms
         """
-        prompt = """
-        Analyze this proforma invoice document and extract the following information in JSON format:
-        {
-            "vendor_name": "name of the vendor/company",
-            "vendor_address": "vendor address if available",
-            "vendor_email": "vendor email if available",
-            "items": [
-                {
-                    "description": "item description",
-                    "quantity": number,
-                    "unit_price": number,
-                    "total": number
-                }
-            ],
-            "total_amount": number,
-            "currency": "currency code",
-            "terms": "payment terms if mentioned",
-            "validity": "validity period if mentioned"
-        }
-        
-        Extract all items and their details. Return only valid JSON.
-        """
-        
         try:
-            # Download file from URL
-            response = requests.get(file_url, timeout=30, stream=True)
-            response.raise_for_status()
-            
-            # Get file content
-            file_content = response.content
-            mime_type = response.headers.get('Content-Type', 'application/pdf')
-            
-            # Process with Gemini
-            # For file content, we need to use the proper format
-            # The new API might require uploading the file first or using inline data
-            import base64
-            
-            # Convert file to base64 for inline inclusion
-            file_base64 = base64.b64encode(file_content).decode('utf-8')
-            
-            # Create content with file data
-            contents = [
-                prompt,
-                {
-                    "inline_data": {
-                        "mime_type": mime_type,
-                        "data": file_base64
-                    }
-                }
-            ]
-            
-            response_obj = self.client.models.generate_content(
-                model="gemini-2.0-flash-exp",
-                contents=contents
-            )
-            
-            # Parse JSON response
-            text = response_obj.text.strip()
-            # Remove markdown code blocks if present
-            if text.startswith('```'):
-                text = text.split('```')[1]
-                if text.startswith('json'):
-                    text = text[4:]
-                text = text.strip()
-            
-            extracted_data = json.loads(text)
-            return extracted_data
-        
+            return self._extract(file_url, PROFORMA_PROMPT, ProformaData, organization_id)
         except Exception as e:
             raise Exception(f"Error extracting proforma data: {str(e)}")
     
-    def extract_receipt_data(self, file_url: str) -> Dict[str, Any]:
+    def extract_receipt_data(self, file_url: str, organization_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Extract data from receipt
         
         Args:
             file_url: URL of the receipt file (Cloudinary URL)
+            organization_id: Organization whose rate limit bucket is charged
         
         Returns:
             Dictionary with extracted data: seller, items, prices, total
         """
-        prompt = """
-        Analyze this receipt document and extract the following information in JSON format:
-        {
-            "seller_name": "name of the seller/vendor",
-            "seller_address": "seller address if available",
-            "items": [
-                {
-                    "description": "item description",
-                    "quantity": number,
-                    "unit_price": number,
-                    "total": number
-                }
-            ],
-            "total_amount": number,
-            "currency": "currency code",
-            "date": "purchase date if available",
-            "payment_method": "payment method if mentioned"
-        }
-        
-        Extract all items and their details. Return only valid JSON.
+        try:
+            return self._extract(file_url, RECEIPT_PROMPT, ReceiptData, organization_id)
+        except Exception as e:
+            raise Exception(f"Error extracting receipt data: {str(e)}")
+    
+    async def aextract_proforma_data(self, file_url: str, organization_id: Optional[str] = None) -> Dict[str, Any]:
         """
+        Async variant of extract_proforma_data for the extraction executor
         
+        The download runs in a worker thread and the model call uses the
+        client's native asyncio API, so many documents can be in flight in
+        one event loop.
+        """
         try:
-            # Download file from URL
-            response = requests.get(file_url, timeout=30, stream=True)
-            response.raise_for_status()
-            
-            # Get file content
-            file_content = response.content
-            mime_type = response.headers.get('Content-Type', 'application/pdf')
-            
-            # Process with Gemini
-            # For file content, we need to use the proper format
-            # The new API might require uploading the file first or using inline data
-            import base64
-            
-            # Convert file to base64 for inline inclusion
-            file_base64 = base64.b64encode(file_content).decode('utf-8')
-            
-            # Create content with file data
-            contents = [
-                prompt,
-                {
-                    "inline_data": {
-                        "mime_type": mime_type,
-                        "data": file_base64
-                    }
-                }
-            ]
-            
+            return await self._aextract(file_url, PROFORMA_PROMPT, ProformaData, organization_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            raise Exception(f"Error extracting proforma data: {str(e)}")
+    
+    async def aextract_receipt_data(self, file_url: str, organization_id: Optional[str] = None) -> Dict[str, Any]:
+        """Async variant of extract_receipt_data for the extraction executor"""
+        try:
+            return await self._aextract(file_url, RECEIPT_PROMPT, ReceiptData, organization_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            raise Exception(f"Error extracting receipt data: {str(e)}")
+    
+    def _extract(self, file_url: str, prompt: str, schema: Type[BaseModel],
+                 organization_id: Optional[str] = None) -> Dict[str, Any]:
+        """Download, run a schema-constrained model call and validate the answer"""
+        file_content, mime_type = self._download_file(file_url)
+        self.rate_limiter.acquire(organization_id=organization_id)
+        with self.circuit_breaker.guard():
             response_obj = self.client.models.generate_content(
-                model="gemini-2.0-flash-exp",
-                contents=contents
+                model=GEMINI_MODEL,
+                contents=self._build_contents(prompt, file_content, mime_type),
+                config=self._generation_config(schema)
+            )
+        try:
+            return parse_extraction(response_obj.text, schema)
+        except ExtractionParseError as e:
+            # Formatting problem only: repair from the text we already paid for
+            logger.warning(f"Repairing malformed extraction output: {str(e)}")
+            self.rate_limiter.acquire(organization_id=organization_id)
+            with self.circuit_breaker.guard():
+                repaired = self.client.models.generate_content(
+                    model=GEMINI_MODEL,
+                    contents=self._build_repair_contents(e.raw_text),
+                    config=self._generation_config(schema)
+                )
+            return parse_extraction(repaired.text, schema)
+    
+    async def _aextract(self, file_url: str, prompt: str, schema: Type[BaseModel],
+                        organization_id: Optional[str] = None) -> Dict[str, Any]:
+        """Async variant of _extract"""
+        file_content, mime_type = await asyncio.to_thread(self._download_file, file_url)
+        await self.rate_limiter.aacquire(organization_id=organization_id)
+        with self.circuit_breaker.guard():
+            response_obj = await self.client.aio.models.generate_content(
+                model=GEMINI_MODEL,
+                contents=self._build_contents(prompt, file_content, mime_type),
+                config=self._generation_config(schema)
             )
-            
-            # Parse JSON response
-            text = response_obj.text.strip()
-            # Remove markdown code blocks if present
-            if text.startswith('```'):
-                text = text.split('```')[1]
-                if text.startswith('json'):
-                    text = text[4:]
-                text = text.strip()
-            
-            extracted_data = json.loads(text)
-            return extracted_data
+        try:
+            return parse_extraction(response_obj.text, schema)
+        except ExtractionParseError as e:
+            logger.warning(f"Repairing malformed extraction output: {str(e)}")
+            await self.rate_limiter.aacquire(organization_id=organization_id)
+            with self.circuit_breaker.guard():
+                repaired = await self.client.aio.models.generate_content(
+                    model=GEMINI_MODEL,
+                    contents=self._build_repair_contents(e.raw_text),
+                    config=self._generation_config(schema)
+                )
+            return parse_extraction(repaired.text, schema)
+    
+    @staticmethod
+    def _generation_config(schema: Type[BaseModel]) -> types.GenerateContentConfig:
+        """Request JSON constrained to the extraction schema"""
+        return types.GenerateContentConfig(
+            response_mime_type='application/json',
+            response_schema=response_schema(schema)
+        )
+    
+    @staticmethod
+    def _build_repair_contents(raw_text: str) -> list:
+        """Text-only repair request: no file download, no document tokens"""
+        return [REPAIR_PROMPT, raw_text]
+    
+    @staticmethod
+    def _download_file(file_url: str) -> Tuple[bytes, str]:
+        """
+        Read a stored file and return (content, mime_type)
         
-        except Exception as e:
-            raise Exception(f"Error extracting receipt data: {str(e)}")
+        Images stored before normalization, or uploaded straight to
+        storage, are normalized here so the model gets the small version.
+        """
+        content, mime_type = read_url(file_url)
+        if settings.IMAGE_NORMALIZE and mime_type in IMAGE_CONTENT_TYPES:
+            normalized = normalize_image(BytesIO(content))
+            if normalized is not None:
+                return normalized.content, normalized.content_type
+        return content, mime_type
+    
+    @staticmethod
+    def _build_contents(prompt: str, file_content: bytes, mime_type: str) -> list:
+        """Build the model request with the file inlined as base64"""
+        return [
+            prompt,
+            {
+                "inline_data": {
+                    "mime_type": mime_type,
+                    "data": base64.b64encode(file_content).decode('utf-8')
+                }
+            }
+        ]
     
-    def validate_receipt_against_po(self, receipt_data: Dict[str, Any], po_data: Dict[str, Any]) -> Dict[str, Any]:
+    @staticmethod
+    def validate_receipt_against_po(
+        receipt_data: Dict[str, Any],
+        po_data: Dict[str, Any],
+        tolerances: Optional[Dict[str, float]] = None,
+        same_vendor: bool = False
+    ) -> Dict[str, Any]:
         """
         Validate receipt against purchase order
         
         Args:
             receipt_data: Extracted receipt data
             po_data: Purchase order data
+            tolerances: Organization.match_tolerances; defaults when omitted
+            same_vendor: Both documents come from the same Vendor through
+                exact or curated aliases, so the seller names are not compared
         
         Returns:
             Dictionary with validation results and discrepancies
         """
         discrepancies = []
         
-        # Check seller name
-        receipt_seller = receipt_data.get('seller_name', '').lower().strip()
-        po_vendor = po_data.get('vendor_name', '').lower().strip()
-        if receipt_seller != po_vendor:
+        # Check seller name (POs built from request items carry no vendor)
+        receipt_seller = receipt_data.get('seller_name') or ''
+        po_vendor = po_data.get('vendor_name') or ''
+        if not same_vendor and po_vendor.strip() and not vendor_names_match(receipt_seller, po_vendor):
             discrepancies.append({
                 'type': 'seller_mismatch',
                 'message': f"Seller name mismatch: Receipt shows '{receipt_data.get('seller_name')}' but PO shows '{po_data.get('vendor_name')}'"
             })
         
-        # Check items
+        # Match items by content rather than by position
         receipt_items = receipt_data.get('items', [])
         po_items = po_data.get('items', [])
+        tolerances = {**DEFAULT_MATCH_TOLERANCES, **(tolerances or {})}
+        matching = match_line_items(po_items, receipt_items, MatchConfig.from_tolerances(tolerances))
         
-        if len(receipt_items) != len(po_items):
+        for pair in matching.partial:
+            po_item = po_items[pair.left_index]
+            receipt_item = receipt_items[pair.right_index]
+            description = po_item.get('description', '')
+            if not pair.description_ok:
+                discrepancies.append({
+                    'type': 'item_description_mismatch',
+                    'message': f"Item '{description}' on the PO matches '{receipt_item.get('description', '')}' on the receipt only by quantity and price"
+                })
+            if not pair.quantity_ok:
+                discrepancies.append({
+                    'type': 'item_quantity_mismatch',
+                    'message': f"Item '{description}' quantity mismatch: Receipt shows {receipt_item.get('quantity')} but PO shows {po_item.get('quantity')}"
+                })
+            if not pair.price_ok:
+                discrepancies.append({
+                    'type': 'item_price_mismatch',
+                    'message': f"Item '{description}' price mismatch: Receipt shows {receipt_item.get('unit_price')} but PO shows {po_item.get('unit_price')}"
+                })
+        
+        for index in matching.unmatched_left:
             discrepancies.append({
-                'type': 'item_count_mismatch',
-                'message': f"Item count mismatch: Receipt has {len(receipt_items)} items but PO has {len(po_items)} items"
+                'type': 'item_missing',
+                'message': f"Item '{po_items[index].get('description', '')}' on the PO was not found on the receipt"
             })
         
-        # Check each item
-        for i, po_item in enumerate(po_items):
-            if i < len(receipt_items):
-                receipt_item = receipt_items[i]
-                
-                # Check description
-                if receipt_item.get('description', '').lower() != po_item.get('description', '').lower():
-                    discrepancies.append({
-                        'type': 'item_description_mismatch',
-                        'message': f"Item {i+1} description mismatch"
-                    })
-                
-                # Check quantity
-                if abs(float(receipt_item.get('quantity', 0)) - float(po_item.get('quantity', 0))) > 0.01:
-                    discrepancies.append({
-                        'type': 'item_quantity_mismatch',
-                        'message': f"Item {i+1} quantity mismatch: Receipt shows {receipt_item.get('quantity')} but PO shows {po_item.get('quantity')}"
-                    })
-                
-                # Check unit price (allow 5% tolerance)
-                receipt_price = float(receipt_item.get('unit_price', 0))
-                po_price = float(po_item.get('unit_price', 0))
-                if po_price > 0 and abs(receipt_price - po_price) / po_price > 0.05:
-                    discrepancies.append({
-                        'type': 'item_price_mismatch',
-                        'message': f"Item {i+1} price mismatch: Receipt shows {receipt_price} but PO shows {po_price}"
-                    })
+        for index in matching.unmatched_right:
+            discrepancies.append({
+                'type': 'item_unexpected',
+                'message': f"Item '{receipt_items[index].get('description', '')}' on the receipt is not on the PO"
+            })
         
-        # Check total amount (allow 5% tolerance)
+        # Check total amount
         receipt_total = float(receipt_data.get('total_amount', 0))
         po_total = float(po_data.get('total_amount', 0))
-        if po_total > 0 and abs(receipt_total - po_total) / po_total > 0.05:
+        if po_total > 0 and abs(receipt_total - po_total) > max(
+            tolerances['absolute'], tolerances['total_amount'] * po_total
+        ):
             discrepancies.append({
                 'type': 'total_amount_mismatch',
                 'message': f"Total amount mismatch: Receipt shows {receipt_total} but PO shows {po_total}"
@@ -251,6 +322,7 @@ class GeminiDocumentProcessor:
         return {
             'is_valid': len(discrepancies) == 0,
             'discrepancies': discrepancies,
+            'line_matching': matching.to_dict(),
             'receipt_data': receipt_data,
             'po_data': po_data
         }
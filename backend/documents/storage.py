@@ -0,0 +1,272 @@
+"""
+Document storage
+
+Every proforma, receipt and PO byte goes through a StorageBackend
+(put, open, url, delete, exists), selected by STORAGE_BACKEND:
+
+    cloudinary: production; files are raw resources whose public ID is
+        the storage name, so URLs can be derived from names
+    local: files under STORAGE_LOCAL_ROOT, served by the `stored-file`
+        view and read through mmap; lets tests, load tests and offline
+        deployments run without any network
+
+Names are storage keys such as 'procure-to-pay/<org>/proformas/<hex>.pdf';
+the database keeps the URLs put() returns. open_url() reads a stored URL
+through the backend that owns it, and over HTTP otherwise (files stored
+before a backend switch, direct uploads to Cloudinary).
+"""
+import logging
+import mimetypes
+import mmap
+import os
+import tempfile
+import threading
+import uuid
+from io import BytesIO
+from typing import BinaryIO, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+import cloudinary
+import cloudinary.api
+import cloudinary.exceptions
+import cloudinary.uploader
+import cloudinary.utils
+import requests
+from django.conf import settings
+from django.urls import Resolver404, resolve, reverse
+
+from .rate_limit import get_rate_limiter
+from .resilience import get_circuit_breaker
+
+logger = logging.getLogger(__name__)
+
+# Files read over HTTP stay in memory up to this size
+SPOOL_SIZE = 1024 * 1024
+
+
+class StorageError(Exception):
+    """A storage name that cannot be used"""
+
+
+class StorageBackend:
+    """Base class for document storage backends"""
+
+    def put(self, file, name: str, organization_id: Optional[str] = None) -> str:
+        """
+        Store a file under `name`, replacing any file of that name
+
+        Args:
+            file: Readable binary file (Django UploadedFile or file object)
+            name: Storage name
+            organization_id: Organization the upload is rate limited under
+
+        Returns:
+            URL of the stored file
+        """
+        raise NotImplementedError
+
+    def open(self, name: str) -> BinaryIO:
+        """Open a stored file for reading as a stream (caller closes it)"""
+        raise NotImplementedError
+
+    def url(self, name: str) -> str:
+        """URL of a stored file"""
+        raise NotImplementedError
+
+    def delete(self, name: str):
+        """Delete a stored file; missing files are ignored"""
+        raise NotImplementedError
+
+    def exists(self, name: str) -> bool:
+        """Whether a file is stored under `name`"""
+        raise NotImplementedError
+
+    def name_for_url(self, url: str) -> Optional[str]:
+        """Storage name of a URL this backend returned, or None"""
+        raise NotImplementedError
+
+
+class CloudinaryStorage(StorageBackend):
+    """
+    Cloudinary raw resources
+
+    Files above PO_UPLOAD_CHUNK_SIZE go up with upload_large, which reads
+    and sends one chunk at a time instead of the whole file.
+    """
+    resource_type = 'raw'
+
+    def put(self, file, name: str, organization_id: Optional[str] = None) -> str:
+        options = {'resource_type': self.resource_type, 'public_id': name, 'overwrite': True}
+        chunk_size = settings.PO_UPLOAD_CHUNK_SIZE
+        file.seek(0, 2)
+        size = file.tell()
+        file.seek(0)
+
+        # Wait for a Cloudinary quota token (global + per-organization)
+        get_rate_limiter('cloudinary').acquire(organization_id=organization_id)
+        with get_circuit_breaker('cloudinary').guard():
+            if size > chunk_size:
+                result = cloudinary.uploader.upload_large(file, chunk_size=chunk_size, **options)
+            else:
+                result = cloudinary.uploader.upload(file, **options)
+        return result['secure_url']
+
+    def open(self, name: str) -> BinaryIO:
+        return download(self.url(name))
+
+    def url(self, name: str) -> str:
+        url, _ = cloudinary.utils.cloudinary_url(name, resource_type=self.resource_type, type='upload', secure=True)
+        return url
+
+    def delete(self, name: str):
+        with get_circuit_breaker('cloudinary').guard():
+            cloudinary.uploader.destroy(name, resource_type=self.resource_type, invalidate=True)
+
+    def exists(self, name: str) -> bool:
+        try:
+            with get_circuit_breaker('cloudinary').guard():
+                cloudinary.api.resource(name, resource_type=self.resource_type)
+        except cloudinary.exceptions.NotFound:
+            return False
+        return True
+
+    def name_for_url(self, url: str) -> Optional[str]:
+        # .../<cloud>/raw/upload/[v<version>/]<public id>
+        marker = f'/{cloudinary.config().cloud_name}/{self.resource_type}/upload/'
+        path = urlparse(url).path
+        if marker not in path:
+            return None
+        name = path.split(marker, 1)[1]
+        first, _, rest = name.partition('/')
+        if rest and first[:1] == 'v' and first[1:].isdigit():
+            name = rest
+        return name
+
+
+class LocalStorage(StorageBackend):
+    """
+    Files on the local filesystem
+
+    Reads are memory mapped, so hashing, image probing and extraction of
+    a stored file never copy it through Python buffers; the stored-file
+    view answers with FileResponse, which the WSGI server sends with
+    sendfile (or nginx, with STORAGE_LOCAL_ACCEL_REDIRECT).
+
+    Args:
+        root: Directory the files are stored in
+        base_url: Scheme and host the files are served from
+    """
+
+    def __init__(self, root: str, base_url: str):
+        self.root = os.path.realpath(root)
+        self.base_url = base_url
+
+    def path(self, name: str) -> str:
+        """Absolute path of a stored file; names cannot escape the root"""
+        path = os.path.realpath(os.path.join(self.root, name))
+        if os.path.commonpath([self.root, path]) != self.root or path == self.root:
+            raise StorageError(f"Invalid storage name {name!r}")
+        return path
+
+    def put(self, file, name: str, organization_id: Optional[str] = None) -> str:
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written under a temporary name and renamed, so readers never see a partial file
+        partial = f'{path}.{uuid.uuid4().hex}.part'
+        file.seek(0)
+        chunks = file.chunks() if hasattr(file, 'chunks') else iter(lambda: file.read(64 * 1024), b'')
+        try:
+            with open(partial, 'wb') as out:
+                for chunk in chunks:
+                    out.write(chunk)
+            os.replace(partial, path)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+        return self.url(name)
+
+    def open(self, name: str) -> BinaryIO:
+        with open(self.path(name), 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return BytesIO()
+            # The mapping keeps its own reference to the file
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def url(self, name: str) -> str:
+        return urljoin(self.base_url, reverse('stored-file', kwargs={'name': name}))
+
+    def delete(self, name: str):
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def exists(self, name: str) -> bool:
+        return os.path.isfile(self.path(name))
+
+    def name_for_url(self, url: str) -> Optional[str]:
+        try:
+            match = resolve(urlparse(url).path)
+        except Resolver404:
+            return None
+        return match.kwargs['name'] if match.url_name == 'stored-file' else None
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> StorageBackend:
+    """Return the configured storage backend (one per process)"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                if settings.STORAGE_BACKEND == 'local':
+                    _storage = LocalStorage(settings.STORAGE_LOCAL_ROOT, settings.STORAGE_LOCAL_BASE_URL)
+                else:
+                    _storage = CloudinaryStorage()
+    return _storage
+
+
+def storage_name(folder: str, filename: str = '') -> str:
+    """A new unique name in `folder`, keeping the file extension: 'a/b', 'x.PDF' -> 'a/b/<hex>.pdf'"""
+    extension = os.path.splitext(filename)[1].lower()
+    return f'{folder}/{uuid.uuid4().hex}{extension}'
+
+
+def guess_content_type(name_or_url: str) -> str:
+    """Content type of a stored file from its name or URL"""
+    return mimetypes.guess_type(urlparse(name_or_url).path)[0] or 'application/octet-stream'
+
+
+def download(url: str) -> BinaryIO:
+    """Fetch a URL into a spooled temporary file (caller closes it)"""
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    try:
+        with get_circuit_breaker('cloudinary').guard():
+            response = requests.get(url, timeout=30, stream=True)
+            response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            spooled.write(chunk)
+    except BaseException:
+        spooled.close()
+        raise
+    spooled.seek(0)
+    return spooled
+
+
+def open_url(url: str) -> BinaryIO:
+    """Open a stored file by URL (caller closes it)"""
+    storage = get_storage()
+    name = storage.name_for_url(url)
+    if name is None:
+        return download(url)
+    return storage.open(name)
+
+
+def read_url(url: str) -> Tuple[bytes, str]:
+    """Contents and content type of a stored file (PDF unless the URL says otherwise)"""
+    with open_url(url) as file:
+        return file.read(), mimetypes.guess_type(urlparse(url).path)[0] or 'application/pdf'
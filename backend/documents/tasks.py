@@ -1,78 +1,426 @@
-from celery import shared_task
+import copy
+from celery import chain, shared_task
 from django.conf import settings
-from purchase_requests.models import PurchaseRequest, Document
+from django.db import transaction
+from django.utils import timezone
+from purchase_requests.models import PurchaseRequest, Document, DocumentFingerprint, SpooledUpload
+from purchase_requests.upload_spool import remove_spool_file, spool_path, storage_folder
+from purchase_requests.utils import store_uploaded_file
+from purchase_requests.po_numbers import assign_po_number
+from vendors.services import resolve_vendor, same_confirmed_vendor
 from .services import GeminiDocumentProcessor
-from .po_generator import generate_purchase_order_pdf
-import cloudinary.uploader
+from .resilience import ResilientTask
+from .executor import AsyncExtractionExecutor, ExtractionJob, ExtractionResult, shared_executor
+from .three_way import three_way_match
+from .duplicates import UploadFingerprint, cached_extraction, fingerprint_file, record_extraction, record_upload
+from .po_generator import TEMPLATE_VERSION, po_render_key, render_purchase_order
+from .storage import get_storage, guess_content_type, open_url, storage_name
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-@shared_task
-def process_proforma_task(request_id: str, file_url: str):
+def set_proforma_extraction_status(request_id: str, file_url: str, status: str, error: str = '') -> bool:
+    """
+    Update a request's proforma extraction status
+    
+    The update is conditional on the proforma URL, so a late result for a
+    proforma that has since been replaced cannot overwrite the status of
+    the current one.
+    
+    Returns:
+        True if the request still points at `file_url`
+    """
+    return PurchaseRequest.objects.filter(id=request_id, proforma_file_url=file_url).update(
+        proforma_extraction_status=status,
+        proforma_extraction_error=error[:2000]
+    ) > 0
+
+
+def schedule_proforma_extraction(request: PurchaseRequest, direct_upload: bool = False):
+    """
+    Start extracting a freshly uploaded proforma in the background
+    
+    Extraction is speculative: it runs at upload time so the data is
+    normally ready long before final approval, and PO generation does not
+    have to wait on the model. The task is enqueued on commit so the worker
+    sees the new URL.
+    
+    Args:
+        request: Request whose proforma_file_url was just set
+        direct_upload: The file went straight to storage, so it is
+            fingerprinted by the worker before extraction
+    """
+    request.proforma_extraction_status = PurchaseRequest.ExtractionStatus.PENDING
+    request.proforma_extraction_error = ''
+    request.save(update_fields=['proforma_extraction_status', 'proforma_extraction_error'])
+    
+    request_id, file_url = str(request.id), request.proforma_file_url
+    if direct_upload:
+        job = fingerprint_first(
+            process_proforma_task.si(request_id, file_url), request_id, Document.DocumentType.PROFORMA, file_url
+        )
+        transaction.on_commit(job.delay)
+    else:
+        transaction.on_commit(lambda: process_proforma_task.delay(request_id, file_url))
+
+
+def fingerprint_first(task, request_id: str, document_type: str, file_url: str):
+    """Chain a task after fingerprinting a direct upload"""
+    return chain(fingerprint_stored_upload_task.si(request_id, document_type, file_url), task)
+
+
+def extract_document(request_id: str, document_type: str, file_url: str, organization_id: str) -> dict:
+    """
+    Extract one uploaded document, reusing the result of a byte-identical
+    earlier upload when there is one
+    
+    The model call goes through the process's shared executor, so calls
+    from concurrently running tasks overlap instead of queueing.
+    
+    Raises:
+        The extraction error when the model call fails
+    """
+    cached = cached_extraction(request_id, document_type, file_url)
+    if cached is not None:
+        logger.info(f"Reusing extraction of an identical {document_type} for request {request_id}")
+        return cached
+    
+    result = shared_executor().run_one(ExtractionJob(
+        request_id=request_id,
+        document_type=document_type,
+        file_url=file_url,
+        organization_id=organization_id
+    ))
+    if not result.ok:
+        raise result.exception or Exception(result.error)
+    return result.data
+
+
+def save_extracted_document(request: PurchaseRequest, document_type: str, file_url: str, **fields):
+    """
+    Create or update the document extracted from one uploaded file
+    
+    There is one document per request, type and file, so re-running
+    extraction (reextract_documents, task retries) updates it in place.
+    Duplicates left by earlier runs are removed.
+    
+    Args:
+        request: Request the file belongs to
+        document_type: Document.DocumentType value
+        file_url: URL of the extracted file
+        **fields: Document fields to set (extracted_data, vendor, ...)
+    
+    Returns:
+        (document, previous) where previous is the earlier version of the
+        document, or None if it was just created
+    """
+    with transaction.atomic():
+        existing = list(
+            Document.objects.select_for_update()
+            .filter(request=request, document_type=document_type, file_url=file_url)
+            .order_by('-created_at')
+        )
+        if not existing:
+            return Document.objects.create(
+                request=request, document_type=document_type, file_url=file_url, **fields
+            ), None
+        
+        document, duplicates = existing[0], existing[1:]
+        if duplicates:
+            Document.objects.filter(id__in=[duplicate.id for duplicate in duplicates]).delete()
+        previous = copy.copy(document)
+        for field, value in fields.items():
+            setattr(document, field, value)
+        document.save()
+        return document, previous
+
+
+def store_proforma_result(request_id: str, file_url: str, extracted_data: dict) -> Document | None:
+    """
+    Persist extracted proforma data as a PROFORMA document
+    
+    Re-extracting the same file updates its document instead of adding one.
+    
+    Returns:
+        The document, or None if the request's proforma was replaced
+        while extraction was running
+    """
+    request = PurchaseRequest.objects.get(id=request_id)
+    if request.proforma_file_url != file_url:
+        logger.info(f"Discarding stale proforma extraction for request {request_id}")
+        return None
+    
+    vendor = resolve_vendor(request.organization_id, extracted_data.get('vendor_name'))
+    document, _ = save_extracted_document(
+        request, Document.DocumentType.PROFORMA, file_url, extracted_data=extracted_data, vendor=vendor
+    )
+    record_extraction(request.id, Document.DocumentType.PROFORMA, file_url, extracted_data, vendor)
+    set_proforma_extraction_status(request_id, file_url, PurchaseRequest.ExtractionStatus.COMPLETED)
+    return document
+
+
+def request_item_rows(request: PurchaseRequest) -> list:
+    """A request's RequestItem rows as plain line-item dicts"""
+    return [
+        {
+            'id': item.id,
+            'description': item.description,
+            'quantity': float(item.quantity),
+            'unit_price': float(item.unit_price),
+            'total': float(item.total),
+        }
+        for item in request.items.all()
+    ]
+
+
+def get_po_data(request: PurchaseRequest) -> dict | None:
+    """
+    Return the data to print on a request's purchase order
+    
+    Uses the speculatively extracted proforma when it is ready and extracts
+    it inline when it is not (still queued, or failed earlier). Requests
+    without a proforma fall back to their own line items.
+    
+    Returns:
+        PO data dict, or None if there is nothing to build a PO from
+    """
+    if request.proforma_file_url:
+        proforma_doc = request.documents.filter(
+            document_type=Document.DocumentType.PROFORMA,
+            file_url=request.proforma_file_url
+        ).first()
+        if proforma_doc:
+            return proforma_doc.extracted_data
+        
+        logger.info(f"Proforma for request {request.id} not extracted yet; extracting inline")
+        data = extract_document(
+            str(request.id), Document.DocumentType.PROFORMA, request.proforma_file_url, str(request.organization_id)
+        )
+        store_proforma_result(str(request.id), request.proforma_file_url, data)
+        return data
+    
+    items = request_item_rows(request)
+    if not items:
+        return None
+    return {'items': items, 'total_amount': float(request.amount)}
+
+
+def store_receipt_result(request_id: str, file_url: str, receipt_data: dict) -> Document:
+    """Validate extracted receipt data against the PO and persist it"""
+    request = PurchaseRequest.objects.get(id=request_id)
+    vendor = resolve_vendor(request.organization_id, receipt_data.get('seller_name'))
+    record_extraction(request.id, Document.DocumentType.RECEIPT, file_url, receipt_data, vendor)
+    
+    # Get PO data
+    po_doc = request.documents.filter(
+        document_type=Document.DocumentType.PO
+    ).first()
+    
+    if not po_doc:
+        logger.warning(f"No PO document found for request {request_id}")
+        # Save receipt document anyway
+        document, _ = save_extracted_document(
+            request, Document.DocumentType.RECEIPT, file_url, extracted_data=receipt_data, vendor=vendor
+        )
+        return document
+    
+    # Validate receipt against PO and the requested line items
+    tolerances = request.organization.match_tolerances
+    validation_result = GeminiDocumentProcessor.validate_receipt_against_po(
+        receipt_data,
+        po_doc.extracted_data,
+        tolerances,
+        same_vendor=(
+            vendor is not None and vendor.id == po_doc.vendor_id
+            and same_confirmed_vendor(
+                request.organization_id, receipt_data.get('seller_name'), po_doc.extracted_data.get('vendor_name')
+            )
+        )
+    )
+    match_report = three_way_match(
+        po_doc.extracted_data,
+        receipt_data,
+        request_item_rows(request),
+        requested_amount=float(request.amount),
+        tolerances=tolerances
+    )
+    
+    # Save receipt document with validation results
+    document, previous = save_extracted_document(
+        request,
+        Document.DocumentType.RECEIPT,
+        file_url,
+        extracted_data={
+            **receipt_data,
+            'validation': validation_result
+        },
+        vendor=vendor,
+        match_report=match_report
+    )
+    
+    # PO-vs-request differences are informational; only the receipt against
+    # the PO decides a discrepancy
+    if not match_report['request_matches_po']:
+        logger.info(
+            f"PO for request {request_id} differs from the requested items: "
+            f"{match_report['aggregate']['breaches']}, unmatched: {match_report['unmatched']}"
+        )
+    
+    # Update request status if discrepancies found. A re-extraction that
+    # finds the discrepancies already reported leaves the status alone, so a
+    # discrepancy someone has since resolved is not flagged again.
+    is_valid = validation_result['is_valid'] and match_report['is_valid']
+    if not is_valid and (previous is None or receipt_was_valid(previous)):
+        request.status = PurchaseRequest.Status.DISCREPANCY
+        request.save()
+        logger.warning(
+            f"Discrepancies found for request {request_id}: {validation_result['discrepancies']}, "
+            f"three-way match: {match_report['summary']}"
+        )
+    elif is_valid:
+        logger.info(f"Receipt validated successfully for request {request_id}")
+    else:
+        logger.info(f"Receipt for request {request_id} re-extracted; discrepancies were already reported")
+    
+    return document
+
+
+def receipt_was_valid(document: Document) -> bool:
+    """Whether a stored receipt passed validation when it was last checked"""
+    return stored_verdict((document.extracted_data or {}).get('validation'), document.match_report)
+
+
+def stored_verdict(validation: dict, match_report: dict) -> bool:
+    """Combined verdict of a stored validation result and match report; unchecked counts as valid"""
+    return bool((validation or {}).get('is_valid', True)) and bool((match_report or {}).get('is_valid', True))
+
+
+def store_extraction_result(result: ExtractionResult):
+    """Persist one executor result, dispatching on document type"""
+    job = result.job
+    if not result.ok:
+        logger.error(f"Extraction failed for request {job.request_id}: {result.error}")
+        if job.document_type == Document.DocumentType.PROFORMA:
+            set_proforma_extraction_status(
+                job.request_id, job.file_url, PurchaseRequest.ExtractionStatus.FAILED, result.error or ''
+            )
+        return
+    if job.document_type == Document.DocumentType.PROFORMA:
+        store_proforma_result(job.request_id, job.file_url, result.data)
+    elif job.document_type == Document.DocumentType.RECEIPT:
+        store_receipt_result(job.request_id, job.file_url, result.data)
+
+
+@shared_task(bind=True, base=ResilientTask)
+def process_proforma_task(self, request_id: str, file_url: str):
     """Process proforma invoice and extract data"""
     try:
         request = PurchaseRequest.objects.get(id=request_id)
-        processor = GeminiDocumentProcessor()
-        
-        # Extract data
-        extracted_data = processor.extract_proforma_data(file_url)
+        if request.proforma_file_url != file_url:
+            logger.info(f"Proforma for request {request_id} was replaced; skipping extraction of {file_url}")
+            return
         
-        # Save document
-        Document.objects.create(
-            request=request,
-            document_type=Document.DocumentType.PROFORMA,
-            file_url=file_url,
-            extracted_data=extracted_data
+        set_proforma_extraction_status(request_id, file_url, PurchaseRequest.ExtractionStatus.PROCESSING)
+        data = extract_document(
+            request_id, Document.DocumentType.PROFORMA, file_url, str(request.organization_id)
         )
-        
+        store_proforma_result(request_id, file_url, data)
         logger.info(f"Proforma processed successfully for request {request_id}")
         
     except Exception as e:
         logger.error(f"Error processing proforma for request {request_id}: {str(e)}")
+        # Stay PENDING while a retry is scheduled so the UI does not flicker to FAILED
+        status = (
+            PurchaseRequest.ExtractionStatus.PENDING if self.will_retry(e)
+            else PurchaseRequest.ExtractionStatus.FAILED
+        )
+        set_proforma_extraction_status(request_id, file_url, status, str(e))
         raise
 
 
-@shared_task
+def upload_purchase_order(pdf_file, organization_id: str, render_key: str = None) -> str:
+    """
+    Store a rendered PO and close the file
+    
+    Args:
+        pdf_file: Rendered PO, any readable binary file
+        organization_id: Organization the upload is rate limited under
+        render_key: po_render_key of the PO; used as the storage name so a
+            repeated upload of the same render overwrites one object
+    
+    Returns:
+        URL of the stored PO
+    """
+    name = f'purchase_orders/{render_key}.pdf' if render_key else storage_name('purchase_orders', '.pdf')
+    try:
+        return get_storage().put(pdf_file, name, organization_id=organization_id)
+    finally:
+        pdf_file.close()
+
+
+def cached_purchase_order(request: PurchaseRequest, render_key: str) -> Document | None:
+    """The request's PO for the current template version if it was rendered from the same inputs"""
+    return Document.objects.filter(
+        request=request,
+        document_type=Document.DocumentType.PO,
+        template_version=TEMPLATE_VERSION,
+        render_key=render_key
+    ).first()
+
+
+def store_purchase_order(request: PurchaseRequest, po_data: dict, po_file_url: str, render_key: str) -> Document:
+    """
+    Point a request at its uploaded PO and save the PO document
+    
+    There is one PO document per request and template version: a
+    re-render for changed inputs replaces it, and of two concurrent runs
+    the second updates the row the first created.
+    """
+    with transaction.atomic():
+        document, _ = Document.objects.update_or_create(
+            request=request,
+            document_type=Document.DocumentType.PO,
+            template_version=TEMPLATE_VERSION,
+            defaults={
+                'file_url': po_file_url,
+                'extracted_data': po_data,
+                'render_key': render_key,
+                'vendor': resolve_vendor(request.organization_id, po_data.get('vendor_name')),
+            }
+        )
+        request.purchase_order_file_url = po_file_url
+        request.save(update_fields=['purchase_order_file_url', 'updated_at'])
+    return document
+
+
+@shared_task(base=ResilientTask)
 def generate_purchase_order_task(request_id: str):
-    """Generate purchase order PDF after final approval"""
+    """
+    Generate purchase order PDF after final approval
+    
+    Idempotent: when the request's PO for the current template version was
+    rendered from the same inputs (see po_render_key), retries, duplicate
+    enqueues and manual re-runs return without rendering or uploading.
+    """
     try:
         request = PurchaseRequest.objects.get(id=request_id)
         
-        # Get proforma data
-        proforma_doc = request.documents.filter(
-            document_type=Document.DocumentType.PROFORMA
-        ).first()
-        
-        if not proforma_doc:
-            logger.warning(f"No proforma document found for request {request_id}")
+        po_data = get_po_data(request)
+        if po_data is None:
+            logger.warning(f"No proforma or line items found for request {request_id}")
             return
         
-        # Generate PO PDF
-        po_data = proforma_doc.extracted_data
-        pdf_buffer = generate_purchase_order_pdf(request, po_data)
-        
-        # Upload to Cloudinary
-        upload_result = cloudinary.uploader.upload(
-            pdf_buffer,
-            resource_type='raw',
-            folder='purchase_orders'
-        )
-        
-        po_file_url = upload_result['secure_url']
-        
-        # Update request
-        request.purchase_order_file_url = po_file_url
-        request.save()
+        assign_po_number(request)
+        render_key = po_render_key(request, po_data)
+        if cached_purchase_order(request, render_key):
+            logger.info(f"Purchase order for request {request_id} is up to date; skipping render")
+            return
         
-        # Save document
-        Document.objects.create(
-            request=request,
-            document_type=Document.DocumentType.PO,
-            file_url=po_file_url,
-            extracted_data=po_data
-        )
+        # Generate PO PDF and upload it to Cloudinary
+        pdf_file = render_purchase_order(request, po_data)
+        po_file_url = upload_purchase_order(pdf_file, str(request.organization_id), render_key)
+        store_purchase_order(request, po_data, po_file_url, render_key)
         
         logger.info(f"Purchase order generated successfully for request {request_id}")
         
@@ -82,6 +430,26 @@ def generate_purchase_order_task(request_id: str):
 
 
 @shared_task
+def generate_purchase_orders_task(request_ids: list) -> dict:
+    """
+    Generate the POs of many approved requests in one go
+    
+    Rendering is fanned out to a process pool of PO_BATCH_WORKERS; POs
+    that fail in the batch are handed to generate_purchase_order_task,
+    which retries them one by one.
+    
+    Returns:
+        Summary counters and render timings for the batch
+    """
+    from .po_batch import PurchaseOrderBatch
+    
+    stats = PurchaseOrderBatch(workers=settings.PO_BATCH_WORKERS).run(request_ids)
+    for request_id in stats.failed:
+        generate_purchase_order_task.delay(request_id)
+    return stats.as_dict()
+
+
+@shared_task(base=ResilientTask)
 def process_receipt_task(request_id: str):
     """Process receipt and validate against PO"""
     try:
@@ -91,53 +459,124 @@ def process_receipt_task(request_id: str):
             logger.warning(f"No receipt file URL for request {request_id}")
             return
         
-        processor = GeminiDocumentProcessor()
-        
         # Extract receipt data
-        receipt_data = processor.extract_receipt_data(request.receipt_file_url)
-        
-        # Get PO data
-        po_doc = request.documents.filter(
-            document_type=Document.DocumentType.PO
-        ).first()
+        data = extract_document(
+            request_id, Document.DocumentType.RECEIPT, request.receipt_file_url, str(request.organization_id)
+        )
+        store_receipt_result(request_id, request.receipt_file_url, data)
         
-        if not po_doc:
-            logger.warning(f"No PO document found for request {request_id}")
-            # Save receipt document anyway
-            Document.objects.create(
-                request=request,
-                document_type=Document.DocumentType.RECEIPT,
-                file_url=request.receipt_file_url,
-                extracted_data=receipt_data
+    except Exception as e:
+        logger.error(f"Error processing receipt for request {request_id}: {str(e)}")
+        raise
+
+
+@shared_task(bind=True, base=ResilientTask)
+def store_spooled_upload_task(self, upload_id: str):
+    """
+    Push a spooled upload to storage and point its request at it
+    
+    Then records the fingerprint and starts extraction, as the API does
+    for synchronous uploads. An upload superseded by a newer one of the
+    same document type is stored but not applied.
+    """
+    upload = SpooledUpload.objects.select_related('request').get(id=upload_id)
+    if upload.status != SpooledUpload.Status.PENDING:
+        return
+    
+    try:
+        with open(spool_path(upload), 'rb') as file:
+            file_url = store_uploaded_file(
+                file, storage_folder(upload), str(upload.request.organization_id), filename=upload.filename
             )
-            return
-        
-        # Validate receipt against PO
-        validation_result = processor.validate_receipt_against_po(
-            receipt_data,
-            po_doc.extracted_data
-        )
+    except Exception as e:
+        if not self.will_retry(e):
+            logger.error(f"Giving up on spooled upload {upload_id}: {str(e)}")
+            SpooledUpload.objects.filter(id=upload_id).update(
+                status=SpooledUpload.Status.FAILED, error=str(e)[:2000]
+            )
+            remove_spool_file(upload)
+        raise
+    
+    apply_spooled_upload(upload, file_url)
+    remove_spool_file(upload)
+
+
+def apply_spooled_upload(upload: SpooledUpload, file_url: str):
+    """Mark a spooled upload stored and, unless superseded, make it the request's file"""
+    request_id = str(upload.request_id)
+    with transaction.atomic():
+        request = PurchaseRequest.objects.select_for_update().get(id=request_id)
+        upload.status, upload.file_url, upload.stored_at = SpooledUpload.Status.STORED, file_url, timezone.now()
+        upload.save(update_fields=['status', 'file_url', 'stored_at'])
         
-        # Save receipt document with validation results
-        Document.objects.create(
-            request=request,
-            document_type=Document.DocumentType.RECEIPT,
-            file_url=request.receipt_file_url,
-            extracted_data={
-                **receipt_data,
-                'validation': validation_result
-            }
-        )
+        if SpooledUpload.objects.filter(
+            request_id=request_id, document_type=upload.document_type, created_at__gt=upload.created_at
+        ).exists():
+            logger.info(f"Spooled {upload.document_type} {upload.id} was superseded; not applied to {request_id}")
+            return
         
-        # Update request status if discrepancies found
-        if not validation_result['is_valid']:
-            request.status = PurchaseRequest.Status.DISCREPANCY
-            request.save()
-            logger.warning(f"Discrepancies found for request {request_id}: {validation_result['discrepancies']}")
+        if upload.document_type == Document.DocumentType.PROFORMA:
+            request.proforma_file_url = file_url
+            request.save(update_fields=['proforma_file_url', 'updated_at'])
+            schedule_proforma_extraction(request)
         else:
-            logger.info(f"Receipt validated successfully for request {request_id}")
-        
+            request.receipt_file_url = file_url
+            request.save(update_fields=['receipt_file_url', 'updated_at'])
+            transaction.on_commit(lambda: process_receipt_task.delay(request_id))
+        record_upload(
+            request, upload.document_type, file_url, UploadFingerprint(upload.content_hash, upload.perceptual_hash)
+        )
+
+
+@shared_task
+def fingerprint_stored_upload_task(request_id: str, document_type: str, file_url: str):
+    """
+    Fingerprint a file that was uploaded straight to storage
+    
+    The API never saw its bytes, so duplicates are looked up here, before
+    extraction so an identical earlier upload can still be reused. Best
+    effort: a failure is logged and extraction runs anyway.
+    """
+    try:
+        if DocumentFingerprint.objects.filter(
+            request_id=request_id, document_type=document_type, file_url=file_url
+        ).exists():
+            return
+        request = PurchaseRequest.objects.get(id=request_id)
+        with open_url(file_url) as file:
+            fingerprint = fingerprint_file(file, guess_content_type(file_url))
+        record_upload(request, document_type, file_url, fingerprint)
     except Exception as e:
-        logger.error(f"Error processing receipt for request {request_id}: {str(e)}")
-        raise
+        logger.warning(f"Could not fingerprint {document_type} {file_url} of request {request_id}: {str(e)}")
+
 
+@shared_task
+def extract_documents_batch_task(jobs: list, concurrency: int = None, timeout: float = None) -> dict:
+    """
+    Extract a batch of documents concurrently inside one worker
+    
+    Args:
+        jobs: List of dicts with request_id, document_type and file_url
+        concurrency: Override for DOCUMENT_EXTRACTION_CONCURRENCY
+        timeout: Override for DOCUMENT_EXTRACTION_TIMEOUT
+    
+    Returns:
+        Summary counters for the batch
+    """
+    executor = AsyncExtractionExecutor(concurrency=concurrency, timeout=timeout)
+    stats = executor.run(
+        [ExtractionJob.from_dict(job) for job in jobs],
+        on_result=store_extraction_result
+    )
+    logger.info(
+        f"Extraction batch finished: {stats.succeeded}/{stats.submitted} succeeded, "
+        f"{stats.failed} failed, {stats.timed_out} timed out in {stats.elapsed:.1f}s"
+    )
+    return {
+        'submitted': stats.submitted,
+        'succeeded': stats.succeeded,
+        'failed': stats.failed,
+        'timed_out': stats.timed_out,
+        'cancelled': stats.cancelled,
+        'elapsed': stats.elapsed,
+    }
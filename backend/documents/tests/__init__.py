@@ -0,0 +1 @@
+# Documents tests package
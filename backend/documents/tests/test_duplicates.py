@@ -0,0 +1,185 @@
+"""Tests for duplicate upload detection"""
+import random
+from datetime import date
+from decimal import Decimal
+from io import BytesIO
+from unittest.mock import patch
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase
+from PIL import Image
+from purchase_requests.models import Document, DocumentFingerprint
+from purchase_requests.tests.factories import PurchaseRequestFactory
+from purchase_requests.tests.mocks import mock_cloudinary_upload, mock_file_upload, mock_pdf
+from users.tests.factories import OrganizationFactory, UserFactory
+from users.tests.test_utils import get_authenticated_client
+from vendors.models import Vendor
+from ..duplicates import (
+    NEAR_DUPLICATE_DISTANCE, cached_extraction, find_duplicates, fingerprint_upload, hamming_distance,
+    hash_bands, normalize_invoice_number, parse_document_date, record_extraction, record_upload
+)
+from ..tasks import process_proforma_task
+from .test_executor import FakeProcessor
+
+
+def image_upload(seed=1, size=(400, 560), fmt='PNG', quality=95, name='scan.png'):
+    """A blocky synthetic 'scan' as an uploaded file"""
+    rng = random.Random(seed)
+    image = Image.new('L', (8, 11))
+    image.putdata([rng.randint(0, 255) for _ in range(8 * 11)])
+    image = image.resize(size, Image.NEAREST)
+    buffer = BytesIO()
+    image.save(buffer, fmt, **({'quality': quality} if fmt == 'JPEG' else {}))
+    content_type = 'image/jpeg' if fmt == 'JPEG' else 'image/png'
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type=content_type)
+
+
+class HashingTests(SimpleTestCase):
+    """Content and perceptual hashes"""
+
+    def test_content_hash_is_stable_and_rewinds(self):
+        upload = mock_file_upload(content=b'%PDF-1.4 invoice')
+        first = fingerprint_upload(upload)
+        self.assertEqual(upload.read(), b'%PDF-1.4 invoice')
+        self.assertEqual(first, fingerprint_upload(mock_file_upload(content=b'%PDF-1.4 invoice')))
+        self.assertIsNone(first.perceptual_hash)
+
+    def test_perceptual_hash_survives_recompression(self):
+        original = fingerprint_upload(image_upload())
+        recompressed = fingerprint_upload(image_upload(size=(300, 420), fmt='JPEG', quality=60, name='scan.jpg'))
+        different = fingerprint_upload(image_upload(seed=2))
+
+        self.assertNotEqual(original.content_hash, recompressed.content_hash)
+        self.assertLessEqual(hamming_distance(original.perceptual_hash, recompressed.perceptual_hash),
+                             NEAR_DUPLICATE_DISTANCE)
+        self.assertGreater(hamming_distance(original.perceptual_hash, different.perceptual_hash), 10)
+
+    def test_unreadable_image_has_no_perceptual_hash(self):
+        upload = SimpleUploadedFile('scan.png', b'not an image', content_type='image/png')
+        self.assertIsNone(fingerprint_upload(upload).perceptual_hash)
+
+    def test_hash_bands(self):
+        self.assertEqual(hash_bands(-1), [0xFFFF] * 4)
+        self.assertEqual(hash_bands(0x0001000200030004), [4, 3, 2, 1])
+
+    def test_normalizers(self):
+        self.assertEqual(normalize_invoice_number(' inv-00123/a '), 'INV00123A')
+        self.assertEqual(parse_document_date('2026-03-04'), date(2026, 3, 4))
+        self.assertIsNone(parse_document_date('n/a'))
+
+
+class DuplicateLookupTests(TestCase):
+    """find_duplicates, record_upload and record_extraction"""
+
+    def setUp(self):
+        self.organization = OrganizationFactory.create()
+        self.first = PurchaseRequestFactory.create(organization=self.organization)
+        self.second = PurchaseRequestFactory.create(organization=self.organization)
+        self.vendor = Vendor.objects.create(organization=self.organization, name='Acme', normalized_name='acme')
+
+    def test_exact_duplicate_across_requests(self):
+        record_upload(self.first, Document.DocumentType.PROFORMA, 'https://files/a.pdf',
+                      fingerprint_upload(mock_file_upload(content=b'same bytes')))
+        record = record_upload(self.second, Document.DocumentType.PROFORMA, 'https://files/b.pdf',
+                               fingerprint_upload(mock_file_upload(content=b'same bytes')))
+
+        self.assertEqual(len(record.duplicates), 1)
+        self.assertEqual(record.duplicates[0]['kind'], 'exact')
+        self.assertEqual(record.duplicates[0]['request'], str(self.first.id))
+
+    def test_near_duplicate_image(self):
+        record_upload(self.first, Document.DocumentType.RECEIPT, 'https://files/a.png',
+                      fingerprint_upload(image_upload()))
+        record = record_upload(self.second, Document.DocumentType.RECEIPT, 'https://files/b.jpg',
+                               fingerprint_upload(image_upload(fmt='JPEG', quality=50, name='b.jpg')))
+        self.assertEqual([d['kind'] for d in record.duplicates], ['near'])
+
+    def test_same_request_and_other_organizations_ignored(self):
+        fingerprint = fingerprint_upload(mock_file_upload(content=b'same bytes'))
+        record_upload(self.first, Document.DocumentType.PROFORMA, 'https://files/a.pdf', fingerprint)
+        other = PurchaseRequestFactory.create()
+        record_upload(other, Document.DocumentType.PROFORMA, 'https://files/c.pdf', fingerprint)
+
+        self.assertEqual(find_duplicates(self.organization.id, fingerprint, exclude_request_id=self.first.id), [])
+        unrelated = fingerprint_upload(mock_file_upload(content=b'other bytes'))
+        self.assertEqual(find_duplicates(self.organization.id, unrelated), [])
+
+    def test_same_invoice_as_different_file(self):
+        for request, content in ((self.first, b'scan one'), (self.second, b'scan two')):
+            record_upload(request, Document.DocumentType.RECEIPT, f'https://files/{content.hex()}.pdf',
+                          fingerprint_upload(mock_file_upload(content=content)))
+
+        data = {'invoice_number': 'INV-42', 'date': '2026-05-01', 'total_amount': 150}
+        record_extraction(self.first.id, Document.DocumentType.RECEIPT, f'https://files/{b"scan one".hex()}.pdf',
+                          data, self.vendor)
+        record = record_extraction(self.second.id, Document.DocumentType.RECEIPT,
+                                   f'https://files/{b"scan two".hex()}.pdf', {**data, 'invoice_number': 'inv 42'},
+                                   self.vendor)
+
+        self.assertEqual(record.invoice_number, 'INV42')
+        self.assertEqual(record.total_amount, Decimal('150.00'))
+        self.assertEqual([d['kind'] for d in record.duplicates], ['invoice_number'])
+
+        # Without an invoice number, vendor + date + total still match
+        third = PurchaseRequestFactory.create(organization=self.organization)
+        record_upload(third, Document.DocumentType.RECEIPT, 'https://files/3.pdf',
+                      fingerprint_upload(mock_file_upload(content=b'scan three')))
+        record = record_extraction(third.id, Document.DocumentType.RECEIPT, 'https://files/3.pdf',
+                                   {**data, 'invoice_number': ''}, self.vendor)
+        self.assertEqual({d['kind'] for d in record.duplicates}, {'vendor_date_total'})
+        self.assertEqual(len(record.duplicates), 2)
+
+    def test_unfingerprinted_upload_ignored(self):
+        self.assertIsNone(record_extraction(self.first.id, Document.DocumentType.RECEIPT, 'https://files/x.pdf', {}))
+        self.assertIsNone(cached_extraction(self.first.id, Document.DocumentType.RECEIPT, 'https://files/x.pdf'))
+
+
+class ExtractionReuseTests(TestCase):
+    """Exact duplicates reuse the earlier extraction"""
+
+    def test_proforma_extraction_skips_model_for_identical_file(self):
+        organization = OrganizationFactory.create()
+        first = PurchaseRequestFactory.create(organization=organization, proforma_file_url='https://files/a.pdf')
+        second = PurchaseRequestFactory.create(organization=organization, proforma_file_url='https://files/b.pdf')
+        for request in (first, second):
+            record_upload(request, Document.DocumentType.PROFORMA, request.proforma_file_url,
+                          fingerprint_upload(mock_file_upload(content=b'same proforma')))
+        Document.objects.create(request=first, document_type=Document.DocumentType.PROFORMA,
+                                file_url='https://files/a.pdf', extracted_data={'vendor_name': 'Acme', 'items': []})
+
+        processor = FakeProcessor()
+        with patch('documents.executor.AsyncExtractionExecutor.processor', processor):
+            process_proforma_task(str(second.id), 'https://files/b.pdf')
+
+        self.assertEqual(processor.peak, 0)
+        document = second.documents.get(document_type=Document.DocumentType.PROFORMA)
+        self.assertEqual(document.extracted_data['vendor_name'], 'Acme')
+
+
+class UploadDuplicateWarningTests(TestCase):
+    """Duplicate warnings on the request API"""
+
+    def setUp(self):
+        self.organization = OrganizationFactory.create()
+        self.staff = UserFactory.create_staff(organization=self.organization)
+
+    def create_request(self, client):
+        with mock_cloudinary_upload(), patch('documents.tasks.process_proforma_task.delay'):
+            return client.post('/api/requests/', {
+                'title': 'Paper', 'description': 'Paper', 'amount': '100.00',
+                'proforma_file': mock_file_upload(content=mock_pdf('same proforma')),
+            }, format='multipart')
+
+    def test_second_upload_is_flagged(self):
+        client, _ = get_authenticated_client(self.staff, self.organization)
+        first = self.create_request(client)
+        second = self.create_request(client)
+
+        self.assertEqual(first.data['duplicate_warnings'], [])
+        self.assertEqual(len(second.data['duplicate_warnings']), 1)
+        warning = second.data['duplicate_warnings'][0]
+        self.assertEqual(warning['kind'], 'exact')
+        self.assertEqual(warning['request'], first.data['id'])
+        self.assertEqual(DocumentFingerprint.objects.count(), 2)
+
+        detail = client.get(f"/api/requests/{second.data['id']}/")
+        self.assertEqual(detail.data['duplicate_warnings'], second.data['duplicate_warnings'])
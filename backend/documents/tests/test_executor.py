@@ -0,0 +1,155 @@
+"""Tests for the async extraction executor"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+from django.test import TestCase
+from purchase_requests.models import Document, PurchaseRequest
+from purchase_requests.tests.factories import PurchaseRequestFactory
+from ..executor import AsyncExtractionExecutor, ExtractionJob, SharedExtractionExecutor
+from ..tasks import process_proforma_task
+
+
+class FakeProcessor:
+    """Processor stub that records peak concurrency"""
+
+    def __init__(self, delay=0.01, fail_urls=()):
+        self.delay = delay
+        self.fail_urls = set(fail_urls)
+        self.in_flight = 0
+        self.peak = 0
+
+    async def _extract(self, file_url):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            if file_url in self.fail_urls:
+                raise Exception("model unavailable")
+            return {'file_url': file_url, 'items': []}
+        finally:
+            self.in_flight -= 1
+
+    async def aextract_proforma_data(self, file_url, organization_id=None):
+        return await self._extract(file_url)
+
+    async def aextract_receipt_data(self, file_url, organization_id=None):
+        return await self._extract(file_url)
+
+
+def make_jobs(count, document_type=Document.DocumentType.PROFORMA):
+    return [
+        ExtractionJob(request_id=str(i), document_type=document_type, file_url=f'https://files/{i}.pdf')
+        for i in range(count)
+    ]
+
+
+class AsyncExtractionExecutorTest(TestCase):
+    """Test AsyncExtractionExecutor"""
+
+    def test_respects_concurrency_limit(self):
+        """Test that no more than `concurrency` calls are in flight"""
+        processor = FakeProcessor()
+        executor = AsyncExtractionExecutor(processor=processor, concurrency=4, timeout=5)
+        results = []
+        stats = executor.run(make_jobs(40), on_result=results.append)
+        self.assertEqual(stats.submitted, 40)
+        self.assertEqual(stats.succeeded, 40)
+        self.assertEqual(len(results), 40)
+        self.assertEqual(processor.peak, 4)
+
+    def test_timeout_is_reported_per_job(self):
+        """Test that a slow call times out without failing the batch"""
+        processor = FakeProcessor(delay=1)
+        executor = AsyncExtractionExecutor(processor=processor, concurrency=2, timeout=0.05)
+        stats = executor.run(make_jobs(3))
+        self.assertEqual(stats.timed_out, 3)
+        self.assertEqual(stats.succeeded, 0)
+
+    def test_errors_are_isolated(self):
+        """Test that one failing document does not stop the others"""
+        processor = FakeProcessor(fail_urls={'https://files/1.pdf'})
+        executor = AsyncExtractionExecutor(processor=processor, concurrency=3, timeout=5)
+        stats = executor.run(make_jobs(5))
+        self.assertEqual(stats.succeeded, 4)
+        self.assertEqual(stats.failed, 1)
+        self.assertIn('model unavailable', stats.errors[0])
+
+    def test_cancel_stops_in_flight_and_pending_jobs(self):
+        """Test that cancel() aborts in-flight calls and skips queued jobs"""
+        processor = FakeProcessor(delay=5)
+        executor = AsyncExtractionExecutor(processor=processor, concurrency=2, timeout=10)
+
+        async def run_and_cancel():
+            run = asyncio.ensure_future(executor.map(make_jobs(10)))
+            await asyncio.sleep(0.05)
+            executor.cancel()
+            return await run
+
+        stats = asyncio.run(run_and_cancel())
+        self.assertEqual(stats.cancelled, 2)
+        self.assertEqual(stats.submitted, 2)
+
+    def test_unsupported_document_type(self):
+        """Test that PO documents are rejected by the executor"""
+        executor = AsyncExtractionExecutor(processor=FakeProcessor(), concurrency=1, timeout=5)
+        result = executor.run_one(make_jobs(1, Document.DocumentType.PO)[0])
+        self.assertFalse(result.ok)
+        self.assertIn('Unsupported document type', result.error)
+
+
+class SharedExtractionExecutorTest(TestCase):
+    """Test the per-process executor used by per-document tasks"""
+
+    def test_callers_in_different_threads_overlap(self):
+        processor = FakeProcessor(delay=0.05)
+        shared = SharedExtractionExecutor(
+            AsyncExtractionExecutor(processor=processor, concurrency=2, timeout=5)
+        )
+        self.addCleanup(shared.close)
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(shared.run_one, make_jobs(4)))
+
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual([r.data['file_url'] for r in results], [f'https://files/{i}.pdf' for i in range(4)])
+        self.assertEqual(processor.peak, 2)
+
+
+class ProcessProformaTaskTest(TestCase):
+    """Test process_proforma_task submitting through the executor"""
+
+    def test_stores_extracted_proforma(self):
+        request = PurchaseRequestFactory.create(proforma_file_url='https://files/proforma.pdf')
+        with patch('documents.executor.AsyncExtractionExecutor.processor', FakeProcessor()):
+            process_proforma_task(str(request.id), 'https://files/proforma.pdf')
+
+        document = request.documents.get(document_type=Document.DocumentType.PROFORMA)
+        self.assertEqual(document.extracted_data['file_url'], 'https://files/proforma.pdf')
+        request.refresh_from_db()
+        self.assertEqual(request.proforma_extraction_status, request.ExtractionStatus.COMPLETED)
+
+    def test_skips_replaced_proforma(self):
+        """Test that a queued job for a replaced proforma does nothing"""
+        request = PurchaseRequestFactory.create(
+            proforma_file_url='https://files/new.pdf',
+            proforma_extraction_status=PurchaseRequest.ExtractionStatus.PENDING
+        )
+        processor = FakeProcessor()
+        with patch('documents.executor.AsyncExtractionExecutor.processor', processor):
+            process_proforma_task(str(request.id), 'https://files/old.pdf')
+
+        self.assertEqual(processor.peak, 0)
+        self.assertFalse(request.documents.exists())
+        request.refresh_from_db()
+        self.assertEqual(request.proforma_extraction_status, request.ExtractionStatus.PENDING)
+
+    def test_permanent_failure_marks_failed(self):
+        request = PurchaseRequestFactory.create(proforma_file_url='https://files/proforma.pdf')
+        processor = FakeProcessor(fail_urls={'https://files/proforma.pdf'})
+        with patch('documents.executor.AsyncExtractionExecutor.processor', processor), \
+                patch('documents.tasks.ResilientTask.will_retry', return_value=False):
+            with self.assertRaises(Exception):
+                process_proforma_task(str(request.id), 'https://files/proforma.pdf')
+
+        request.refresh_from_db()
+        self.assertEqual(request.proforma_extraction_status, request.ExtractionStatus.FAILED)
+        self.assertIn('model unavailable', request.proforma_extraction_error)
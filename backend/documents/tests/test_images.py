@@ -0,0 +1,101 @@
+"""Tests for image normalization"""
+import os
+import shutil
+import tempfile
+from io import BytesIO
+from unittest.mock import patch
+from django.test import SimpleTestCase, override_settings
+from PIL import Image
+from PIL.ExifTags import Base as ExifTag
+from ..images import max_edge, normalize_image, put_document
+from ..services import GeminiDocumentProcessor
+from ..storage import LocalStorage
+
+
+def photo(size=(2400, 1800), orientation=None, mode='RGB', image_format='JPEG') -> BytesIO:
+    """A noisy 'phone photo' with camera EXIF and optional orientation"""
+    image = Image.effect_noise(size, 40).convert(mode)
+    exif = Image.Exif()
+    exif[ExifTag.Make] = 'Phone'
+    if orientation:
+        exif[ExifTag.Orientation] = orientation
+    out = BytesIO()
+    image.save(out, image_format, exif=exif.tobytes(), **({'quality': 95} if image_format == 'JPEG' else {}))
+    out.seek(0)
+    return out
+
+
+@override_settings(IMAGE_NORMALIZE_DPI=100, IMAGE_NORMALIZE_FORMAT='JPEG', IMAGE_NORMALIZE_QUALITY=85)
+class NormalizeImageTest(SimpleTestCase):
+    """Test normalize_image"""
+
+    def test_photo_is_made_upright_smaller_and_stripped(self):
+        original = photo(orientation=6)  # Rotated 90 degrees: stored landscape, shown portrait
+
+        normalized = normalize_image(original)
+
+        self.assertEqual(original.tell(), 0)
+        self.assertEqual((normalized.width, normalized.height), (round(max_edge() * 3 / 4), max_edge()))
+        self.assertLess(len(normalized.content), normalized.original_size / 3)
+        with Image.open(BytesIO(normalized.content)) as image:
+            self.assertEqual((image.format, image.size), ('JPEG', (normalized.width, normalized.height)))
+            self.assertEqual(dict(image.getexif()), {})
+            self.assertNotIn('icc_profile', image.info)
+
+    def test_transparent_png_is_flattened(self):
+        normalized = normalize_image(photo(size=(1600, 1200), mode='RGBA', image_format='PNG'))
+
+        self.assertEqual(normalized.content_type, 'image/jpeg')
+        with Image.open(BytesIO(normalized.content)) as image:
+            self.assertEqual(image.mode, 'RGB')
+
+    def test_left_alone(self):
+        small = BytesIO()
+        Image.new('RGB', (600, 800), 'white').save(small, 'JPEG')
+        cases = {
+            'already normalized': small,
+            'pdf': BytesIO(b'%PDF-1.4 not an image'),
+            'truncated image': BytesIO(photo().getvalue()[:100]),
+        }
+        for name, file in cases.items():
+            with self.subTest(name):
+                self.assertIsNone(normalize_image(file))
+
+
+@override_settings(IMAGE_NORMALIZE=True, IMAGE_NORMALIZE_DPI=100, IMAGE_NORMALIZE_FORMAT='JPEG')
+class PutDocumentTest(SimpleTestCase):
+    """Test put_document and normalization before extraction"""
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.storage = LocalStorage(root, 'http://testserver')
+        patcher = patch('documents.storage._storage', self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(IMAGE_KEEP_ORIGINAL=True)
+    def test_original_is_kept_next_to_normalized_file(self):
+        original = photo(mode='RGBA', image_format='PNG')
+
+        url = put_document(original, 'procure-to-pay/1/receipts/abc.png')
+
+        self.assertEqual(url, 'http://testserver/files/procure-to-pay/1/receipts/abc.jpg')
+        with open(self.storage.path('procure-to-pay/1/receipts/originals/abc.png'), 'rb') as kept:
+            self.assertEqual(kept.read(), original.getvalue())
+        self.assertLess(os.path.getsize(self.storage.path('procure-to-pay/1/receipts/abc.jpg')),
+                        len(original.getvalue()))
+
+    def test_stored_original_is_normalized_for_extraction(self):
+        url = self.storage.put(photo(orientation=8), 'procure-to-pay/1/receipts/legacy.jpg')
+
+        content, mime_type = GeminiDocumentProcessor._download_file(url)
+
+        self.assertEqual(mime_type, 'image/jpeg')
+        with Image.open(BytesIO(content)) as image:
+            self.assertEqual(image.size, (round(max_edge() * 3 / 4), max_edge()))
+        with override_settings(IMAGE_NORMALIZE=False):
+            self.assertEqual(
+                len(GeminiDocumentProcessor._download_file(url)[0]),
+                os.path.getsize(self.storage.path('procure-to-pay/1/receipts/legacy.jpg'))
+            )
@@ -0,0 +1,124 @@
+"""Tests for order-independent line-item matching"""
+import itertools
+import random
+import time
+from django.test import SimpleTestCase
+from ..matching import hungarian, match_line_items
+from ..services import GeminiDocumentProcessor
+from ..three_way import three_way_match
+
+
+def item(description, quantity=1, unit_price=10.0):
+    return {'description': description, 'quantity': quantity, 'unit_price': unit_price,
+            'total': quantity * unit_price}
+
+
+def synthetic_invoice(lines, seed=0):
+    """Distinct SKU-like lines, as large catalogue invoices have"""
+    rng = random.Random(seed)
+    words = ['steel', 'bolt', 'washer', 'cable', 'paper', 'toner', 'chair', 'desk', 'lamp', 'drill']
+    return [
+        item(f'{rng.choice(words)} {rng.choice(words)} sku{i} model{i % 97}',
+             quantity=rng.randint(1, 50), unit_price=round(rng.uniform(1, 500), 2))
+        for i in range(lines)
+    ]
+
+
+class HungarianTest(SimpleTestCase):
+    """Test the assignment solver against brute force"""
+
+    def test_matches_brute_force(self):
+        rng = random.Random(7)
+        for rows, cols in [(3, 3), (3, 5), (5, 3), (4, 4)]:
+            cost = [[rng.random() for _ in range(cols)] for _ in range(rows)]
+            pairs = hungarian(cost)
+            best = min(
+                sum(cost[i][j] for i, j in (zip(range(rows), perm) if rows <= cols else zip(perm, range(cols))))
+                for perm in itertools.permutations(range(max(rows, cols)), min(rows, cols))
+            )
+            self.assertAlmostEqual(sum(cost[i][j] for i, j in pairs), best)
+            self.assertEqual(len(pairs), min(rows, cols))
+
+
+class LineItemMatcherTest(SimpleTestCase):
+    """Test match_line_items"""
+
+    def test_reordered_lines_match(self):
+        po = [item('Office chair'), item('Standing desk', 2, 300), item('Desk lamp', 4, 25)]
+        receipt = list(reversed(po))
+        result = match_line_items(po, receipt)
+        self.assertEqual(len(result.matched), 3)
+        self.assertEqual({(p.left_index, p.right_index) for p in result.matched}, {(0, 2), (1, 1), (2, 0)})
+
+    def test_missing_line_does_not_cascade(self):
+        """Test that dropping the first line leaves the rest matched"""
+        po = [item('HDMI cable 2m'), item('USB-C charger 65W', 3, 40), item('Laptop stand', 1, 55)]
+        result = match_line_items(po, po[1:])
+        self.assertEqual(len(result.matched), 2)
+        self.assertEqual(result.unmatched_left, [0])
+        self.assertEqual(result.unmatched_right, [])
+
+    def test_quantity_difference_is_partial(self):
+        po = [item('A4 copy paper box', 10, 20)]
+        receipt = [item('Copy paper A4 (box)', 8, 20)]
+        result = match_line_items(po, receipt)
+        self.assertEqual(len(result.partial), 1)
+        self.assertFalse(result.partial[0].quantity_ok)
+        self.assertTrue(result.partial[0].price_ok)
+
+    def test_similar_lines_get_optimal_assignment(self):
+        """Test that near-duplicate descriptions are resolved by amounts"""
+        po = [item('Toner cartridge black', 2, 80), item('Toner cartridge cyan', 2, 95)]
+        receipt = [item('Toner cartridge cyan', 2, 95), item('Toner cartridge blk', 2, 80)]
+        result = match_line_items(po, receipt)
+        self.assertEqual({(p.left_index, p.right_index) for p in result.matched}, {(0, 1), (1, 0)})
+
+    def test_residual_pass_pairs_unreadable_descriptions(self):
+        result = match_line_items([item('', 3, 12.5)], [item('???', 3, 12.5)])
+        self.assertEqual(len(result.matched), 1)
+
+    def test_residual_pass_does_not_vouch_for_different_descriptions(self):
+        result = match_line_items([item('Dell Laptop XPS', 1, 1200)], [item('Office chair ergonomic', 1, 1200)])
+        self.assertEqual(result.matched, [])
+        self.assertEqual(len(result.partial), 1)
+        self.assertFalse(result.partial[0].description_ok)
+
+    def test_large_invoice_is_subquadratic(self):
+        """Test that a shuffled 5,000-line invoice matches fully in bounded time"""
+        po = synthetic_invoice(5000)
+        receipt = po[:]
+        random.Random(1).shuffle(receipt)
+        start = time.perf_counter()
+        result = match_line_items(po, receipt)
+        elapsed = time.perf_counter() - start
+        self.assertEqual(len(result.matched), 5000)
+        self.assertLess(result.candidate_pairs, 5000 * 11)
+        self.assertLess(elapsed, 10)
+
+
+class ValidateReceiptTest(SimpleTestCase):
+    """Test GeminiDocumentProcessor.validate_receipt_against_po"""
+
+    def test_reordered_receipt_is_valid(self):
+        po = {'vendor_name': 'Acme', 'items': [item('Chair', 2, 50), item('Desk', 1, 200)], 'total_amount': 300}
+        receipt = {'seller_name': 'Acme', 'items': [item('Desk', 1, 200), item('Chair', 2, 50)], 'total_amount': 300}
+        result = GeminiDocumentProcessor.validate_receipt_against_po(receipt, po)
+        self.assertTrue(result['is_valid'], result['discrepancies'])
+
+    def test_missing_item_is_reported_once(self):
+        po = {'vendor_name': 'Acme', 'items': [item('Chair', 2, 50), item('Desk', 1, 200)], 'total_amount': 300}
+        receipt = {'seller_name': 'Acme', 'items': [item('Desk', 1, 200)], 'total_amount': 300}
+        result = GeminiDocumentProcessor.validate_receipt_against_po(receipt, po)
+        self.assertEqual([d['type'] for d in result['discrepancies']], ['item_missing'])
+
+    def test_unrelated_description_with_equal_amounts_is_reported(self):
+        po = {'vendor_name': 'Acme', 'items': [item('Dell Laptop XPS', 1, 1200)], 'total_amount': 1200}
+        receipt = {'seller_name': 'Acme', 'items': [item('Office chair ergonomic', 1, 1200)], 'total_amount': 1200}
+
+        result = GeminiDocumentProcessor.validate_receipt_against_po(receipt, po)
+
+        self.assertFalse(result['is_valid'])
+        self.assertEqual([d['type'] for d in result['discrepancies']], ['item_description_mismatch'])
+        report = three_way_match(po, receipt, [])
+        self.assertFalse(report['is_valid'])
+        self.assertEqual(report['unmatched']['receipt_not_on_po'], [0])
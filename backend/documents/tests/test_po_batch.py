@@ -0,0 +1,121 @@
+"""Tests for batch purchase order generation"""
+import os
+from io import StringIO
+from unittest.mock import patch
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from purchase_requests.models import Document, PurchaseRequest
+from purchase_requests.tests.factories import PurchaseRequestFactory, RequestItemFactory
+from ..po_batch import PurchaseOrderBatch, percentile
+from ..po_generator import TEMPLATE_VERSION
+from ..tasks import generate_purchase_orders_task
+
+PO = {
+    'vendor_name': 'Acme',
+    'items': [{'description': 'Office chair', 'quantity': 4, 'unit_price': 120, 'total': 480}],
+    'total_amount': 480,
+}
+
+
+def fake_upload(pdf_file, **kwargs):
+    assert pdf_file.read(4) == b'%PDF'
+    return {'secure_url': f'https://files/{os.path.basename(pdf_file.name)}'}
+
+
+@patch('documents.storage.cloudinary.uploader.upload', side_effect=fake_upload)
+class PurchaseOrderBatchTest(TestCase):
+    """Test PurchaseOrderBatch"""
+
+    def setUp(self):
+        self.requests = [
+            PurchaseRequestFactory.create(amount=480, status=PurchaseRequest.Status.APPROVED)
+            for _ in range(3)
+        ]
+        for request in self.requests:
+            RequestItemFactory.create(request=request, description='Office chair', quantity=4, unit_price=120)
+
+    def test_generates_po_documents(self, mock_upload):
+        results = []
+        stats = PurchaseOrderBatch(workers=0, chunk_size=2, on_result=results.append).run(
+            [request.id for request in self.requests]
+        )
+
+        self.assertEqual((stats.requests, stats.generated, stats.failed), (3, 3, []))
+        self.assertEqual(len(results), 3)
+        self.assertGreater(results[0]['bytes'], 0)
+        for request in self.requests:
+            request.refresh_from_db()
+            po_doc = request.documents.get(document_type=Document.DocumentType.PO)
+            self.assertEqual(po_doc.file_url, request.purchase_order_file_url)
+
+    def test_regenerate_renders_current_version_once(self, mock_upload):
+        request = self.requests[0]
+        # Issued before PO documents were versioned
+        Document.objects.create(
+            request=request, document_type=Document.DocumentType.PO,
+            file_url='https://files/old.pdf', extracted_data=PO
+        )
+        ids = [r.id for r in self.requests]
+        stats = PurchaseOrderBatch(workers=0, regenerate=True).run(ids)
+
+        # Requests without an issued PO are left alone
+        self.assertEqual((stats.generated, stats.skipped), (1, 2))
+        po_doc = request.documents.get(document_type=Document.DocumentType.PO, template_version=TEMPLATE_VERSION)
+        request.refresh_from_db()
+        self.assertEqual(request.purchase_order_file_url, po_doc.file_url)
+        self.assertEqual(po_doc.extracted_data, PO)
+
+        stats = PurchaseOrderBatch(workers=0, regenerate=True).run(ids)
+        self.assertEqual((stats.generated, stats.cached), (0, 1))
+
+        stats = PurchaseOrderBatch(workers=0, regenerate=True, force=True).run(ids)
+        self.assertEqual(stats.generated, 1)
+        self.assertEqual(request.documents.filter(template_version=TEMPLATE_VERSION).count(), 1)
+        self.assertEqual(mock_upload.call_count, 2)
+
+    def test_process_pool_dry_run(self, mock_upload):
+        stats = PurchaseOrderBatch(workers=2, dry_run=True).run([r.id for r in self.requests])
+
+        self.assertEqual(stats.generated, 3)
+        self.assertEqual(len(stats.render_seconds), 3)
+        mock_upload.assert_not_called()
+        self.assertFalse(Document.objects.filter(document_type=Document.DocumentType.PO).exists())
+
+    def test_render_failure_does_not_stop_batch(self, mock_upload):
+        bad = self.requests[1]
+        with patch('documents.po_batch.get_po_data',
+                   side_effect=lambda request: {'items': None} if request.id == bad.id else PO):
+            stats = PurchaseOrderBatch(workers=0).run([r.id for r in self.requests])
+
+        self.assertEqual(stats.generated, 2)
+        self.assertEqual(stats.failed, [str(bad.id)])
+
+    @override_settings(PO_BATCH_WORKERS=0)
+    def test_task_retries_failures_individually(self, mock_upload):
+        with patch('documents.po_batch.upload_purchase_order', side_effect=RuntimeError('down')), \
+                patch('documents.tasks.generate_purchase_order_task.delay') as mock_delay:
+            summary = generate_purchase_orders_task([str(r.id) for r in self.requests])
+
+        self.assertEqual(summary['generated'], 0)
+        self.assertEqual(len(summary['failed']), 3)
+        self.assertEqual(mock_delay.call_count, 3)
+
+    def test_regenerate_pos_command(self, mock_upload):
+        Document.objects.create(
+            request=self.requests[0], document_type=Document.DocumentType.PO,
+            file_url='https://files/old.pdf', extracted_data=PO
+        )
+        out = StringIO()
+        call_command('regenerate_pos', '--workers', '0', '-v', '2', stdout=out, stderr=StringIO())
+        output = out.getvalue()
+        self.assertIn(f'request {self.requests[0].id}: render', output)
+        self.assertIn('Regenerated 1 of 1 POs', output)
+        self.assertIn('render p50', output)
+
+
+class PercentileTest(SimpleTestCase):
+    def test_nearest_rank(self):
+        values = [float(v) for v in range(1, 101)]
+        self.assertEqual(percentile(values, 0.5), 50.0)
+        self.assertEqual(percentile(values, 0.95), 95.0)
+        self.assertEqual(percentile([], 0.5), 0.0)
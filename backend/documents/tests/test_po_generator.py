@@ -0,0 +1,167 @@
+"""Tests for the compiled purchase order templates"""
+import re
+import uuid
+import zlib
+from contextlib import nullcontext
+from decimal import Decimal
+from io import BytesIO
+from unittest.mock import MagicMock, patch
+from django.test import SimpleTestCase
+from PIL import Image
+from pypdf import PdfReader
+from organizations.models import Organization
+from purchase_requests.models import PurchaseRequest
+from ..po_generator import (
+    PageCompressingCanvas, clear_po_template_cache, generate_purchase_order_pdf, get_po_template,
+    render_purchase_order
+)
+
+PO_DATA = {
+    'vendor_name': 'Acme',
+    'items': [{'description': 'Paper', 'quantity': 2, 'unit_price': 5.0, 'total': 10.0}],
+    'total_amount': 10.0,
+    'currency': 'USD',
+}
+
+
+def make_request(organization, description='Office supplies'):
+    return PurchaseRequest(
+        id=uuid.uuid4(), organization=organization, title='Supplies',
+        description=description, amount=Decimal('10.00')
+    )
+
+
+def logo_response(content=None, headers=None):
+    if content is None:
+        buffer = BytesIO()
+        Image.new('RGBA', (800, 300), (200, 30, 30, 255)).save(buffer, 'PNG')
+        content = buffer.getvalue()
+    response = MagicMock(headers=headers or {})
+    response.__enter__.return_value = response
+    response.raise_for_status.return_value = None
+    response.iter_content.side_effect = lambda chunk_size: (
+        content[i:i + chunk_size] for i in range(0, len(content), chunk_size)
+    )
+    return response
+
+
+class POTemplateCacheTests(SimpleTestCase):
+    """Templates are compiled once per organization and branding"""
+
+    def setUp(self):
+        clear_po_template_cache()
+        self.organization = Organization(id=1, name='Acme Buyer', settings={})
+
+    def test_renders_pdf(self):
+        pdf = generate_purchase_order_pdf(make_request(self.organization, 'Pens <blue> & pencils'), PO_DATA)
+        self.assertTrue(pdf.getvalue().startswith(b'%PDF'))
+
+    def test_template_reused_until_branding_changes(self):
+        first = get_po_template(self.organization)
+        self.assertIs(get_po_template(self.organization), first)
+        self.assertIsNot(get_po_template(Organization(id=2, name='Other', settings={})), first)
+
+        self.organization.settings = {'po_branding': {'primary_color': '#003366', 'terms': 'Net 45'}}
+        recompiled = get_po_template(self.organization)
+        self.assertIsNot(recompiled, first)
+        self.assertEqual(recompiled.branding['terms'], 'Net 45')
+        self.assertEqual(recompiled.branding['font'], 'Helvetica')
+
+    def test_logo_fetched_once_per_compile(self):
+        self.organization.settings = {'po_branding': {'logo_url': 'https://cdn.example.com/logo.png',
+                                                      'company_name': 'Acme Buyer Ltd'}}
+        with patch('documents.po_generator.requests.get', return_value=logo_response()) as mock_get:
+            for _ in range(3):
+                pdf = generate_purchase_order_pdf(make_request(self.organization), PO_DATA)
+        mock_get.assert_called_once()
+        template = get_po_template(self.organization)
+        self.assertLessEqual(template.logo.getSize()[0], 320)
+        self.assertTrue(pdf.getvalue().startswith(b'%PDF'))
+
+    def test_oversized_logo_is_not_downloaded(self):
+        """Test that a logo over LOGO_MAX_BYTES is refused by Content-Length or while streaming"""
+        self.organization.settings = {'po_branding': {'logo_url': 'https://cdn.example.com/huge.png'}}
+        declared = logo_response(headers={'Content-Length': str(50 * 1024 * 1024)})
+        undeclared = logo_response(content=b'\0' * (256 * 1024))
+        for response in (declared, undeclared):
+            clear_po_template_cache()
+            with patch('documents.po_generator.requests.get', return_value=response) as mock_get, \
+                    patch('documents.po_generator.LOGO_MAX_BYTES', 100 * 1024):
+                self.assertIsNone(get_po_template(self.organization).logo)
+            self.assertTrue(mock_get.call_args.kwargs['stream'])
+        declared.iter_content.assert_not_called()
+
+    def test_broken_logo_and_unknown_font_fall_back(self):
+        self.organization.settings = {'po_branding': {
+            'logo_url': 'https://cdn.example.com/missing.png', 'font': 'Comic Sans', 'primary_color': 'blue-ish'
+        }}
+        with patch('documents.po_generator.requests.get', side_effect=ConnectionError('down')):
+            template = get_po_template(self.organization)
+            pdf = template.render(make_request(self.organization), PO_DATA)
+        self.assertIsNone(template.logo)
+        self.assertEqual(template.font, 'Helvetica')
+        self.assertTrue(pdf.getvalue().startswith(b'%PDF'))
+
+    def test_renders_into_given_file(self):
+        output = BytesIO()
+        result = get_po_template(self.organization).render(make_request(self.organization), PO_DATA, output)
+        self.assertIs(result, output)
+        self.assertEqual(output.tell(), 0)
+
+
+class LargePurchaseOrderTests(SimpleTestCase):
+    """Long POs are laid out in chunks and streamed to a spooled file"""
+
+    def setUp(self):
+        clear_po_template_cache()
+        self.organization = Organization(id=1, name='Acme Buyer', settings={})
+
+    def page_streams(self, pdf: bytes) -> list:
+        return [
+            zlib.decompress(match.group(1))
+            for match in re.finditer(rb'/FlateDecode.*?>>\s*stream\n(.*?)endstream', pdf, re.S)
+        ]
+
+    def test_headers_repeat_on_every_page(self):
+        items = [{'description': f'Line {i}', 'quantity': 1, 'unit_price': 1.0, 'total': 1.0} for i in range(450)]
+        with patch('documents.po_generator.ITEM_CHUNK_ROWS', 200):
+            pdf_file = render_purchase_order(make_request(self.organization), {**PO_DATA, 'items': items})
+        pdf = pdf_file.read()
+        pdf_file.close()
+
+        page_count = len(re.findall(rb'/Type /Page\b', pdf))
+        self.assertGreater(page_count, 5)
+        pages = [stream for stream in self.page_streams(pdf) if b'Line ' in stream]
+        self.assertEqual(len(pages), page_count)
+        for stream in pages:
+            self.assertIn(b'(Description)', stream)
+        text = b''.join(pages)
+        self.assertIn(b'(Line 449)', text)
+        self.assertEqual(text.count(b'(TOTAL)'), 1)
+
+    def test_output_parses(self):
+        """Test that pypdf reads every page of a long PO, with and without per-page compression"""
+        items = [{'description': f'Line {i}', 'quantity': 1, 'unit_price': 1.0, 'total': 1.0} for i in range(150)]
+        for internals_changed in (False, True):
+            changed_internals = patch.object(
+                PageCompressingCanvas, '_compress_last_page', side_effect=AttributeError('Pages')
+            ) if internals_changed else nullcontext()
+            with self.subTest(internals_changed=internals_changed), changed_internals, \
+                    patch.object(PageCompressingCanvas, '_compress_pages', True):
+                pdf_file = render_purchase_order(make_request(self.organization), {**PO_DATA, 'items': items})
+            reader = PdfReader(pdf_file)
+            self.assertGreater(len(reader.pages), 2)
+            text = ''.join(page.extract_text() for page in reader.pages)
+            self.assertIn('Line 0', text)
+            self.assertIn('Line 149', text)
+            self.assertIn('TOTAL', text)
+            pdf_file.close()
+
+    def test_spools_to_disk_past_threshold(self):
+        items = [{'description': f'Line {i}', 'quantity': 1, 'unit_price': 1.0, 'total': 1.0} for i in range(300)]
+        with patch('documents.po_generator.SPOOL_MAX_BYTES', 1024):
+            pdf_file = render_purchase_order(make_request(self.organization), {**PO_DATA, 'items': items})
+        self.assertTrue(pdf_file._rolled)
+        self.assertEqual(pdf_file.tell(), 0)
+        self.assertTrue(pdf_file.read(4) == b'%PDF')
+        pdf_file.close()
@@ -0,0 +1,136 @@
+"""Tests for the token-bucket rate limiter"""
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from rest_framework import status
+from rest_framework.test import APIClient
+from purchase_requests.tests.mocks import mock_cloudinary_upload, mock_file_upload
+from users.tests.factories import OrganizationFactory, UserFactory
+from users.tests.test_utils import get_authenticated_client
+from ..middleware import RateLimitMiddleware
+from ..rate_limit import (
+    LocalBucketBackend, RateLimiter, RateLimitExceeded, format_prometheus_metrics, max_wait_limit, parse_rate
+)
+
+RATE_LIMITS = {
+    'gemini': {'global': '100/s', 'organization': '20/s'},
+}
+
+
+@override_settings(RATE_LIMITS=RATE_LIMITS, RATE_LIMIT_BURST_SECONDS=0.1, RATE_LIMIT_MAX_WAIT=5)
+class RateLimiterTest(SimpleTestCase):
+    """Test RateLimiter with the in-process backend"""
+
+    def setUp(self):
+        self.backend = LocalBucketBackend()
+        self.limiter = RateLimiter('gemini', backend=self.backend)
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate('60/m'), 1)
+        self.assertEqual(parse_rate('7200/hour'), 2)
+        self.assertIsNone(parse_rate(''))
+
+    def test_global_and_org_buckets(self):
+        """Test that an organization call is charged to both buckets"""
+        buckets = self.limiter.buckets('org-1')
+        self.assertEqual(len(buckets), 2)
+        self.assertEqual(buckets[1].key, 'ratelimit:gemini:org:org-1')
+        self.assertEqual(len(self.limiter.buckets()), 1)
+
+    def test_burst_then_backpressure(self):
+        """Test that calls beyond the burst wait for refill instead of failing"""
+        # Org bucket holds 2 tokens (20/s * 0.1s) and refills every 50ms
+        waits = [self.limiter.acquire(organization_id='org-1') for _ in range(4)]
+        self.assertEqual(waits[:2], [0.0, 0.0])
+        self.assertGreater(waits[2], 0)
+        metrics = self.backend.metrics('gemini')
+        self.assertEqual(metrics['acquired'], 4)
+        self.assertEqual(metrics['throttled'], 2)
+        self.assertGreater(metrics['wait_seconds'], 0)
+
+    def test_org_buckets_are_isolated(self):
+        """Test that one organization's burst does not throttle another"""
+        self.limiter.acquire(organization_id='org-1')
+        self.limiter.acquire(organization_id='org-1')
+        self.assertEqual(self.limiter.acquire(organization_id='org-2'), 0.0)
+
+    def test_max_wait_exceeded(self):
+        """Test that callers give up once the wait would exceed max_wait"""
+        self.limiter.acquire(organization_id='org-1')
+        self.limiter.acquire(organization_id='org-1')
+        with self.assertRaises(RateLimitExceeded):
+            self.limiter.acquire(organization_id='org-1', max_wait=0)
+
+    def test_max_wait_limit_caps_default_wait(self):
+        """Test that max_wait_limit replaces RATE_LIMIT_MAX_WAIT within its block"""
+        self.limiter.acquire(organization_id='org-1')
+        self.limiter.acquire(organization_id='org-1')
+        with max_wait_limit(0), self.assertRaises(RateLimitExceeded) as raised:
+            self.limiter.acquire(organization_id='org-1')
+        self.assertGreater(raised.exception.retry_after, 0)
+        self.assertGreater(self.limiter.acquire(organization_id='org-1'), 0)
+
+    @override_settings(RATE_LIMITS={'gemini': {'global': '', 'organization': ''}})
+    def test_unconfigured_limiter_is_noop(self):
+        self.assertEqual(self.limiter.acquire(organization_id='org-1'), 0.0)
+
+    def test_prometheus_format(self):
+        text = format_prometheus_metrics({'gemini': {'acquired': 3, 'throttled': 1, 'wait_seconds': 0.5}})
+        self.assertIn('ratelimit_wait_seconds_total{limiter="gemini"} 0.5', text)
+
+
+@override_settings(RATE_LIMITS={'cloudinary': {'global': '', 'organization': '1/h'}}, RATE_LIMIT_BURST_SECONDS=1)
+class RequestPathThrottleTest(TestCase):
+    """Test that throttled uploads on the request path answer 429"""
+
+    def test_throttled_upload_returns_retry_after(self):
+        organization = OrganizationFactory.create()
+        client, _ = get_authenticated_client(UserFactory.create_staff(organization=organization), organization)
+
+        responses = []
+        with mock_cloudinary_upload():
+            for _ in range(2):
+                responses.append(client.post('/api/requests/', {
+                    'title': 'Laptop', 'description': 'Laptop for new hire', 'amount': '100.00',
+                    'proforma_file': mock_file_upload(),
+                }, format='multipart'))
+
+        self.assertEqual(responses[0].status_code, status.HTTP_201_CREATED)
+        self.assertEqual(responses[1].status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreater(int(responses[1]['Retry-After']), 3000)
+        self.assertIn('Too many uploads', responses[1].json()['detail'])
+
+    @override_settings(RATE_LIMITS=RATE_LIMITS, RATE_LIMIT_BURST_SECONDS=0.1)
+    def test_throttled_extraction_names_extraction(self):
+        """Test that a Gemini limit is not reported as an upload limit"""
+        limiter = RateLimiter('gemini', backend=LocalBucketBackend())
+        limiter.acquire(organization_id='org-1')
+        limiter.acquire(organization_id='org-1')
+        with self.assertRaises(RateLimitExceeded) as raised:
+            limiter.acquire(organization_id='org-1', max_wait=0)
+
+        middleware = RateLimitMiddleware(lambda request: None)
+        response = middleware.process_exception(RequestFactory().get('/'), raised.exception)
+
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('documents are being processed', response.content.decode())
+        self.assertNotIn('uploads', response.content.decode())
+
+
+class MetricsEndpointTest(TestCase):
+    """Test access to /metrics"""
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_requires_metrics_token(self):
+        client = APIClient()
+        self.assertEqual(client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
+        client.credentials(HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
+        client.credentials(HTTP_AUTHORIZATION='Bearer scrape-secret')
+        response = client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(b'ratelimit_acquired_total', response.content)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_disabled_without_token(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Bearer ')
+        self.assertEqual(client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
@@ -0,0 +1,133 @@
+"""Tests for retry classification, circuit breakers and the dead-letter store"""
+import uuid
+from unittest.mock import patch
+import requests
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from purchase_requests.tests.factories import PurchaseRequestFactory
+from ..models import FailedTask
+from ..resilience import (
+    PERMANENT, RETRYABLE, CircuitBreaker, CircuitOpenError, backoff_delay, classify_error
+)
+from ..tasks import process_proforma_task
+
+
+def wrapped(exc):
+    """Raise exc and re-wrap it the way the services do"""
+    try:
+        try:
+            raise exc
+        except Exception as e:
+            raise Exception(f"Error extracting proforma data: {str(e)}")
+    except Exception as outer:
+        return outer
+
+
+class ClassifyErrorTest(SimpleTestCase):
+    """Test classify_error"""
+
+    def test_transient_errors_are_retryable(self):
+        self.assertEqual(classify_error(requests.ConnectionError()), RETRYABLE)
+        self.assertEqual(classify_error(TimeoutError()), RETRYABLE)
+        self.assertEqual(classify_error(CircuitOpenError()), RETRYABLE)
+
+    def test_http_status_classification(self):
+        response = requests.Response()
+        response.status_code = 503
+        self.assertEqual(classify_error(requests.HTTPError(response=response)), RETRYABLE)
+        response.status_code = 404
+        self.assertEqual(classify_error(requests.HTTPError(response=response)), PERMANENT)
+
+    def test_wrapped_errors_use_the_cause(self):
+        """Test that generic wrapper exceptions are classified by their context"""
+        self.assertEqual(classify_error(wrapped(requests.Timeout())), RETRYABLE)
+        self.assertEqual(classify_error(wrapped(ValueError('bad input'))), PERMANENT)
+
+    def test_backoff_is_capped(self):
+        for attempt in range(20):
+            self.assertLessEqual(backoff_delay(attempt, base=1, cap=30), 30)
+
+
+class CircuitBreakerTest(SimpleTestCase):
+    """Test CircuitBreaker"""
+
+    def setUp(self):
+        cache.clear()
+        self.breaker = CircuitBreaker('test', failure_threshold=2, recovery_timeout=60)
+
+    def _fail(self, exc):
+        with self.assertRaises(type(exc)):
+            with self.breaker.guard():
+                raise exc
+
+    def test_opens_after_threshold(self):
+        self._fail(requests.ConnectionError())
+        self.assertEqual(self.breaker.state, 'closed')
+        self._fail(requests.ConnectionError())
+        self.assertEqual(self.breaker.state, 'open')
+        with self.assertRaises(CircuitOpenError):
+            with self.breaker.guard():
+                pass
+
+    def test_permanent_errors_do_not_trip(self):
+        self._fail(ValueError())
+        self._fail(ValueError())
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_half_open_allows_single_trial(self):
+        self._fail(requests.ConnectionError())
+        self._fail(requests.ConnectionError())
+        with patch('documents.resilience.time.time', return_value=cache.get('circuit:test:opened_at') + 61):
+            self.assertEqual(self.breaker.state, 'half-open')
+            self.breaker.before_call()
+            with self.assertRaises(CircuitOpenError):
+                self.breaker.before_call()
+            self.breaker.record_success()
+        self.assertEqual(self.breaker.state, 'closed')
+
+
+@override_settings(TASK_RETRY_MAX=2)
+class ResilientTaskTest(TestCase):
+    """Test retries and the dead-letter store"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_retryable_error_is_retried_then_dead_lettered(self):
+        request = PurchaseRequestFactory.create(proforma_file_url='https://files/proforma.pdf')
+        with patch('documents.services.GeminiDocumentProcessor.__init__',
+                   side_effect=requests.ConnectionError('gemini down')) as mock_init:
+            with self.assertRaises(requests.ConnectionError):
+                process_proforma_task.delay(str(request.id), 'https://files/proforma.pdf')
+
+        self.assertEqual(mock_init.call_count, 3)
+        failed = FailedTask.objects.get()
+        self.assertEqual(failed.task_name, 'documents.tasks.process_proforma_task')
+        self.assertEqual(failed.args, [str(request.id), 'https://files/proforma.pdf'])
+        self.assertEqual(failed.retries, 2)
+        self.assertFalse(failed.is_permanent)
+        request.refresh_from_db()
+        self.assertEqual(request.proforma_extraction_status, request.ExtractionStatus.FAILED)
+
+    def test_permanent_error_is_not_retried(self):
+        with self.assertRaises(Exception):
+            process_proforma_task.delay(str(uuid.uuid4()), 'https://files/proforma.pdf')
+
+        failed = FailedTask.objects.get()
+        self.assertTrue(failed.is_permanent)
+        self.assertEqual(failed.retries, 0)
+
+    def test_replay_reenqueues_task(self):
+        request = PurchaseRequestFactory.create()
+        failed = FailedTask.objects.create(
+            task_name='documents.tasks.process_proforma_task',
+            args=[str(request.id), 'https://files/proforma.pdf'],
+            error_class='requests.exceptions.ConnectionError',
+        )
+        with patch('documents.tasks.process_proforma_task.run') as mock_run:
+            failed.replay()
+
+        mock_run.assert_called_once_with(str(request.id), 'https://files/proforma.pdf')
+        failed.refresh_from_db()
+        self.assertEqual(failed.status, FailedTask.Status.REPLAYED)
+        self.assertEqual(failed.replay_count, 1)
@@ -0,0 +1,164 @@
+"""Tests for batch receipt re-validation"""
+from io import StringIO
+from unittest.mock import patch
+from django.core.management import call_command
+from django.test import TestCase
+from purchase_requests.models import Document, PurchaseRequest
+from purchase_requests.tests.factories import PurchaseRequestFactory
+from ..revalidation import ReceiptRevalidator, revalidate_payload
+from ..tasks import store_proforma_result, store_receipt_result
+
+PO = {
+    'vendor_name': 'Acme',
+    'items': [{'description': 'Office chair', 'quantity': 4, 'unit_price': 120, 'total': 480}],
+    'total_amount': 480,
+}
+RECEIPT = {
+    'seller_name': 'Acme',
+    'items': [{'description': 'Office chair', 'quantity': 4, 'unit_price': 124, 'total': 496}],
+    'total_amount': 496,
+}
+
+
+class ReceiptRevalidatorTest(TestCase):
+    """Test ReceiptRevalidator"""
+
+    def setUp(self):
+        # 3.3% over on price: a discrepancy at 1%, within the 5% default
+        self.request = PurchaseRequestFactory.create(amount=480, status=PurchaseRequest.Status.APPROVED)
+        self.organization = self.request.organization
+        self.organization.set_setting('match_tolerances', {'unit_price': 0.01, 'line_total': 0.01,
+                                                           'total_amount': 0.01})
+        Document.objects.create(
+            request=self.request, document_type=Document.DocumentType.PO,
+            file_url='https://files/po.pdf', extracted_data=PO
+        )
+        self.receipt = store_receipt_result(str(self.request.id), 'https://files/receipt.pdf', RECEIPT)
+        self.request.refresh_from_db()
+        self.assertEqual(self.request.status, PurchaseRequest.Status.DISCREPANCY)
+        # Tolerances are relaxed afterwards
+        self.organization.set_setting('match_tolerances', {})
+
+    def test_relaxed_tolerances_clear_discrepancy(self):
+        stats = ReceiptRevalidator(workers=0).run()
+
+        self.assertEqual(stats.receipts, 1)
+        self.assertEqual(stats.changed, 1)
+        self.assertEqual(stats.status_changes, {'DISCREPANCY->APPROVED': 1})
+        self.request.refresh_from_db()
+        self.assertEqual(self.request.status, PurchaseRequest.Status.APPROVED)
+        self.receipt.refresh_from_db()
+        self.assertTrue(self.receipt.extracted_data['validation']['is_valid'])
+        self.assertTrue(self.receipt.match_report['is_valid'])
+        self.assertEqual(self.receipt.extracted_data['items'], RECEIPT['items'])
+
+    def test_dry_run_reports_without_writing(self):
+        diffs = []
+        stats = ReceiptRevalidator(workers=0, dry_run=True, on_diff=diffs.append).run()
+
+        self.assertEqual(stats.changed, 1)
+        self.assertEqual(diffs[0]['removed'], ['item_price_mismatch', 'total_amount_mismatch'])
+        self.assertEqual(diffs[0]['status'], ('DISCREPANCY', 'APPROVED'))
+        self.request.refresh_from_db()
+        self.assertEqual(self.request.status, PurchaseRequest.Status.DISCREPANCY)
+
+    def test_process_pool(self):
+        stats = ReceiptRevalidator(workers=2, chunk_size=1).run()
+        self.assertEqual(stats.status_changes, {'DISCREPANCY->APPROVED': 1})
+
+    def test_concurrent_status_change_wins(self):
+        """Test that a request resolved while its receipt was being validated keeps its new status"""
+        def resolve_meanwhile(payload):
+            PurchaseRequest.objects.filter(id=self.request.id).update(status=PurchaseRequest.Status.REJECTED)
+            return revalidate_payload(payload)
+
+        with patch('documents.revalidation.revalidate_payload', side_effect=resolve_meanwhile):
+            stats = ReceiptRevalidator(workers=0).run()
+
+        self.assertEqual(stats.status_changes, {})
+        self.request.refresh_from_db()
+        self.assertEqual(self.request.status, PurchaseRequest.Status.REJECTED)
+
+    def test_resolved_discrepancy_is_not_reopened(self):
+        """Test that a discrepancy already reported and since resolved is not flagged again"""
+        self.organization.set_setting('match_tolerances', {'unit_price': 0.01, 'line_total': 0.01,
+                                                           'total_amount': 0.01})
+        PurchaseRequest.objects.filter(id=self.request.id).update(status=PurchaseRequest.Status.APPROVED)
+
+        stats = ReceiptRevalidator(workers=0).run()
+
+        self.assertEqual(stats.status_changes, {})
+        self.request.refresh_from_db()
+        self.assertEqual(self.request.status, PurchaseRequest.Status.APPROVED)
+
+    def test_match_report_change_is_counted(self):
+        """Test that the diff compares the combined verdicts, not only the validation result"""
+        Document.objects.filter(id=self.receipt.id).update(
+            extracted_data={**RECEIPT, 'validation': {'is_valid': True, 'discrepancies': []}}
+        )
+        diffs = []
+        stats = ReceiptRevalidator(workers=0, dry_run=True, on_diff=diffs.append).run()
+
+        self.assertEqual(stats.changed, 1)
+        self.assertEqual((diffs[0]['was_valid'], diffs[0]['is_valid']), (False, True))
+
+    def test_unchanged_results_are_not_counted(self):
+        self.organization.set_setting('match_tolerances', {'unit_price': 0.01, 'line_total': 0.01,
+                                                           'total_amount': 0.01})
+        stats = ReceiptRevalidator(workers=0).run()
+        self.assertEqual(stats.changed, 0)
+        self.assertEqual(stats.status_changes, {})
+
+    def test_command_dry_run_output(self):
+        out = StringIO()
+        call_command('revalidate_receipts', '--dry-run', '--workers', '0', stdout=out, stderr=StringIO())
+        output = out.getvalue()
+        self.assertIn('status DISCREPANCY -> APPROVED', output)
+        self.assertIn('Would change 1 of 1 receipts', output)
+
+
+class ReextractionTest(TestCase):
+    """Re-running extraction on a stored file updates its document"""
+
+    def setUp(self):
+        self.request = PurchaseRequestFactory.create(
+            amount=480, status=PurchaseRequest.Status.APPROVED, proforma_file_url='https://files/proforma.pdf'
+        )
+        self.request.organization.set_setting('match_tolerances', {'unit_price': 0.01, 'line_total': 0.01,
+                                                                   'total_amount': 0.01})
+        Document.objects.create(
+            request=self.request, document_type=Document.DocumentType.PO,
+            file_url='https://files/po.pdf', extracted_data=PO
+        )
+
+    def test_proforma_is_updated_in_place(self):
+        store_proforma_result(str(self.request.id), 'https://files/proforma.pdf', PO)
+        changed = {**PO, 'items': PO['items'] * 2}
+        document = store_proforma_result(str(self.request.id), 'https://files/proforma.pdf', changed)
+
+        self.assertEqual(self.request.documents.filter(document_type=Document.DocumentType.PROFORMA).get(), document)
+        self.assertEqual(document.extracted_data, changed)
+        self.assertEqual(document.line_items.count(), 2)
+
+    def test_receipt_rerun_does_not_reflag_resolved_discrepancy(self):
+        store_receipt_result(str(self.request.id), 'https://files/receipt.pdf', RECEIPT)
+        self.request.refresh_from_db()
+        self.assertEqual(self.request.status, PurchaseRequest.Status.DISCREPANCY)
+        PurchaseRequest.objects.filter(id=self.request.id).update(status=PurchaseRequest.Status.APPROVED)
+
+        store_receipt_result(str(self.request.id), 'https://files/receipt.pdf', RECEIPT)
+
+        self.assertEqual(self.request.documents.filter(document_type=Document.DocumentType.RECEIPT).count(), 1)
+        self.request.refresh_from_db()
+        self.assertEqual(self.request.status, PurchaseRequest.Status.APPROVED)
+
+    def test_duplicates_from_earlier_runs_are_removed(self):
+        for _ in range(2):
+            Document.objects.create(
+                request=self.request, document_type=Document.DocumentType.RECEIPT,
+                file_url='https://files/receipt.pdf', extracted_data=RECEIPT
+            )
+
+        store_receipt_result(str(self.request.id), 'https://files/receipt.pdf', RECEIPT)
+
+        self.assertEqual(self.request.documents.filter(document_type=Document.DocumentType.RECEIPT).count(), 1)
@@ -0,0 +1,74 @@
+"""Tests for extraction schemas and the repair path"""
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+from django.test import SimpleTestCase
+from ..schemas import (
+    ExtractionParseError, ProformaData, ReceiptData, parse_extraction, response_schema
+)
+from ..services import GeminiDocumentProcessor
+
+
+class ParseExtractionTest(SimpleTestCase):
+    """Test parse_extraction"""
+
+    def test_coerces_numbers(self):
+        """Test that formatted numbers are coerced to floats"""
+        data = parse_extraction(
+            '{"vendor_name": "ACME", "items": [{"description": "Paper", "quantity": "10", '
+            '"unit_price": "$1,200.50", "total": "12005"}], "total_amount": "USD 12,005.00"}',
+            ProformaData
+        )
+        self.assertEqual(data['items'][0]['quantity'], 10.0)
+        self.assertEqual(data['items'][0]['unit_price'], 1200.5)
+        self.assertEqual(data['total_amount'], 12005.0)
+        self.assertEqual(data['vendor_email'], '')
+
+    def test_repairs_formatting(self):
+        """Test that fences, prose and trailing commas are repaired locally"""
+        text = 'Here you go:\n```json\n{"seller_name": "ACME", "items": [], "total_amount": 5,}\n```'
+        data = parse_extraction(text, ReceiptData)
+        self.assertEqual(data['seller_name'], 'ACME')
+        self.assertEqual(data['total_amount'], 5.0)
+
+    def test_repairs_python_literals(self):
+        """Test that single-quoted / None payloads are accepted"""
+        data = parse_extraction("{'seller_name': 'ACME', 'items': None, 'total_amount': None}", ReceiptData)
+        self.assertEqual(data['items'], [])
+        self.assertEqual(data['total_amount'], 0.0)
+
+    def test_unrepairable_keeps_raw_text(self):
+        """Test that unrepairable text raises with the raw text attached"""
+        with self.assertRaises(ExtractionParseError) as ctx:
+            parse_extraction('no json here', ProformaData)
+        self.assertEqual(ctx.exception.raw_text, 'no json here')
+
+    def test_invalid_number_fails_validation(self):
+        """Test that non-numeric values fail schema validation"""
+        with self.assertRaises(ExtractionParseError):
+            parse_extraction('{"total_amount": "about a hundred"}', ProformaData)
+
+    def test_response_schema_has_no_defaults(self):
+        """Test that the schema sent to Gemini contains no default values"""
+        self.assertNotIn("'default'", str(response_schema(ProformaData)))
+
+
+class ExtractionRepairTest(SimpleTestCase):
+    """Test the text-only repair call"""
+
+    @patch('documents.services.GeminiDocumentProcessor._download_file', return_value=(b'%PDF', 'application/pdf'))
+    def test_repair_does_not_redownload(self, mock_download):
+        processor = GeminiDocumentProcessor.__new__(GeminiDocumentProcessor)
+        processor.client = MagicMock()
+        processor.rate_limiter = MagicMock()
+        processor.circuit_breaker = MagicMock()
+        processor.client.models.generate_content.side_effect = [
+            SimpleNamespace(text='{"vendor_name": "ACME" "total_amount": 1}'),
+            SimpleNamespace(text='{"vendor_name": "ACME", "total_amount": 1}'),
+        ]
+
+        data = processor.extract_proforma_data('https://files/proforma.pdf')
+
+        self.assertEqual(data['vendor_name'], 'ACME')
+        self.assertEqual(mock_download.call_count, 1)
+        repair_call = processor.client.models.generate_content.call_args_list[1]
+        self.assertNotIn('inline_data', str(repair_call.kwargs['contents']))
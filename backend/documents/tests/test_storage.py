@@ -0,0 +1,110 @@
+"""Tests for document storage backends"""
+import shutil
+import tempfile
+from io import BytesIO
+from unittest.mock import patch
+import cloudinary
+from django.test import SimpleTestCase, TestCase, override_settings
+from purchase_requests.models import PurchaseRequest
+from purchase_requests.tests.mocks import mock_file_upload, mock_pdf
+from users.tests.factories import OrganizationFactory, UserFactory
+from users.tests.test_utils import get_authenticated_client
+from ..services import GeminiDocumentProcessor
+from ..storage import CloudinaryStorage, LocalStorage, StorageError, open_url
+
+PDF = mock_pdf('stored')
+
+
+class LocalStorageTest(TestCase):
+    """Test LocalStorage and the stored-file view"""
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.storage = LocalStorage(root, 'http://testserver')
+        patcher = patch('documents.storage._storage', self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_put_open_delete(self):
+        name = 'procure-to-pay/1/proformas/a.pdf'
+        url = self.storage.put(BytesIO(PDF), name)
+
+        self.assertEqual(url, 'http://testserver/files/procure-to-pay/1/proformas/a.pdf')
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(self.storage.name_for_url(url), name)
+        with self.storage.open(name) as file:
+            self.assertEqual(file.read(4), b'%PDF')
+            file.seek(0)
+            self.assertEqual(file.read(), PDF)
+        with open_url(url) as file:
+            self.assertEqual(file.read(), PDF)
+
+        self.storage.delete(name)
+        self.assertFalse(self.storage.exists(name))
+        self.storage.delete(name)
+
+    def test_names_stay_inside_root(self):
+        for name in ('../outside.pdf', 'a/../../outside.pdf', ''):
+            with self.subTest(name), self.assertRaises(StorageError):
+                self.storage.path(name)
+
+    def test_stored_file_view(self):
+        url = self.storage.put(BytesIO(PDF), 'receipts/r.pdf')
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(b''.join(response.streaming_content), PDF)
+
+        self.assertEqual(self.client.get('/files/receipts/missing.pdf').status_code, 404)
+        self.assertEqual(self.client.get('/files/../settings.py').status_code, 404)
+        with override_settings(STORAGE_LOCAL_ACCEL_REDIRECT='/protected/'):
+            self.assertEqual(self.client.get(url)['X-Accel-Redirect'], '/protected/receipts/r.pdf')
+        with patch('documents.storage._storage', CloudinaryStorage()):
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_upload_and_extraction_run_offline(self):
+        organization = OrganizationFactory.create()
+        staff = UserFactory.create_staff(organization=organization)
+        client, _ = get_authenticated_client(staff, organization)
+        with patch('documents.tasks.process_proforma_task.delay'):
+            response = client.post('/api/requests/', {
+                'title': 'Chairs', 'description': 'Office chairs', 'amount': '10.00',
+                'proforma_file': mock_file_upload('proforma.pdf', 'application/pdf', PDF),
+            }, format='multipart')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        request = PurchaseRequest.objects.get(id=response.data['id'])
+        self.assertTrue(request.proforma_file_url.startswith('http://testserver/files/procure-to-pay/'))
+        self.assertEqual(GeminiDocumentProcessor._download_file(request.proforma_file_url), (PDF, 'application/pdf'))
+
+
+class CloudinaryStorageTest(SimpleTestCase):
+    """Test CloudinaryStorage names and URLs"""
+
+    def setUp(self):
+        config = cloudinary.config()
+        previous = config.cloud_name
+        cloudinary.config(cloud_name='demo')
+        self.addCleanup(lambda: cloudinary.config(cloud_name=previous))
+        self.storage = CloudinaryStorage()
+
+    def test_urls_map_back_to_names(self):
+        name = 'purchase_orders/abc.pdf'
+        url = self.storage.url(name)
+
+        self.assertEqual(url, 'https://res.cloudinary.com/demo/raw/upload/v1/purchase_orders/abc.pdf')
+        self.assertEqual(self.storage.name_for_url(url), name)
+        self.assertEqual(self.storage.name_for_url(
+            'https://res.cloudinary.com/demo/raw/upload/v1700000000/purchase_orders/abc.pdf'
+        ), name)
+        self.assertIsNone(self.storage.name_for_url('https://res.cloudinary.com/demo/image/upload/v1/x.jpg'))
+
+    @patch('documents.storage.cloudinary.uploader.upload',
+           return_value={'secure_url': 'https://res.cloudinary.com/demo/raw/upload/v1/receipts/r.pdf'})
+    def test_put_uses_name_as_public_id(self, mock_upload):
+        url = self.storage.put(BytesIO(PDF), 'receipts/r.pdf', organization_id='org')
+
+        self.assertEqual(url, 'https://res.cloudinary.com/demo/raw/upload/v1/receipts/r.pdf')
+        self.assertEqual(mock_upload.call_args.kwargs, {
+            'resource_type': 'raw', 'public_id': 'receipts/r.pdf', 'overwrite': True
+        })
@@ -0,0 +1,138 @@
+"""Tests for purchase order generation"""
+from tempfile import SpooledTemporaryFile
+from unittest.mock import patch
+from django.db import IntegrityError, transaction
+from django.test import TestCase, override_settings
+from purchase_requests.models import Document, PurchaseRequest
+from purchase_requests.tests.factories import PurchaseRequestFactory, RequestItemFactory
+from ..po_generator import TEMPLATE_VERSION
+from ..tasks import generate_purchase_order_task, get_po_data, upload_purchase_order
+from .test_executor import FakeProcessor
+
+
+@patch('documents.storage.cloudinary.uploader.upload', return_value={'secure_url': 'https://files/po.pdf'})
+class GeneratePurchaseOrderTaskTest(TestCase):
+    """Test generate_purchase_order_task"""
+
+    def test_uses_speculatively_extracted_proforma(self, mock_upload):
+        request = PurchaseRequestFactory.create(proforma_file_url='https://files/proforma.pdf')
+        Document.objects.create(
+            request=request,
+            document_type=Document.DocumentType.PROFORMA,
+            file_url='https://files/proforma.pdf',
+            extracted_data={'vendor_name': 'Acme', 'items': []}
+        )
+        processor = FakeProcessor()
+        with patch('documents.executor.AsyncExtractionExecutor.processor', processor):
+            generate_purchase_order_task(str(request.id))
+
+        self.assertEqual(processor.peak, 0)
+        request.refresh_from_db()
+        self.assertEqual(request.purchase_order_file_url, 'https://files/po.pdf')
+        po = request.documents.get(document_type=Document.DocumentType.PO)
+        self.assertEqual(po.extracted_data['vendor_name'], 'Acme')
+
+    def test_extracts_inline_when_not_ready(self, mock_upload):
+        """Test that PO generation extracts the proforma if speculation has not finished"""
+        request = PurchaseRequestFactory.create(proforma_file_url='https://files/proforma.pdf')
+        Document.objects.create(
+            request=request,
+            document_type=Document.DocumentType.PROFORMA,
+            file_url='https://files/replaced.pdf',
+            extracted_data={'vendor_name': 'Stale'}
+        )
+        with patch('documents.executor.AsyncExtractionExecutor.processor', FakeProcessor()):
+            generate_purchase_order_task(str(request.id))
+
+        po = request.documents.get(document_type=Document.DocumentType.PO)
+        self.assertEqual(po.extracted_data['file_url'], 'https://files/proforma.pdf')
+        request.refresh_from_db()
+        self.assertEqual(request.proforma_extraction_status, request.ExtractionStatus.COMPLETED)
+
+    def test_falls_back_to_request_items(self, mock_upload):
+        request = PurchaseRequestFactory.create()
+        RequestItemFactory.create(request=request, description='Chair', quantity=2, unit_price=50)
+
+        po_data = get_po_data(request)
+
+        self.assertEqual(po_data['items'][0]['description'], 'Chair')
+        self.assertEqual(po_data['items'][0]['total'], 100.0)
+
+    def test_no_proforma_or_items_skips(self, mock_upload):
+        request = PurchaseRequestFactory.create()
+        generate_purchase_order_task(str(request.id))
+        mock_upload.assert_not_called()
+
+    def test_rerun_with_same_inputs_does_not_render(self, mock_upload):
+        """Test that retries and duplicate enqueues reuse the PO already issued"""
+        request = PurchaseRequestFactory.create()
+        item = RequestItemFactory.create(request=request, description='Chair', quantity=2, unit_price=50)
+        generate_purchase_order_task(str(request.id))
+        with patch('documents.tasks.render_purchase_order') as mock_render:
+            generate_purchase_order_task(str(request.id))
+        mock_render.assert_not_called()
+        self.assertEqual(mock_upload.call_count, 1)
+        po = request.documents.get(document_type=Document.DocumentType.PO)
+        self.assertEqual(po.template_version, TEMPLATE_VERSION)
+        request.refresh_from_db()
+        self.assertRegex(request.po_number, r'^PO-\d{6}$')
+        self.assertEqual(mock_upload.call_args.kwargs['public_id'], f'purchase_orders/{po.render_key}.pdf')
+
+        # Changed inputs re-render into the same PO document
+        item.quantity = 3
+        item.save()
+        generate_purchase_order_task(str(request.id))
+        self.assertEqual(mock_upload.call_count, 2)
+        po_after = request.documents.get(document_type=Document.DocumentType.PO)
+        self.assertEqual(po_after.id, po.id)
+        self.assertNotEqual(po_after.render_key, po.render_key)
+        self.assertEqual(PurchaseRequest.objects.get(id=request.id).po_number, request.po_number)
+        self.assertEqual(po_after.extracted_data['items'][0]['quantity'], 3.0)
+
+    def test_one_po_per_request_and_version(self, mock_upload):
+        request = PurchaseRequestFactory.create()
+        Document.objects.create(
+            request=request, document_type=Document.DocumentType.PO, file_url='https://files/a.pdf',
+            template_version=TEMPLATE_VERSION, render_key='a'
+        )
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Document.objects.create(
+                request=request, document_type=Document.DocumentType.PO, file_url='https://files/b.pdf',
+                template_version=TEMPLATE_VERSION, render_key='b'
+            )
+
+
+@override_settings(PO_UPLOAD_CHUNK_SIZE=1024)
+class UploadPurchaseOrderTest(TestCase):
+    """Test upload_purchase_order"""
+
+    def pdf_file(self, size):
+        pdf_file = SpooledTemporaryFile()
+        pdf_file.write(b'%PDF' + b'0' * (size - 4))
+        return pdf_file
+
+    @patch('documents.storage.cloudinary.uploader.upload_large', return_value={'secure_url': 'https://files/big.pdf'})
+    @patch('documents.storage.cloudinary.uploader.upload')
+    def test_large_file_uploads_in_chunks(self, mock_upload, mock_upload_large):
+        pdf_file = self.pdf_file(4096)
+        self.assertEqual(upload_purchase_order(pdf_file, 'org'), 'https://files/big.pdf')
+        mock_upload.assert_not_called()
+        self.assertEqual(mock_upload_large.call_args.kwargs['chunk_size'], 1024)
+        self.assertTrue(pdf_file.closed)
+
+    @patch('documents.storage.cloudinary.uploader.upload_large')
+    def test_small_file_uploads_at_once(self, mock_upload_large):
+        def upload(file, **kwargs):
+            self.assertEqual(file.read(4), b'%PDF')
+            return {'secure_url': 'https://files/small.pdf'}
+
+        with patch('documents.storage.cloudinary.uploader.upload', side_effect=upload):
+            self.assertEqual(upload_purchase_order(self.pdf_file(512), 'org'), 'https://files/small.pdf')
+        mock_upload_large.assert_not_called()
+
+    @patch('documents.storage.cloudinary.uploader.upload', side_effect=RuntimeError('down'))
+    def test_file_closed_on_failure(self, mock_upload):
+        pdf_file = self.pdf_file(512)
+        with self.assertRaises(RuntimeError):
+            upload_purchase_order(pdf_file, 'org')
+        self.assertTrue(pdf_file.closed)
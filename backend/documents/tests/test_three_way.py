@@ -0,0 +1,132 @@
+"""Tests for the vectorized three-way match"""
+import numpy as np
+from django.test import SimpleTestCase, TestCase
+from purchase_requests.models import Document, PurchaseRequest
+from purchase_requests.tests.factories import PurchaseRequestFactory, RequestItemFactory
+from ..tasks import store_receipt_result
+from ..three_way import breach_mask, three_way_match
+
+
+def item(description, quantity, unit_price, **extra):
+    return {'description': description, 'quantity': quantity, 'unit_price': unit_price,
+            'total': quantity * unit_price, **extra}
+
+
+PO = {
+    'vendor_name': 'Acme',
+    'items': [item('Office chair', 4, 120), item('Standing desk', 2, 450)],
+    'total_amount': 1380,
+}
+
+
+class BreachMaskTest(SimpleTestCase):
+    """Test breach_mask"""
+
+    def test_relative_absolute_and_nan(self):
+        values = np.array([100.0, 106.0, 0.005, np.nan])
+        reference = np.array([100.0, 100.0, 0.0, 100.0])
+        mask = breach_mask(values, reference, 0.05, 0.01)
+        self.assertEqual(mask.tolist(), [False, True, False, False])
+
+
+class ThreeWayMatchTest(SimpleTestCase):
+    """Test three_way_match"""
+
+    def test_all_sources_agree(self):
+        receipt = {'items': list(reversed(PO['items'])), 'total_amount': 1380}
+        requested = [item('Office chair', 4, 120, id=1), item('Standing desk', 2, 450, id=2)]
+        report = three_way_match(PO, receipt, requested, requested_amount=1380)
+        self.assertTrue(report['is_valid'], report)
+        self.assertEqual(report['summary']['lines_with_breaches'], 0)
+
+    def test_price_breach_is_reported_per_line(self):
+        receipt = {'items': [item('Office chair', 4, 130), item('Standing desk', 2, 450)], 'total_amount': 1420}
+        report = three_way_match(PO, receipt, [], requested_amount=1380)
+        self.assertFalse(report['is_valid'])
+        self.assertEqual(len(report['lines']), 1)
+        line = report['lines'][0]
+        self.assertEqual(line['description'], 'Office chair')
+        self.assertEqual(line['breaches'], ['receipt_unit_price', 'receipt_line_total'])
+        self.assertEqual(line['receipt']['unit_price'], 130.0)
+        self.assertIsNone(line['request']['unit_price'])
+        self.assertEqual(report['aggregate']['breaches'], [])
+
+    def test_request_items_are_compared(self):
+        """Test that the PO is checked against what was actually requested"""
+        receipt = {'items': PO['items'], 'total_amount': 1380}
+        requested = [item('Office chair', 3, 120, id=7), item('Standing desk', 2, 450, id=8)]
+        report = three_way_match(PO, receipt, requested, requested_amount=1260)
+        self.assertEqual(report['lines'][0]['request_item_id'], 7)
+        self.assertIn('request_quantity', report['lines'][0]['breaches'])
+        self.assertEqual(report['aggregate']['breaches'], ['request_total_amount'])
+        self.assertTrue(report['is_valid'], report)
+        self.assertFalse(report['request_matches_po'])
+
+    def test_request_wording_does_not_fail_receipt(self):
+        """Test that request items worded unlike the PO are reported but do not fail the receipt"""
+        receipt = {'items': PO['items'], 'total_amount': 1380}
+        requested = [item('Ergonomic seating', 4, 120, id=1), item('Height adjustable table', 2, 450, id=2)]
+        report = three_way_match(PO, receipt, requested, requested_amount=1380)
+        self.assertTrue(report['is_valid'], report)
+        self.assertFalse(report['request_matches_po'])
+        self.assertEqual(report['unmatched']['po_missing_from_request'], [0, 1])
+        self.assertEqual(report['unmatched']['request_items_not_on_po'], [1, 2])
+
+    def test_org_tolerances_override_defaults(self):
+        receipt = {'items': [item('Office chair', 4, 130), item('Standing desk', 2, 450)], 'total_amount': 1420}
+        report = three_way_match(
+            PO, receipt, [], requested_amount=1380,
+            tolerances={'unit_price': 0.1, 'line_total': 0.1}
+        )
+        self.assertTrue(report['is_valid'], report)
+        self.assertEqual(report['tolerances']['unit_price'], 0.1)
+
+    def test_missing_and_extra_lines(self):
+        receipt = {'items': [item('Standing desk', 2, 450), item('Delivery fee', 1, 50)], 'total_amount': 950}
+        report = three_way_match(PO, receipt, [])
+        self.assertEqual(report['unmatched']['po_missing_from_receipt'], [0])
+        self.assertEqual(report['unmatched']['receipt_not_on_po'], [1])
+
+
+class StoreReceiptMatchReportTest(TestCase):
+    """Test that receipt processing stores the three-way report"""
+
+    def test_report_is_stored_and_sets_discrepancy(self):
+        request = PurchaseRequestFactory.create(amount=1380, status=PurchaseRequest.Status.APPROVED)
+        request.organization.set_setting('match_tolerances', {'unit_price': 0.01})
+        RequestItemFactory.create(request=request, description='Office chair', quantity=4, unit_price=120)
+        RequestItemFactory.create(request=request, description='Standing desk', quantity=2, unit_price=450)
+        Document.objects.create(
+            request=request, document_type=Document.DocumentType.PO,
+            file_url='https://files/po.pdf', extracted_data=PO
+        )
+        receipt = {
+            'seller_name': 'Acme',
+            'items': [item('Standing desk', 2, 450), item('Office chair', 4, 123)],
+            'total_amount': 1392,
+        }
+
+        document = store_receipt_result(str(request.id), 'https://files/receipt.pdf', receipt)
+
+        self.assertEqual(document.match_report['tolerances']['unit_price'], 0.01)
+        self.assertEqual(document.match_report['lines'][0]['breaches'], ['receipt_unit_price'])
+        request.refresh_from_db()
+        self.assertEqual(request.status, PurchaseRequest.Status.DISCREPANCY)
+
+    def test_request_wording_does_not_set_discrepancy(self):
+        """Test that a receipt equal to the PO validates even when the request items differ in wording"""
+        request = PurchaseRequestFactory.create(amount=1380, status=PurchaseRequest.Status.APPROVED)
+        RequestItemFactory.create(request=request, description='Ergonomic seating', quantity=4, unit_price=120)
+        RequestItemFactory.create(request=request, description='Height adjustable table', quantity=2, unit_price=450)
+        Document.objects.create(
+            request=request, document_type=Document.DocumentType.PO,
+            file_url='https://files/po.pdf', extracted_data=PO
+        )
+        receipt = {'seller_name': 'Acme', 'items': PO['items'], 'total_amount': 1380}
+
+        document = store_receipt_result(str(request.id), 'https://files/receipt.pdf', receipt)
+
+        self.assertTrue(document.match_report['is_valid'], document.match_report)
+        self.assertFalse(document.match_report['request_matches_po'])
+        request.refresh_from_db()
+        self.assertEqual(request.status, PurchaseRequest.Status.APPROVED)
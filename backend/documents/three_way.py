@@ -0,0 +1,166 @@
+"""
+Three-way match of purchase order, receipt and requested line items
+
+Receipt lines and the request's RequestItem rows are first aligned to the
+PO lines with the order-independent matcher. Quantities, unit prices and
+line totals from the three sources are then loaded into one
+(source, line, field) NumPy array, NaN where a source has no line, and
+every tolerance check runs as one vectorized comparison against the PO.
+
+The report carries two verdicts. is_valid covers the receipt against the
+PO and is what flags a discrepancy; request_matches_po covers the PO
+against the original request and is informational, since a PO built from
+proforma lines is often worded differently from the requested items.
+"""
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from organizations.models import DEFAULT_MATCH_TOLERANCES
+
+from .matching import MatchConfig, LineItemMatcher, to_number
+
+PO, RECEIPT, REQUEST = 0, 1, 2
+SOURCES = ('po', 'receipt', 'request')
+FIELDS = ('quantity', 'unit_price', 'line_total')
+
+
+def _line_values(item: Dict[str, Any]) -> List[float]:
+    quantity = to_number(item.get('quantity'))
+    unit_price = to_number(item.get('unit_price'))
+    total = item.get('total')
+    line_total = to_number(total) if total not in (None, '') else quantity * unit_price
+    return [quantity, unit_price, line_total]
+
+
+def breach_mask(values: np.ndarray, reference: np.ndarray, relative: float, absolute: float) -> np.ndarray:
+    """
+    Element-wise tolerance breaches of `values` against `reference`
+
+    A value breaches when it differs from the reference by more than both
+    `absolute` and `relative` * |reference|. NaN on either side (no line in
+    that source) never breaches; missing lines are reported separately.
+    """
+    diff = np.abs(values - reference)
+    allowed = np.maximum(absolute, relative * np.abs(reference))
+    with np.errstate(invalid='ignore'):
+        return np.nan_to_num(diff, nan=0.0) > np.where(np.isnan(allowed), np.inf, allowed)
+
+
+def three_way_match(
+    po_data: Dict[str, Any],
+    receipt_data: Dict[str, Any],
+    request_items: List[Dict[str, Any]],
+    requested_amount: Optional[float] = None,
+    tolerances: Optional[Dict[str, float]] = None,
+) -> Dict[str, Any]:
+    """
+    Compare PO, receipt and requested lines within tolerances
+
+    Args:
+        po_data: Extracted PO data (the reference)
+        receipt_data: Extracted receipt data
+        request_items: RequestItem rows as dicts (id, description, quantity, unit_price, total)
+        requested_amount: The request's approved amount
+        tolerances: Organization.match_tolerances; defaults when omitted
+
+    Returns:
+        Structured discrepancy report (JSON-serializable). is_valid is the
+        receipt-vs-PO verdict, request_matches_po the PO-vs-request one.
+    """
+    tolerances = {**DEFAULT_MATCH_TOLERANCES, **(tolerances or {})}
+    po_items = po_data.get('items') or []
+    receipt_items = receipt_data.get('items') or []
+    matcher = LineItemMatcher(MatchConfig.from_tolerances(tolerances))
+
+    receipt_match = matcher.match(po_items, receipt_items)
+    request_match = matcher.match(po_items, request_items)
+    # Lines paired on amounts alone despite different descriptions stay unmatched
+    receipt_for = {p.left_index: p.right_index for p in receipt_match.pairs if p.description_ok}
+    request_for = {p.left_index: p.right_index for p in request_match.pairs if p.description_ok}
+
+    n = len(po_items)
+    values = np.full((3, n, len(FIELDS)), np.nan)
+    if n:
+        values[PO] = [_line_values(item) for item in po_items]
+    for i, j in receipt_for.items():
+        values[RECEIPT, i] = _line_values(receipt_items[j])
+    for i, j in request_for.items():
+        values[REQUEST, i] = _line_values(request_items[j])
+
+    # breaches[source, line, field] for receipt and request against the PO
+    relative = np.array([tolerances['quantity'], tolerances['unit_price'], tolerances['line_total']])
+    breaches = breach_mask(values[RECEIPT:], values[PO][np.newaxis], relative, tolerances['absolute'])
+
+    lines = []
+    for i in np.flatnonzero(breaches.any(axis=(0, 2))):
+        lines.append({
+            'po_index': int(i),
+            'receipt_index': receipt_for.get(i),
+            'request_item_id': request_items[request_for[i]].get('id') if i in request_for else None,
+            'description': po_items[i].get('description', ''),
+            **{
+                source: dict(zip(FIELDS, (None if np.isnan(v) else float(v) for v in values[s, i])))
+                for s, source in enumerate(SOURCES)
+            },
+            'breaches': [
+                f'{SOURCES[s + 1]}_{FIELDS[f]}'
+                for s, f in zip(*np.nonzero(breaches[:, i, :]))
+            ],
+        })
+
+    totals = {
+        'po': to_number(po_data.get('total_amount')) or float(np.nansum(values[PO, :, 2])),
+        'receipt': to_number(receipt_data.get('total_amount')) or float(
+            sum(_line_values(item)[2] for item in receipt_items)
+        ),
+        'request': float(requested_amount) if requested_amount is not None else float(
+            sum(_line_values(item)[2] for item in request_items)
+        ),
+    }
+    total_values = np.array([totals['receipt'], totals['request']])
+    # A PO without a total gives nothing to compare against
+    po_total = totals['po'] if totals['po'] > 0 else np.nan
+    total_breaches = breach_mask(
+        total_values, np.full(2, po_total), tolerances['total_amount'], tolerances['absolute']
+    )
+    aggregate = {
+        'totals': totals,
+        'breaches': [f'{SOURCES[s + 1]}_total_amount' for s in np.flatnonzero(total_breaches)],
+    }
+
+    receipt_unmatched_right = sorted(set(range(len(receipt_items))) - set(receipt_for.values()))
+    request_unmatched_right = sorted(set(range(len(request_items))) - set(request_for.values()))
+    unmatched = {
+        'po_missing_from_receipt': [i for i in range(n) if i not in receipt_for],
+        # Requests created from a proforma alone have no lines to compare
+        'po_missing_from_request': [i for i in range(n) if i not in request_for] if request_items else [],
+        'receipt_not_on_po': receipt_unmatched_right,
+        'request_items_not_on_po': [request_items[j].get('id') for j in request_unmatched_right],
+    }
+    line_breach_counts = breaches.sum(axis=1)
+    receipt_total_breach, request_total_breach = total_breaches.tolist()
+
+    return {
+        'is_valid': not (
+            breaches[0].any() or receipt_total_breach
+            or unmatched['po_missing_from_receipt'] or unmatched['receipt_not_on_po']
+        ),
+        'request_matches_po': not (
+            breaches[1].any() or request_total_breach
+            or unmatched['po_missing_from_request'] or unmatched['request_items_not_on_po']
+        ),
+        'tolerances': tolerances,
+        'summary': {
+            'po_lines': n,
+            'receipt_lines': len(receipt_items),
+            'request_lines': len(request_items),
+            'lines_with_breaches': len(lines),
+            'breach_counts': {
+                f'{SOURCES[s + 1]}_{field}': int(line_breach_counts[s, f])
+                for s in range(2) for f, field in enumerate(FIELDS)
+            },
+        },
+        'lines': lines,
+        'aggregate': aggregate,
+        'unmatched': unmatched,
+    }
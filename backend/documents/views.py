@@ -1,3 +1,35 @@
-from django.shortcuts import render
+"""Views of the documents app"""
+import os
+from urllib.parse import quote
 
-# Create your views here.
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse
+
+from .storage import LocalStorage, StorageError, get_storage, guess_content_type
+
+
+def stored_file(request, name):
+    """
+    Serve a file of the local storage backend
+
+    Public, like the Cloudinary URLs it stands in for (names are random).
+    FileResponse goes through the WSGI file wrapper, so the server sends
+    the file with sendfile; behind nginx, STORAGE_LOCAL_ACCEL_REDIRECT
+    hands the transfer to nginx instead.
+    """
+    storage = get_storage()
+    if not isinstance(storage, LocalStorage):
+        raise Http404
+    try:
+        path = storage.path(name)
+    except StorageError:
+        raise Http404
+    if not os.path.isfile(path):
+        raise Http404
+
+    content_type = guess_content_type(name)
+    if settings.STORAGE_LOCAL_ACCEL_REDIRECT:
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = f"{settings.STORAGE_LOCAL_ACCEL_REDIRECT.rstrip('/')}/{quote(name)}"
+        return response
+    return FileResponse(open(path, 'rb'), content_type=content_type)
@@ -1,3 +1,10 @@
 from django.contrib import admin
+from .models import PendingNotification
 
-# Register your models here.
+
+@admin.register(PendingNotification)
+class PendingNotificationAdmin(admin.ModelAdmin):
+    list_display = ['recipient', 'notification_type', 'request', 'created_at']
+    list_filter = ['notification_type']
+    search_fields = ['recipient__email', 'request__title']
+    raw_id_fields = ['recipient', 'request']
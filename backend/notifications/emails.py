@@ -0,0 +1,85 @@
+"""
+Notification emails
+
+Each notification type has three templates under
+notifications/email/: <type>_subject.txt, <type>.txt and <type>.html.
+They are compiled once per process; every recipient gets their own
+EmailMultiAlternatives (plain text plus HTML), and a batch is sent over a
+single backend connection instead of one SMTP session per message.
+"""
+import logging
+from functools import lru_cache
+from typing import Any, Dict, List
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template.loader import get_template
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def email_templates(notification_type: str):
+    """Compiled (subject, text, html) templates of a notification type"""
+    return tuple(
+        get_template(f'notifications/email/{notification_type}{suffix}')
+        for suffix in ('_subject.txt', '.txt', '.html')
+    )
+
+
+def render_email(notification_type: str, recipient, context: Dict[str, Any]) -> EmailMultiAlternatives:
+    """
+    Build one recipient's email
+
+    Args:
+        notification_type: Template name, e.g. 'approved'
+        recipient: User the email goes to (available to templates as `recipient`)
+        context: Template context
+
+    Returns:
+        Unsent message addressed to recipient.email
+    """
+    subject, text, html = email_templates(notification_type)
+    context = {**context, 'recipient': recipient}
+    message = EmailMultiAlternatives(
+        subject=' '.join(subject.render(context).split()),
+        body=text.render(context).strip(),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[recipient.email],
+    )
+    message.attach_alternative(html.render(context), 'text/html')
+    return message
+
+
+def send_batch(messages: List[EmailMultiAlternatives]) -> Dict[str, Any]:
+    """
+    Send messages over one connection, reporting each recipient
+
+    A message the server refuses does not stop the rest. Failing to open
+    the connection raises, since nothing was sent.
+
+    Returns:
+        {'sent': [email, ...], 'failed': {email: error}}
+    """
+    report = {'sent': [], 'failed': {}}
+    if not messages:
+        return report
+
+    connection = get_connection(fail_silently=False)
+    connection.open()
+    try:
+        for message in messages:
+            recipient = ', '.join(message.to)
+            try:
+                if connection.send_messages([message]):
+                    report['sent'].append(recipient)
+                else:
+                    report['failed'][recipient] = 'Not accepted by the mail backend'
+            except Exception as e:
+                report['failed'][recipient] = str(e)
+    finally:
+        connection.close()
+
+    for recipient, error in report['failed'].items():
+        logger.warning(f"Notification to {recipient} failed: {error}")
+    return report
@@ -1 +1,33 @@
-# This app doesn't need models, it's just for notifications
+from django.db import models
+from purchase_requests.models import PurchaseRequest
+from users.models import User
+
+
+class PendingNotification(models.Model):
+    """A notification held back for a recipient's next digest"""
+
+    recipient = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='pending_notifications'
+    )
+    request = models.ForeignKey(
+        PurchaseRequest,
+        on_delete=models.CASCADE,
+        related_name='pending_notifications'
+    )
+    notification_type = models.CharField(max_length=50)
+    context = models.JSONField(
+        default=dict,
+        help_text="Extra template context, e.g. the approval level"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['recipient', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.notification_type} for {self.recipient} - {self.request}"
@@ -1,143 +1,172 @@
 from celery import shared_task
-from django.core.mail import send_mail
-from django.conf import settings
-from django.template.loader import render_to_string
+from django.db import transaction
 from purchase_requests.models import PurchaseRequest
 from users.models import User
+from documents.resilience import ResilientTask, RetryableError
+from .emails import render_email, send_batch
+from .models import PendingNotification
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Sent immediately even to recipients who asked for a digest
+URGENT_NOTIFICATIONS = {'rejected'}
 
-@shared_task
-def send_approval_notification_task(request_id: str, notification_type: str, approver_id: str = None):
+
+@shared_task(bind=True, base=ResilientTask)
+def send_approval_notification_task(self, request_id: str, notification_type: str, approver_id: str = None):
     """
     Send email notification for approval/rejection
-    
+
+    All recipients are sent to over one mail connection. Recipients who
+    chose digest delivery get the notification queued for their next
+    digest instead, unless it is urgent. The task only fails (and is
+    retried) when no email could be sent at all, so a retry never repeats
+    an email someone already received. Digest rows are written after the
+    sends, so a retry does not queue them twice.
+
     Args:
         request_id: PurchaseRequest ID
         notification_type: 'pending_next_level', 'approved', 'rejected'
         approver_id: User ID of the approver (optional)
+
+    Returns:
+        {'sent': [email, ...], 'failed': {email: error}, 'queued': [email, ...]}
+    """
+    request = PurchaseRequest.objects.select_related('created_by', 'organization').get(id=request_id)
+
+    # Check if email notifications are enabled
+    if not request.organization.email_notifications_enabled:
+        logger.info(f"Email notifications disabled for organization {request.organization.id}")
+        return
+
+    recipients, context = notification_recipients(request, notification_type, approver_id)
+    immediate, digest = [], []
+    for recipient in recipients:
+        if (notification_type not in URGENT_NOTIFICATIONS
+                and recipient.notification_delivery == User.NotificationDelivery.DIGEST):
+            digest.append(recipient)
+        else:
+            immediate.append(recipient)
+
+    report = send_batch([render_email(notification_type, recipient, context) for recipient in immediate])
+    if report['failed'] and not report['sent']:
+        raise RetryableError(f"No {notification_type} notification delivered: {report['failed']}")
+
+    # Queued only once the immediate sends went through, so a retry does not
+    # queue the same notification again
+    extra_context = {key: value for key, value in context.items() if key != 'request'}
+    PendingNotification.objects.bulk_create([
+        PendingNotification(
+            recipient=recipient, request=request,
+            notification_type=notification_type, context=extra_context
+        )
+        for recipient in digest
+    ])
+    report['queued'] = [recipient.email for recipient in digest]
+    logger.info(
+        f"{notification_type} notification for request {request_id}: "
+        f"{len(report['sent'])} sent, {len(report['failed'])} failed, {len(report['queued'])} queued for digest"
+    )
+    return report
+
+
+def notification_recipients(request: PurchaseRequest, notification_type: str, approver_id: str = None):
+    """
+    Who a notification goes to, and the template context
+
+    Returns:
+        ([User, ...], context dict)
+    """
+    context = {'request': request}
+
+    if notification_type == 'pending_next_level':
+        # Notify the approvers at the next level
+        next_level = request.current_approval_level + 1
+        if next_level > request.get_required_approval_levels():
+            # This shouldn't happen, but handle it
+            return [], context
+        context['level'] = next_level
+        approvers = User.objects.filter(
+            organization=request.organization,
+            role=User.Role.APPROVER,
+            approval_level=next_level,
+            is_active=True
+        )
+        return list(approvers), context
+
+    if notification_type == 'rejected':
+        approver = User.objects.filter(id=approver_id).first() if approver_id else None
+        context['approver_name'] = approver.email if approver else "an approver"
+
+    if notification_type in ('approved', 'rejected'):
+        # Notify the requester
+        return [request.created_by], context
+    return [], context
+
+
+@shared_task
+def send_notification_digests_task():
     """
-    try:
-        request = PurchaseRequest.objects.select_related('created_by', 'organization').get(id=request_id)
-        
-        # Check if email notifications are enabled
-        if not request.organization.email_notifications_enabled:
-            logger.info(f"Email notifications disabled for organization {request.organization.id}")
-            return
-        
-        if notification_type == 'pending_next_level':
-            # Notify next approver
-            next_level = request.current_approval_level + 1
-            required_levels = request.get_required_approval_levels()
-            
-            if next_level > required_levels:
-                # This shouldn't happen, but handle it
-                return
-            
-            # Find approvers at next level
-            approvers = User.objects.filter(
-                organization=request.organization,
-                role=User.Role.APPROVER,
-                approval_level=next_level,
-                is_active=True
-            )
-            
-            for approver in approvers:
-                subject = f"Purchase Request Pending Approval - {request.title}"
-                message = f"""
-                Hello {approver.first_name or approver.email},
-                
-                A purchase request requires your approval at level {next_level}.
-                
-                Request Details:
-                - Title: {request.title}
-                - Amount: ${request.amount}
-                - Description: {request.description}
-                - Created by: {request.created_by.email}
-                
-                Please review and approve or reject this request.
-                
-                Best regards,
-                Procure-to-Pay System
-                """
-                
-                send_mail(
-                    subject,
-                    message,
-                    settings.DEFAULT_FROM_EMAIL,
-                    [approver.email],
-                    fail_silently=False,
-                )
-                logger.info(f"Approval notification sent to {approver.email}")
-        
-        elif notification_type == 'approved':
-            # Notify requester
-            subject = f"Purchase Request Approved - {request.title}"
-            message = f"""
-            Hello {request.created_by.first_name or request.created_by.email},
-            
-            Your purchase request has been approved!
-            
-            Request Details:
-            - Title: {request.title}
-            - Amount: ${request.amount}
-            - Status: Approved
-            
-            A purchase order has been generated automatically.
-            
-            Best regards,
-            Procure-to-Pay System
-            """
-            
-            send_mail(
-                subject,
-                message,
-                settings.DEFAULT_FROM_EMAIL,
-                [request.created_by.email],
-                fail_silently=False,
-            )
-            logger.info(f"Approval notification sent to {request.created_by.email}")
-        
-        elif notification_type == 'rejected':
-            # Notify requester
-            approver = None
-            if approver_id:
-                try:
-                    approver = User.objects.get(id=approver_id)
-                except User.DoesNotExist:
-                    pass
-            
-            approver_name = approver.email if approver else "an approver"
-            
-            subject = f"Purchase Request Rejected - {request.title}"
-            message = f"""
-            Hello {request.created_by.first_name or request.created_by.email},
-            
-            Your purchase request has been rejected by {approver_name}.
-            
-            Request Details:
-            - Title: {request.title}
-            - Amount: ${request.amount}
-            - Status: Rejected
-            
-            Please review the rejection comments and resubmit if needed.
-            
-            Best regards,
-            Procure-to-Pay System
-            """
-            
-            send_mail(
-                subject,
-                message,
-                settings.DEFAULT_FROM_EMAIL,
-                [request.created_by.email],
-                fail_silently=False,
-            )
-            logger.info(f"Rejection notification sent to {request.created_by.email}")
-        
-    except Exception as e:
-        logger.error(f"Error sending notification for request {request_id}: {str(e)}")
-        raise
+    Send each recipient one email listing their queued notifications
+
+    Run periodically by celery beat (NOTIFICATION_DIGEST_INTERVAL).
+    Approval reminders for requests that have since moved on are dropped.
+    Queued notifications of a recipient whose digest fails stay queued
+    for the next run. Rows are locked while sending, so overlapping runs
+    skip them instead of sending them twice.
+
+    Returns:
+        {'sent': [email, ...], 'failed': {email: error}, 'notifications': count}
+    """
+    with transaction.atomic():
+        pending = list(
+            PendingNotification.objects
+            .select_for_update(skip_locked=True, of=('self',))
+            .select_related('recipient', 'request__created_by')
+        )
+
+        stale = [notification.id for notification in pending if not is_current(notification)]
+        PendingNotification.objects.filter(id__in=stale).delete()
+
+        by_recipient = {}
+        for notification in pending:
+            if notification.id not in stale:
+                by_recipient.setdefault(notification.recipient, []).append(notification)
+
+        messages = [
+            render_email('digest', recipient, {
+                'notifications': [
+                    {'type': notification.notification_type, 'request': notification.request, **notification.context}
+                    for notification in notifications
+                ]
+            })
+            for recipient, notifications in by_recipient.items()
+        ]
+        report = send_batch(messages)
+
+        delivered = set(report['sent'])
+        PendingNotification.objects.filter(
+            id__in=[notification.id for recipient, notifications in by_recipient.items()
+                    if recipient.email in delivered for notification in notifications]
+        ).delete()
+
+    report['notifications'] = sum(
+        len(notifications) for recipient, notifications in by_recipient.items() if recipient.email in delivered
+    )
+    logger.info(
+        f"Notification digests: {report['notifications']} notifications in {len(report['sent'])} emails, "
+        f"{len(report['failed'])} failed, {len(stale)} stale dropped"
+    )
+    return report
+
 
+def is_current(notification: PendingNotification) -> bool:
+    """Whether a queued notification is still worth sending"""
+    if notification.notification_type != 'pending_next_level':
+        return True
+    request = notification.request
+    return (
+        request.status == PurchaseRequest.Status.PENDING
+        and request.current_approval_level + 1 == notification.context.get('level')
+    )
@@ -1,3 +1,198 @@
-from django.test import TestCase
+"""Tests for approval notification emails"""
+from smtplib import SMTPRecipientsRefused
+from unittest.mock import patch
+from django.core import mail
+from django.core.mail import get_connection
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import TestCase, override_settings
+from documents.models import FailedTask
+from documents.resilience import RetryableError
+from purchase_requests.models import PurchaseRequest
+from purchase_requests.tests.factories import PurchaseRequestFactory
+from users.models import User
+from users.tests.factories import OrganizationFactory, UserFactory
+from .emails import send_batch
+from .models import PendingNotification
+from .tasks import send_approval_notification_task, send_notification_digests_task
 
-# Create your tests here.
+REFUSED = set()
+
+
+class RefusingBackend(EmailBackend):
+    """locmem backend whose server refuses the addresses in REFUSED"""
+
+    def send_messages(self, messages):
+        for message in messages:
+            refused = {address: (550, b'Mailbox unavailable') for address in message.to if address in REFUSED}
+            if refused:
+                raise SMTPRecipientsRefused(refused)
+        return super().send_messages(messages)
+
+
+class ApprovalNotificationTest(TestCase):
+    """Test send_approval_notification_task"""
+
+    def setUp(self):
+        self.organization = OrganizationFactory.create()
+        self.request = PurchaseRequestFactory.create(organization=self.organization, title='Chairs & desks')
+        self.approvers = [
+            UserFactory.create_approver(organization=self.organization, approval_level=1) for _ in range(3)
+        ]
+        UserFactory.create_approver(organization=self.organization, approval_level=2)
+        self.addCleanup(REFUSED.clear)
+
+    def test_approvers_are_sent_to_over_one_connection(self):
+        with patch('notifications.emails.get_connection', wraps=get_connection) as mock_connection:
+            report = send_approval_notification_task(str(self.request.id), 'pending_next_level')
+
+        mock_connection.assert_called_once()
+        self.assertEqual(sorted(report['sent']), sorted(approver.email for approver in self.approvers))
+        self.assertEqual(report['failed'], {})
+        self.assertEqual(len(mail.outbox), 3)
+        messages = {message.to[0]: message for message in mail.outbox}
+        for approver in self.approvers:
+            message = messages[approver.email]
+            self.assertEqual(message.subject, 'Purchase Request Pending Approval - Chairs & desks')
+            self.assertIn(f'Hello {approver.first_name},', message.body)
+            self.assertIn('at level 1', message.body)
+            html, mimetype = message.alternatives[0]
+            self.assertEqual(mimetype, 'text/html')
+            self.assertIn('Chairs &amp; desks', html)
+
+    @override_settings(EMAIL_BACKEND='notifications.tests.RefusingBackend')
+    def test_refused_recipient_does_not_stop_the_batch(self):
+        REFUSED.add(self.approvers[1].email)
+
+        report = send_approval_notification_task(str(self.request.id), 'pending_next_level')
+
+        self.assertEqual(len(report['sent']), 2)
+        self.assertEqual(list(report['failed']), [self.approvers[1].email])
+        self.assertIn('Mailbox unavailable', report['failed'][self.approvers[1].email])
+
+    @override_settings(EMAIL_BACKEND='notifications.tests.RefusingBackend', TASK_RETRY_MAX=1)
+    def test_nothing_delivered_is_retried(self):
+        REFUSED.add(self.request.created_by.email)
+
+        with self.assertRaises(RetryableError):
+            send_approval_notification_task.delay(str(self.request.id), 'rejected', str(self.approvers[0].id))
+
+        self.assertEqual(FailedTask.objects.get().retries, 1)
+
+    def test_rejection_names_the_approver(self):
+        send_approval_notification_task(str(self.request.id), 'rejected', str(self.approvers[0].id))
+
+        [message] = mail.outbox
+        self.assertEqual(message.to, [self.request.created_by.email])
+        self.assertIn(f'rejected by {self.approvers[0].email}', message.body)
+
+    def test_disabled_organization_gets_nothing(self):
+        self.organization.set_setting('email_notifications_enabled', False)
+
+        self.assertIsNone(send_approval_notification_task(str(self.request.id), 'approved'))
+        self.assertEqual(mail.outbox, [])
+
+
+class DigestTest(TestCase):
+    """Test digest delivery and send_notification_digests_task"""
+
+    def setUp(self):
+        self.organization = OrganizationFactory.create()
+        self.requester = UserFactory.create_staff(
+            organization=self.organization, notification_delivery=User.NotificationDelivery.DIGEST
+        )
+        self.approvers = [
+            UserFactory.create_approver(
+                organization=self.organization, approval_level=1,
+                notification_delivery=User.NotificationDelivery.DIGEST
+            )
+            for _ in range(3)
+        ]
+        self.addCleanup(REFUSED.clear)
+
+    def create_request(self, **kwargs):
+        return PurchaseRequestFactory.create(organization=self.organization, created_by=self.requester, **kwargs)
+
+    def test_digest_recipients_are_queued(self):
+        immediate = UserFactory.create_approver(organization=self.organization, approval_level=1)
+        request = self.create_request()
+
+        report = send_approval_notification_task(str(request.id), 'pending_next_level')
+
+        self.assertEqual(report['sent'], [immediate.email])
+        self.assertEqual(sorted(report['queued']), sorted(approver.email for approver in self.approvers))
+        self.assertEqual([message.to for message in mail.outbox], [[immediate.email]])
+        self.assertEqual(PendingNotification.objects.filter(request=request).count(), 3)
+        self.assertEqual(PendingNotification.objects.first().context, {'level': 1})
+
+    @override_settings(TASK_RETRY_MAX=2)
+    def test_retry_does_not_queue_twice(self):
+        """Test that digest rows are written once when the immediate sends fail and are retried"""
+        immediate = UserFactory.create_approver(organization=self.organization, approval_level=1)
+        request = self.create_request()
+        attempts = []
+
+        def fail_first(messages):
+            attempts.append(len(messages))
+            if len(attempts) < 3:
+                return {'sent': [], 'failed': {immediate.email: 'Connection unexpectedly closed'}}
+            return send_batch(messages)
+
+        with patch('notifications.tasks.send_batch', side_effect=fail_first):
+            report = send_approval_notification_task.delay(str(request.id), 'pending_next_level').get()
+
+        self.assertEqual(attempts, [1, 1, 1])
+        self.assertEqual(report['sent'], [immediate.email])
+        self.assertEqual(PendingNotification.objects.filter(request=request).count(), 3)
+
+    def test_busy_day_sends_one_email_per_recipient(self):
+        requests = [self.create_request(title=f'Request {number}') for number in range(10)]
+        for request in requests:
+            send_approval_notification_task(str(request.id), 'pending_next_level')
+        send_approval_notification_task(str(requests[0].id), 'approved')
+        self.assertEqual(mail.outbox, [])
+
+        report = send_notification_digests_task()
+
+        self.assertEqual(report['notifications'], 31)
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertFalse(PendingNotification.objects.exists())
+        digest = next(message for message in mail.outbox if message.to == [self.approvers[0].email])
+        self.assertEqual(digest.subject, 'Purchase Request Digest - 10 updates')
+        self.assertEqual(digest.body.count('Awaiting your approval at level 1'), 10)
+        self.assertIn('Request 9', digest.alternatives[0][0])
+        digest = next(message for message in mail.outbox if message.to == [self.requester.email])
+        self.assertEqual(digest.subject, 'Purchase Request Digest - 1 update')
+        self.assertIn('Approved: Request 0', digest.body)
+
+    def test_rejection_is_sent_immediately(self):
+        request = self.create_request()
+
+        report = send_approval_notification_task(str(request.id), 'rejected', str(self.approvers[0].id))
+
+        self.assertEqual(report['sent'], [self.requester.email])
+        self.assertEqual(report['queued'], [])
+        self.assertFalse(PendingNotification.objects.exists())
+
+    def test_request_that_moved_on_is_dropped(self):
+        request = self.create_request()
+        send_approval_notification_task(str(request.id), 'pending_next_level')
+        PurchaseRequest.objects.filter(id=request.id).update(status=PurchaseRequest.Status.REJECTED)
+
+        report = send_notification_digests_task()
+
+        self.assertEqual(report['sent'], [])
+        self.assertEqual(mail.outbox, [])
+        self.assertFalse(PendingNotification.objects.exists())
+
+    @override_settings(EMAIL_BACKEND='notifications.tests.RefusingBackend')
+    def test_failed_digest_stays_queued(self):
+        REFUSED.add(self.approvers[0].email)
+        send_approval_notification_task(str(self.create_request().id), 'pending_next_level')
+
+        report = send_notification_digests_task()
+
+        self.assertEqual(len(report['sent']), 2)
+        self.assertEqual(list(report['failed']), [self.approvers[0].email])
+        self.assertEqual(
+            list(PendingNotification.objects.values_list('recipient', flat=True)), [self.approvers[0].id]
+        )
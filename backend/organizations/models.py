@@ -1,6 +1,28 @@
 from django.db import models
 from django.utils.text import slugify
 
+# Relative tolerances for receipt/PO/request matching; differences at or
+# below `absolute` are always treated as rounding
+DEFAULT_MATCH_TOLERANCES = {
+    'quantity': 0.0,
+    'unit_price': 0.05,
+    'line_total': 0.05,
+    'total_amount': 0.05,
+    'absolute': 0.01,
+}
+
+# Purchase order branding; any key can be overridden under settings['po_branding']
+DEFAULT_PO_BRANDING = {
+    'company_name': '',
+    'address': '',
+    'logo_url': '',
+    'terms': '',
+    'font': 'Helvetica',
+    'primary_color': '#1a1a1a',
+    'header_color': '#808080',
+    'stripe_color': '#f5f5dc',
+}
+
 
 class Organization(models.Model):
     """Organization model for multi-tenancy"""
@@ -47,3 +69,26 @@ class Organization(models.Model):
     def email_notifications_enabled(self):
         """Check if email notifications are enabled"""
         return self.get_setting('email_notifications_enabled', True)
+
+    @property
+    def match_tolerances(self):
+        """Get matching tolerances, with per-key overrides from settings"""
+        overrides = self.get_setting('match_tolerances') or {}
+        return {
+            key: float(overrides.get(key, default))
+            for key, default in DEFAULT_MATCH_TOLERANCES.items()
+        }
+
+    @property
+    def po_number_prefix(self):
+        """Prefix of sequential PO numbers, e.g. 'PO' for PO-000042"""
+        return self.get_setting('po_number_prefix') or 'PO'
+
+    @property
+    def po_branding(self):
+        """Get purchase order branding, with per-key overrides from settings"""
+        overrides = self.get_setting('po_branding') or {}
+        return {
+            key: str(overrides.get(key) or default)
+            for key, default in DEFAULT_PO_BRANDING.items()
+        }
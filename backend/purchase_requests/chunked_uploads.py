@@ -0,0 +1,299 @@
+"""
+Resumable chunked uploads
+
+For files too large to send in one multipart request (multi-page scanned
+proformas), or over connections that drop:
+
+    POST   /api/upload-sessions/                 declare name, type, size, sha256
+    PUT    /api/upload-sessions/<id>/            one chunk, Content-Range: bytes a-b/size
+    GET    /api/upload-sessions/<id>/            resume offset after a dropped connection
+    POST   /api/upload-sessions/<id>/complete/   assemble, verify, store
+    DELETE /api/upload-sessions/<id>/            abort
+
+Chunks are written in order straight into a part file under
+UPLOAD_SPOOL_DIR, streamed from the request body (never parsed or
+buffered as multipart); a chunk that does not start at the session's
+offset is refused with the offset to resume from. Completing checks the
+assembled size and SHA-256 against what was declared, applies the
+multipart content checks (magic bytes, page count, pixels), puts the
+file in storage and returns a direct upload token, so the file is
+recorded with `proforma_upload` / `receipt_upload` like any other direct
+upload.
+"""
+import hashlib
+import logging
+import os
+import re
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+from documents.images import put_document
+from .direct_uploads import new_public_id, upload_token
+from .models import UploadSession
+from .utils import validate_file_contents, validate_file_type
+
+logger = logging.getLogger(__name__)
+
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+COPY_BUFFER = 64 * 1024
+
+
+class ChunkedUploadError(Exception):
+    """A chunk or completion the session cannot accept"""
+    status_code = 400
+
+    def __init__(self, message: str, offset: int = None):
+        super().__init__(message)
+        self.offset = offset
+
+
+class ChunkedUploadConflict(ChunkedUploadError):
+    """The session is not in a state to accept the call (wrong offset, incomplete, closed)"""
+    status_code = 409
+
+
+def session_path(session: UploadSession) -> str:
+    """Absolute path of a session's part file"""
+    return os.path.join(settings.UPLOAD_SPOOL_DIR, 'sessions', f'{session.id}.part')
+
+
+def remove_part_file(session: UploadSession):
+    """Delete a session's part file; missing files are ignored"""
+    try:
+        os.remove(session_path(session))
+    except FileNotFoundError:
+        pass
+
+
+def start_session(user, document_type: str, filename: str, content_type: str,
+                  size: int, checksum: str) -> UploadSession:
+    """
+    Open an upload session (metadata validated by UploadSessionCreateSerializer)
+
+    Args:
+        user: User who uploads (and later records) the file
+        document_type: PROFORMA or RECEIPT
+        filename: Original file name
+        content_type: Declared MIME type
+        size: Total size in bytes
+        checksum: Hex SHA-256 of the whole file
+
+    Returns:
+        The OPEN session
+    """
+    session = UploadSession.objects.create(
+        organization_id=user.organization_id,
+        user=user,
+        document_type=document_type,
+        filename=os.path.basename(filename)[:255],
+        content_type=content_type,
+        size=size,
+        checksum=checksum.lower(),
+        public_id=new_public_id(user, document_type),
+    )
+    path = session_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    logger.info(f"Opened upload session {session.id} for {session.filename} ({size} bytes)")
+    return session
+
+
+def parse_content_range(header: str):
+    """'bytes 0-99/1000' -> (0, 99, 1000)"""
+    match = CONTENT_RANGE.match(header or '')
+    if not match:
+        raise ChunkedUploadError("Content-Range must be 'bytes <first>-<last>/<size>'.")
+    first, last, total = (int(value) for value in match.groups())
+    if last < first:
+        raise ChunkedUploadError('Content-Range is empty.')
+    return first, last, total
+
+
+def open_session(session_id, user) -> UploadSession:
+    """Lock the user's session for the rest of the transaction"""
+    session = UploadSession.objects.select_for_update().filter(id=session_id, user=user).first()
+    if session is None:
+        raise UploadSession.DoesNotExist
+    if session.status != UploadSession.Status.OPEN:
+        raise ChunkedUploadConflict(f'Upload session is {session.status.lower()}.')
+    if session.updated_at < timezone.now() - timedelta(seconds=settings.CHUNKED_UPLOAD_TTL):
+        raise ChunkedUploadConflict('Upload session has expired.')
+    return session
+
+
+def write_chunk(session_id, user, content_range: str, content_length: int, stream) -> UploadSession:
+    """
+    Append one chunk to a session
+
+    Args:
+        session_id: Session ID
+        user: Requesting user (sessions are private to their user)
+        content_range: Content-Range header of the chunk
+        content_length: Content-Length of the request
+        stream: Request body, read COPY_BUFFER bytes at a time
+
+    Returns:
+        The session, with `received` advanced past the chunk
+
+    Raises:
+        UploadSession.DoesNotExist: Not the user's session
+        ChunkedUploadConflict: Chunk does not start at the resume offset,
+            or the session is closed (carries the resume offset)
+        ChunkedUploadError: Malformed range, or body shorter than declared
+    """
+    first, last, total = parse_content_range(content_range)
+    length = last - first + 1
+    if length != content_length:
+        raise ChunkedUploadError('Content-Range does not match Content-Length.')
+    if length > settings.CHUNKED_UPLOAD_CHUNK_SIZE:
+        raise ChunkedUploadError(f'Chunks are limited to {settings.CHUNKED_UPLOAD_CHUNK_SIZE} bytes.')
+
+    with transaction.atomic():
+        session = open_session(session_id, user)
+        if total != session.size or last >= session.size:
+            raise ChunkedUploadError(f'Content-Range is outside the {session.size} byte file.')
+        if first != session.received:
+            raise ChunkedUploadConflict(
+                f'Chunk starts at {first}, expected {session.received}.', offset=session.received
+            )
+
+        written = 0
+        with open(session_path(session), 'r+b') as part:
+            # Anything past the offset is left over from a chunk that was never acknowledged
+            part.seek(first)
+            while written < length:
+                data = stream.read(min(COPY_BUFFER, length - written))
+                if not data:
+                    break
+                part.write(data)
+                written += len(data)
+            part.truncate()
+        if written < length:
+            raise ChunkedUploadError(
+                f'Chunk ended after {written} of {length} bytes.', offset=session.received
+            )
+
+        session.received = last + 1
+        session.save(update_fields=['received', 'updated_at'])
+    return session
+
+
+def complete_session(session_id, user) -> dict:
+    """
+    Verify the assembled file and put it in storage
+
+    A file whose hash does not match the declared checksum, or that fails
+    the multipart upload content checks, fails the session (its part file
+    is removed; the upload has to start over).
+
+    Only the checks run with the session row locked; the session is then
+    marked STORING and the file is put in storage after commit, since that
+    can wait on the rate limiter and the storage provider. A storage error
+    reopens the session so completing can be retried without re-sending
+    the chunks.
+
+    Returns:
+        {'token', 'public_id', 'session'} to record as a direct upload
+
+    Raises:
+        UploadSession.DoesNotExist: Not the user's session
+        ChunkedUploadConflict: Chunks missing or session closed
+        ChunkedUploadError: Checksum mismatch or file rejected
+    """
+    with transaction.atomic():
+        session = open_session(session_id, user)
+        if session.received != session.size:
+            raise ChunkedUploadConflict(
+                f'Received {session.received} of {session.size} bytes.', offset=session.received
+            )
+
+        path = session_path(session)
+        digest = hashlib.sha256()
+        with open(path, 'rb') as part:
+            for block in iter(lambda: part.read(COPY_BUFFER), b''):
+                digest.update(block)
+            error = check_assembled_file(session, part, digest.hexdigest())
+
+        if error:
+            session.status = UploadSession.Status.FAILED
+            session.error = error
+        else:
+            session.status = UploadSession.Status.STORING
+        session.save(update_fields=['status', 'error', 'updated_at'])
+
+    if error:
+        remove_part_file(session)
+        logger.warning(f"Upload session {session.id} failed: {error}")
+        raise ChunkedUploadError(error)
+
+    storing = UploadSession.objects.filter(id=session.id, status=UploadSession.Status.STORING)
+    try:
+        extension = os.path.splitext(session.filename)[1].lower()
+        with open(path, 'rb') as part:
+            file_url = put_document(
+                part, f'{session.public_id}{extension}', organization_id=str(session.organization_id)
+            )
+    except Exception as e:
+        storing.update(status=UploadSession.Status.OPEN, error=str(e)[:2000], updated_at=timezone.now())
+        logger.warning(f"Upload session {session.id} could not be stored: {str(e)}")
+        raise
+
+    session.file_url = file_url
+    session.status = UploadSession.Status.COMPLETE
+    session.completed_at = timezone.now()
+    storing.update(
+        status=session.status, error='', file_url=file_url,
+        completed_at=session.completed_at, updated_at=session.completed_at
+    )
+    remove_part_file(session)
+    logger.info(f"Completed upload session {session.id}: {session.file_url}")
+    return {
+        'token': upload_token(user, session.document_type, session.public_id),
+        'public_id': session.public_id,
+        'session': str(session.id),
+    }
+
+
+def check_assembled_file(session: UploadSession, part, checksum: str) -> Optional[str]:
+    """Why the assembled file cannot be stored, or None"""
+    if checksum != session.checksum:
+        return 'Assembled file does not match the declared SHA-256; upload it again.'
+    file = File(part, name=session.filename)
+    file.content_type = session.content_type
+    for is_valid, error in (validate_file_type(file), validate_file_contents(file)):
+        if not is_valid:
+            return error
+    return None
+
+
+def abort_session(session_id, user):
+    """Delete a session and its part file"""
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().filter(id=session_id, user=user).first()
+        if session is None:
+            raise UploadSession.DoesNotExist
+        session.delete()
+    remove_part_file(session)
+
+
+def purge_expired_sessions() -> int:
+    """
+    Remove sessions idle for CHUNKED_UPLOAD_TTL and their part files
+
+    Completed sessions go too: their files are in storage and their
+    tokens have long expired.
+
+    Returns:
+        Number of sessions removed
+    """
+    cutoff = timezone.now() - timedelta(seconds=max(settings.CHUNKED_UPLOAD_TTL, settings.DIRECT_UPLOAD_TTL))
+    expired = list(UploadSession.objects.filter(updated_at__lt=cutoff))
+    for session in expired:
+        remove_part_file(session)
+    UploadSession.objects.filter(id__in=[session.id for session in expired]).delete()
+    return len(expired)
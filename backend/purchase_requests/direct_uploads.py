@@ -0,0 +1,377 @@
+"""
+Signed direct-to-storage uploads
+
+The API never proxies the file bytes: the client asks POST /api/uploads/
+for short-lived upload parameters, sends the file straight to object
+storage with them, and then hands the storage response back with the
+request it creates or updates. The backend only checks that the response
+is signed by the storage provider and belongs to the upload it issued,
+and records the URL.
+
+The upload token (django.core.signing) pins the organization, user,
+document type and public ID chosen by the server, so an asset can only
+be recorded by the user it was issued to, for the kind of document it
+was issued for. Both the token and the provider upload signature expire
+after DIRECT_UPLOAD_TTL seconds.
+
+Backends (DIRECT_UPLOAD_BACKEND):
+    cloudinary: signed Cloudinary upload API requests; the response is
+        verified with the account's API secret, and the stored asset's
+        size, pages and pixels are read back from the Admin API, since
+        the file never passes through the multipart upload checks
+    local: stand-in upload endpoint that puts files in the configured
+        storage (documents.storage) and signs its responses with
+        SECRET_KEY, for tests and offline development
+
+Large files can instead be sent to the API in resumable chunks
+(chunked_uploads); a completed session is recorded with the same token.
+"""
+import logging
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Any, Dict
+
+import cloudinary
+import cloudinary.api
+import cloudinary.exceptions
+import cloudinary.uploader
+import cloudinary.utils
+from django.conf import settings
+from django.core import signing
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from documents.resilience import get_circuit_breaker
+from documents.storage import get_storage
+from .models import Document, UploadSession
+from .utils import validate_file_contents, validate_file_size, validate_file_type
+
+logger = logging.getLogger(__name__)
+
+TOKEN_SALT = 'purchase_requests.direct_upload'
+ALLOWED_FORMATS = ('pdf', 'jpg', 'jpeg', 'png', 'webp')
+MAX_UPLOAD_MB = 10
+FOLDERS = {
+    Document.DocumentType.PROFORMA: 'proformas',
+    Document.DocumentType.RECEIPT: 'receipts',
+}
+
+
+class DirectUploadError(Exception):
+    """An upload token or storage response that cannot be recorded"""
+
+
+class DirectUploadBackend:
+    """Base class for direct upload backends"""
+
+    def sign(self, public_id: str, http_request) -> Dict[str, Any]:
+        """
+        Upload parameters for one asset
+
+        Returns:
+            {'upload_url': str, 'fields': dict} - the client POSTs the
+            fields plus `file` as multipart/form-data to upload_url
+        """
+        raise NotImplementedError
+
+    def verify(self, asset: Dict[str, Any], http_request) -> str:
+        """
+        Check a storage response returned by the client
+
+        Returns:
+            URL of the stored file
+
+        Raises:
+            DirectUploadError: The response is not signed by the storage
+        """
+        raise NotImplementedError
+
+
+class CloudinaryDirectUploadBackend(DirectUploadBackend):
+    """Signed uploads to the Cloudinary upload API"""
+
+    def sign(self, public_id: str, http_request) -> Dict[str, Any]:
+        config = cloudinary.config()
+        params = {
+            'public_id': public_id,
+            'timestamp': int(time.time()),
+            # Enforced by Cloudinary, since the file never passes through the API
+            'allowed_formats': ','.join(ALLOWED_FORMATS),
+        }
+        params['signature'] = cloudinary.utils.api_sign_request(
+            params, config.api_secret, config.signature_algorithm
+        )
+        params['api_key'] = config.api_key
+        return {
+            'upload_url': cloudinary.utils.cloudinary_api_url('upload', resource_type='auto'),
+            'fields': params,
+        }
+
+    def verify(self, asset: Dict[str, Any], http_request) -> str:
+        if not cloudinary.utils.verify_api_response_signature(
+            asset['public_id'], asset['version'], asset['signature']
+        ):
+            raise DirectUploadError('Upload signature is invalid.')
+
+        # Only public_id and version are signed, so everything else is read
+        # back from Cloudinary rather than taken from the client. Uploads are
+        # signed for resource_type auto, which stores PDFs and images as
+        # 'image' assets that Cloudinary has parsed.
+        resource = self._resource(asset['public_id'])
+        if str(resource.get('version')) != str(asset['version']):
+            raise DirectUploadError('Uploaded file does not match the upload token.')
+        try:
+            check_stored_asset(resource)
+        except DirectUploadError:
+            self._discard(asset['public_id'])
+            raise
+
+        url, _ = cloudinary.utils.cloudinary_url(
+            asset['public_id'],
+            resource_type='image',
+            type='upload',
+            version=resource['version'],
+            format=resource['format'],
+            secure=True,
+        )
+        return url
+
+    @staticmethod
+    def _resource(public_id: str) -> Dict[str, Any]:
+        """Admin API metadata of an uploaded asset, including its page count"""
+        with get_circuit_breaker('cloudinary').guard():
+            try:
+                return cloudinary.api.resource(public_id, resource_type='image', type='upload', pages=True)
+            except cloudinary.exceptions.NotFound:
+                pass
+        raise DirectUploadError('Uploaded file not found.')
+
+    @staticmethod
+    def _discard(public_id: str):
+        """Delete a rejected asset; failing to is only logged"""
+        try:
+            with get_circuit_breaker('cloudinary').guard():
+                cloudinary.uploader.destroy(public_id, resource_type='image', invalidate=True)
+        except Exception as e:
+            logger.warning(f"Could not delete rejected direct upload {public_id}: {str(e)}")
+
+
+class LocalDirectUploadBackend(DirectUploadBackend):
+    """
+    Stand-in for a storage upload API, on top of the configured storage
+
+    Mirrors the Cloudinary flow: the client POSTs the signed fields and
+    the file to the local upload endpoint, which puts the file in storage
+    (STORAGE_BACKEND=local keeps everything offline) and answers with a
+    response signed the same way the stored assets are verified.
+    """
+
+    @staticmethod
+    def _signature(*values) -> str:
+        return salted_hmac(TOKEN_SALT, ':'.join(str(value) for value in values)).hexdigest()
+
+    def sign(self, public_id: str, http_request) -> Dict[str, Any]:
+        timestamp = int(time.time())
+        return {
+            'upload_url': http_request.build_absolute_uri(reverse('direct-upload-local')),
+            'fields': {
+                'public_id': public_id,
+                'timestamp': timestamp,
+                'signature': self._signature(public_id, timestamp),
+            },
+        }
+
+    def receive(self, fields: Dict[str, Any], file) -> Dict[str, Any]:
+        """
+        Store an upload sent to the local endpoint
+
+        Returns:
+            Cloudinary-style response for the client to hand back
+
+        Raises:
+            DirectUploadError: Bad signature, expired parameters or file
+        """
+        public_id, timestamp = fields.get('public_id', ''), fields.get('timestamp', '')
+        if not constant_time_compare(fields.get('signature', ''), self._signature(public_id, timestamp)):
+            raise DirectUploadError('Upload signature is invalid.')
+        if time.time() - int(timestamp) > settings.DIRECT_UPLOAD_TTL:
+            raise DirectUploadError('Upload parameters have expired.')
+        for is_valid, error in (validate_file_type(file), validate_file_size(file, max_size_mb=MAX_UPLOAD_MB),
+                                validate_file_contents(file)):
+            if not is_valid:
+                raise DirectUploadError(error)
+
+        file_format = file.name.rsplit('.', 1)[-1].lower()
+        file_url = get_storage().put(file, f'{public_id}.{file_format}')
+        version = int(time.time())
+        return {
+            'public_id': public_id,
+            'version': version,
+            'signature': self._signature(public_id, version),
+            'resource_type': 'raw',
+            'format': file_format,
+            'bytes': file.size,
+            'secure_url': file_url,
+        }
+
+    def verify(self, asset: Dict[str, Any], http_request) -> str:
+        if not constant_time_compare(
+            str(asset['signature']), self._signature(asset['public_id'], asset['version'])
+        ):
+            raise DirectUploadError('Upload signature is invalid.')
+        storage = get_storage()
+        name = f"{asset['public_id']}.{asset.get('format', '')}"
+        if not storage.exists(name):
+            raise DirectUploadError('Uploaded file not found.')
+        return storage.url(name)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_direct_upload_backend() -> DirectUploadBackend:
+    """Return the configured direct upload backend (one per process)"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if settings.DIRECT_UPLOAD_BACKEND == 'local':
+                    _backend = LocalDirectUploadBackend()
+                else:
+                    _backend = CloudinaryDirectUploadBackend()
+    return _backend
+
+
+def check_stored_asset(resource: Dict[str, Any]):
+    """
+    Apply the multipart upload content checks to Cloudinary asset metadata
+
+    The format is the one Cloudinary detected from the content; size,
+    page count and pixels are held to the same limits as validate_file_size
+    and validate_file_contents.
+
+    Raises:
+        DirectUploadError: Format, size, pages or pixels not allowed
+    """
+    file_format = (resource.get('format') or '').lower()
+    if file_format not in ALLOWED_FORMATS:
+        raise DirectUploadError(f"File format {file_format or 'unknown'} not allowed.")
+    is_valid, error = validate_file_size(SimpleNamespace(size=resource.get('bytes') or 0), max_size_mb=MAX_UPLOAD_MB)
+    if not is_valid:
+        raise DirectUploadError(error)
+
+    pages = resource.get('pages')
+    if file_format == 'pdf':
+        if not pages:
+            raise DirectUploadError('PDF could not be read; it may be damaged or password-protected')
+        if pages > settings.UPLOAD_MAX_PDF_PAGES:
+            raise DirectUploadError(
+                f"PDF has {pages} pages; at most {settings.UPLOAD_MAX_PDF_PAGES} are allowed"
+            )
+    else:
+        pixels = (resource.get('width') or 0) * (resource.get('height') or 0) * (pages or 1)
+        if not pixels:
+            raise DirectUploadError('Image could not be read')
+        if pixels > settings.UPLOAD_MAX_IMAGE_PIXELS:
+            raise DirectUploadError(
+                f"Image is too large; at most {settings.UPLOAD_MAX_IMAGE_PIXELS // 1_000_000} megapixels are allowed"
+            )
+
+
+def validate_upload_metadata(filename: str, content_type: str, size: int, max_size_mb: int = MAX_UPLOAD_MB):
+    """
+    Apply the multipart upload checks to what the client says it will upload
+
+    Raises:
+        DirectUploadError: Type or size not allowed
+    """
+    file = SimpleNamespace(name=filename, content_type=content_type, size=size)
+    for is_valid, error in (validate_file_type(file), validate_file_size(file, max_size_mb=max_size_mb)):
+        if not is_valid:
+            raise DirectUploadError(error)
+
+
+def new_public_id(user, document_type: str) -> str:
+    """Storage public ID for a new upload by `user` (no extension)"""
+    return f'procure-to-pay/{user.organization_id}/{FOLDERS[document_type]}/{uuid.uuid4().hex}'
+
+
+def upload_token(user, document_type: str, public_id: str) -> str:
+    """Token that lets `user` record the upload `public_id` as `document_type`"""
+    return signing.dumps({
+        'organization': str(user.organization_id),
+        'user': str(user.id),
+        'document_type': document_type,
+        'public_id': public_id,
+    }, salt=TOKEN_SALT)
+
+
+def issue_upload(http_request, document_type: str) -> Dict[str, Any]:
+    """
+    Upload parameters and token for one proforma or receipt
+
+    Args:
+        http_request: Request of the authenticated user who will upload
+        document_type: PROFORMA or RECEIPT
+
+    Returns:
+        {'token', 'upload_url', 'fields', 'expires_in'}
+    """
+    public_id = new_public_id(http_request.user, document_type)
+    return {
+        'token': upload_token(http_request.user, document_type, public_id),
+        **get_direct_upload_backend().sign(public_id, http_request),
+        'expires_in': settings.DIRECT_UPLOAD_TTL,
+    }
+
+
+def verify_upload(http_request, document_type: str, asset: Dict[str, Any]) -> str:
+    """
+    Check a direct upload before its URL is recorded
+
+    Args:
+        http_request: Request of the user recording the upload
+        document_type: What the upload is recorded as
+        asset: The token plus the storage response (public_id, version,
+            signature, resource_type, format), or the token, public_id
+            and completed chunked upload session
+
+    Returns:
+        URL of the stored file
+
+    Raises:
+        DirectUploadError: Expired or foreign token, a storage response
+            that is not for the issued upload, or a stored file that fails
+            the upload checks
+    """
+    try:
+        issued = signing.loads(asset['token'], salt=TOKEN_SALT, max_age=settings.DIRECT_UPLOAD_TTL)
+    except signing.SignatureExpired:
+        raise DirectUploadError('Upload token has expired.')
+    except signing.BadSignature:
+        raise DirectUploadError('Upload token is invalid.')
+
+    user = http_request.user
+    if issued['user'] != str(user.id) or issued['organization'] != str(user.organization_id):
+        raise DirectUploadError('Upload token was issued to another user.')
+    if issued['document_type'] != document_type:
+        raise DirectUploadError(f"Upload token was issued for a {issued['document_type'].lower()}.")
+    if asset['public_id'] != issued['public_id']:
+        raise DirectUploadError('Uploaded file does not match the upload token.')
+    if asset.get('format') and asset['format'].lower() not in ALLOWED_FORMATS:
+        raise DirectUploadError(f"File format {asset['format']} not allowed.")
+
+    if asset.get('session'):
+        # Assembled and checked by the API itself (chunked_uploads)
+        file_url = UploadSession.objects.filter(
+            id=asset['session'], public_id=issued['public_id'], status=UploadSession.Status.COMPLETE
+        ).values_list('file_url', flat=True).first()
+        if not file_url:
+            raise DirectUploadError('Upload session is not complete.')
+    else:
+        file_url = get_direct_upload_backend().verify(asset, http_request)
+    logger.info(f"Recorded direct upload {asset['public_id']} for user {user.id}")
+    return file_url
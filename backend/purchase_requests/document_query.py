@@ -0,0 +1,155 @@
+"""
+Whitelisted filter DSL over Document.extracted_data
+
+Query parameters of the form ``data.<field>[__<op>]=<value>`` are
+compiled into ORM filters, e.g.::
+
+    ?data.currency=EUR&data.total_amount__gte=500
+    ?data.payment_method__in=card,cash
+    ?data.items.description=A4 Paper
+
+Only the fields in FIELDS and the operators listed for each are accepted,
+so clients cannot reach arbitrary keys or lookups. On PostgreSQL equality
+and ``in`` become jsonb containment (``@>``), which the jsonb_path_ops GIN
+index on extracted_data serves; range and text lookups become key-path
+queries that run on the rows the containment clauses leave.
+"""
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, Tuple
+
+from django.db import connection
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+
+from .models import ExtractedLineItem
+
+PARAM_PREFIX = 'data.'
+MAX_CLAUSES = 10
+MAX_IN_VALUES = 50
+
+TEXT_OPS = ('eq', 'in', 'icontains')
+NUMBER_OPS = ('eq', 'in', 'gt', 'gte', 'lt', 'lte')
+
+
+@dataclass(frozen=True)
+class QueryField:
+    """A filterable extracted field"""
+    path: Tuple[str, ...]
+    kind: str
+    ops: Tuple[str, ...]
+    # Set for fields of the elements of the items array
+    in_items: bool = False
+
+
+FIELDS: Dict[str, QueryField] = {
+    'currency': QueryField(('currency',), 'text', TEXT_OPS),
+    'payment_method': QueryField(('payment_method',), 'text', TEXT_OPS),
+    'terms': QueryField(('terms',), 'text', TEXT_OPS),
+    'validity': QueryField(('validity',), 'text', TEXT_OPS),
+    # Extracted as written on the receipt ("15/03/2024", "March 3, 2024"), so
+    # range lookups would compare strings; no ranges until it is normalized
+    'date': QueryField(('date',), 'text', TEXT_OPS),
+    'vendor_name': QueryField(('vendor_name',), 'text', TEXT_OPS),
+    'seller_name': QueryField(('seller_name',), 'text', TEXT_OPS),
+    'total_amount': QueryField(('total_amount',), 'number', NUMBER_OPS),
+    'items.description': QueryField(('description',), 'text', ('eq',), in_items=True),
+}
+
+
+def _nest(path: Tuple[str, ...], value):
+    """{'a': {'b': value}} for path ('a', 'b')"""
+    for key in reversed(path):
+        value = {key: value}
+    return value
+
+
+def _coerce(name: str, field: QueryField, raw: str):
+    if field.kind == 'text':
+        return raw
+    try:
+        number = Decimal(raw)
+    except InvalidOperation:
+        raise ValidationError({f'{PARAM_PREFIX}{name}': f"'{raw}' is not a number."})
+    if not number.is_finite():
+        raise ValidationError({f'{PARAM_PREFIX}{name}': f"'{raw}' is not a number."})
+    # Extracted numbers are stored as JSON numbers; containment compares by type
+    return int(number) if number == number.to_integral_value() else float(number)
+
+
+def _equals(field: QueryField, value, containment: bool) -> Q:
+    if field.in_items:
+        if containment:
+            return Q(extracted_data__contains={'items': [_nest(field.path, value)]})
+        # Without containment, array members are reached through the line item projection
+        return Q(id__in=ExtractedLineItem.objects.filter(
+            **{'__'.join(field.path): value}
+        ).values('document_id'))
+    if containment:
+        return Q(extracted_data__contains=_nest(field.path, value))
+    return Q(**{'extracted_data__' + '__'.join(field.path): value})
+
+
+def compile_clause(name: str, op: str, raw: str, containment: bool) -> Q:
+    """
+    Compile one ``data.<name>__<op>=<raw>`` parameter
+
+    Args:
+        name: Whitelisted field name
+        op: Operator (eq when omitted)
+        raw: Raw query parameter value
+        containment: Compile equality to jsonb containment (PostgreSQL)
+
+    Returns:
+        Q object over Document
+    """
+    field = FIELDS.get(name)
+    if field is None:
+        raise ValidationError({
+            f'{PARAM_PREFIX}{name}': f'Unknown field. Allowed: {", ".join(sorted(FIELDS))}.'
+        })
+    if op not in field.ops:
+        raise ValidationError({
+            f'{PARAM_PREFIX}{name}': f"Unsupported operator '{op}'. Allowed: {', '.join(field.ops)}."
+        })
+
+    if op == 'eq':
+        return _equals(field, _coerce(name, field, raw), containment)
+    if op == 'in':
+        values = [v.strip() for v in raw.split(',') if v.strip()]
+        if not values or len(values) > MAX_IN_VALUES:
+            raise ValidationError({
+                f'{PARAM_PREFIX}{name}__in': f'Give between 1 and {MAX_IN_VALUES} comma-separated values.'
+            })
+        clause = Q()
+        for value in values:
+            clause |= _equals(field, _coerce(name, field, value), containment)
+        return clause
+    # Range and text lookups cannot use containment; they filter by key path
+    return Q(**{'extracted_data__' + '__'.join(field.path) + f'__{op}': _coerce(name, field, raw)})
+
+
+def compile_filters(params: Iterable[Tuple[str, str]], containment: bool = None) -> Q:
+    """
+    Compile every ``data.*`` query parameter into one Q (AND of clauses)
+
+    Args:
+        params: (key, value) pairs, e.g. request.query_params.items()
+        containment: Force containment compilation; defaults to PostgreSQL only,
+            as other backends do not support JSON containment
+
+    Returns:
+        Q object over Document (empty when there are no data.* parameters)
+    """
+    if containment is None:
+        containment = connection.vendor == 'postgresql'
+
+    clauses = [(key[len(PARAM_PREFIX):], value) for key, value in params if key.startswith(PARAM_PREFIX)]
+    if len(clauses) > MAX_CLAUSES:
+        raise ValidationError({'data': f'At most {MAX_CLAUSES} data filters are allowed.'})
+
+    query = Q()
+    for key, value in clauses:
+        name, _, op = key.partition('__')
+        query &= compile_clause(name, op or 'eq', value, containment)
+    return query
@@ -0,0 +1,53 @@
+"""
+Build the ExtractedLineItem projection for existing documents
+
+Document.save keeps the projection in sync from now on; this fills it in
+for documents written before it existed (or rebuilds it with --rebuild).
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from purchase_requests.models import Document, ExtractedLineItem
+
+
+class Command(BaseCommand):
+    help = 'Project Document.extracted_data items into the ExtractedLineItem table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organization', help='Only backfill documents of this organization ID')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Documents per chunk')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Rebuild documents that already have line items')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        queryset = Document.objects.select_related('request').only(
+            'id', 'request__organization_id', 'vendor_id', 'document_type', 'extracted_data', 'created_at'
+        )
+        if not options['rebuild']:
+            queryset = queryset.filter(line_items__isnull=True)
+        if options['organization']:
+            queryset = queryset.filter(request__organization_id=options['organization'])
+
+        documents_done = rows = 0
+        last_id = 0
+        while True:
+            # Keyset pagination; unprojected documents leave the filter as we go
+            chunk = list(queryset.filter(id__gt=last_id).order_by('id')[:options['chunk_size']])
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+
+            line_items = []
+            for document in chunk:
+                line_items.extend(document.build_line_items(document.request.organization_id))
+            with transaction.atomic():
+                ExtractedLineItem.objects.filter(document__in=chunk).delete()
+                ExtractedLineItem.objects.bulk_create(line_items, batch_size=1000)
+
+            documents_done += len(chunk)
+            rows += len(line_items)
+            self.stderr.write(f"{documents_done} documents, {rows} line items")
+
+        self.stdout.write(self.style.SUCCESS(f"Projected {rows} line items from {documents_done} documents"))
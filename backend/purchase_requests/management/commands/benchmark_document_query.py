@@ -0,0 +1,140 @@
+"""
+Benchmark data.* document filters on a large synthetic document set
+
+Inserts the documents inside a transaction that is rolled back at the
+end, so the database is left as it was. On PostgreSQL each query is also
+EXPLAINed to show whether the jsonb_path_ops GIN index was used.
+"""
+import random
+import time
+import uuid
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from organizations.models import Organization
+from purchase_requests.document_query import compile_filters
+from purchase_requests.models import Document, PurchaseRequest
+
+User = get_user_model()
+
+CURRENCIES = ['USD', 'EUR', 'GBP', 'KES', 'NGN', 'ZAR', 'JPY', 'CHF']
+PAYMENT_METHODS = ['card', 'cash', 'bank transfer', 'mobile money', 'cheque']
+TERMS = ['Net 30', 'Net 60', 'Due on receipt', '50% upfront', 'Net 15 days']
+ITEMS = ['A4 Paper', 'Toner Black', 'Office Chair', 'Desk Lamp', 'USB Cable', 'Monitor 24in']
+
+QUERIES = [
+    ('currency', [('data.currency', 'CHF')]),
+    ('payment method in', [('data.payment_method__in', 'cheque,mobile money')]),
+    ('currency + terms', [('data.currency', 'EUR'), ('data.terms', 'Net 60')]),
+    ('item description', [('data.items.description', 'Monitor 24in')]),
+    ('currency + total range', [('data.currency', 'JPY'), ('data.total_amount__gte', '9000')]),
+    ('terms icontains (no index)', [('data.terms__icontains', 'upfront')]),
+]
+
+
+def synthetic_data(rng: random.Random, document_type: str) -> dict:
+    items = [
+        {'description': rng.choice(ITEMS), 'quantity': rng.randint(1, 20), 'unit_price': round(rng.uniform(1, 500), 2)}
+        for _ in range(rng.randint(1, 4))
+    ]
+    for item in items:
+        item['total'] = round(item['quantity'] * item['unit_price'], 2)
+    data = {
+        'currency': rng.choice(CURRENCIES),
+        'items': items,
+        'total_amount': round(sum(item['total'] for item in items), 2),
+    }
+    if document_type == Document.DocumentType.RECEIPT:
+        data.update(seller_name=f'Vendor {rng.randint(1, 5000)}', payment_method=rng.choice(PAYMENT_METHODS),
+                    date=f'2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}')
+    else:
+        data.update(vendor_name=f'Vendor {rng.randint(1, 5000)}', terms=rng.choice(TERMS),
+                    validity=f'{rng.choice([7, 14, 30])} days')
+    return data
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark data.* document filters on synthetic documents (rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documents', type=int, default=1_000_000, help='Documents to insert')
+        parser.add_argument('--requests', type=int, default=10_000, help='Requests to spread them over')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per query (best is reported)')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if options['documents'] < 1 or options['requests'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--documents, --requests and --batch-size must be positive')
+        try:
+            with transaction.atomic():
+                self._run(options)
+                raise _Rollback
+        except _Rollback:
+            self.stdout.write('Synthetic data rolled back')
+
+    def _run(self, options):
+        rng = random.Random(options['seed'])
+        organization = Organization.objects.create(name=f'benchmark-{uuid.uuid4().hex[:12]}')
+        user = User.objects.create_user(
+            email=f'{organization.name}@example.com', password=None, organization=organization
+        )
+        requests = PurchaseRequest.objects.bulk_create([
+            PurchaseRequest(organization=organization, created_by=user, title=f'Benchmark {i}',
+                            description='', amount=Decimal('100.00'))
+            for i in range(options['requests'])
+        ], batch_size=options['batch_size'])
+
+        start = time.perf_counter()
+        types = Document.DocumentType.values
+        remaining = options['documents']
+        while remaining:
+            size = min(remaining, options['batch_size'])
+            documents = []
+            for _ in range(size):
+                document_type = rng.choice(types)
+                documents.append(Document(
+                    request=rng.choice(requests), document_type=document_type,
+                    file_url='https://example.com/benchmark.pdf',
+                    extracted_data=synthetic_data(rng, document_type),
+                ))
+            # bulk_create skips Document.save, so no line item projection is built
+            Document.objects.bulk_create(documents)
+            remaining -= size
+        self.stdout.write(f"Inserted {options['documents']} documents in {time.perf_counter() - start:.1f}s")
+
+        postgres = connection.vendor == 'postgresql'
+        if postgres:
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE purchase_requests_document')
+        else:
+            self.stdout.write(self.style.WARNING(
+                f'{connection.vendor}: no containment or GIN index, queries use key-path scans'
+            ))
+
+        base = Document.objects.filter(request__organization=organization)
+        self.stdout.write(f"{'query':<28} {'rows':>8} {'count ms':>9} {'page ms':>8}  plan")
+        for label, params in QUERIES:
+            queryset = base.filter(compile_filters(params))
+            count_times, page_times = [], []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                rows = queryset.count()
+                count_times.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                list(queryset.order_by('-created_at').values_list('id', flat=True)[:50])
+                page_times.append(time.perf_counter() - start)
+
+            plan = ''
+            if postgres:
+                explain = queryset.explain()
+                plan = 'GIN index' if 'purchase_re_document_data_gin' in explain else 'scan'
+            self.stdout.write(
+                f"{label:<28} {rows:>8} {min(count_times) * 1000:>9.1f} {min(page_times) * 1000:>8.1f}  {plan}"
+            )
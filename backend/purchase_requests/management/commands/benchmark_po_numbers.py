@@ -0,0 +1,101 @@
+"""
+Benchmark PO number allocation under parallel approvers
+
+Each thread plays an approver whose requests reach final approval and
+get their PO number (allocate + assign), all in one organization so they
+contend for the same sequence row. Block size 1 is the baseline of one
+locked counter update per number. Uses a throwaway organization that is
+deleted afterwards; on SQLite writers are serialized by the database, so
+run it against PostgreSQL for representative numbers.
+"""
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from organizations.models import Organization
+from purchase_requests.models import PurchaseRequest
+from purchase_requests.po_numbers import PONumberAllocator, assign_po_number, po_number_gaps
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Benchmark PO number allocations per second under parallel approvers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Parallel approvers')
+        parser.add_argument('--per-thread', type=int, default=250, help='Final approvals per approver')
+        parser.add_argument('--block-sizes', type=int, nargs='+', default=[1, 20, 100],
+                            help='Allocator block sizes to compare')
+
+    def handle(self, *args, **options):
+        if options['threads'] < 1 or options['per_thread'] < 1 or min(options['block_sizes']) < 1:
+            raise CommandError('--threads, --per-thread and --block-sizes must be positive')
+
+        self.stdout.write(f"{options['threads']} approvers x {options['per_thread']} approvals "
+                          f"({connection.vendor})")
+        self.stdout.write(f"{'block':>6} {'allocs/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'gaps':>6}")
+        for block_size in options['block_sizes']:
+            organization = Organization.objects.create(name=f'benchmark-{uuid.uuid4().hex[:12]}')
+            try:
+                self._run(organization, block_size, options['threads'], options['per_thread'])
+            finally:
+                organization.delete()
+
+    def _run(self, organization, block_size, threads, per_thread):
+        user = User.objects.create_user(
+            email=f'{organization.name}@example.com', password=None, organization=organization
+        )
+        requests = PurchaseRequest.objects.bulk_create([
+            PurchaseRequest(organization=organization, created_by=user, title=f'Benchmark {i}',
+                            description='', amount=Decimal('100.00'), status=PurchaseRequest.Status.APPROVED)
+            for i in range(threads * per_thread)
+        ])
+        for request in requests:
+            request.organization = organization
+
+        allocator = PONumberAllocator(block_size=block_size)
+        latencies, errors = [], []
+        barrier = threading.Barrier(threads + 1)
+
+        def approver(batch):
+            timings = []
+            try:
+                barrier.wait()
+                for request in batch:
+                    start = time.perf_counter()
+                    assign_po_number(request, allocator)
+                    timings.append(time.perf_counter() - start)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                latencies.extend(timings)
+                connection.close()
+
+        workers = [
+            threading.Thread(target=approver, args=(requests[i * per_thread:(i + 1) * per_thread],))
+            for i in range(threads)
+        ]
+        for worker in workers:
+            worker.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        if errors:
+            raise CommandError(f"{len(errors)} approvers failed: {errors[0]}")
+
+        assigned = PurchaseRequest.objects.filter(organization=organization, po_sequence__isnull=False)
+        if assigned.values('po_sequence').distinct().count() != len(requests):
+            raise CommandError('Duplicate or missing PO numbers')
+        gaps = sum(last - first + 1 for first, last in po_number_gaps(organization.id))
+
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+        self.stdout.write(f"{block_size:>6} {len(requests) / elapsed:>10.0f} {p50:>8.2f} {p99:>8.2f} {gaps:>6}")
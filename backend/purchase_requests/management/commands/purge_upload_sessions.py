@@ -0,0 +1,16 @@
+"""
+Remove chunked upload sessions idle for longer than CHUNKED_UPLOAD_TTL
+
+Abandoned sessions keep a part file under UPLOAD_SPOOL_DIR; run this
+periodically (e.g. daily from cron) to reclaim the space.
+"""
+from django.core.management.base import BaseCommand
+from purchase_requests.chunked_uploads import purge_expired_sessions
+
+
+class Command(BaseCommand):
+    help = 'Delete expired chunked upload sessions and their part files'
+
+    def handle(self, *args, **options):
+        removed = purge_expired_sessions()
+        self.stdout.write(self.style.SUCCESS(f'Removed {removed} expired upload sessions'))
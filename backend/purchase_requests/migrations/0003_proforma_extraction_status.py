@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-19 08:19
+
+from django.db import migrations, models
+
+
+def backfill_extraction_status(apps, schema_editor):
+    PurchaseRequest = apps.get_model('purchase_requests', 'PurchaseRequest')
+    with_proforma = PurchaseRequest.objects.exclude(proforma_file_url__isnull=True).exclude(proforma_file_url='')
+    with_proforma.filter(documents__document_type='PROFORMA').update(proforma_extraction_status='COMPLETED')
+    with_proforma.exclude(documents__document_type='PROFORMA').update(proforma_extraction_status='FAILED')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('purchase_requests', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchaserequest',
+            name='proforma_extraction_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='purchaserequest',
+            name='proforma_extraction_status',
+            field=models.CharField(choices=[('NONE', 'No proforma'), ('PENDING', 'Pending'), ('PROCESSING', 'Processing'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed')], default='NONE', max_length=20),
+        ),
+        migrations.RunPython(backfill_extraction_status, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 08:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('purchase_requests', '0003_proforma_extraction_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='match_report',
+            field=models.JSONField(blank=True, default=dict, help_text='Three-way match report (receipts only)'),
+        ),
+    ]
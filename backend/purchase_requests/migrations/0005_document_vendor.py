@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-19 08:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('purchase_requests', '0004_document_match_report'),
+        ('vendors', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='vendor',
+            field=models.ForeignKey(blank=True, help_text='Vendor resolved from the extracted vendor/seller name', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='documents', to='vendors.vendor'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['vendor', 'document_type'], name='purchase_re_vendor__871d0b_idx'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.8 on 2026-10-19 08:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_trigram_index(apps, schema_editor):
+    # Substring search (?q=) on PostgreSQL; pg_trgm is enabled by vendors.0001
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS purchase_re_lineitem_desc_trgm '
+        'ON purchase_requests_extractedlineitem USING gin (normalized_description gin_trgm_ops)'
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS purchase_re_lineitem_desc_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organizations', '0001_initial'),
+        ('purchase_requests', '0005_document_vendor'),
+        ('vendors', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExtractedLineItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document_type', models.CharField(choices=[('PROFORMA', 'Proforma'), ('PO', 'Purchase Order'), ('RECEIPT', 'Receipt')], max_length=20)),
+                ('position', models.IntegerField()),
+                ('description', models.CharField(blank=True, max_length=255)),
+                ('normalized_description', models.CharField(blank=True, max_length=255)),
+                ('quantity', models.DecimalField(blank=True, decimal_places=4, max_digits=14, null=True)),
+                ('unit_price', models.DecimalField(blank=True, decimal_places=4, max_digits=14, null=True)),
+                ('total', models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True)),
+                ('currency', models.CharField(blank=True, max_length=10)),
+                ('document_created_at', models.DateTimeField()),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='line_items', to='purchase_requests.document')),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='extracted_line_items', to='organizations.organization')),
+                ('request', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='extracted_line_items', to='purchase_requests.purchaserequest')),
+                ('vendor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='line_items', to='vendors.vendor')),
+            ],
+            options={
+                'ordering': ['-document_created_at', 'position'],
+                'indexes': [models.Index(fields=['organization', 'normalized_description', 'document_created_at'], name='purchase_re_organiz_5e734f_idx'), models.Index(fields=['organization', 'document_type', 'document_created_at'], name='purchase_re_organiz_e9db12_idx'), models.Index(fields=['vendor', 'normalized_description'], name='purchase_re_vendor__53592c_idx')],
+            },
+        ),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations
+
+
+def create_gin_index(apps, schema_editor):
+    # jsonb_path_ops serves @> containment (the data.* filters) with a
+    # smaller index than the default jsonb_ops; PostgreSQL only
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS purchase_re_document_data_gin '
+        'ON purchase_requests_document USING gin (extracted_data jsonb_path_ops)'
+    )
+
+
+def drop_gin_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS purchase_re_document_data_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('purchase_requests', '0006_extracted_line_items'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_gin_index, drop_gin_index),
+    ]
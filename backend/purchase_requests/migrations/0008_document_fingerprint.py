@@ -0,0 +1,42 @@
+# Generated by Django 5.2.8 on 2026-10-19 08:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organizations', '0001_initial'),
+        ('purchase_requests', '0007_document_extracted_data_gin'),
+        ('vendors', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document_type', models.CharField(choices=[('PROFORMA', 'Proforma'), ('PO', 'Purchase Order'), ('RECEIPT', 'Receipt')], max_length=20)),
+                ('file_url', models.URLField(max_length=500)),
+                ('content_hash', models.CharField(help_text='SHA-256 of the uploaded bytes', max_length=64)),
+                ('perceptual_hash', models.BigIntegerField(blank=True, help_text='64-bit dHash (images only)', null=True)),
+                ('phash_band_0', models.IntegerField(blank=True, null=True)),
+                ('phash_band_1', models.IntegerField(blank=True, null=True)),
+                ('phash_band_2', models.IntegerField(blank=True, null=True)),
+                ('phash_band_3', models.IntegerField(blank=True, null=True)),
+                ('invoice_number', models.CharField(blank=True, help_text='Normalized invoice/receipt number', max_length=100)),
+                ('document_date', models.DateField(blank=True, null=True)),
+                ('total_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True)),
+                ('duplicates', models.JSONField(blank=True, default=list, help_text='Earlier uploads this one duplicates (kind, request, document_type, ...)')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='document_fingerprints', to='organizations.organization')),
+                ('request', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fingerprints', to='purchase_requests.purchaserequest')),
+                ('vendor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='fingerprints', to='vendors.vendor')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['organization', 'content_hash'], name='purchase_re_organiz_978f13_idx'), models.Index(fields=['organization', 'phash_band_0'], name='purchase_re_organiz_c0666b_idx'), models.Index(fields=['organization', 'phash_band_1'], name='purchase_re_organiz_2236f0_idx'), models.Index(fields=['organization', 'phash_band_2'], name='purchase_re_organiz_1a9f14_idx'), models.Index(fields=['organization', 'phash_band_3'], name='purchase_re_organiz_5f1b52_idx'), models.Index(fields=['organization', 'vendor', 'invoice_number'], name='purchase_re_organiz_057793_idx'), models.Index(fields=['organization', 'vendor', 'document_date', 'total_amount'], name='purchase_re_organiz_59a969_idx'), models.Index(fields=['request', 'document_type'], name='purchase_re_request_3b300e_idx')],
+            },
+        ),
+    ]
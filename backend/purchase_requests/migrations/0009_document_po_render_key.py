@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-19 09:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('purchase_requests', '0008_document_fingerprint'),
+        ('vendors', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='render_key',
+            field=models.CharField(blank=True, default='', help_text='Digest of the inputs the PO was rendered from (POs only)', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='template_version',
+            field=models.PositiveIntegerField(blank=True, help_text='PO template version the file was rendered with (POs only)', null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='document',
+            constraint=models.UniqueConstraint(condition=models.Q(('document_type', 'PO')), fields=('request', 'template_version'), name='unique_po_per_request_version'),
+        ),
+    ]
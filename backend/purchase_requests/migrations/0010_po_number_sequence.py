@@ -0,0 +1,38 @@
+# Generated by Django 5.2.8 on 2026-10-19 09:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organizations', '0001_initial'),
+        ('purchase_requests', '0009_document_po_render_key'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PONumberSequence',
+            fields=[
+                ('organization', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='po_number_sequence', serialize=False, to='organizations.organization')),
+                ('last_reserved', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='purchaserequest',
+            name='po_number',
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='purchaserequest',
+            name='po_sequence',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='purchaserequest',
+            constraint=models.UniqueConstraint(fields=('organization', 'po_sequence'), name='unique_po_sequence_per_organization'),
+        ),
+    ]
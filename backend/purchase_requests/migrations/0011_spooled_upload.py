@@ -0,0 +1,38 @@
+# Generated by Django 5.2.8 on 2026-10-19 09:37
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('purchase_requests', '0010_po_number_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpooledUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('document_type', models.CharField(choices=[('PROFORMA', 'Proforma'), ('PO', 'Purchase Order'), ('RECEIPT', 'Receipt')], max_length=20)),
+                ('filename', models.CharField(max_length=255)),
+                ('content_type', models.CharField(max_length=100)),
+                ('size', models.PositiveBigIntegerField()),
+                ('spool_name', models.CharField(help_text='File name under UPLOAD_SPOOL_DIR', max_length=255)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('perceptual_hash', models.BigIntegerField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('STORED', 'Stored'), ('FAILED', 'Failed')], default='PENDING', max_length=20)),
+                ('error', models.TextField(blank=True)),
+                ('file_url', models.URLField(blank=True, max_length=500, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('stored_at', models.DateTimeField(blank=True, null=True)),
+                ('request', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='spooled_uploads', to='purchase_requests.purchaserequest')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['request', 'document_type'], name='purchase_re_request_0df4bb_idx'), models.Index(fields=['status', 'created_at'], name='purchase_re_status_3af220_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.8 on 2026-10-19 09:51
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organizations', '0001_initial'),
+        ('purchase_requests', '0011_spooled_upload'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('document_type', models.CharField(choices=[('PROFORMA', 'Proforma'), ('PO', 'Purchase Order'), ('RECEIPT', 'Receipt')], max_length=20)),
+                ('filename', models.CharField(max_length=255)),
+                ('content_type', models.CharField(max_length=100)),
+                ('size', models.PositiveBigIntegerField()),
+                ('checksum', models.CharField(help_text='SHA-256 of the whole file, declared by the client', max_length=64)),
+                ('public_id', models.CharField(max_length=255)),
+                ('received', models.PositiveBigIntegerField(default=0)),
+                ('status', models.CharField(choices=[('OPEN', 'Open'), ('STORING', 'Storing'), ('COMPLETE', 'Complete'), ('FAILED', 'Failed')], default='OPEN', max_length=20)),
+                ('error', models.TextField(blank=True)),
+                ('file_url', models.URLField(blank=True, max_length=500, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to='organizations.organization')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'updated_at'], name='purchase_re_status_ec1de0_idx')],
+            },
+        ),
+    ]
@@ -1,9 +1,34 @@
-from django.db import models
+import re
+from decimal import Decimal, InvalidOperation
+from django.db import models, transaction
 from django.core.validators import MinValueValidator
 from organizations.models import Organization
 from users.models import User
+from vendors.models import Vendor
 import uuid
 
+_DESCRIPTION_TOKEN_RE = re.compile(r'[a-z0-9]+')
+# Amounts outside the column range are model noise, not data
+_MAX_AMOUNT = Decimal('1e10')
+
+
+def normalize_description(description) -> str:
+    """Lowercase alphanumeric tokens of a line description, e.g. 'A4 Paper (box)' -> 'a4 paper box'"""
+    return ' '.join(_DESCRIPTION_TOKEN_RE.findall(str(description or '').lower()))[:255]
+
+
+def _to_decimal(value):
+    """Lenient Decimal for extracted amounts; None when unreadable"""
+    if value is None or value == '' or isinstance(value, bool):
+        return None
+    try:
+        number = Decimal(str(value).replace(',', '').strip().lstrip('$'))
+    except InvalidOperation:
+        return None
+    if not number.is_finite() or abs(number) >= _MAX_AMOUNT:
+        return None
+    return number
+
 
 class PurchaseRequest(models.Model):
     """Purchase Request model"""
@@ -14,6 +39,13 @@ class PurchaseRequest(models.Model):
         REJECTED = 'REJECTED', 'Rejected'
         DISCREPANCY = 'DISCREPANCY', 'Discrepancy'
     
+    class ExtractionStatus(models.TextChoices):
+        NONE = 'NONE', 'No proforma'
+        PENDING = 'PENDING', 'Pending'
+        PROCESSING = 'PROCESSING', 'Processing'
+        COMPLETED = 'COMPLETED', 'Completed'
+        FAILED = 'FAILED', 'Failed'
+    
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     organization = models.ForeignKey(
         Organization,
@@ -45,14 +77,26 @@ class PurchaseRequest(models.Model):
         blank=True
     )
     
-    # File URLs (stored in Cloudinary)
+    # File URLs (documents.storage; Cloudinary in production)
     proforma_file_url = models.URLField(max_length=500, blank=True, null=True)
     purchase_order_file_url = models.URLField(max_length=500, blank=True, null=True)
     receipt_file_url = models.URLField(max_length=500, blank=True, null=True)
     
+    # Proforma extraction runs speculatively at upload time
+    proforma_extraction_status = models.CharField(
+        max_length=20,
+        choices=ExtractionStatus.choices,
+        default=ExtractionStatus.NONE
+    )
+    proforma_extraction_error = models.TextField(blank=True)
+    
     # Current approval tracking
     current_approval_level = models.IntegerField(default=0)
     
+    # Sequential per-organization PO number, assigned when the PO is generated
+    po_sequence = models.PositiveBigIntegerField(null=True, blank=True, editable=False)
+    po_number = models.CharField(max_length=32, blank=True, editable=False)
+    
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -64,6 +108,12 @@ class PurchaseRequest(models.Model):
             models.Index(fields=['created_by', 'status']),
             models.Index(fields=['status', 'created_at']),
         ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['organization', 'po_sequence'],
+                name='unique_po_sequence_per_organization'
+            ),
+        ]
 
     def __str__(self):
         return f"{self.title} - {self.get_status_display()}"
@@ -172,6 +222,26 @@ class RequestItem(models.Model):
         super().save(*args, **kwargs)
 
 
+class PONumberSequence(models.Model):
+    """
+    High-water mark of the PO numbers reserved for an organization
+    
+    Allocators reserve numbers in blocks (see purchase_requests.po_numbers),
+    so this is the last number handed to any allocator, not the last one
+    printed on a PO.
+    """
+    organization = models.OneToOneField(
+        Organization,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='po_number_sequence'
+    )
+    last_reserved = models.PositiveBigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.organization.name} PO numbers reserved to {self.last_reserved}"
+
+
 class Document(models.Model):
     """Document model for extracted data"""
     
@@ -191,13 +261,299 @@ class Document(models.Model):
         default=dict,
         help_text="Extracted data from document (vendor, items, prices, terms)"
     )
+    vendor = models.ForeignKey(
+        Vendor,
+        on_delete=models.SET_NULL,
+        related_name='documents',
+        null=True,
+        blank=True,
+        help_text="Vendor resolved from the extracted vendor/seller name"
+    )
+    match_report = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Three-way match report (receipts only)"
+    )
+    template_version = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="PO template version the file was rendered with (POs only)"
+    )
+    render_key = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        help_text="Digest of the inputs the PO was rendered from (POs only)"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['request', 'document_type']),
+            models.Index(fields=['vendor', 'document_type']),
+        ]
+        constraints = [
+            # One PO per request and template version; earlier POs have no version
+            models.UniqueConstraint(
+                fields=['request', 'template_version'],
+                condition=models.Q(document_type='PO'),
+                name='unique_po_per_request_version'
+            ),
         ]
 
     def __str__(self):
         return f"{self.request.title} - {self.get_document_type_display()}"
+
+    def save(self, *args, **kwargs):
+        """Save and keep the ExtractedLineItem projection in sync"""
+        update_fields = kwargs.get('update_fields')
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if update_fields is None or {'extracted_data', 'vendor'} & set(update_fields):
+                self.sync_line_items()
+
+    def sync_line_items(self):
+        """Rebuild this document's ExtractedLineItem rows from extracted_data['items']"""
+        organization_id = PurchaseRequest.objects.filter(id=self.request_id).values_list(
+            'organization_id', flat=True
+        ).first()
+        self.line_items.all().delete()
+        ExtractedLineItem.objects.bulk_create(self.build_line_items(organization_id))
+
+    def build_line_items(self, organization_id) -> list:
+        """Unsaved ExtractedLineItem rows for extracted_data['items']"""
+        data = self.extracted_data if isinstance(self.extracted_data, dict) else {}
+        items = data.get('items') or []
+        currency = str(data.get('currency') or '')[:10]
+        return [
+            ExtractedLineItem(
+                document=self,
+                organization_id=organization_id,
+                request_id=self.request_id,
+                vendor_id=self.vendor_id,
+                document_type=self.document_type,
+                position=position,
+                description=str(item.get('description') or '')[:255],
+                normalized_description=normalize_description(item.get('description')),
+                quantity=_to_decimal(item.get('quantity')),
+                unit_price=_to_decimal(item.get('unit_price')),
+                total=_to_decimal(item.get('total')),
+                currency=currency,
+                document_created_at=self.created_at,
+            )
+            for position, item in enumerate(items)
+            if isinstance(item, dict)
+        ]
+
+
+class ExtractedLineItem(models.Model):
+    """
+    Relational projection of one extracted line item
+
+    Mirrors Document.extracted_data['items'] (rebuilt on every Document
+    save) so item-level questions run on indexes instead of JSON scans.
+    Organization, request, vendor and type are denormalized from the
+    document for index-only filtering.
+    """
+    document = models.ForeignKey(
+        Document,
+        on_delete=models.CASCADE,
+        related_name='line_items'
+    )
+    organization = models.ForeignKey(
+        Organization,
+        on_delete=models.CASCADE,
+        related_name='extracted_line_items'
+    )
+    request = models.ForeignKey(
+        PurchaseRequest,
+        on_delete=models.CASCADE,
+        related_name='extracted_line_items'
+    )
+    vendor = models.ForeignKey(
+        Vendor,
+        on_delete=models.SET_NULL,
+        related_name='line_items',
+        null=True,
+        blank=True
+    )
+    document_type = models.CharField(max_length=20, choices=Document.DocumentType.choices)
+    position = models.IntegerField()
+    description = models.CharField(max_length=255, blank=True)
+    normalized_description = models.CharField(max_length=255, blank=True)
+    quantity = models.DecimalField(max_digits=14, decimal_places=4, null=True, blank=True)
+    unit_price = models.DecimalField(max_digits=14, decimal_places=4, null=True, blank=True)
+    total = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True)
+    currency = models.CharField(max_length=10, blank=True)
+    document_created_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-document_created_at', 'position']
+        indexes = [
+            models.Index(fields=['organization', 'normalized_description', 'document_created_at']),
+            models.Index(fields=['organization', 'document_type', 'document_created_at']),
+            models.Index(fields=['vendor', 'normalized_description']),
+        ]
+
+    def __str__(self):
+        return f"{self.description} ({self.get_document_type_display()})"
+
+
+class DocumentFingerprint(models.Model):
+    """
+    Hashes and identifying fields of an uploaded proforma or receipt
+
+    Written at upload time (content and perceptual hashes) and completed
+    after extraction (invoice number, vendor, date, total), so the same
+    document submitted on several requests can be flagged. The perceptual
+    hash is also stored as four 16-bit bands: two hashes within 3 bits of
+    each other always share a band, so near duplicates are found with
+    indexed equality lookups.
+    """
+    organization = models.ForeignKey(
+        Organization,
+        on_delete=models.CASCADE,
+        related_name='document_fingerprints'
+    )
+    request = models.ForeignKey(
+        PurchaseRequest,
+        on_delete=models.CASCADE,
+        related_name='fingerprints'
+    )
+    document_type = models.CharField(max_length=20, choices=Document.DocumentType.choices)
+    file_url = models.URLField(max_length=500)
+    content_hash = models.CharField(max_length=64, help_text="SHA-256 of the uploaded bytes")
+    perceptual_hash = models.BigIntegerField(null=True, blank=True, help_text="64-bit dHash (images only)")
+    phash_band_0 = models.IntegerField(null=True, blank=True)
+    phash_band_1 = models.IntegerField(null=True, blank=True)
+    phash_band_2 = models.IntegerField(null=True, blank=True)
+    phash_band_3 = models.IntegerField(null=True, blank=True)
+    invoice_number = models.CharField(max_length=100, blank=True, help_text="Normalized invoice/receipt number")
+    vendor = models.ForeignKey(
+        Vendor,
+        on_delete=models.SET_NULL,
+        related_name='fingerprints',
+        null=True,
+        blank=True
+    )
+    document_date = models.DateField(null=True, blank=True)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True)
+    duplicates = models.JSONField(
+        default=list,
+        blank=True,
+        help_text="Earlier uploads this one duplicates (kind, request, document_type, ...)"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['organization', 'content_hash']),
+            models.Index(fields=['organization', 'phash_band_0']),
+            models.Index(fields=['organization', 'phash_band_1']),
+            models.Index(fields=['organization', 'phash_band_2']),
+            models.Index(fields=['organization', 'phash_band_3']),
+            models.Index(fields=['organization', 'vendor', 'invoice_number']),
+            models.Index(fields=['organization', 'vendor', 'document_date', 'total_amount']),
+            models.Index(fields=['request', 'document_type']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_document_type_display()} {self.content_hash[:12]}"
+
+
+class SpooledUpload(models.Model):
+    """
+    A proforma or receipt accepted by the API but not yet in storage
+
+    With ASYNC_UPLOADS the validated file is written to UPLOAD_SPOOL_DIR
+    (a volume shared with the workers) and the API answers 202 right
+    away; a worker pushes it to storage, sets the request's file URL and
+    starts extraction. The hashes are taken while the bytes are at hand,
+    so duplicates are still reported in the API response.
+    """
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', 'Pending'
+        STORED = 'STORED', 'Stored'
+        FAILED = 'FAILED', 'Failed'
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    request = models.ForeignKey(
+        PurchaseRequest,
+        on_delete=models.CASCADE,
+        related_name='spooled_uploads'
+    )
+    document_type = models.CharField(max_length=20, choices=Document.DocumentType.choices)
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100)
+    size = models.PositiveBigIntegerField()
+    spool_name = models.CharField(max_length=255, help_text="File name under UPLOAD_SPOOL_DIR")
+    content_hash = models.CharField(max_length=64)
+    perceptual_hash = models.BigIntegerField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    error = models.TextField(blank=True)
+    file_url = models.URLField(max_length=500, blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    stored_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['request', 'document_type']),
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_document_type_display()} {self.filename} ({self.status})"
+
+
+class UploadSession(models.Model):
+    """
+    A resumable chunked upload of one proforma or receipt
+
+    The client declares the file (name, type, size, SHA-256), PUTs it in
+    chunks at increasing offsets and completes the session; the API
+    assembles the chunks under UPLOAD_SPOOL_DIR, checks size and hash and
+    puts the file in storage. `received` is the resume offset.
+    """
+    class Status(models.TextChoices):
+        OPEN = 'OPEN', 'Open'
+        # Verified and being put in storage, outside any transaction
+        STORING = 'STORING', 'Storing'
+        COMPLETE = 'COMPLETE', 'Complete'
+        FAILED = 'FAILED', 'Failed'
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    organization = models.ForeignKey(
+        Organization,
+        on_delete=models.CASCADE,
+        related_name='upload_sessions'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='upload_sessions'
+    )
+    document_type = models.CharField(max_length=20, choices=Document.DocumentType.choices)
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100)
+    size = models.PositiveBigIntegerField()
+    checksum = models.CharField(max_length=64, help_text="SHA-256 of the whole file, declared by the client")
+    public_id = models.CharField(max_length=255)
+    received = models.PositiveBigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.OPEN)
+    error = models.TextField(blank=True)
+    file_url = models.URLField(max_length=500, blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'updated_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_document_type_display()} {self.filename} ({self.received}/{self.size}, {self.status})"
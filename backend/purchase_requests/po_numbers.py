@@ -0,0 +1,179 @@
+"""
+Sequential per-organization PO numbers
+
+Numbers come from PONumberSequence, one row per organization. Taking
+them one at a time would serialize every PO of an organization on that
+row lock, so each process reserves a block of PO_NUMBER_BLOCK_SIZE
+numbers in one short transaction and hands them out from memory.
+Reservations commit on their own: numbers are never reused after a
+rollback, and the ones a process reserves but never assigns (block
+remainders at shutdown) are gaps, reported by po_number_gaps.
+
+The unique (organization, po_sequence) constraint is the backstop: if a
+reservation made inside an outer transaction is rolled back and the same
+numbers are reserved again elsewhere, the second assignment fails, the
+stale block is dropped and a fresh one is reserved.
+"""
+import logging
+import threading
+from typing import Dict, List, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import PONumberSequence, PurchaseRequest
+
+logger = logging.getLogger(__name__)
+
+MAX_ASSIGN_ATTEMPTS = 3
+
+
+class PONumberAllocator:
+    """
+    Hand out PO numbers from blocks reserved in the database
+
+    Thread-safe; one instance per process (see get_po_number_allocator).
+
+    Args:
+        block_size: Numbers reserved per database round trip
+    """
+
+    def __init__(self, block_size: int = None):
+        self.block_size = max(1, block_size or settings.PO_NUMBER_BLOCK_SIZE)
+        self._lock = threading.Lock()
+        # organization ID -> [next, last] of the current block
+        self._blocks: Dict[int, List[int]] = {}
+        # organization ID -> numbers given back by release()
+        self._released: Dict[int, List[int]] = {}
+
+    def reserve_block(self, organization_id: int, size: int) -> Tuple[int, int]:
+        """
+        Reserve `size` numbers for an organization
+
+        Returns:
+            (first, last) of the reserved range
+        """
+        with transaction.atomic():
+            PONumberSequence.objects.get_or_create(organization_id=organization_id)
+            PONumberSequence.objects.filter(organization_id=organization_id).update(
+                last_reserved=F('last_reserved') + size
+            )
+            last = PONumberSequence.objects.filter(
+                organization_id=organization_id
+            ).values_list('last_reserved', flat=True).get()
+        return last - size + 1, last
+
+    def allocate(self, organization_id: int) -> int:
+        """Next PO number for an organization"""
+        with self._lock:
+            released = self._released.get(organization_id)
+            if released:
+                return released.pop()
+            block = self._blocks.get(organization_id)
+            if block is None or block[0] > block[1]:
+                # Reserved under the lock: concurrent callers wait for one round trip
+                block = list(self.reserve_block(organization_id, self.block_size))
+                self._blocks[organization_id] = block
+            number = block[0]
+            block[0] += 1
+            return number
+
+    def release(self, organization_id: int, number: int):
+        """Give back a number that was allocated but not assigned"""
+        with self._lock:
+            self._released.setdefault(organization_id, []).append(number)
+
+    def discard(self, organization_id: int):
+        """Drop the cached block and released numbers of an organization"""
+        with self._lock:
+            self._blocks.pop(organization_id, None)
+            self._released.pop(organization_id, None)
+
+
+_allocator = None
+_allocator_lock = threading.Lock()
+
+
+def get_po_number_allocator() -> PONumberAllocator:
+    """Return the PO number allocator (one per process)"""
+    global _allocator
+    if _allocator is None:
+        with _allocator_lock:
+            if _allocator is None:
+                _allocator = PONumberAllocator()
+    return _allocator
+
+
+def format_po_number(prefix: str, sequence: int) -> str:
+    """'PO', 42 -> 'PO-000042'"""
+    return f"{prefix}-{sequence:06d}"
+
+
+def assign_po_number(request: PurchaseRequest, allocator: PONumberAllocator = None) -> str:
+    """
+    Give a request its PO number, once
+
+    Idempotent: a request that already has a number keeps it, and of two
+    concurrent calls for the same request one wins and the other returns
+    the winner's number (its own goes back to the allocator).
+
+    Returns:
+        The request's PO number
+    """
+    if request.po_number:
+        return request.po_number
+
+    allocator = allocator or get_po_number_allocator()
+    organization_id = request.organization_id
+    for _ in range(MAX_ASSIGN_ATTEMPTS):
+        sequence = allocator.allocate(organization_id)
+        po_number = format_po_number(request.organization.po_number_prefix, sequence)
+        try:
+            with transaction.atomic():
+                assigned = PurchaseRequest.objects.filter(id=request.id, po_sequence__isnull=True).update(
+                    po_sequence=sequence, po_number=po_number
+                )
+        except IntegrityError:
+            logger.warning(
+                f"PO number {sequence} of organization {organization_id} is already taken; "
+                f"reserving a new block"
+            )
+            allocator.discard(organization_id)
+            continue
+
+        if assigned:
+            request.po_sequence, request.po_number = sequence, po_number
+        else:
+            allocator.release(organization_id, sequence)
+            request.refresh_from_db(fields=['po_sequence', 'po_number'])
+        return request.po_number
+
+    raise RuntimeError(f"Could not assign a PO number to request {request.id}")
+
+
+def po_number_gaps(organization_id: int) -> List[Tuple[int, int]]:
+    """
+    Reserved PO numbers that no request carries, as inclusive ranges
+
+    Numbers still held in a live process's block show up here until they
+    are assigned.
+
+    Returns:
+        List of (first, last) ranges in ascending order
+    """
+    last_reserved = PONumberSequence.objects.filter(
+        organization_id=organization_id
+    ).values_list('last_reserved', flat=True).first() or 0
+
+    gaps, expected = [], 1
+    assigned = PurchaseRequest.objects.filter(
+        organization_id=organization_id, po_sequence__isnull=False
+    ).order_by('po_sequence').values_list('po_sequence', flat=True)
+    for sequence in assigned.iterator(chunk_size=5000):
+        if sequence > expected:
+            gaps.append((expected, sequence - 1))
+        expected = sequence + 1
+    if expected <= last_reserved:
+        gaps.append((expected, last_reserved))
+    return gaps
@@ -1,7 +1,12 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import PurchaseRequest, Approval, RequestItem, Document
+from .models import PurchaseRequest, Approval, RequestItem, Document, ExtractedLineItem, UploadSession
 from users.serializers import UserSerializer
-from .utils import upload_file_to_cloudinary, validate_file_type, validate_file_size
+from .utils import upload_file_to_storage, validate_file_contents, validate_file_type, validate_file_size
+from .direct_uploads import DirectUploadError, validate_upload_metadata, verify_upload
+from .upload_spool import spool_upload
+from documents.duplicates import fingerprint_upload, record_upload
+from documents.tasks import schedule_proforma_extraction
 
 
 class RequestItemSerializer(serializers.ModelSerializer):
@@ -32,11 +37,29 @@ class ApprovalSerializer(serializers.ModelSerializer):
 
 class DocumentSerializer(serializers.ModelSerializer):
     """Document serializer"""
+    vendor_name = serializers.CharField(source='vendor.name', read_only=True, default=None)
     
     class Meta:
         model = Document
-        fields = ['id', 'document_type', 'file_url', 'extracted_data', 'created_at']
-        read_only_fields = ['id', 'created_at']
+        fields = [
+            'id', 'document_type', 'file_url', 'extracted_data',
+            'vendor', 'vendor_name', 'match_report', 'created_at'
+        ]
+        read_only_fields = ['id', 'vendor', 'match_report', 'created_at']
+
+
+class ExtractedLineItemSerializer(serializers.ModelSerializer):
+    """Extracted line item serializer"""
+    vendor_name = serializers.CharField(source='vendor.name', read_only=True, default=None)
+    
+    class Meta:
+        model = ExtractedLineItem
+        fields = [
+            'id', 'document', 'request', 'document_type', 'vendor', 'vendor_name',
+            'position', 'description', 'normalized_description',
+            'quantity', 'unit_price', 'total', 'currency', 'document_created_at'
+        ]
+        read_only_fields = fields
 
 
 class PurchaseRequestSerializer(serializers.ModelSerializer):
@@ -49,6 +72,8 @@ class PurchaseRequestSerializer(serializers.ModelSerializer):
     documents = DocumentSerializer(many=True, read_only=True)
     can_be_updated = serializers.BooleanField(read_only=True)
     required_approval_levels = serializers.IntegerField(read_only=True)
+    duplicate_warnings = serializers.SerializerMethodField()
+    pending_uploads = serializers.SerializerMethodField()
     
     class Meta:
         model = PurchaseRequest
@@ -56,15 +81,17 @@ class PurchaseRequestSerializer(serializers.ModelSerializer):
             'id', 'organization', 'organization_name',
             'title', 'description', 'amount', 'status',
             'created_by', 'created_by_email', 'created_by_name',
-            'updated_by', 'current_approval_level',
+            'updated_by', 'current_approval_level', 'po_number',
             'proforma_file_url', 'purchase_order_file_url', 'receipt_file_url',
+            'proforma_extraction_status', 'proforma_extraction_error',
             'items', 'approvals', 'documents',
-            'can_be_updated', 'required_approval_levels',
+            'can_be_updated', 'required_approval_levels', 'duplicate_warnings', 'pending_uploads',
             'created_at', 'updated_at'
         ]
         read_only_fields = [
             'id', 'created_by', 'updated_by', 'current_approval_level',
-            'status', 'created_at', 'updated_at'
+            'status', 'proforma_extraction_status', 'proforma_extraction_error',
+            'created_at', 'updated_at'
         ]
     
     def get_created_by_name(self, obj):
@@ -72,20 +99,130 @@ class PurchaseRequestSerializer(serializers.ModelSerializer):
     
     def get_required_approval_levels(self, obj):
         return obj.get_required_approval_levels()
+    
+    def get_duplicate_warnings(self, obj):
+        """Duplicates flagged for the request's current proforma and receipt"""
+        current = {obj.proforma_file_url, obj.receipt_file_url} - {None, ''}
+        return [
+            {**duplicate, 'uploaded_as': fingerprint.document_type}
+            for fingerprint in obj.fingerprints.all()
+            if fingerprint.file_url in current
+            for duplicate in fingerprint.duplicates
+        ]
+    
+    def get_pending_uploads(self, obj):
+        """Latest spooled upload per document type that is not in storage yet (or failed to get there)"""
+        latest = {}
+        for upload in obj.spooled_uploads.all():
+            latest.setdefault(upload.document_type, upload)
+        return [
+            {
+                'id': str(upload.id),
+                'document_type': upload.document_type,
+                'filename': upload.filename,
+                'status': upload.status,
+                'error': upload.error,
+            }
+            for upload in latest.values()
+            if upload.status != upload.Status.STORED
+        ]
+
+
+class DirectUploadSignSerializer(serializers.Serializer):
+    """Request upload parameters for a file the client will send to storage"""
+    document_type = serializers.ChoiceField(
+        choices=[Document.DocumentType.PROFORMA, Document.DocumentType.RECEIPT]
+    )
+    filename = serializers.CharField(max_length=255)
+    content_type = serializers.CharField(max_length=100)
+    size = serializers.IntegerField(min_value=1)
+    
+    def validate(self, attrs):
+        """Same type and size checks as a multipart upload"""
+        try:
+            validate_upload_metadata(attrs['filename'], attrs['content_type'], attrs['size'])
+        except DirectUploadError as e:
+            raise serializers.ValidationError(str(e))
+        return attrs
+
+
+class UploadSessionCreateSerializer(DirectUploadSignSerializer):
+    """Open a chunked upload session: the file as for signing, plus its SHA-256"""
+    checksum = serializers.RegexField(r'^[0-9a-fA-F]{64}$', help_text='Hex SHA-256 of the whole file')
+    
+    def validate(self, attrs):
+        """Multipart type checks, with the larger chunked upload size limit"""
+        try:
+            validate_upload_metadata(
+                attrs['filename'], attrs['content_type'], attrs['size'], max_size_mb=settings.CHUNKED_UPLOAD_MAX_MB
+            )
+        except DirectUploadError as e:
+            raise serializers.ValidationError(str(e))
+        return attrs
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """Upload session progress; `received` is the offset to resume from"""
+    
+    class Meta:
+        model = UploadSession
+        fields = [
+            'id', 'document_type', 'filename', 'content_type', 'size', 'received',
+            'status', 'error', 'created_at', 'updated_at'
+        ]
+        read_only_fields = fields
+
+
+class DirectUploadSerializer(serializers.Serializer):
+    """
+    A file uploaded straight to storage: the token from /api/uploads/
+    plus the storage response, or the token and session returned by a
+    completed chunked upload. Validates to {'file_url': ...}.
+    """
+    token = serializers.CharField()
+    public_id = serializers.CharField(max_length=255)
+    version = serializers.IntegerField(required=False)
+    signature = serializers.CharField(max_length=128, required=False)
+    session = serializers.UUIDField(required=False)
+    resource_type = serializers.CharField(required=False, default='image')
+    format = serializers.CharField(required=False, allow_blank=True, default='')
+    
+    def __init__(self, *args, document_type=None, **kwargs):
+        self.document_type = document_type
+        super().__init__(*args, **kwargs)
+    
+    def validate(self, attrs):
+        if not attrs.get('session') and ('version' not in attrs or 'signature' not in attrs):
+            raise serializers.ValidationError('Send the version and signature of the upload, or its session.')
+        try:
+            file_url = verify_upload(self.context['request'], self.document_type, attrs)
+        except DirectUploadError as e:
+            raise serializers.ValidationError(str(e))
+        return {'file_url': file_url}
 
 
 class PurchaseRequestCreateSerializer(serializers.ModelSerializer):
     """Purchase request create serializer"""
+    # Set when the proforma was spooled for a worker to store (ASYNC_UPLOADS)
+    spooled_upload = None
     items = RequestItemSerializer(many=True, required=False)
     proforma_file = serializers.FileField(required=False, write_only=True)
+    proforma_upload = DirectUploadSerializer(
+        document_type=Document.DocumentType.PROFORMA, required=False, write_only=True
+    )
     
     class Meta:
         model = PurchaseRequest
         fields = [
             'title', 'description', 'amount',
-            'proforma_file', 'items'
+            'proforma_file', 'proforma_upload', 'items'
         ]
     
+    def validate(self, attrs):
+        if attrs.get('proforma_file') and attrs.get('proforma_upload'):
+            raise serializers.ValidationError('Send either proforma_file or proforma_upload, not both.')
+        return attrs
+    
     def validate_proforma_file(self, value):
         """Validate proforma file"""
         if value:
@@ -98,23 +235,33 @@ class PurchaseRequestCreateSerializer(serializers.ModelSerializer):
             is_valid, error = validate_file_size(value, max_size_mb=10)
             if not is_valid:
                 raise serializers.ValidationError(error)
+            
+            # Page count / pixel probe, before anything decodes the file
+            is_valid, error = validate_file_contents(value)
+            if not is_valid:
+                raise serializers.ValidationError(error)
         
         return value
     
     def create(self, validated_data):
         items_data = validated_data.pop('items', [])
         proforma_file = validated_data.pop('proforma_file', None)
+        proforma_upload = validated_data.pop('proforma_upload', None)
         
-        # Upload proforma file to Cloudinary if provided
-        proforma_file_url = None
+        # Upload proforma file to storage if provided
+        proforma_file_url = proforma_upload['file_url'] if proforma_upload else None
         if proforma_file:
-            proforma_file_url = upload_file_to_cloudinary(
+            # Hashed before upload so duplicates are known before any model call
+            fingerprint = fingerprint_upload(proforma_file)
+        if proforma_file and not settings.ASYNC_UPLOADS:
+            proforma_file_url = upload_file_to_storage(
                 proforma_file,
-                folder=f'procure-to-pay/{self.context["request"].user.organization.id}/proformas'
+                folder=f'procure-to-pay/{self.context["request"].user.organization.id}/proformas',
+                organization_id=str(self.context['request'].user.organization.id)
             )
             if not proforma_file_url:
                 raise serializers.ValidationError({
-                    'proforma_file': 'Failed to upload file to Cloudinary. Please try again.'
+                    'proforma_file': 'Failed to upload file. Please try again.'
                 })
         
         # organization and created_by are passed as kwargs from perform_create
@@ -133,21 +280,39 @@ class PurchaseRequestCreateSerializer(serializers.ModelSerializer):
         for item_data in items_data:
             RequestItem.objects.create(request=request, **item_data)
         
+        if proforma_file and settings.ASYNC_UPLOADS:
+            # Stored, fingerprinted and extracted by a worker
+            self.spooled_upload = spool_upload(request, Document.DocumentType.PROFORMA, proforma_file, fingerprint)
+        elif proforma_file:
+            record_upload(request, Document.DocumentType.PROFORMA, proforma_file_url, fingerprint)
+        if proforma_file_url:
+            schedule_proforma_extraction(request, direct_upload=proforma_upload is not None)
+        
         return request
 
 
 class PurchaseRequestUpdateSerializer(serializers.ModelSerializer):
     """Purchase request update serializer"""
+    # Set when the proforma was spooled for a worker to store (ASYNC_UPLOADS)
+    spooled_upload = None
     items = RequestItemSerializer(many=True, required=False)
     proforma_file = serializers.FileField(required=False, write_only=True)
+    proforma_upload = DirectUploadSerializer(
+        document_type=Document.DocumentType.PROFORMA, required=False, write_only=True
+    )
     
     class Meta:
         model = PurchaseRequest
         fields = [
             'title', 'description', 'amount',
-            'proforma_file', 'items'
+            'proforma_file', 'proforma_upload', 'items'
         ]
     
+    def validate(self, attrs):
+        if attrs.get('proforma_file') and attrs.get('proforma_upload'):
+            raise serializers.ValidationError('Send either proforma_file or proforma_upload, not both.')
+        return attrs
+    
     def validate_proforma_file(self, value):
         """Validate proforma file"""
         if value:
@@ -160,22 +325,33 @@ class PurchaseRequestUpdateSerializer(serializers.ModelSerializer):
             is_valid, error = validate_file_size(value, max_size_mb=10)
             if not is_valid:
                 raise serializers.ValidationError(error)
+            
+            # Page count / pixel probe, before anything decodes the file
+            is_valid, error = validate_file_contents(value)
+            if not is_valid:
+                raise serializers.ValidationError(error)
         
         return value
     
     def update(self, instance, validated_data):
         items_data = validated_data.pop('items', None)
         proforma_file = validated_data.pop('proforma_file', None)
+        proforma_upload = validated_data.pop('proforma_upload', None)
+        if proforma_upload:
+            validated_data['proforma_file_url'] = proforma_upload['file_url']
         
-        # Upload new proforma file to Cloudinary if provided
+        # Upload new proforma file to storage if provided
         if proforma_file:
-            proforma_file_url = upload_file_to_cloudinary(
+            fingerprint = fingerprint_upload(proforma_file)
+        if proforma_file and not settings.ASYNC_UPLOADS:
+            proforma_file_url = upload_file_to_storage(
                 proforma_file,
-                folder=f'procure-to-pay/{instance.organization.id}/proformas'
+                folder=f'procure-to-pay/{instance.organization.id}/proformas',
+                organization_id=str(instance.organization.id)
             )
             if not proforma_file_url:
                 raise serializers.ValidationError({
-                    'proforma_file': 'Failed to upload file to Cloudinary. Please try again.'
+                    'proforma_file': 'Failed to upload file. Please try again.'
                 })
             validated_data['proforma_file_url'] = proforma_file_url
         
@@ -194,6 +370,13 @@ class PurchaseRequestUpdateSerializer(serializers.ModelSerializer):
             for item_data in items_data:
                 RequestItem.objects.create(request=instance, **item_data)
         
+        if proforma_file and settings.ASYNC_UPLOADS:
+            self.spooled_upload = spool_upload(instance, Document.DocumentType.PROFORMA, proforma_file, fingerprint)
+        elif proforma_file:
+            record_upload(instance, Document.DocumentType.PROFORMA, instance.proforma_file_url, fingerprint)
+        if proforma_upload or (proforma_file and not settings.ASYNC_UPLOADS):
+            schedule_proforma_extraction(instance, direct_upload=proforma_upload is not None)
+        
         return instance
 
 
@@ -202,14 +385,26 @@ class ApproveRequestSerializer(serializers.Serializer):
     comments = serializers.CharField(required=False, allow_blank=True)
 
 
+class BulkApproveRequestSerializer(serializers.Serializer):
+    """Bulk approve serializer"""
+    ids = serializers.ListField(child=serializers.UUIDField(), allow_empty=False, max_length=100)
+    comments = serializers.CharField(required=False, allow_blank=True)
+
+
 class RejectRequestSerializer(serializers.Serializer):
     """Reject request serializer"""
     comments = serializers.CharField(required=True)
 
 
 class SubmitReceiptSerializer(serializers.Serializer):
-    """Submit receipt serializer"""
-    receipt_file = serializers.FileField(required=True)
+    """Submit receipt serializer: a multipart file or a direct upload"""
+    receipt_file = serializers.FileField(required=False)
+    receipt_upload = DirectUploadSerializer(document_type=Document.DocumentType.RECEIPT, required=False)
+    
+    def validate(self, attrs):
+        if bool(attrs.get('receipt_file')) == bool(attrs.get('receipt_upload')):
+            raise serializers.ValidationError('Send either receipt_file or receipt_upload.')
+        return attrs
     
     def validate_receipt_file(self, value):
         """Validate receipt file"""
@@ -223,5 +418,10 @@ class SubmitReceiptSerializer(serializers.Serializer):
         if not is_valid:
             raise serializers.ValidationError(error)
         
+        # Page count / pixel probe, before anything decodes the file
+        is_valid, error = validate_file_contents(value)
+        if not is_valid:
+            raise serializers.ValidationError(error)
+        
         return value
 
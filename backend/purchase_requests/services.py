@@ -1,7 +1,7 @@
 from django.db import transaction
 from django.core.exceptions import ValidationError
 from .models import PurchaseRequest, Approval
-from documents.tasks import generate_purchase_order_task
+from documents.tasks import generate_purchase_order_task, generate_purchase_orders_task
 from notifications.tasks import send_approval_notification_task
 
 
@@ -65,7 +65,7 @@ class ApprovalWorkflowService:
     
     @staticmethod
     @transaction.atomic
-    def approve_request(request: PurchaseRequest, user, comments: str = "") -> Approval:
+    def approve_request(request: PurchaseRequest, user, comments: str = "", generate_po: bool = True) -> Approval:
         """
         Approve a request at the user's approval level
         
@@ -73,6 +73,8 @@ class ApprovalWorkflowService:
             request: PurchaseRequest instance
             user: User instance (must be approver)
             comments: Optional comments
+            generate_po: Enqueue PO generation on final approval (bulk
+                approval generates the POs in one batch instead)
         
         Returns:
             Approval instance
@@ -118,8 +120,10 @@ class ApprovalWorkflowService:
             request.status = PurchaseRequest.Status.APPROVED
             request.save()
             
-            # Generate PO asynchronously
-            generate_purchase_order_task.delay(str(request.id))
+            # Generate PO asynchronously once the approval is committed
+            if generate_po:
+                request_id = str(request.id)
+                transaction.on_commit(lambda: generate_purchase_order_task.delay(request_id))
             
             # Send notification
             send_approval_notification_task.delay(
@@ -138,6 +142,42 @@ class ApprovalWorkflowService:
         
         return approval
     
+    @staticmethod
+    def approve_requests(requests, user, comments: str = "") -> tuple[list, dict]:
+        """
+        Approve many requests at the user's approval level
+        
+        Each request is approved in its own savepoint, so one that cannot
+        be approved does not undo the others. The POs of the requests given
+        their final approval are generated by one batch task on commit.
+        
+        Args:
+            requests: PurchaseRequest instances
+            user: User instance (must be approver)
+            comments: Optional comments, applied to every approval
+        
+        Returns:
+            tuple: (approvals: list of Approval, errors: dict of request ID -> reason)
+        """
+        approvals, errors, approved_ids = [], {}, []
+        with transaction.atomic():
+            for request in requests:
+                try:
+                    approval = ApprovalWorkflowService.approve_request(
+                        request, user, comments, generate_po=False
+                    )
+                except ValidationError as e:
+                    errors[str(request.id)] = ' '.join(e.messages)
+                    continue
+                approvals.append(approval)
+                if request.status == PurchaseRequest.Status.APPROVED:
+                    approved_ids.append(str(request.id))
+            
+            if approved_ids:
+                transaction.on_commit(lambda: generate_purchase_orders_task.delay(approved_ids))
+        
+        return approvals, errors
+    
     @staticmethod
     @transaction.atomic
     def reject_request(request: PurchaseRequest, user, comments: str = "") -> Approval:
@@ -3,6 +3,7 @@ from unittest.mock import patch, MagicMock
 from functools import wraps
 from io import BytesIO
 from django.core.files.uploadedfile import SimpleUploadedFile
+from reportlab.pdfgen import canvas
 
 
 def mock_cloudinary_upload(return_url='https://cloudinary.com/test-file.pdf'):
@@ -30,7 +31,7 @@ def mock_cloudinary_upload(return_url='https://cloudinary.com/test-file.pdf'):
             'public_id': 'test-public-id'
         }
     
-    return patch('purchase_requests.utils.cloudinary.uploader.upload', side_effect=mock_upload)
+    return patch('documents.storage.cloudinary.uploader.upload', side_effect=mock_upload)
 
 
 def mock_celery_task():
@@ -49,21 +50,44 @@ def mock_celery_task():
     return patch('documents.tasks.process_receipt_task.delay', mock_delay)
 
 
-def mock_file_upload(filename='test.pdf', content_type='application/pdf', content=b'fake pdf content'):
+def mock_pdf(text='fake pdf content', pages=1):
+    """
+    Create a small well-formed PDF for upload tests
+    
+    The same arguments always give the same bytes, so duplicate checks
+    can be tested with it.
+    
+    Args:
+        text: Text drawn on each page
+        pages: Number of pages
+    
+    Returns:
+        PDF content as bytes
+    """
+    out = BytesIO()
+    document = canvas.Canvas(out, invariant=1)
+    for page in range(pages):
+        document.drawString(72, 720, f'{text} - page {page + 1}')
+        document.showPage()
+    document.save()
+    return out.getvalue()
+
+
+def mock_file_upload(filename='test.pdf', content_type='application/pdf', content=None):
     """
     Create a mock file upload for testing
     
     Args:
         filename: Name of the file
         content_type: MIME type of the file
-        content: File content as bytes
+        content: File content as bytes; defaults to mock_pdf()
     
     Returns:
         SimpleUploadedFile instance
     """
     return SimpleUploadedFile(
         name=filename,
-        content=content,
+        content=mock_pdf() if content is None else content,
         content_type=content_type
     )
 
@@ -0,0 +1,160 @@
+"""Tests for resumable chunked uploads"""
+import hashlib
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest.mock import patch
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework import status
+from users.tests.factories import OrganizationFactory, UserFactory
+from users.tests.test_utils import get_authenticated_client
+from documents.storage import LocalStorage
+from .mocks import mock_pdf
+from ..chunked_uploads import purge_expired_sessions, session_path
+from ..models import PurchaseRequest, UploadSession
+
+PDF = mock_pdf('scanned proforma', pages=3)
+CHUNK = 256
+
+
+@override_settings(CHUNKED_UPLOAD_CHUNK_SIZE=CHUNK)
+class ChunkedUploadTests(TestCase):
+    """Tests for /api/upload-sessions/"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        spool = override_settings(UPLOAD_SPOOL_DIR=os.path.join(self.root, 'spool'))
+        spool.enable()
+        self.addCleanup(spool.disable)
+        patcher = patch('documents.storage._storage', LocalStorage(os.path.join(self.root, 'files'), 'http://testserver'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.organization = OrganizationFactory.create()
+        self.staff = UserFactory.create_staff(organization=self.organization)
+        self.client, _ = get_authenticated_client(self.staff, self.organization)
+
+    def start(self, content=PDF, **overrides):
+        data = {'document_type': 'PROFORMA', 'filename': 'scan.pdf', 'content_type': 'application/pdf',
+                'size': len(content), 'checksum': hashlib.sha256(content).hexdigest(), **overrides}
+        return self.client.post('/api/upload-sessions/', data, format='json')
+
+    def put(self, session_id, first, data, total=len(PDF)):
+        return self.client.put(
+            f'/api/upload-sessions/{session_id}/', data, content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {first}-{first + len(data) - 1}/{total}'
+        )
+
+    def send(self, session_id, start=0, end=len(PDF)):
+        for first in range(start, end, CHUNK):
+            response = self.put(session_id, first, PDF[first:min(first + CHUNK, end)])
+            self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return response
+
+    def test_resumed_upload_is_recorded_as_proforma(self):
+        session_id = self.start().data['id']
+        self.send(session_id, end=2 * CHUNK)
+
+        # Connection dropped: a chunk past the offset is refused with the offset to resume from
+        response = self.put(session_id, 3 * CHUNK, PDF[3 * CHUNK:4 * CHUNK])
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['received'], 2 * CHUNK)
+        received = self.client.get(f'/api/upload-sessions/{session_id}/').data['received']
+        self.send(session_id, start=received)
+
+        response = self.client.post(f'/api/upload-sessions/{session_id}/complete/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertFalse(os.path.exists(session_path(UploadSession.objects.get(id=session_id))))
+
+        with patch('documents.tasks.process_proforma_task.run'), self.captureOnCommitCallbacks(execute=True):
+            created = self.client.post('/api/requests/', {
+                'title': 'Scanner', 'description': 'Scanned proforma', 'amount': '90.00',
+                'proforma_upload': response.data,
+            }, format='json')
+        self.assertEqual(created.status_code, status.HTTP_201_CREATED, created.data)
+        file_url = PurchaseRequest.objects.get(title='Scanner').proforma_file_url
+        self.assertEqual(self.client.get(file_url).getvalue(), PDF)
+
+    def test_storage_error_reopens_session(self):
+        """Test that completing can be retried after storage fails, without re-sending chunks"""
+        session_id = self.start().data['id']
+        self.send(session_id)
+
+        with patch('purchase_requests.chunked_uploads.put_document', side_effect=OSError('storage unavailable')), \
+                self.assertRaises(OSError):
+            self.client.post(f'/api/upload-sessions/{session_id}/complete/')
+        session = UploadSession.objects.get(id=session_id)
+        self.assertEqual((session.status, session.error), (UploadSession.Status.OPEN, 'storage unavailable'))
+        self.assertTrue(os.path.exists(session_path(session)))
+
+        response = self.client.post(f'/api/upload-sessions/{session_id}/complete/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        session.refresh_from_db()
+        self.assertEqual((session.status, session.error), (UploadSession.Status.COMPLETE, ''))
+        self.assertFalse(os.path.exists(session_path(session)))
+
+    def test_checksum_mismatch_fails_session(self):
+        session_id = self.start(checksum='0' * 64).data['id']
+        self.send(session_id)
+
+        response = self.client.post(f'/api/upload-sessions/{session_id}/complete/')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        session = UploadSession.objects.get(id=session_id)
+        self.assertEqual(session.status, UploadSession.Status.FAILED)
+        self.assertFalse(os.path.exists(session_path(session)))
+        self.assertEqual(self.put(session_id, 0, PDF[:CHUNK]).status_code, status.HTTP_409_CONFLICT)
+
+    def test_content_is_checked_on_completion(self):
+        content = b'MZ' + PDF[2:]  # Not a PDF after all
+        session_id = self.start(content).data['id']
+        for first in range(0, len(content), CHUNK):
+            self.put(session_id, first, content[first:first + CHUNK])
+
+        response = self.client.post(f'/api/upload-sessions/{session_id}/complete/')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('not application/pdf', response.data['detail'])
+        self.assertEqual(UploadSession.objects.get(id=session_id).status, UploadSession.Status.FAILED)
+
+    def test_chunks_are_checked(self):
+        session_id = self.start().data['id']
+        cases = {
+            'range longer than body': self.client.put(
+                f'/api/upload-sessions/{session_id}/', PDF[:4], content_type='application/octet-stream',
+                HTTP_CONTENT_RANGE=f'bytes 0-7/{len(PDF)}'
+            ),
+            'chunk too large': self.put(session_id, 0, PDF[:CHUNK + 1]),
+            'wrong total': self.put(session_id, 0, PDF[:CHUNK], total=len(PDF) + 1),
+            'no range': self.client.put(f'/api/upload-sessions/{session_id}/', PDF[:CHUNK],
+                                        content_type='application/octet-stream'),
+        }
+        for name, response in cases.items():
+            with self.subTest(name):
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(f'/api/upload-sessions/{session_id}/complete/')
+        self.assertEqual((response.status_code, response.data['received']), (status.HTTP_409_CONFLICT, 0))
+
+    def test_sessions_are_private_and_limited(self):
+        session_id = self.start().data['id']
+        other_client, _ = get_authenticated_client(
+            UserFactory.create_staff(organization=self.organization), self.organization
+        )
+        self.assertEqual(other_client.get(f'/api/upload-sessions/{session_id}/').status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+        # Above the multipart limit, within CHUNKED_UPLOAD_MAX_MB
+        self.assertEqual(self.start(size=30 * 1024 * 1024).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.start(size=51 * 1024 * 1024).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.start(filename='run.exe').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_purge_expired_sessions(self):
+        stale, fresh = (UploadSession.objects.get(id=self.start().data['id']) for _ in range(2))
+        UploadSession.objects.filter(id=stale.id).update(updated_at=timezone.now() - timedelta(days=2))
+
+        self.assertEqual(purge_expired_sessions(), 1)
+        self.assertFalse(os.path.exists(session_path(stale)))
+        self.assertEqual(list(UploadSession.objects.all()), [fresh])
@@ -0,0 +1,204 @@
+"""Tests for signed direct-to-storage uploads"""
+import hashlib
+import shutil
+import tempfile
+from unittest.mock import patch
+import cloudinary
+import cloudinary.exceptions
+import cloudinary.utils
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework import status
+from rest_framework.test import APIClient
+from users.tests.factories import OrganizationFactory, UserFactory
+from users.tests.test_utils import get_authenticated_client
+from documents.storage import LocalStorage
+from .factories import PurchaseRequestFactory
+from .mocks import mock_file_upload, mock_pdf
+from ..direct_uploads import CloudinaryDirectUploadBackend, DirectUploadError, LocalDirectUploadBackend
+from ..models import Document, DocumentFingerprint, PurchaseRequest
+
+PDF = mock_pdf('direct upload')
+
+
+class DirectUploadTests(TestCase):
+    """Tests for /api/uploads/ with the local storage stand-in"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        for name, value in (('documents.storage._storage', LocalStorage(self.root, 'http://testserver')),
+                            ('purchase_requests.direct_uploads._backend', LocalDirectUploadBackend())):
+            patcher = patch(name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.organization = OrganizationFactory.create()
+        self.staff = UserFactory.create_staff(organization=self.organization)
+        self.client, _ = get_authenticated_client(self.staff, self.organization)
+
+    def sign(self, document_type=Document.DocumentType.PROFORMA, client=None, **overrides):
+        data = {'document_type': document_type, 'filename': 'invoice.pdf',
+                'content_type': 'application/pdf', 'size': len(PDF), **overrides}
+        return (client or self.client).post('/api/uploads/', data, format='json')
+
+    def upload(self, ticket, content=PDF):
+        """Send the file to storage the way a browser would: unauthenticated, signed fields only"""
+        response = APIClient().post(ticket['upload_url'], {
+            **ticket['fields'], 'file': mock_file_upload('invoice.pdf', 'application/pdf', content)
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return {'token': ticket['token'], **response.data}
+
+    def test_create_request_with_direct_upload(self):
+        ticket = self.sign().data
+        asset = self.upload(ticket)
+
+        with patch('documents.tasks.process_proforma_task.run') as mock_extract, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/requests/', {
+                'title': 'Chairs', 'description': 'Office chairs', 'amount': '480.00',
+                'proforma_upload': asset,
+            }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        request = PurchaseRequest.objects.get(title='Chairs')
+        self.assertEqual(request.proforma_file_url, asset['secure_url'])
+        mock_extract.assert_called_once_with(str(request.id), asset['secure_url'])
+        # Fingerprinted from storage, since the API never saw the bytes
+        fingerprint = DocumentFingerprint.objects.get(request=request)
+        self.assertEqual(fingerprint.content_hash, hashlib.sha256(PDF).hexdigest())
+        self.assertEqual(self.client.get(asset['secure_url']).getvalue(), PDF)
+
+    def test_submit_receipt_flags_duplicates_from_storage(self):
+        earlier = PurchaseRequestFactory.create(created_by=self.staff, organization=self.organization)
+        DocumentFingerprint.objects.create(
+            organization=self.organization, request=earlier, document_type=Document.DocumentType.RECEIPT,
+            file_url='https://files/earlier.pdf', content_hash=hashlib.sha256(PDF).hexdigest()
+        )
+        request = PurchaseRequestFactory.create(
+            created_by=self.staff, organization=self.organization, status=PurchaseRequest.Status.APPROVED
+        )
+        asset = self.upload(self.sign(Document.DocumentType.RECEIPT).data)
+
+        with patch('documents.tasks.process_receipt_task.run') as mock_process:
+            response = self.client.post(
+                f'/api/requests/{request.id}/submit_receipt/', {'receipt_upload': asset}, format='json'
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        mock_process.assert_called_once_with(str(request.id))
+        fingerprint = DocumentFingerprint.objects.get(request=request)
+        self.assertEqual(fingerprint.duplicates[0]['request'], str(earlier.id))
+
+    def test_upload_must_match_token(self):
+        asset = self.upload(self.sign().data)
+        other_staff = UserFactory.create_staff(organization=self.organization)
+        other_client, _ = get_authenticated_client(other_staff, self.organization)
+        other_asset = self.upload(self.sign(client=other_client).data)
+        receipt_asset = self.upload(self.sign(Document.DocumentType.RECEIPT).data)
+
+        cases = {
+            'another user': (other_asset, 'issued to another user'),
+            'receipt as proforma': (receipt_asset, 'issued for a receipt'),
+            'swapped file': ({**asset, 'public_id': other_asset['public_id']}, 'does not match'),
+            'forged response': ({**asset, 'signature': '0' * 40}, 'signature is invalid'),
+            'forged token': ({**asset, 'token': asset['token'] + 'x'}, 'token is invalid'),
+        }
+        for name, (proforma_upload, error) in cases.items():
+            with self.subTest(name):
+                response = self.client.post('/api/requests/', {
+                    'title': 'Chairs', 'description': 'Office chairs', 'amount': '10.00', 'proforma_upload': proforma_upload,
+                }, format='json')
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertIn(error, str(response.data['proforma_upload']))
+        self.assertFalse(PurchaseRequest.objects.exists())
+
+    def test_expired_token(self):
+        asset = self.upload(self.sign().data)
+        with override_settings(DIRECT_UPLOAD_TTL=-1):
+            response = self.client.post('/api/requests/', {
+                'title': 'Chairs', 'description': 'Office chairs', 'amount': '10.00', 'proforma_upload': asset,
+            }, format='json')
+        self.assertIn('expired', str(response.data['proforma_upload']))
+
+    def test_sign_validates_file(self):
+        self.assertEqual(self.sign(filename='run.exe', content_type='application/x-msdownload').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.sign(size=11 * 1024 * 1024).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(APIClient().post('/api/uploads/', {}).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_local_upload_requires_signed_fields(self):
+        ticket = self.sign().data
+        ticket['fields']['public_id'] = f'procure-to-pay/{self.organization.id}/proformas/other'
+        response = APIClient().post(ticket['upload_url'], {
+            **ticket['fields'], 'file': mock_file_upload('invoice.pdf', 'application/pdf', PDF)
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CloudinaryDirectUploadBackendTests(SimpleTestCase):
+    """Test CloudinaryDirectUploadBackend against Cloudinary's signing scheme"""
+
+    def setUp(self):
+        config = cloudinary.config()
+        previous = (config.cloud_name, config.api_key, config.api_secret)
+        cloudinary.config(cloud_name='demo', api_key='key', api_secret='secret')
+        self.addCleanup(lambda: cloudinary.config(
+            cloud_name=previous[0], api_key=previous[1], api_secret=previous[2]
+        ))
+        self.backend = CloudinaryDirectUploadBackend()
+
+    def test_sign(self):
+        ticket = self.backend.sign('procure-to-pay/1/proformas/abc', http_request=None)
+        fields = dict(ticket['fields'])
+        signature, api_key = fields.pop('signature'), fields.pop('api_key')
+
+        self.assertEqual(ticket['upload_url'], 'https://api.cloudinary.com/v1_1/demo/auto/upload')
+        self.assertEqual(signature, cloudinary.utils.api_sign_request(fields, 'secret'))
+        self.assertEqual(api_key, 'key')
+        self.assertEqual(fields['allowed_formats'], 'pdf,jpg,jpeg,png,webp')
+
+    def signed_asset(self, **extra):
+        public_id, version = 'procure-to-pay/1/proformas/abc', 1700000000
+        signature = cloudinary.utils.api_sign_request(
+            {'public_id': public_id, 'version': version}, 'secret', signature_version=1
+        )
+        return {'public_id': public_id, 'version': version, 'signature': signature, **extra}
+
+    def resource(self, **overrides):
+        return {'public_id': 'procure-to-pay/1/proformas/abc', 'version': 1700000000, 'resource_type': 'image',
+                'format': 'pdf', 'bytes': 120_000, 'pages': 2, 'width': 612, 'height': 792, **overrides}
+
+    def test_verify_builds_url_from_signed_fields(self):
+        asset = self.signed_asset(resource_type='image', format='webp', secure_url='https://evil.example/x.pdf')
+
+        with patch('cloudinary.api.resource', return_value=self.resource()) as mock_resource:
+            url = self.backend.verify(asset, http_request=None)
+            with self.assertRaises(DirectUploadError):
+                self.backend.verify({**asset, 'version': asset['version'] + 1}, http_request=None)
+
+        self.assertEqual(url, f"https://res.cloudinary.com/demo/image/upload/v{asset['version']}/{asset['public_id']}.pdf")
+        mock_resource.assert_called_once_with(asset['public_id'], resource_type='image', type='upload', pages=True)
+
+    @override_settings(UPLOAD_MAX_PDF_PAGES=3, UPLOAD_MAX_IMAGE_PIXELS=1_000_000)
+    def test_verify_checks_stored_asset(self):
+        """Test that size, pages and pixels come from Cloudinary, not from the client's asset fields"""
+        asset = self.signed_asset(bytes=100, pages=1, width=10, height=10)
+        cases = {
+            'too large': self.resource(bytes=11 * 1024 * 1024),
+            'too many pages': self.resource(pages=4),
+            'unreadable pdf': self.resource(pages=None),
+            'too many pixels': self.resource(format='png', pages=None, width=2000, height=1000),
+            'not an allowed format': self.resource(format='gif', pages=None),
+        }
+        for name, resource in cases.items():
+            with self.subTest(name), patch('cloudinary.api.resource', return_value=resource), \
+                    patch('cloudinary.uploader.destroy') as mock_destroy:
+                with self.assertRaises(DirectUploadError):
+                    self.backend.verify(asset, http_request=None)
+                mock_destroy.assert_called_once_with(asset['public_id'], resource_type='image', invalidate=True)
+
+    def test_verify_missing_asset(self):
+        with patch('cloudinary.api.resource', side_effect=cloudinary.exceptions.NotFound('Resource not found')), \
+                self.assertRaisesMessage(DirectUploadError, 'not found'):
+            self.backend.verify(self.signed_asset(), http_request=None)
@@ -0,0 +1,118 @@
+"""Tests for the data.* document filter DSL and GET /api/documents/"""
+from io import StringIO
+from django.core.management import call_command
+from django.db.models import Q
+from django.test import SimpleTestCase, TestCase
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from .factories import PurchaseRequestFactory
+from users.tests.factories import OrganizationFactory, UserFactory
+from users.tests.test_utils import get_authenticated_client
+from ..document_query import MAX_CLAUSES, compile_filters
+from ..models import Document
+
+
+class CompileFiltersTests(SimpleTestCase):
+    """Compilation of data.* parameters into Q objects"""
+
+    def test_equality_compiles_to_containment(self):
+        query = compile_filters([('data.currency', 'EUR'), ('data.total_amount', '120')], containment=True)
+        self.assertEqual(query, Q(extracted_data__contains={'currency': 'EUR'}) &
+                         Q(extracted_data__contains={'total_amount': 120}))
+
+    def test_in_compiles_to_or_of_containment(self):
+        query = compile_filters([('data.payment_method__in', 'card, cash')], containment=True)
+        self.assertEqual(query, Q(extracted_data__contains={'payment_method': 'card'}) |
+                         Q(extracted_data__contains={'payment_method': 'cash'}))
+
+    def test_item_field_uses_array_containment(self):
+        query = compile_filters([('data.items.description', 'A4 Paper')], containment=True)
+        self.assertEqual(query, Q(extracted_data__contains={'items': [{'description': 'A4 Paper'}]}))
+
+    def test_range_and_text_use_key_paths(self):
+        query = compile_filters(
+            [('data.total_amount__gte', '99.5'), ('data.terms__icontains', 'net')], containment=True
+        )
+        self.assertEqual(query, Q(extracted_data__total_amount__gte=99.5) &
+                         Q(extracted_data__terms__icontains='net'))
+
+    def test_equality_without_containment(self):
+        query = compile_filters([('data.currency', 'EUR')], containment=False)
+        self.assertEqual(query, Q(extracted_data__currency='EUR'))
+
+    def test_other_parameters_ignored(self):
+        self.assertEqual(compile_filters([('page', '2'), ('ordering', 'created_at')]), Q())
+
+    def test_rejects_unknown_fields_operators_and_values(self):
+        invalid = [
+            [('data.password', 'x')],
+            [('data.currency__regex', '.*')],
+            [('data.items.description__icontains', 'paper')],
+            [('data.total_amount__gte', 'lots')],
+            [('data.total_amount', 'NaN')],
+            [('data.date__gte', '2024-01-01')],
+            [('data.currency__in', ' , ')],
+            [('data.currency', 'EUR')] * (MAX_CLAUSES + 1),
+        ]
+        for params in invalid:
+            with self.assertRaises(ValidationError, msg=params):
+                compile_filters(params, containment=True)
+
+
+class DocumentViewTests(TestCase):
+    """Tests for GET /api/documents/"""
+
+    def setUp(self):
+        self.organization = OrganizationFactory.create()
+        self.staff = UserFactory.create_staff(organization=self.organization)
+        self.approver = UserFactory.create_approver(approval_level=1, organization=self.organization)
+        own = PurchaseRequestFactory.create(created_by=self.staff, organization=self.organization)
+        other = PurchaseRequestFactory.create(organization=self.organization)
+
+        self.proforma = Document.objects.create(
+            request=own, document_type=Document.DocumentType.PROFORMA, file_url='https://example.com/1.pdf',
+            extracted_data={'currency': 'EUR', 'terms': 'Net 30', 'total_amount': 120.0,
+                            'items': [{'description': 'A4 Paper', 'quantity': 10, 'unit_price': 12}]},
+        )
+        self.receipt = Document.objects.create(
+            request=other, document_type=Document.DocumentType.RECEIPT, file_url='https://example.com/2.pdf',
+            extracted_data={'currency': 'USD', 'payment_method': 'card', 'total_amount': 80,
+                            'items': [{'description': 'Toner', 'quantity': 1, 'unit_price': 80}]},
+        )
+
+    def ids(self, query, user=None):
+        client, _ = get_authenticated_client(user or self.approver, self.organization)
+        response = client.get(f'/api/documents/?{query}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return {d['id'] for d in response.data.get('results', response.data)}
+
+    def test_visibility(self):
+        self.assertEqual(self.ids(''), {self.proforma.id, self.receipt.id})
+        self.assertEqual(self.ids('', user=self.staff), {self.proforma.id})
+
+    def test_data_filters(self):
+        self.assertEqual(self.ids('data.currency=EUR'), {self.proforma.id})
+        self.assertEqual(self.ids('data.payment_method__in=cash,card'), {self.receipt.id})
+        self.assertEqual(self.ids('data.total_amount__gte=100'), {self.proforma.id})
+        self.assertEqual(self.ids('data.total_amount=80'), {self.receipt.id})
+        self.assertEqual(self.ids('data.terms__icontains=net'), {self.proforma.id})
+        self.assertEqual(self.ids('data.items.description=Toner'), {self.receipt.id})
+        self.assertEqual(self.ids('data.currency=EUR&document_type=RECEIPT'), set())
+
+    def test_invalid_filter_rejected(self):
+        client, _ = get_authenticated_client(self.approver, self.organization)
+        response = client.get('/api/documents/?data.secret=1')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('data.secret', response.data)
+
+
+class BenchmarkDocumentQueryTests(TestCase):
+    """The benchmark command runs and leaves no data behind"""
+
+    def test_rolls_back(self):
+        out = StringIO()
+        call_command('benchmark_document_query', '--documents', '300', '--requests', '5',
+                     '--batch-size', '100', '--repeat', '1', stdout=out)
+        self.assertIn('rolled back', out.getvalue())
+        self.assertIn('item description', out.getvalue())
+        self.assertEqual(Document.objects.count(), 0)
@@ -0,0 +1,116 @@
+"""Tests for upload content checks (magic bytes, page count, pixels)"""
+import struct
+import zlib
+from io import BytesIO
+from django.test import SimpleTestCase, TestCase, override_settings
+from PIL import Image
+from rest_framework import status
+from users.tests.factories import OrganizationFactory, UserFactory
+from users.tests.test_utils import get_authenticated_client
+from .mocks import mock_cloudinary_upload, mock_file_upload, mock_pdf
+from ..utils import SNIFF_BYTES, has_pdf_trailer, sniff_content_type, validate_file_contents, validate_file_type
+
+
+def pdf(pages: int) -> bytes:
+    return mock_pdf('Proforma', pages=pages)
+
+
+def image(image_format: str, size=(40, 30)) -> bytes:
+    out = BytesIO()
+    Image.new('RGB', size, 'white').save(out, image_format)
+    return out.getvalue()
+
+
+def png_claiming(width: int, height: int) -> bytes:
+    """A tiny PNG whose header claims width x height pixels"""
+    content = image('PNG')
+    header = b'IHDR' + struct.pack('>II', width, height) + content[24:29]
+    return content[:12] + header + struct.pack('>I', zlib.crc32(header)) + content[33:]
+
+
+class CountingFile(BytesIO):
+    """Records how many bytes were read"""
+    bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+class SniffTest(SimpleTestCase):
+    """Test magic byte checks in validate_file_type"""
+
+    def test_content_must_match_declared_type(self):
+        cases = {
+            ('invoice.pdf', 'application/pdf', pdf(1)): True,
+            ('photo.jpg', 'image/jpg', image('JPEG')): True,
+            ('photo.png', 'image/png', image('PNG')): True,
+            ('photo.webp', 'image/webp', image('WEBP')): True,
+            ('invoice.pdf', 'application/pdf', b'MZ\x90\x00 executable'): False,
+            ('photo.jpg', 'image/jpeg', image('PNG')): False,
+            ('page.pdf', 'application/pdf', b'<html>%PDF-</html>'.rjust(2048)): False,
+        }
+        for (name, content_type, content), expected in cases.items():
+            with self.subTest(name=name, content_type=content_type, content=content[:8]):
+                is_valid, _ = validate_file_type(mock_file_upload(name, content_type, content))
+                self.assertEqual(is_valid, expected)
+
+    def test_reads_only_the_head(self):
+        file = CountingFile(pdf(1) + b'\0' * (1024 * 1024))
+        file.seek(10)
+
+        self.assertEqual(sniff_content_type(file), 'application/pdf')
+        self.assertEqual(file.bytes_read, SNIFF_BYTES)
+        self.assertEqual(file.tell(), 10)
+
+
+@override_settings(UPLOAD_MAX_PDF_PAGES=3, UPLOAD_MAX_IMAGE_PIXELS=1_000_000)
+class ProbeTest(SimpleTestCase):
+    """Test validate_file_contents"""
+
+    def test_page_and_pixel_limits(self):
+        cases = {
+            'pdf at the limit': (pdf(3), 'application/pdf', True),
+            'pdf over the limit': (pdf(4), 'application/pdf', False),
+            'no trailer': (b'%PDF-1.4 no xref', 'application/pdf', False),
+            'truncated pdf': (pdf(2)[:-200], 'application/pdf', False),
+            'unreadable page tree': (b'%PDF-1.4\n1 0 obj garbage\nstartxref\n9\n%%EOF\n', 'application/pdf', False),
+            'image': (image('JPEG', (1000, 1000)), 'image/jpeg', True),
+            'decompression bomb': (png_claiming(2000, 2000), 'image/png', False),
+            'bomb beyond the Pillow limit': (png_claiming(65000, 65000), 'image/png', False),
+            'unreadable image': (image('PNG')[:20], 'image/png', False),
+        }
+        for name, (content, content_type, expected) in cases.items():
+            with self.subTest(name):
+                is_valid, error = validate_file_contents(BytesIO(content), content_type)
+                self.assertEqual(is_valid, expected, error)
+
+
+    def test_pdf_trailer_is_read_from_the_tail(self):
+        file = CountingFile(pdf(1).replace(b'%%EOF', b'%%EOF' + b'\0' * 100))
+        file.seek(10)
+
+        self.assertTrue(has_pdf_trailer(file))
+        self.assertLessEqual(file.bytes_read, 1024)
+        self.assertEqual(file.tell(), 10)
+        self.assertFalse(has_pdf_trailer(BytesIO(b'%PDF-1.4 %%EOF startxref')))
+
+
+@override_settings(UPLOAD_MAX_PDF_PAGES=3)
+class UploadProbeTest(TestCase):
+    """Content checks on the request API"""
+
+    def test_long_pdf_is_rejected_before_upload(self):
+        organization = OrganizationFactory.create()
+        client, _ = get_authenticated_client(UserFactory.create_staff(organization=organization), organization)
+
+        with mock_cloudinary_upload() as mock_upload:
+            response = client.post('/api/requests/', {
+                'title': 'Catalogue', 'description': 'Printed catalogue', 'amount': '100.00',
+                'proforma_file': mock_file_upload('catalogue.pdf', 'application/pdf', pdf(4)),
+            }, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('4 pages', str(response.data['proforma_file']))
+        mock_upload.assert_not_called()
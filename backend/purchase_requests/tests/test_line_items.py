@@ -0,0 +1,196 @@
+"""Tests for the extracted line item projection and its endpoints"""
+from decimal import Decimal
+from io import StringIO
+from django.core.management import call_command
+from django.test import TestCase
+from rest_framework import status
+from .factories import PurchaseRequestFactory
+from users.tests.factories import OrganizationFactory, UserFactory
+from users.tests.test_utils import get_authenticated_client
+from vendors.models import Vendor
+from ..models import Approval, Document, ExtractedLineItem, PurchaseRequest, normalize_description
+
+
+def invoice(*items, currency='USD'):
+    return {
+        'currency': currency,
+        'items': [
+            {'description': description, 'quantity': quantity, 'unit_price': unit_price,
+             'total': quantity * unit_price}
+            for description, quantity, unit_price in items
+        ],
+    }
+
+
+class LineItemProjectionTests(TestCase):
+    """Document.save keeps ExtractedLineItem rows in step with extracted_data"""
+
+    def setUp(self):
+        self.organization = OrganizationFactory.create()
+        self.staff = UserFactory.create_staff(organization=self.organization)
+        self.request = PurchaseRequestFactory.create(created_by=self.staff, organization=self.organization)
+        self.vendor = Vendor.objects.create(organization=self.organization, name='Acme', normalized_name='acme')
+
+    def test_normalize_description(self):
+        self.assertEqual(normalize_description('  A4 Paper, 80gsm (White)! '), 'a4 paper 80gsm white')
+        self.assertEqual(normalize_description(None), '')
+
+    def test_rows_created_on_save(self):
+        document = Document.objects.create(
+            request=self.request,
+            document_type=Document.DocumentType.PROFORMA,
+            file_url='https://example.com/p.pdf',
+            extracted_data=invoice(('A4 Paper', 10, 4.5), ('Toner Black', 2, 60)),
+            vendor=self.vendor,
+        )
+        rows = list(ExtractedLineItem.objects.filter(document=document).order_by('position'))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0].normalized_description, 'a4 paper')
+        self.assertEqual(rows[0].unit_price, Decimal('4.5'))
+        self.assertEqual(rows[1].total, Decimal('120'))
+        self.assertEqual(rows[0].organization_id, self.organization.id)
+        self.assertEqual(rows[0].vendor_id, self.vendor.id)
+        self.assertEqual(rows[0].currency, 'USD')
+        self.assertEqual(rows[0].document_created_at, document.created_at)
+
+    def test_rows_replaced_on_update(self):
+        document = Document.objects.create(
+            request=self.request,
+            document_type=Document.DocumentType.RECEIPT,
+            file_url='https://example.com/r.pdf',
+            extracted_data=invoice(('A4 Paper', 10, 4.5), ('Toner Black', 2, 60)),
+        )
+        document.extracted_data = invoice(('Stapler', 1, 3))
+        document.vendor = self.vendor
+        document.save(update_fields=['extracted_data', 'vendor'])
+
+        rows = list(document.line_items.all())
+        self.assertEqual([r.description for r in rows], ['Stapler'])
+        self.assertEqual(rows[0].vendor_id, self.vendor.id)
+
+    def test_unreadable_values_are_null(self):
+        document = Document.objects.create(
+            request=self.request,
+            document_type=Document.DocumentType.RECEIPT,
+            file_url='https://example.com/r.pdf',
+            extracted_data={'items': [{'description': 'Misc', 'quantity': 'some', 'unit_price': '1e20'}, 'junk']},
+        )
+        row = document.line_items.get()
+        self.assertIsNone(row.quantity)
+        self.assertIsNone(row.unit_price)
+
+    def test_backfill_command(self):
+        document = Document.objects.create(
+            request=self.request,
+            document_type=Document.DocumentType.PO,
+            file_url='https://example.com/po.pdf',
+            extracted_data=invoice(('A4 Paper', 10, 4.5)),
+        )
+        ExtractedLineItem.objects.all().delete()
+
+        out = StringIO()
+        call_command('backfill_line_items', '--chunk-size', '1', stdout=out, stderr=StringIO())
+
+        self.assertEqual(document.line_items.count(), 1)
+        self.assertIn('Projected 1 line items from 1 documents', out.getvalue())
+
+        # Already projected documents are skipped unless rebuilding
+        out = StringIO()
+        call_command('backfill_line_items', stdout=out, stderr=StringIO())
+        self.assertIn('from 0 documents', out.getvalue())
+        call_command('backfill_line_items', '--rebuild', stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(document.line_items.count(), 1)
+
+
+class LineItemViewTests(TestCase):
+    """Tests for GET /api/line-items/"""
+
+    def setUp(self):
+        self.organization = OrganizationFactory.create()
+        self.staff = UserFactory.create_staff(organization=self.organization)
+        self.other_staff = UserFactory.create_staff(organization=self.organization)
+        self.approver = UserFactory.create_approver(approval_level=1, organization=self.organization)
+        self.other_approver = UserFactory.create_approver(approval_level=2, organization=self.organization)
+        self.acme = Vendor.objects.create(organization=self.organization, name='Acme', normalized_name='acme')
+        self.globex = Vendor.objects.create(organization=self.organization, name='Globex', normalized_name='globex')
+
+        own = PurchaseRequestFactory.create(created_by=self.staff, organization=self.organization)
+        other = PurchaseRequestFactory.create(
+            created_by=self.other_staff, organization=self.organization, status=PurchaseRequest.Status.APPROVED
+        )
+        # The approver can open `own` (pending at level 1) and `other` (reviewed by them)
+        Approval.objects.create(
+            request=other, approver=self.approver, approval_level=1, action=Approval.Action.APPROVED
+        )
+        Document.objects.create(
+            request=own, document_type=Document.DocumentType.PROFORMA, file_url='https://example.com/1.pdf',
+            extracted_data=invoice(('A4 Paper', 10, 4.0), ('Toner Black', 2, 60)), vendor=self.acme,
+        )
+        Document.objects.create(
+            request=other, document_type=Document.DocumentType.RECEIPT, file_url='https://example.com/2.pdf',
+            extracted_data=invoice(('A4 paper', 5, 5.0)), vendor=self.globex,
+        )
+        Document.objects.create(
+            request=other, document_type=Document.DocumentType.PO, file_url='https://example.com/3.pdf',
+            extracted_data=invoice(('a4 PAPER', 5, 6.0)), vendor=self.globex,
+        )
+
+        other_org = OrganizationFactory.create()
+        outsider = PurchaseRequestFactory.create(organization=other_org)
+        Document.objects.create(
+            request=outsider, document_type=Document.DocumentType.PO, file_url='https://example.com/4.pdf',
+            extracted_data=invoice(('A4 Paper', 1, 1.0)),
+        )
+
+    def get(self, user, url):
+        client, _ = get_authenticated_client(user, self.organization)
+        return client.get(url)
+
+    def results(self, response):
+        return response.data.get('results', response.data)
+
+    def test_staff_see_own_items_only(self):
+        response = self.get(self.staff, '/api/line-items/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(self.results(response)), 2)
+
+    def test_approver_sees_requests_they_can_open(self):
+        response = self.get(self.approver, '/api/line-items/')
+        self.assertEqual(len(self.results(response)), 4)
+
+    def test_approver_does_not_see_other_requests(self):
+        """Test that a level 2 approver sees neither the level 1 request nor one they did not review"""
+        response = self.get(self.other_approver, '/api/line-items/')
+        self.assertEqual(self.results(response), [])
+        response = self.get(self.other_approver, '/api/line-items/price-history/?description=A4+Paper')
+        self.assertEqual(response.data['results'], [])
+
+    def test_filters(self):
+        by_description = self.results(self.get(self.approver, '/api/line-items/?description=a4%20paper'))
+        self.assertEqual(len(by_description), 3)
+        by_text = self.results(self.get(self.approver, '/api/line-items/?q=toner'))
+        self.assertEqual([r['description'] for r in by_text], ['Toner Black'])
+        by_type = self.results(self.get(self.approver, '/api/line-items/?document_type=RECEIPT'))
+        self.assertEqual(len(by_type), 1)
+        by_vendor = self.results(self.get(self.approver, f'/api/line-items/?vendor={self.globex.id}'))
+        self.assertEqual({r['vendor_name'] for r in by_vendor}, {'Globex'})
+
+    def test_invalid_filters_rejected(self):
+        for query in ('document_type=INVOICE', 'vendor=acme', 'request=nope'):
+            response = self.get(self.approver, f'/api/line-items/?{query}')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+
+    def test_price_history(self):
+        response = self.get(self.approver, '/api/line-items/price-history/?description=A4+Paper')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['description'], 'a4 paper')
+        by_vendor = {row['vendor_name']: row for row in response.data['results']}
+        self.assertEqual(by_vendor['Acme']['count'], 1)
+        self.assertEqual(by_vendor['Globex']['count'], 2)
+        self.assertEqual(by_vendor['Globex']['min_unit_price'], 5.0)
+        self.assertEqual(by_vendor['Globex']['max_unit_price'], 6.0)
+        self.assertEqual(by_vendor['Globex']['avg_unit_price'], 5.5)
+
+    def test_price_history_requires_description(self):
+        response = self.get(self.approver, '/api/line-items/price-history/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
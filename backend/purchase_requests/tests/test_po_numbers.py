@@ -0,0 +1,72 @@
+"""Tests for sequential PO numbers"""
+from django.db import transaction
+from django.test import TestCase
+from .factories import PurchaseRequestFactory
+from ..models import PONumberSequence, PurchaseRequest
+from ..po_numbers import PONumberAllocator, assign_po_number, po_number_gaps
+
+
+class _Rollback(Exception):
+    pass
+
+
+class PONumberAllocatorTest(TestCase):
+    """Test PONumberAllocator and assign_po_number"""
+
+    def setUp(self):
+        self.request = PurchaseRequestFactory.create()
+        self.organization = self.request.organization
+
+    def make_request(self, organization=None):
+        return PurchaseRequestFactory.create(organization=organization or self.organization)
+
+    def test_numbers_are_sequential_per_organization(self):
+        allocator = PONumberAllocator(block_size=5)
+        numbers = [assign_po_number(self.make_request(), allocator) for _ in range(3)]
+        other = PurchaseRequestFactory.create()
+        other.organization.set_setting('po_number_prefix', 'ACME')
+
+        self.assertEqual(numbers, ['PO-000001', 'PO-000002', 'PO-000003'])
+        self.assertEqual(assign_po_number(other, allocator), 'ACME-000001')
+
+    def test_blocks_are_reserved_once(self):
+        allocator = PONumberAllocator(block_size=5)
+        self.assertEqual(allocator.allocate(self.organization.id), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual([allocator.allocate(self.organization.id) for _ in range(4)], [2, 3, 4, 5])
+        self.assertEqual(allocator.allocate(self.organization.id), 6)
+        self.assertEqual(PONumberSequence.objects.get(organization=self.organization).last_reserved, 10)
+
+    def test_assign_is_idempotent(self):
+        allocator = PONumberAllocator(block_size=5)
+        po_number = assign_po_number(self.request, allocator)
+        stale = PurchaseRequest.objects.get(id=self.request.id)
+        stale.po_number, stale.po_sequence = '', None
+
+        # A concurrent run that lost keeps the winner's number and gives its own back
+        self.assertEqual(assign_po_number(stale, allocator), po_number)
+        self.assertEqual(assign_po_number(self.make_request(), allocator), 'PO-000002')
+
+    def test_rolled_back_block_is_replaced(self):
+        stale = PONumberAllocator(block_size=5)
+        try:
+            with transaction.atomic():
+                stale.allocate(self.organization.id)
+                raise _Rollback
+        except _Rollback:
+            pass
+        # The rolled back numbers are reserved and used again elsewhere
+        other = PONumberAllocator(block_size=5)
+        for _ in range(2):
+            assign_po_number(self.make_request(), other)
+
+        self.assertEqual(assign_po_number(self.request, stale), 'PO-000006')
+
+    def test_gaps(self):
+        allocator = PONumberAllocator(block_size=10)
+        for _ in range(3):
+            assign_po_number(self.make_request(), allocator)
+        PurchaseRequest.objects.filter(po_sequence=2).update(po_sequence=None, po_number='')
+
+        self.assertEqual(po_number_gaps(self.organization.id), [(2, 2), (4, 10)])
+        self.assertEqual(po_number_gaps(PurchaseRequestFactory.create().organization_id), [])
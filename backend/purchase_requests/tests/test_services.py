@@ -79,3 +79,20 @@ class ApprovalWorkflowServiceTest(TestCase):
         self.request.refresh_from_db()
         self.assertEqual(self.request.status, PurchaseRequest.Status.REJECTED)
 
+    
+    def test_approve_requests_isolates_failures(self):
+        """Test that one request that cannot be approved does not undo the others"""
+        rejected = PurchaseRequest.objects.create(
+            organization=self.org,
+            title='Rejected Request',
+            description='Test Description',
+            amount=500.00,
+            created_by=self.staff,
+            status=PurchaseRequest.Status.REJECTED
+        )
+        approvals, errors = ApprovalWorkflowService.approve_requests(
+            [self.request, rejected], self.approver1, 'Bulk'
+        )
+        self.assertEqual([a.request_id for a in approvals], [self.request.id])
+        self.assertEqual(errors, {str(rejected.id): 'Request is not pending'})
+        self.assertFalse(Approval.objects.filter(request=rejected).exists())
@@ -0,0 +1,126 @@
+"""Tests for asynchronous (spooled) uploads"""
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+import cloudinary.exceptions
+from django.test import TestCase, override_settings
+from rest_framework import status
+from users.tests.factories import OrganizationFactory, UserFactory
+from users.tests.test_utils import get_authenticated_client
+from documents.tasks import apply_spooled_upload
+from .factories import PurchaseRequestFactory
+from .mocks import mock_cloudinary_upload, mock_file_upload, mock_pdf
+from ..models import Document, DocumentFingerprint, PurchaseRequest, SpooledUpload
+from ..upload_spool import spool_path
+
+STORED_URL = 'https://cloudinary.com/spooled.pdf'
+
+
+class SpooledUploadTests(TestCase):
+    """Tests for ASYNC_UPLOADS"""
+
+    def setUp(self):
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir)
+        async_uploads = override_settings(ASYNC_UPLOADS=True, UPLOAD_SPOOL_DIR=spool_dir)
+        async_uploads.enable()
+        self.addCleanup(async_uploads.disable)
+
+        self.organization = OrganizationFactory.create()
+        self.staff = UserFactory.create_staff(organization=self.organization)
+        self.client, _ = get_authenticated_client(self.staff, self.organization)
+
+    def test_create_returns_202_before_storage(self):
+        with mock_cloudinary_upload(STORED_URL) as mock_upload, \
+                patch('documents.tasks.process_proforma_task.delay') as mock_extract:
+            with self.captureOnCommitCallbacks() as callbacks:
+                response = self.client.post('/api/requests/', {
+                    'title': 'Chairs', 'description': 'Office chairs', 'amount': '480.00',
+                    'proforma_file': mock_file_upload('proforma.pdf', 'application/pdf', mock_pdf('chairs')),
+                }, format='multipart')
+
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            self.assertIsNone(response.data['proforma_file_url'])
+            [pending] = response.data['pending_uploads']
+            self.assertEqual((pending['document_type'], pending['status']), ('PROFORMA', 'PENDING'))
+            upload = SpooledUpload.objects.get(id=pending['id'])
+            self.assertTrue(os.path.exists(spool_path(upload)))
+            mock_upload.assert_not_called()
+
+            # The worker stores the file, then extraction starts
+            with self.captureOnCommitCallbacks(execute=True):
+                for callback in callbacks:
+                    callback()
+
+        request = PurchaseRequest.objects.get(id=response.data['id'])
+        upload.refresh_from_db()
+        self.assertEqual(request.proforma_file_url, STORED_URL)
+        self.assertEqual((upload.status, upload.file_url), (SpooledUpload.Status.STORED, STORED_URL))
+        self.assertFalse(os.path.exists(spool_path(upload)))
+        mock_upload.assert_called_once()
+        mock_extract.assert_called_once_with(str(request.id), STORED_URL)
+        self.assertTrue(DocumentFingerprint.objects.filter(request=request, file_url=STORED_URL).exists())
+        self.assertEqual(self.client.get(f'/api/requests/{request.id}/').data['pending_uploads'], [])
+
+    def test_submit_receipt_reports_duplicates_at_once(self):
+        earlier, request = (
+            PurchaseRequestFactory.create(
+                created_by=self.staff, organization=self.organization, status=PurchaseRequest.Status.APPROVED
+            )
+            for _ in range(2)
+        )
+        with mock_cloudinary_upload(STORED_URL), \
+                patch('documents.tasks.process_receipt_task.delay') as mock_process:
+            for target in (earlier, request):
+                with self.captureOnCommitCallbacks(execute=True):
+                    response = self.client.post(f'/api/requests/{target.id}/submit_receipt/', {
+                        'receipt_file': mock_file_upload('receipt.pdf', 'application/pdf', mock_pdf('receipt'))
+                    }, format='multipart')
+                self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        self.assertEqual(response.data['upload']['status'], 'PENDING')
+        self.assertEqual(response.data['duplicates'][0]['request'], str(earlier.id))
+        self.assertEqual(mock_process.call_count, 2)
+        request.refresh_from_db()
+        self.assertEqual(request.receipt_file_url, STORED_URL)
+
+    @override_settings(TASK_RETRY_MAX=0)
+    def test_failed_storage_is_reported(self):
+        request = PurchaseRequestFactory.create(created_by=self.staff, organization=self.organization)
+        with patch('documents.storage.cloudinary.uploader.upload',
+                   side_effect=cloudinary.exceptions.BadRequest('Invalid image file')), \
+                self.assertRaises(cloudinary.exceptions.BadRequest), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/api/requests/{request.id}/', {
+                'proforma_file': mock_file_upload('proforma.pdf', 'application/pdf'),
+            }, format='multipart')
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        upload = SpooledUpload.objects.get(request=request)
+        self.assertEqual(upload.status, SpooledUpload.Status.FAILED)
+        self.assertFalse(os.path.exists(spool_path(upload)))
+        [pending] = self.client.get(f'/api/requests/{request.id}/').data['pending_uploads']
+        self.assertEqual((pending['status'], pending['error']), ('FAILED', 'Invalid image file'))
+        request.refresh_from_db()
+        self.assertIsNone(request.proforma_file_url)
+
+    def test_superseded_upload_is_not_applied(self):
+        request = PurchaseRequestFactory.create(created_by=self.staff, organization=self.organization)
+        older, newer = (
+            SpooledUpload.objects.create(
+                request=request, document_type=Document.DocumentType.PROFORMA, filename=name,
+                content_type='application/pdf', size=1, spool_name=name, content_hash=name * 8
+            )
+            for name in ('old.pdf', 'new.pdf')
+        )
+        with patch('documents.tasks.process_proforma_task.delay') as mock_extract, \
+                self.captureOnCommitCallbacks(execute=True):
+            apply_spooled_upload(newer, 'https://files/new.pdf')
+            apply_spooled_upload(older, 'https://files/old.pdf')
+
+        request.refresh_from_db()
+        self.assertEqual(request.proforma_file_url, 'https://files/new.pdf')
+        mock_extract.assert_called_once_with(str(request.id), 'https://files/new.pdf')
+        older.refresh_from_db()
+        self.assertEqual(older.status, SpooledUpload.Status.STORED)
@@ -1,4 +1,5 @@
 """Unit tests for purchase request endpoints"""
+from unittest.mock import patch
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from rest_framework import status
@@ -312,7 +313,8 @@ class PurchaseRequestCreateViewTests(TestCase):
     
     def test_proforma_file_upload(self):
         """Test proforma file upload with mocked Cloudinary"""
-        with mock_cloudinary_upload(return_url='https://cloudinary.com/test-proforma.pdf'):
+        with mock_cloudinary_upload(return_url='https://cloudinary.com/test-proforma.pdf'), \
+                patch('documents.tasks.process_proforma_task.delay') as mock_delay:
             client, _ = get_authenticated_client(self.staff, self.organization)
             
             test_file = mock_file_upload('test.pdf', 'application/pdf')
@@ -324,12 +326,16 @@ class PurchaseRequestCreateViewTests(TestCase):
                 'proforma_file': test_file
             }
             
-            response = client.post('/api/requests/', data, format='multipart')
+            with self.captureOnCommitCallbacks(execute=True):
+                response = client.post('/api/requests/', data, format='multipart')
             
             self.assertEqual(response.status_code, status.HTTP_201_CREATED)
             # Check that proforma_file_url is in the response
             self.assertIsNotNone(response.data.get('proforma_file_url'))
             self.assertEqual(response.data.get('proforma_file_url'), 'https://cloudinary.com/test-proforma.pdf')
+            # Extraction starts speculatively at upload time
+            self.assertEqual(response.data.get('proforma_extraction_status'), 'PENDING')
+            mock_delay.assert_called_once_with(response.data['id'], 'https://cloudinary.com/test-proforma.pdf')
     
     def test_validation_error_missing_fields(self):
         """Test validation error for missing required fields"""
@@ -665,6 +671,59 @@ class PurchaseRequestApproveViewTests(TestCase):
         ).exists())
 
 
+class PurchaseRequestBulkApproveViewTests(TestCase):
+    """Tests for POST /api/requests/bulk-approve/"""
+    
+    def setUp(self):
+        self.organization = OrganizationFactory.create(settings={'approval_levels_count': 1})
+        self.staff = UserFactory.create_staff(organization=self.organization)
+        self.approver = UserFactory.create_approver(approval_level=1, organization=self.organization)
+        self.requests = [
+            PurchaseRequestFactory.create(
+                created_by=self.staff,
+                organization=self.organization,
+                status=PurchaseRequest.Status.PENDING
+            )
+            for _ in range(3)
+        ]
+    
+    @patch('purchase_requests.services.generate_purchase_orders_task.delay')
+    @patch('purchase_requests.services.generate_purchase_order_task.delay')
+    def test_final_approvals_generate_pos_in_one_batch(self, mock_single, mock_batch):
+        """Test that finally approved requests are handed to one batch PO task"""
+        client, _ = get_authenticated_client(self.approver, self.organization)
+        other_org_request = PurchaseRequestFactory.create(status=PurchaseRequest.Status.PENDING)
+        self.requests[2].status = PurchaseRequest.Status.REJECTED
+        self.requests[2].save()
+        ids = [str(r.id) for r in self.requests] + [str(other_org_request.id)]
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post('/api/requests/bulk-approve/', {'ids': ids}, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            {a['request'] for a in response.data['approved']},
+            {str(self.requests[0].id), str(self.requests[1].id)}
+        )
+        self.assertEqual(response.data['errors'], {
+            str(self.requests[2].id): 'Not found.',
+            str(other_org_request.id): 'Not found.',
+        })
+        mock_single.assert_not_called()
+        mock_batch.assert_called_once()
+        self.assertEqual(sorted(mock_batch.call_args.args[0]), sorted(ids[:2]))
+        self.requests[0].refresh_from_db()
+        self.assertEqual(self.requests[0].status, PurchaseRequest.Status.APPROVED)
+    
+    def test_staff_cannot_bulk_approve(self):
+        """Test that non-approvers cannot bulk approve"""
+        client, _ = get_authenticated_client(self.staff, self.organization)
+        response = client.post(
+            '/api/requests/bulk-approve/', {'ids': [str(self.requests[0].id)]}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
 class PurchaseRequestRejectViewTests(TestCase):
     """Tests for PATCH /api/requests/{id}/reject/"""
     
@@ -841,3 +900,39 @@ class PurchaseRequestSubmitReceiptViewTests(TestCase):
         
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
+
+
+class ExtractionStatusViewTests(TestCase):
+    """Tests for GET /api/requests/{id}/extraction-status/"""
+    
+    def setUp(self):
+        self.organization = OrganizationFactory.create()
+        self.staff = UserFactory.create_staff(organization=self.organization)
+        self.other_staff = UserFactory.create_staff(organization=OrganizationFactory.create())
+    
+    def test_returns_extraction_status(self):
+        """Test that the status endpoint returns only the extraction fields"""
+        request = PurchaseRequestFactory.create(
+            created_by=self.staff,
+            organization=self.organization,
+            proforma_file_url='https://files/proforma.pdf',
+            proforma_extraction_status=PurchaseRequest.ExtractionStatus.FAILED,
+            proforma_extraction_error='unreadable scan'
+        )
+        client, _ = get_authenticated_client(self.staff, self.organization)
+        
+        response = client.get(f'/api/requests/{request.id}/extraction-status/')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['proforma_extraction_status'], 'FAILED')
+        self.assertEqual(response.data['proforma_extraction_error'], 'unreadable scan')
+        self.assertNotIn('items', response.data)
+    
+    def test_other_organization_cannot_see_status(self):
+        """Test that the status endpoint respects queryset visibility"""
+        request = PurchaseRequestFactory.create(created_by=self.staff, organization=self.organization)
+        client, _ = get_authenticated_client(self.other_staff, self.other_staff.organization)
+        
+        response = client.get(f'/api/requests/{request.id}/extraction-status/')
+        
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
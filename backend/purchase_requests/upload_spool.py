@@ -0,0 +1,92 @@
+"""
+Local spool for asynchronous uploads
+
+With ASYNC_UPLOADS the API does not wait on the storage provider: the
+validated file is written to UPLOAD_SPOOL_DIR, a SpooledUpload row is
+created and the request returns 202. store_spooled_upload_task (run on
+commit) pushes the file to storage, points the request at it, starts
+extraction and removes the spool file. UPLOAD_SPOOL_DIR must be shared
+by the web and worker containers.
+"""
+import logging
+import os
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+
+from documents.duplicates import UploadFingerprint, find_duplicates
+from .direct_uploads import FOLDERS
+from .models import PurchaseRequest, SpooledUpload
+
+logger = logging.getLogger(__name__)
+
+
+def spool_path(upload: SpooledUpload) -> str:
+    """Absolute path of an upload's spool file"""
+    return os.path.join(settings.UPLOAD_SPOOL_DIR, upload.spool_name)
+
+
+def storage_folder(upload: SpooledUpload) -> str:
+    """Storage folder of the upload, as for synchronous uploads"""
+    return f'procure-to-pay/{upload.request.organization_id}/{FOLDERS[upload.document_type]}'
+
+
+def spool_upload(request: PurchaseRequest, document_type: str, file,
+                 fingerprint: UploadFingerprint) -> SpooledUpload:
+    """
+    Write a validated upload to the spool and queue it for storage
+
+    The file is written under a temporary name and renamed into place, so
+    a worker never sees a partial file; the task is enqueued on commit.
+
+    Args:
+        request: Request the file was uploaded to
+        document_type: PROFORMA or RECEIPT
+        file: Django UploadedFile
+        fingerprint: Result of fingerprint_upload
+
+    Returns:
+        The PENDING SpooledUpload
+    """
+    from documents.tasks import store_spooled_upload_task
+
+    extension = os.path.splitext(file.name)[1].lower()
+    spool_name = f'{uuid.uuid4().hex}{extension}'
+    path = os.path.join(settings.UPLOAD_SPOOL_DIR, spool_name)
+    os.makedirs(settings.UPLOAD_SPOOL_DIR, exist_ok=True)
+    partial = f'{path}.part'
+    file.seek(0)
+    with open(partial, 'wb') as out:
+        for chunk in file.chunks():
+            out.write(chunk)
+    os.replace(partial, path)
+
+    upload = SpooledUpload.objects.create(
+        request=request,
+        document_type=document_type,
+        filename=os.path.basename(file.name)[:255],
+        content_type=file.content_type,
+        size=file.size,
+        spool_name=spool_name,
+        content_hash=fingerprint.content_hash,
+        perceptual_hash=fingerprint.perceptual_hash,
+    )
+    upload_id = str(upload.id)
+    transaction.on_commit(lambda: store_spooled_upload_task.delay(upload_id))
+    logger.info(f"Spooled {document_type} {upload.filename} ({file.size} bytes) for request {request.id}")
+    return upload
+
+
+def spooled_duplicates(upload: SpooledUpload):
+    """Duplicates of a spooled upload, for the 202 response"""
+    fingerprint = UploadFingerprint(upload.content_hash, upload.perceptual_hash)
+    return find_duplicates(upload.request.organization_id, fingerprint, exclude_request_id=upload.request_id)
+
+
+def remove_spool_file(upload: SpooledUpload):
+    """Delete an upload's spool file if it is still there"""
+    try:
+        os.remove(spool_path(upload))
+    except FileNotFoundError:
+        pass
@@ -1,9 +1,13 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import PurchaseRequestViewSet
+from .views import PurchaseRequestViewSet, DocumentViewSet, ExtractedLineItemViewSet, DirectUploadViewSet, UploadSessionViewSet
 
 router = DefaultRouter()
 router.register(r'requests', PurchaseRequestViewSet, basename='purchaserequest')
+router.register(r'documents', DocumentViewSet, basename='document')
+router.register(r'line-items', ExtractedLineItemViewSet, basename='extractedlineitem')
+router.register(r'uploads', DirectUploadViewSet, basename='direct-upload')
+router.register(r'upload-sessions', UploadSessionViewSet, basename='upload-session')
 
 urlpatterns = [
     path('', include(router.urls)),
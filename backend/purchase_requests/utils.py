@@ -1,36 +1,65 @@
 """Utility functions for purchase requests"""
-import cloudinary.uploader
-from django.conf import settings
+import logging
 from typing import Optional, Tuple, List
+from django.conf import settings
+from PIL import Image, UnidentifiedImageError
+from pypdf import PdfReader
+from pypdf.errors import PyPdfError
+from documents.images import put_document
+from documents.rate_limit import RateLimitExceeded
+from documents.storage import storage_name
+
+logger = logging.getLogger(__name__)
+
+# Bytes read to identify a file; a PDF header may follow up to 1 KB of junk
+SNIFF_BYTES = 4 * 1024
+# Bytes read from the end of a PDF for its startxref / %%EOF trailer
+PDF_TAIL_BYTES = 1024
+CONTENT_TYPE_ALIASES = {'image/jpg': 'image/jpeg'}
 
 
-def upload_file_to_cloudinary(file, folder: str = 'procure-to-pay') -> Optional[str]:
+def upload_file_to_storage(file, folder: str = 'procure-to-pay', organization_id: Optional[str] = None) -> Optional[str]:
     """
-    Upload a file to Cloudinary and return the URL
+    Store an uploaded file and return the URL
     
     Args:
         file: Django UploadedFile or file-like object
-        folder: Cloudinary folder path
+        folder: Storage folder path
+        organization_id: Organization whose rate limit bucket is charged
         
     Returns:
         URL string if successful, None if failed
     """
     try:
-        # Upload to Cloudinary
-        result = cloudinary.uploader.upload(
-            file,
-            folder=folder,
-            resource_type='auto',  # Auto-detect: image, video, raw (PDF)
-            use_filename=True,
-            unique_filename=True,
-        )
-        return result.get('secure_url') or result.get('url')
+        return store_uploaded_file(file, folder, organization_id)
+    except RateLimitExceeded:
+        # Answered with 429 by documents.middleware.RateLimitMiddleware
+        raise
     except Exception as e:
-        # Log error in production
-        print(f"Error uploading file to Cloudinary: {str(e)}")
+        logger.exception(f"Error uploading file to storage: {str(e)}")
         return None
 
 
+def store_uploaded_file(file, folder: str, organization_id: Optional[str] = None, filename: str = None) -> str:
+    """
+    Store a file under a new unique name, raising on failure (for tasks that retry)
+    
+    Images are normalized first (documents.images), so the stored name
+    may have a different extension.
+    
+    Args:
+        file: Django UploadedFile or file-like object
+        folder: Storage folder path
+        organization_id: Organization whose rate limit bucket is charged
+        filename: Original file name (for the extension); defaults to file.name
+        
+    Returns:
+        URL string
+    """
+    name = storage_name(folder, filename or getattr(file, 'name', '') or '')
+    return put_document(file, name, organization_id=organization_id)
+
+
 def validate_file_type(file, allowed_types: List[str] = None) -> Tuple[bool, Optional[str]]:
     """
     Validate file type
@@ -61,9 +90,124 @@ def validate_file_type(file, allowed_types: List[str] = None) -> Tuple[bool, Opt
     if f'.{file_extension}' not in allowed_extensions:
         return False, f"File extension .{file_extension} not allowed"
     
+    # Check the content itself (metadata-only checks have nothing to read)
+    if hasattr(file, 'read'):
+        declared = CONTENT_TYPE_ALIASES.get(file.content_type, file.content_type)
+        if sniff_content_type(file) != declared:
+            return False, f"File content is not {file.content_type}"
+    
+    return True, None
+
+
+def sniff_content_type(file) -> Optional[str]:
+    """
+    Identify a file from its magic bytes, reading only the first SNIFF_BYTES
+    
+    Args:
+        file: Readable binary file; its position is restored
+        
+    Returns:
+        'application/pdf', 'image/jpeg', 'image/png', 'image/webp' or None
+    """
+    position = file.tell()
+    file.seek(0)
+    head = file.read(SNIFF_BYTES)
+    file.seek(position)
+    
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if b'%PDF-' in head[:1024]:
+        return 'application/pdf'
+    return None
+
+
+def validate_file_contents(file, content_type: str = None) -> Tuple[bool, Optional[str]]:
+    """
+    Probe a file's size in pages or pixels before anything decodes it
+    
+    Images are checked from their header (width x height x frames against
+    UPLOAD_MAX_IMAGE_PIXELS), which rejects decompression bombs without
+    decoding them; PDFs by their trailer and the page count in their page
+    tree root (UPLOAD_MAX_PDF_PAGES). A truncated PDF, or one whose page
+    tree cannot be read (damaged or password-protected), is rejected
+    rather than stored and sent to extraction.
+    
+    Args:
+        file: Readable binary file; its position is restored
+        content_type: Defaults to file.content_type
+        
+    Returns:
+        (is_valid, error_message)
+    """
+    content_type = CONTENT_TYPE_ALIASES.get(content_type or file.content_type, content_type or file.content_type)
+    position = file.tell()
+    try:
+        file.seek(0)
+        if content_type == 'application/pdf':
+            if not has_pdf_trailer(file):
+                return False, "PDF is truncated or damaged"
+            pages = pdf_page_count(file)
+            if pages is None:
+                return False, "PDF could not be read; it may be damaged or password-protected"
+            if pages > settings.UPLOAD_MAX_PDF_PAGES:
+                return False, f"PDF has {pages} pages; at most {settings.UPLOAD_MAX_PDF_PAGES} are allowed"
+        else:
+            try:
+                with Image.open(file) as image:
+                    width, height = image.size
+                    pixels = width * height * getattr(image, 'n_frames', 1)
+            except Image.DecompressionBombError:
+                pixels = None
+            except (UnidentifiedImageError, OSError, ValueError):
+                return False, "Image could not be read"
+            if pixels is None or pixels > settings.UPLOAD_MAX_IMAGE_PIXELS:
+                return False, (
+                    f"Image is too large; at most {settings.UPLOAD_MAX_IMAGE_PIXELS // 1_000_000} megapixels are allowed"
+                )
+    finally:
+        file.seek(position)
     return True, None
 
 
+def has_pdf_trailer(file) -> bool:
+    """
+    Whether the last PDF_TAIL_BYTES hold a startxref followed by %%EOF
+    
+    Args:
+        file: Readable, seekable binary file; its position is restored
+    """
+    position = file.tell()
+    try:
+        file.seek(0, 2)
+        file.seek(max(file.tell() - PDF_TAIL_BYTES, 0))
+        tail = file.read(PDF_TAIL_BYTES)
+    finally:
+        file.seek(position)
+    end = tail.rfind(b'%%EOF')
+    return end != -1 and tail.rfind(b'startxref', 0, end) != -1
+
+
+def pdf_page_count(file) -> Optional[int]:
+    """
+    Page count from the PDF trailer and page tree root, or None if unreadable
+    
+    Only the cross-reference table and the root objects are read, not the
+    pages themselves.
+    """
+    try:
+        reader = PdfReader(file, strict=False)
+        if reader.is_encrypted and not reader.decrypt(''):
+            return None
+        return int(reader.trailer['/Root']['/Pages']['/Count'])
+    except (PyPdfError, KeyError, TypeError, ValueError, OSError) as e:
+        logger.info(f"Could not read PDF page count: {str(e)}")
+        return None
+
+
 def validate_file_size(file, max_size_mb: int = 10) -> Tuple[bool, Optional[str]]:
     """
     Validate file size
@@ -1,24 +1,41 @@
 from rest_framework import viewsets, status, filters
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.parsers import MultiPartParser
 from rest_framework.mixins import CreateModelMixin
 from django_filters.rest_framework import DjangoFilterBackend
+from django.conf import settings
+from django.http import Http404
+from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from datetime import timedelta
-from django.db.models import Q, Sum
-from .models import PurchaseRequest, Approval
+import uuid
+from django.db.models import Avg, Count, Max, Min, Q, Sum
+from .models import PurchaseRequest, Approval, Document, ExtractedLineItem, UploadSession, normalize_description
 from .serializers import (
     PurchaseRequestSerializer,
+    DocumentSerializer,
+    ExtractedLineItemSerializer,
     PurchaseRequestCreateSerializer,
     PurchaseRequestUpdateSerializer,
     ApproveRequestSerializer,
+    BulkApproveRequestSerializer,
     RejectRequestSerializer,
-    SubmitReceiptSerializer
+    SubmitReceiptSerializer,
+    DirectUploadSignSerializer,
+    UploadSessionCreateSerializer,
+    UploadSessionSerializer
 )
+from .direct_uploads import DirectUploadError, LocalDirectUploadBackend, get_direct_upload_backend, issue_upload
+from .upload_spool import spool_upload, spooled_duplicates
+from .chunked_uploads import ChunkedUploadError, abort_session, complete_session, start_session, write_chunk
 from .services import ApprovalWorkflowService
+from .document_query import compile_filters
 from users.permissions import IsStaff, IsApprover, IsFinance, IsInOrganization
-from documents.tasks import process_receipt_task
+from documents.duplicates import fingerprint_upload, record_upload
+from documents.tasks import fingerprint_first, process_receipt_task
 
 
 class PurchaseRequestViewSet(viewsets.ModelViewSet):
@@ -33,38 +50,7 @@ class PurchaseRequestViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         """Filter queryset based on user role and organization"""
-        base_queryset = PurchaseRequest.objects.filter(
-            organization=self.request.user.organization
-        )
-        
-        # Role-based filtering
-        if self.request.user.role == self.request.user.Role.STAFF:
-            # Staff can only see their own requests
-            queryset = base_queryset.filter(created_by=self.request.user)
-        elif self.request.user.role == self.request.user.Role.APPROVER:
-            # Approvers can see pending requests they can act on + their reviewed requests
-            # Get IDs from both querysets and then filter
-            pending = ApprovalWorkflowService.get_pending_requests_for_approver(self.request.user)
-            reviewed = PurchaseRequest.objects.filter(
-                organization=self.request.user.organization,
-                approvals__approver=self.request.user
-            ).distinct()
-            
-            # Get IDs from both querysets
-            pending_ids = list(pending.values_list('id', flat=True))
-            reviewed_ids = list(reviewed.values_list('id', flat=True))
-            all_ids = list(set(pending_ids + reviewed_ids))
-            
-            # Filter by IDs to avoid union() which doesn't support select_related
-            queryset = base_queryset.filter(id__in=all_ids)
-        elif self.request.user.role == self.request.user.Role.FINANCE:
-            # Finance can see approved requests (or all if configured)
-            if self.request.user.organization.finance_can_see_all:
-                queryset = base_queryset
-            else:
-                queryset = base_queryset.filter(status=PurchaseRequest.Status.APPROVED)
-        else:
-            queryset = base_queryset
+        queryset = visible_requests(self.request.user)
         
         # Additional filtering
         status_filter = self.request.query_params.get('status')
@@ -72,6 +58,7 @@ class PurchaseRequestViewSet(viewsets.ModelViewSet):
         date_to = self.request.query_params.get('date_to')
         amount_min = self.request.query_params.get('amount_min')
         amount_max = self.request.query_params.get('amount_max')
+        vendor = self.request.query_params.get('vendor')
         
         if date_from:
             queryset = queryset.filter(created_at__gte=date_from)
@@ -81,10 +68,17 @@ class PurchaseRequestViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(amount__gte=amount_min)
         if amount_max:
             queryset = queryset.filter(amount__lte=amount_max)
+        if vendor:
+            if not vendor.isdigit():
+                raise ValidationError({'vendor': 'Must be a vendor ID.'})
+            # Semi-join on the indexed Document.vendor FK (no duplicates, no JSON scan)
+            queryset = queryset.filter(
+                id__in=Document.objects.filter(vendor_id=vendor).values('request_id')
+            )
         
         # Apply select_related and prefetch_related at the end
         return queryset.select_related('organization', 'created_by', 'updated_by').prefetch_related(
-            'items', 'approvals__approver', 'documents'
+            'items', 'approvals__approver', 'documents__vendor', 'fingerprints', 'spooled_uploads'
         )
     
     def get_serializer_class(self):
@@ -104,7 +98,9 @@ class PurchaseRequestViewSet(viewsets.ModelViewSet):
         instance = serializer.instance
         response_serializer = PurchaseRequestSerializer(instance)
         headers = self.get_success_headers(response_serializer.data)
-        return Response(response_serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+        # 202 while the proforma is on its way to storage (ASYNC_UPLOADS)
+        response_status = status.HTTP_202_ACCEPTED if serializer.spooled_upload else status.HTTP_201_CREATED
+        return Response(response_serializer.data, status=response_status, headers=headers)
     
     def get_permissions(self):
         """Return appropriate permissions based on action"""
@@ -112,7 +108,7 @@ class PurchaseRequestViewSet(viewsets.ModelViewSet):
             return [IsAuthenticated(), IsStaff()]
         elif self.action in ['update', 'partial_update']:
             return [IsAuthenticated(), IsStaff(), IsInOrganization()]
-        elif self.action in ['approve', 'reject']:
+        elif self.action in ['approve', 'reject', 'bulk_approve']:
             return [IsAuthenticated(), IsApprover(), IsInOrganization()]
         elif self.action == 'submit_receipt':
             return [IsAuthenticated(), IsStaff(), IsInOrganization()]
@@ -134,7 +130,9 @@ class PurchaseRequestViewSet(viewsets.ModelViewSet):
         instance = serializer.instance
         response_serializer = PurchaseRequestSerializer(instance)
         headers = self.get_success_headers(response_serializer.data)
-        return Response(response_serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+        # 202 while the proforma is on its way to storage (ASYNC_UPLOADS)
+        response_status = status.HTTP_202_ACCEPTED if serializer.spooled_upload else status.HTTP_201_CREATED
+        return Response(response_serializer.data, status=response_status, headers=headers)
     
     def update(self, request, *args, **kwargs):
         """Update purchase request (only if pending)"""
@@ -146,7 +144,15 @@ class PurchaseRequestViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        return super().update(request, *args, **kwargs)
+        response = super().update(request, *args, **kwargs)
+        if self.spooled_upload:
+            response.status_code = status.HTTP_202_ACCEPTED
+        return response
+    
+    def perform_update(self, serializer):
+        """Update purchase request, noting whether the proforma was spooled"""
+        serializer.save()
+        self.spooled_upload = serializer.spooled_upload
     
     @action(detail=True, methods=['patch'])
     def approve(self, request, pk=None):
@@ -176,6 +182,38 @@ class PurchaseRequestViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
     
+    @action(detail=False, methods=['post'], url_path='bulk-approve')
+    def bulk_approve(self, request):
+        """Approve several purchase requests; their POs are generated as one batch"""
+        serializer = BulkApproveRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        ids = serializer.validated_data['ids']
+        requests = list(self.get_queryset().filter(id__in=ids))
+        approvals, errors = ApprovalWorkflowService.approve_requests(
+            requests,
+            request.user,
+            comments=serializer.validated_data.get('comments', '')
+        )
+        found = {str(request_obj.id) for request_obj in requests}
+        for request_id in map(str, ids):
+            if request_id not in found:
+                errors[request_id] = 'Not found.'
+        
+        return Response({
+            'approved': [
+                {
+                    'request': str(approval.request_id),
+                    'id': approval.id,
+                    'approval_level': approval.approval_level,
+                    'action': approval.action,
+                    'timestamp': approval.timestamp
+                }
+                for approval in approvals
+            ],
+            'errors': errors
+        }, status=status.HTTP_200_OK)
+    
     @action(detail=True, methods=['patch'])
     def reject(self, request, pk=None):
         """Reject a purchase request"""
@@ -207,10 +245,10 @@ class PurchaseRequestViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def submit_receipt(self, request, pk=None):
         """Submit receipt for a purchase request"""
-        from .utils import upload_file_to_cloudinary
+        from .utils import upload_file_to_storage
         
         request_obj = self.get_object()
-        serializer = SubmitReceiptSerializer(data=request.data)
+        serializer = SubmitReceiptSerializer(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
         
         if request_obj.status != PurchaseRequest.Status.APPROVED:
@@ -219,18 +257,39 @@ class PurchaseRequestViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Upload receipt file to Cloudinary
-        receipt_file = serializer.validated_data['receipt_file']
-        receipt_file_url = upload_file_to_cloudinary(
-            receipt_file,
-            folder=f'procure-to-pay/{request_obj.organization.id}/receipts'
-        )
+        receipt_upload = serializer.validated_data.get('receipt_upload')
+        if not receipt_upload and settings.ASYNC_UPLOADS:
+            # Stored, fingerprinted and validated by a worker; duplicates are known now
+            receipt_file = serializer.validated_data['receipt_file']
+            upload = spool_upload(
+                request_obj, Document.DocumentType.RECEIPT, receipt_file, fingerprint_upload(receipt_file)
+            )
+            return Response({
+                'detail': 'Receipt accepted. Upload and validation in progress.',
+                'upload': {'id': str(upload.id), 'status': upload.status},
+                'duplicates': spooled_duplicates(upload)
+            }, status=status.HTTP_202_ACCEPTED)
         
-        if not receipt_file_url:
-            return Response(
-                {'detail': 'Failed to upload receipt file. Please try again.'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        if receipt_upload:
+            # Already in storage; fingerprinted by the worker before extraction
+            receipt_file_url, fingerprint = receipt_upload['file_url'], None
+        else:
+            # Hash before uploading so duplicates are flagged before any model call
+            receipt_file = serializer.validated_data['receipt_file']
+            fingerprint = fingerprint_upload(receipt_file)
+            
+            # Upload receipt file to storage
+            receipt_file_url = upload_file_to_storage(
+                receipt_file,
+                folder=f'procure-to-pay/{request_obj.organization.id}/receipts',
+                organization_id=str(request_obj.organization.id)
             )
+            
+            if not receipt_file_url:
+                return Response(
+                    {'detail': 'Failed to upload receipt file. Please try again.'},
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
         
         # Update receipt file URL
         request_obj.receipt_file_url = receipt_file_url
@@ -238,12 +297,34 @@ class PurchaseRequestViewSet(viewsets.ModelViewSet):
         request_obj.save()
         
         # Process receipt asynchronously
-        process_receipt_task.delay(str(request_obj.id))
+        if fingerprint is None:
+            duplicates = []
+            fingerprint_first(
+                process_receipt_task.si(str(request_obj.id)),
+                str(request_obj.id), Document.DocumentType.RECEIPT, receipt_file_url
+            ).delay()
+        else:
+            duplicates = record_upload(
+                request_obj, Document.DocumentType.RECEIPT, receipt_file_url, fingerprint
+            ).duplicates
+            process_receipt_task.delay(str(request_obj.id))
         
         return Response({
-            'detail': 'Receipt submitted successfully. Validation in progress.'
+            'detail': 'Receipt submitted successfully. Validation in progress.',
+            'duplicates': duplicates
         }, status=status.HTTP_200_OK)
     
+    @action(detail=True, methods=['get'], url_path='extraction-status')
+    def extraction_status(self, request, pk=None):
+        """Get proforma extraction progress without loading the full request"""
+        data = get_object_or_404(
+            self.get_queryset().select_related(None).prefetch_related(None).values(
+                'id', 'proforma_extraction_status', 'proforma_extraction_error'
+            ),
+            pk=pk
+        )
+        return Response(data)
+    
     @action(detail=False, methods=['get'])
     def statistics(self, request):
         """Get dashboard statistics based on user role"""
@@ -354,3 +435,281 @@ class PurchaseRequestViewSet(viewsets.ModelViewSet):
                 {'detail': 'Statistics not available for this role.'},
                 status=status.HTTP_403_FORBIDDEN
             )
+
+
+def visible_requests(user):
+    """
+    Purchase requests the user may see, by role
+    
+    Staff see their own requests, approvers the requests pending at their
+    level plus those they reviewed, finance follows the
+    finance_can_see_all setting.
+    """
+    base_queryset = PurchaseRequest.objects.filter(
+        organization=user.organization
+    )
+    
+    # Role-based filtering
+    if user.role == user.Role.STAFF:
+        # Staff can only see their own requests
+        queryset = base_queryset.filter(created_by=user)
+    elif user.role == user.Role.APPROVER:
+        # Approvers can see pending requests they can act on + their reviewed requests
+        # Get IDs from both querysets and then filter
+        pending = ApprovalWorkflowService.get_pending_requests_for_approver(user)
+        reviewed = PurchaseRequest.objects.filter(
+            organization=user.organization,
+            approvals__approver=user
+        ).distinct()
+        
+        # Get IDs from both querysets
+        pending_ids = list(pending.values_list('id', flat=True))
+        reviewed_ids = list(reviewed.values_list('id', flat=True))
+        all_ids = list(set(pending_ids + reviewed_ids))
+        
+        # Filter by IDs to avoid union() which doesn't support select_related
+        queryset = base_queryset.filter(id__in=all_ids)
+    elif user.role == user.Role.FINANCE:
+        # Finance can see approved requests (or all if configured)
+        if user.organization.finance_can_see_all:
+            queryset = base_queryset
+        else:
+            queryset = base_queryset.filter(status=PurchaseRequest.Status.APPROVED)
+    else:
+        queryset = base_queryset
+    
+    return queryset
+
+
+def restrict_to_visible_requests(queryset, user):
+    """Limit a queryset of request-owned rows to the requests in visible_requests(user)"""
+    return queryset.filter(request__in=visible_requests(user))
+
+
+class DocumentViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Documents filterable by extracted fields
+    
+    Besides document_type, request and vendor, accepts the whitelisted
+    data.* filters of document_query (e.g. ?data.currency=EUR).
+    """
+    serializer_class = DocumentSerializer
+    permission_classes = [IsAuthenticated]
+    filter_backends = [filters.OrderingFilter]
+    ordering_fields = ['created_at']
+    ordering = ['-created_at']
+    
+    def get_queryset(self):
+        """Filter documents by visibility and query parameters"""
+        user = self.request.user
+        queryset = restrict_to_visible_requests(
+            Document.objects.filter(request__organization=user.organization), user
+        )
+        
+        params = self.request.query_params
+        document_type = params.get('document_type')
+        vendor = params.get('vendor')
+        request_id = params.get('request')
+        
+        if document_type:
+            if document_type not in Document.DocumentType.values:
+                raise ValidationError({'document_type': f'Must be one of {", ".join(Document.DocumentType.values)}.'})
+            queryset = queryset.filter(document_type=document_type)
+        if vendor:
+            if not vendor.isdigit():
+                raise ValidationError({'vendor': 'Must be a vendor ID.'})
+            queryset = queryset.filter(vendor_id=vendor)
+        if request_id:
+            try:
+                queryset = queryset.filter(request_id=uuid.UUID(request_id))
+            except ValueError:
+                raise ValidationError({'request': 'Must be a request ID.'})
+        
+        queryset = queryset.filter(compile_filters(params.items()))
+        return queryset.select_related('vendor')
+
+
+class ExtractedLineItemViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Indexed queries over extracted line items
+    
+    Visibility follows restrict_to_visible_requests.
+    """
+    serializer_class = ExtractedLineItemSerializer
+    permission_classes = [IsAuthenticated]
+    filter_backends = [filters.OrderingFilter]
+    ordering_fields = ['document_created_at', 'unit_price', 'total']
+    ordering = ['-document_created_at', 'position']
+    
+    def get_queryset(self):
+        """Filter line items by visibility and query parameters"""
+        user = self.request.user
+        queryset = restrict_to_visible_requests(
+            ExtractedLineItem.objects.filter(organization=user.organization), user
+        )
+        
+        params = self.request.query_params
+        description = params.get('description')
+        q = params.get('q')
+        document_type = params.get('document_type')
+        vendor = params.get('vendor')
+        request_id = params.get('request')
+        currency = params.get('currency')
+        date_from = params.get('date_from')
+        date_to = params.get('date_to')
+        
+        if description:
+            queryset = queryset.filter(normalized_description=normalize_description(description))
+        if q:
+            # LIKE '%...%' is served by the trigram index on PostgreSQL
+            queryset = queryset.filter(normalized_description__contains=normalize_description(q))
+        if document_type:
+            if document_type not in Document.DocumentType.values:
+                raise ValidationError({'document_type': f'Must be one of {", ".join(Document.DocumentType.values)}.'})
+            queryset = queryset.filter(document_type=document_type)
+        if vendor:
+            if not vendor.isdigit():
+                raise ValidationError({'vendor': 'Must be a vendor ID.'})
+            queryset = queryset.filter(vendor_id=vendor)
+        if request_id:
+            try:
+                queryset = queryset.filter(request_id=uuid.UUID(request_id))
+            except ValueError:
+                raise ValidationError({'request': 'Must be a request ID.'})
+        if currency:
+            queryset = queryset.filter(currency__iexact=currency)
+        if date_from:
+            queryset = queryset.filter(document_created_at__gte=date_from)
+        if date_to:
+            queryset = queryset.filter(document_created_at__lte=date_to)
+        
+        return queryset.select_related('vendor')
+    
+    @action(detail=False, methods=['get'], url_path='price-history')
+    def price_history(self, request):
+        """Unit price statistics for one item, per vendor and currency"""
+        if not request.query_params.get('description'):
+            raise ValidationError({'description': 'This query parameter is required.'})
+        
+        queryset = self.get_queryset().filter(unit_price__isnull=False)
+        stats = queryset.order_by().values('currency', 'vendor_id', 'vendor__name').annotate(
+            count=Count('id'),
+            min_unit_price=Min('unit_price'),
+            max_unit_price=Max('unit_price'),
+            avg_unit_price=Avg('unit_price'),
+            last_seen=Max('document_created_at')
+        ).order_by('-last_seen')
+        
+        return Response({
+            'description': normalize_description(request.query_params['description']),
+            'results': [
+                {
+                    'currency': row['currency'],
+                    'vendor': row['vendor_id'],
+                    'vendor_name': row['vendor__name'],
+                    'count': row['count'],
+                    'min_unit_price': float(row['min_unit_price']),
+                    'max_unit_price': float(row['max_unit_price']),
+                    'avg_unit_price': round(float(row['avg_unit_price']), 4),
+                    'last_seen': row['last_seen'],
+                }
+                for row in stats
+            ]
+        })
+
+
+class DirectUploadViewSet(viewsets.ViewSet):
+    """Signed uploads that go straight from the client to storage"""
+    permission_classes = [IsAuthenticated]
+    
+    def create(self, request):
+        """Issue short-lived upload parameters for one proforma or receipt"""
+        serializer = DirectUploadSignSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(
+            issue_upload(request, serializer.validated_data['document_type']),
+            status=status.HTTP_201_CREATED
+        )
+    
+    @action(detail=False, methods=['post'], permission_classes=[AllowAny], authentication_classes=[],
+            parser_classes=[MultiPartParser])
+    def local(self, request):
+        """Upload endpoint of the local storage stand-in; authorized by the signed fields"""
+        backend = local_upload_backend()
+        if 'file' not in request.FILES:
+            return Response({'detail': 'No file was sent.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            asset = backend.receive(request.data, request.FILES['file'])
+        except DirectUploadError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(asset)
+
+
+def local_upload_backend() -> LocalDirectUploadBackend:
+    """The local direct upload backend; 404 when another backend is configured"""
+    backend = get_direct_upload_backend()
+    if not isinstance(backend, LocalDirectUploadBackend):
+        raise Http404
+    return backend
+
+
+class UploadSessionViewSet(viewsets.ViewSet):
+    """Resumable chunked uploads (see chunked_uploads)"""
+    permission_classes = [IsAuthenticated]
+    lookup_value_regex = '[0-9a-f-]{36}'
+    
+    def create(self, request):
+        """Open a session for one proforma or receipt"""
+        serializer = UploadSessionCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        session = start_session(request.user, **serializer.validated_data)
+        return Response(
+            {**UploadSessionSerializer(session).data, 'chunk_size': settings.CHUNKED_UPLOAD_CHUNK_SIZE},
+            status=status.HTTP_201_CREATED
+        )
+    
+    def retrieve(self, request, pk=None):
+        """Session progress, to resume after a dropped connection"""
+        session = get_object_or_404(UploadSession, id=pk, user=request.user)
+        return Response(UploadSessionSerializer(session).data)
+    
+    def update(self, request, pk=None):
+        """Write one chunk; the body is the raw bytes named by Content-Range"""
+        try:
+            session = write_chunk(
+                pk, request.user,
+                request.META.get('HTTP_CONTENT_RANGE'),
+                int(request.META.get('CONTENT_LENGTH') or 0),
+                request.stream,
+            )
+        except UploadSession.DoesNotExist:
+            raise Http404
+        except ChunkedUploadError as e:
+            return chunked_upload_error(e)
+        return Response(UploadSessionSerializer(session).data)
+    
+    def destroy(self, request, pk=None):
+        """Abort a session"""
+        try:
+            abort_session(pk, request.user)
+        except UploadSession.DoesNotExist:
+            raise Http404
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        """Assemble and verify the file; returns the upload to record as proforma_upload/receipt_upload"""
+        try:
+            return Response(complete_session(pk, request.user))
+        except UploadSession.DoesNotExist:
+            raise Http404
+        except ChunkedUploadError as e:
+            return chunked_upload_error(e)
+
+
+def chunked_upload_error(error: ChunkedUploadError) -> Response:
+    """Error response for a refused chunk or completion, with the offset to resume from"""
+    data = {'detail': str(error)}
+    if error.offset is not None:
+        data['received'] = error.offset
+    return Response(data, status=error.status_code)
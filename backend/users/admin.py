@@ -12,7 +12,7 @@ class UserAdmin(BaseUserAdmin):
     
     fieldsets = BaseUserAdmin.fieldsets + (
         ('Organization & Role', {
-            'fields': ('organization', 'role', 'approval_level')
+            'fields': ('organization', 'role', 'approval_level', 'notification_delivery')
         }),
     )
     
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 10:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='notification_delivery',
+            field=models.CharField(choices=[('IMMEDIATE', 'Immediately'), ('DIGEST', 'Periodic digest')], default='IMMEDIATE', help_text='Email each notification, or collect them into a periodic digest (rejections are always immediate)', max_length=20),
+        ),
+    ]
@@ -34,6 +34,10 @@ class User(AbstractUser):
         STAFF = 'STAFF', 'Staff'
         APPROVER = 'APPROVER', 'Approver'
         FINANCE = 'FINANCE', 'Finance'
+
+    class NotificationDelivery(models.TextChoices):
+        IMMEDIATE = 'IMMEDIATE', 'Immediately'
+        DIGEST = 'DIGEST', 'Periodic digest'
     
     email = models.EmailField(unique=True)
     username = models.CharField(max_length=150, blank=True, null=True)
@@ -54,6 +58,12 @@ class User(AbstractUser):
         blank=True,
         help_text="Approval level for APPROVER role (1, 2, 3, etc.)"
     )
+    notification_delivery = models.CharField(
+        max_length=20,
+        choices=NotificationDelivery.choices,
+        default=NotificationDelivery.IMMEDIATE,
+        help_text="Email each notification, or collect them into a periodic digest (rejections are always immediate)"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
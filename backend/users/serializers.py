@@ -12,12 +12,20 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
         fields = [
             'id', 'email', 'first_name', 'last_name',
-            'role', 'approval_level', 'organization', 'organization_name',
+            'role', 'approval_level', 'notification_delivery', 'organization', 'organization_name',
             'is_active', 'created_at'
         ]
         read_only_fields = ['id', 'created_at']
 
 
+class UserPreferencesSerializer(serializers.ModelSerializer):
+    """Settings users may change on their own account"""
+
+    class Meta:
+        model = User
+        fields = ['notification_delivery']
+
+
 class LoginSerializer(serializers.Serializer):
     """Login serializer"""
     email = serializers.EmailField()
@@ -208,6 +208,18 @@ class MeViewTests(TestCase):
         self.assertEqual(response.data['role'], self.user.role)
         self.assertIn('organization', response.data)
     
+    def test_update_notification_delivery(self):
+        """Test users can switch to digest notifications but not change their role"""
+        response = self.client.patch('/api/auth/me/', {
+            'notification_delivery': 'DIGEST', 'role': 'FINANCE'
+        }, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['notification_delivery'], 'DIGEST')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.notification_delivery, User.NotificationDelivery.DIGEST)
+        self.assertEqual(self.user.role, User.Role.STAFF)
+    
     def test_me_requires_authentication(self):
         """Test me endpoint requires authentication"""
         unauthenticated_client = APIClient()
@@ -4,7 +4,7 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import get_user_model
-from .serializers import LoginSerializer, UserSerializer, UserRegistrationSerializer
+from .serializers import LoginSerializer, UserSerializer, UserPreferencesSerializer, UserRegistrationSerializer
 
 User = get_user_model()
 
@@ -96,10 +96,14 @@ def refresh_token_view(request):
         )
 
 
-@api_view(['GET'])
+@api_view(['GET', 'PATCH'])
 @permission_classes([IsAuthenticated])
 def me_view(request):
-    """Get current user"""
+    """Get current user, or update their preferences (PATCH)"""
+    if request.method == 'PATCH':
+        preferences = UserPreferencesSerializer(request.user, data=request.data, partial=True)
+        preferences.is_valid(raise_exception=True)
+        preferences.save()
     serializer = UserSerializer(request.user)
     return Response(serializer.data)
 
@@ -0,0 +1,28 @@
+from django.contrib import admin
+from .models import Vendor, VendorAlias
+
+
+class VendorAliasInline(admin.TabularInline):
+    model = VendorAlias
+    extra = 0
+    fields = ['alias', 'normalized_alias', 'source', 'occurrences', 'created_at']
+    readonly_fields = ['normalized_alias', 'occurrences', 'created_at']
+
+
+@admin.register(Vendor)
+class VendorAdmin(admin.ModelAdmin):
+    list_display = ['name', 'organization', 'normalized_name', 'created_at']
+    list_filter = ['organization']
+    search_fields = ['name', 'normalized_name', 'aliases__alias']
+    readonly_fields = ['created_at', 'updated_at']
+    raw_id_fields = ['organization']
+    inlines = [VendorAliasInline]
+
+
+@admin.register(VendorAlias)
+class VendorAliasAdmin(admin.ModelAdmin):
+    list_display = ['alias', 'vendor', 'organization', 'source', 'occurrences', 'created_at']
+    list_filter = ['source']
+    search_fields = ['alias', 'normalized_alias', 'vendor__name']
+    readonly_fields = ['created_at']
+    raw_id_fields = ['vendor', 'organization']
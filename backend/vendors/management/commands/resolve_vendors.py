@@ -0,0 +1,68 @@
+"""
+Link existing documents to vendors
+
+Documents extracted before vendor resolution existed only carry the
+vendor name inside extracted_data. This resolves it once, in chunks, so
+that vendor filters work from the Document.vendor foreign key.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from purchase_requests.models import Document, ExtractedLineItem
+from vendors.services import resolve_vendor
+
+NAME_FIELDS = {
+    Document.DocumentType.PROFORMA: 'vendor_name',
+    Document.DocumentType.PO: 'vendor_name',
+    Document.DocumentType.RECEIPT: 'seller_name',
+}
+
+
+class Command(BaseCommand):
+    help = 'Resolve vendors for documents that are not linked to one yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organization', help='Only resolve documents of this organization ID')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Documents per chunk')
+        parser.add_argument('--all', action='store_true', help='Re-resolve documents that already have a vendor')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        queryset = Document.objects.all()
+        if not options['all']:
+            queryset = queryset.filter(vendor__isnull=True)
+        if options['organization']:
+            queryset = queryset.filter(request__organization_id=options['organization'])
+
+        processed = linked = 0
+        last_id = 0
+        while True:
+            # Keyset pagination: rows leave the vendor__isnull filter as we go
+            chunk = list(
+                queryset.filter(id__gt=last_id).order_by('id').values(
+                    'id', 'document_type', 'extracted_data', 'request__organization_id'
+                )[:options['chunk_size']]
+            )
+            if not chunk:
+                break
+            last_id = chunk[-1]['id']
+
+            updates, documents_by_vendor = [], {}
+            for doc in chunk:
+                name = (doc['extracted_data'] or {}).get(NAME_FIELDS[doc['document_type']])
+                vendor = resolve_vendor(doc['request__organization_id'], name)
+                if vendor:
+                    updates.append(Document(id=doc['id'], vendor=vendor))
+                    documents_by_vendor.setdefault(vendor.id, []).append(doc['id'])
+            with transaction.atomic():
+                # bulk_update bypasses Document.save, so keep the line item projection in step
+                Document.objects.bulk_update(updates, ['vendor'])
+                for vendor_id, document_ids in documents_by_vendor.items():
+                    ExtractedLineItem.objects.filter(document_id__in=document_ids).update(vendor_id=vendor_id)
+
+            processed += len(chunk)
+            linked += len(updates)
+            self.stderr.write(f"{processed} documents processed, {linked} linked")
+
+        self.stdout.write(self.style.SUCCESS(f"Linked {linked} of {processed} documents to vendors"))
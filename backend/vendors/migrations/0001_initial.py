@@ -0,0 +1,81 @@
+# Generated by Django 5.2.8 on 2026-10-19 08:38
+
+import django.db.models.deletion
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+TRIGRAM_INDEXES = [
+    ('vendors_vendor_name_trgm', 'vendors_vendor', 'normalized_name'),
+    ('vendors_alias_trgm', 'vendors_vendoralias', 'normalized_alias'),
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # GIN trigram indexes only exist on PostgreSQL; other backends fall back
+    # to a scan in vendors.services
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin ({column} gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('organizations', '0001_initial'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.CreateModel(
+            name='Vendor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Display name (first spelling seen)', max_length=255)),
+                ('normalized_name', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vendors', to='organizations.organization')),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='VendorAlias',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('alias', models.CharField(max_length=255)),
+                ('normalized_alias', models.CharField(max_length=255)),
+                ('occurrences', models.IntegerField(default=1)),
+                ('source', models.CharField(choices=[('EXACT', 'Same normalized name'), ('SIMILARITY', 'Similar name'), ('CURATED', 'Confirmed by a person')], default='CURATED', help_text='How the spelling was linked to the vendor; similarity links are not trusted to prove two documents come from the same vendor', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vendor_aliases', to='organizations.organization')),
+                ('vendor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='aliases', to='vendors.vendor')),
+            ],
+            options={
+                'verbose_name_plural': 'vendor aliases',
+                'ordering': ['alias'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='vendor',
+            constraint=models.UniqueConstraint(fields=('organization', 'normalized_name'), name='unique_vendor_per_organization'),
+        ),
+        migrations.AddConstraint(
+            model_name='vendoralias',
+            constraint=models.UniqueConstraint(fields=('organization', 'normalized_alias'), name='unique_vendor_alias_per_organization'),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,72 @@
+from django.db import models
+from organizations.models import Organization
+
+
+class Vendor(models.Model):
+    """A supplier, deduplicated per organization by normalized name"""
+    organization = models.ForeignKey(
+        Organization,
+        on_delete=models.CASCADE,
+        related_name='vendors'
+    )
+    name = models.CharField(max_length=255, help_text="Display name (first spelling seen)")
+    normalized_name = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['name']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['organization', 'normalized_name'],
+                name='unique_vendor_per_organization'
+            ),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class VendorAlias(models.Model):
+    """A spelling of a vendor name as it appeared on a document"""
+
+    class Source(models.TextChoices):
+        EXACT = 'EXACT', 'Same normalized name'
+        SIMILARITY = 'SIMILARITY', 'Similar name'
+        CURATED = 'CURATED', 'Confirmed by a person'
+
+    vendor = models.ForeignKey(
+        Vendor,
+        on_delete=models.CASCADE,
+        related_name='aliases'
+    )
+    # Denormalized so alias lookups stay on one index
+    organization = models.ForeignKey(
+        Organization,
+        on_delete=models.CASCADE,
+        related_name='vendor_aliases'
+    )
+    alias = models.CharField(max_length=255)
+    normalized_alias = models.CharField(max_length=255)
+    occurrences = models.IntegerField(default=1)
+    source = models.CharField(
+        max_length=20,
+        choices=Source.choices,
+        default=Source.CURATED,
+        help_text="How the spelling was linked to the vendor; similarity links are not trusted "
+                  "to prove two documents come from the same vendor"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['alias']
+        verbose_name_plural = 'vendor aliases'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['organization', 'normalized_alias'],
+                name='unique_vendor_alias_per_organization'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.alias} -> {self.vendor.name}"
@@ -0,0 +1,12 @@
+from rest_framework import serializers
+from .models import Vendor
+
+
+class VendorSerializer(serializers.ModelSerializer):
+    """Vendor serializer"""
+    aliases = serializers.SlugRelatedField(many=True, read_only=True, slug_field='alias')
+    
+    class Meta:
+        model = Vendor
+        fields = ['id', 'name', 'normalized_name', 'aliases', 'created_at']
+        read_only_fields = fields
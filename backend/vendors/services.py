@@ -0,0 +1,194 @@
+"""
+Vendor name normalization and resolution
+
+Names are normalized (case, punctuation, legal-form suffixes) so that
+"ACME Ltd" and "Acme Limited" share one key. Resolution tries the exact
+normalized alias first (unique index), then a pg_trgm similarity search
+on PostgreSQL, and only then creates a new vendor.
+
+Aliases linked by similarity group a vendor's documents, but only exact
+and curated aliases count as proof that two documents come from the
+same vendor (see same_confirmed_vendor).
+"""
+import logging
+import re
+import unicodedata
+from difflib import SequenceMatcher
+from typing import Dict, Iterable, Optional, Tuple
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+
+from .models import Vendor, VendorAlias
+
+logger = logging.getLogger(__name__)
+
+# Similarity above which two normalized names are treated as the same vendor.
+# Kept at the vendor_names_match threshold: a looser link would merge
+# distinct suppliers such as "Kigali Office Supplies" / "Kigali Office Solutions".
+SIMILARITY_THRESHOLD = 0.85
+
+LEGAL_SUFFIXES = {
+    'ltd', 'limited', 'llc', 'llp', 'lp', 'inc', 'incorporated', 'corp', 'corporation',
+    'co', 'company', 'plc', 'gmbh', 'ag', 'sa', 'sarl', 'srl', 'spa', 'bv', 'nv', 'pty',
+    'pvt', 'private', 'oy', 'ab', 'as', 'kk', 'sas',
+}
+_NON_ALNUM_RE = re.compile(r'[^a-z0-9&]+')
+
+
+def normalize_vendor_name(name: Optional[str]) -> str:
+    """
+    Normalize a vendor name for matching
+
+    Lowercases, strips accents and punctuation, drops legal-form suffixes
+    and a leading "the", e.g. "The ACME Co., Ltd." -> "acme".
+    """
+    text = unicodedata.normalize('NFKD', str(name or '')).encode('ascii', 'ignore').decode()
+    text = text.lower().replace('&', ' & ')
+    words = [w for w in _NON_ALNUM_RE.split(text) if w]
+    if words and words[0] == 'the':
+        words = words[1:]
+    # Only trailing suffixes: "Company Store Ltd" keeps "company"
+    while len(words) > 1 and words[-1] in LEGAL_SUFFIXES:
+        words.pop()
+    return ' '.join(words)
+
+
+def name_similarity(a: str, b: str) -> float:
+    """Similarity of two normalized names in [0, 1]"""
+    if not a or not b:
+        return 0.0
+    if a == b:
+        return 1.0
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def vendor_names_match(a: Optional[str], b: Optional[str], threshold: float = SIMILARITY_THRESHOLD) -> bool:
+    """Whether two raw vendor names refer to the same vendor"""
+    normalized_a, normalized_b = normalize_vendor_name(a), normalize_vendor_name(b)
+    if not normalized_a and not normalized_b:
+        return True
+    return name_similarity(normalized_a, normalized_b) >= threshold
+
+
+def _similar_alias(organization_id, normalized: str) -> Optional[VendorAlias]:
+    """Closest existing alias above SIMILARITY_THRESHOLD, if any"""
+    aliases = VendorAlias.objects.filter(organization_id=organization_id).select_related('vendor')
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import TrigramSimilarity
+        # The % operator uses the GIN trigram index; similarity() ranks the hits
+        return aliases.filter(normalized_alias__trigram_similar=normalized).annotate(
+            similarity=TrigramSimilarity('normalized_alias', normalized)
+        ).filter(similarity__gte=SIMILARITY_THRESHOLD).order_by('-similarity').first()
+
+    # Fallback for other databases (development, tests): scan the
+    # organization's aliases that share the first character
+    best, best_score = None, SIMILARITY_THRESHOLD
+    for alias in aliases.filter(normalized_alias__startswith=normalized[:1]):
+        score = name_similarity(alias.normalized_alias, normalized)
+        if score >= best_score:
+            best, best_score = alias, score
+    return best
+
+
+def resolve_vendor(organization_id, name: Optional[str], create: bool = True) -> Optional[Vendor]:
+    """
+    Find or create the vendor for a name seen on a document
+
+    Args:
+        organization_id: Owning organization
+        name: Raw vendor name as extracted
+        create: Create a vendor when nothing matches
+
+    Returns:
+        Vendor, or None for blank names (or no match with create=False)
+    """
+    normalized = normalize_vendor_name(name)
+    if not normalized:
+        return None
+
+    alias = VendorAlias.objects.filter(
+        organization_id=organization_id,
+        normalized_alias=normalized
+    ).select_related('vendor').first()
+    if alias:
+        VendorAlias.objects.filter(id=alias.id).update(occurrences=F('occurrences') + 1)
+        return alias.vendor
+
+    similar = _similar_alias(organization_id, normalized)
+    if similar:
+        vendor = similar.vendor
+    elif create:
+        vendor, _ = Vendor.objects.get_or_create(
+            organization_id=organization_id,
+            normalized_name=normalized,
+            defaults={'name': str(name).strip()[:255]}
+        )
+    else:
+        return None
+
+    try:
+        with transaction.atomic():
+            VendorAlias.objects.create(
+                vendor=vendor,
+                organization_id=organization_id,
+                alias=str(name).strip()[:255],
+                normalized_alias=normalized,
+                source=VendorAlias.Source.SIMILARITY if similar else VendorAlias.Source.EXACT
+            )
+    except IntegrityError:
+        # Another worker recorded the same spelling concurrently
+        pass
+    if similar:
+        logger.info(f"Resolved vendor '{name}' to '{vendor.name}' by similarity")
+    return vendor
+
+
+def confirmed_aliases(names: Iterable[Tuple[object, Optional[str]]]) -> Dict[Tuple[str, str], int]:
+    """
+    Vendors that names are confirmed spellings of
+
+    Args:
+        names: (organization_id, raw name) pairs
+
+    Returns:
+        {(organization_id as str, normalized name): vendor_id} for names
+        with an exact or curated alias
+    """
+    wanted = {(str(org), normalize_vendor_name(name)) for org, name in names}
+    wanted = {(org, normalized) for org, normalized in wanted if normalized}
+    if not wanted:
+        return {}
+    aliases = VendorAlias.objects.filter(
+        organization_id__in={org for org, _ in wanted},
+        normalized_alias__in={normalized for _, normalized in wanted},
+    ).exclude(source=VendorAlias.Source.SIMILARITY).values_list('organization_id', 'normalized_alias', 'vendor_id')
+    return {
+        (str(org), normalized): vendor_id
+        for org, normalized, vendor_id in aliases
+        if (str(org), normalized) in wanted
+    }
+
+
+def same_confirmed_vendor(organization_id, a: Optional[str], b: Optional[str],
+                          aliases: Optional[Dict[Tuple[str, str], int]] = None) -> bool:
+    """
+    Whether two raw names are known spellings of one vendor
+
+    True when they normalize to the same name, or both have exact or
+    curated aliases of the same vendor. A link created by similarity
+    alone does not count.
+
+    Args:
+        aliases: Result of confirmed_aliases() covering both names, to
+            avoid a query per call in batch jobs
+    """
+    normalized_a, normalized_b = normalize_vendor_name(a), normalize_vendor_name(b)
+    if not normalized_a or not normalized_b:
+        return False
+    if normalized_a == normalized_b:
+        return True
+    if aliases is None:
+        aliases = confirmed_aliases([(organization_id, a), (organization_id, b)])
+    vendor_id = aliases.get((str(organization_id), normalized_a))
+    return vendor_id is not None and vendor_id == aliases.get((str(organization_id), normalized_b))
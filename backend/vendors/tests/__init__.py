@@ -0,0 +1 @@
+# Vendors tests package
@@ -0,0 +1,87 @@
+"""Tests for vendor normalization and resolution"""
+from django.test import SimpleTestCase, TestCase
+from users.tests.factories import OrganizationFactory
+from ..models import Vendor, VendorAlias
+from ..services import (
+    confirmed_aliases, normalize_vendor_name, resolve_vendor, same_confirmed_vendor, vendor_names_match
+)
+
+
+class NormalizeVendorNameTest(SimpleTestCase):
+    """Test normalize_vendor_name and vendor_names_match"""
+
+    def test_legal_suffixes_and_punctuation(self):
+        self.assertEqual(normalize_vendor_name('ACME Ltd'), 'acme')
+        self.assertEqual(normalize_vendor_name('Acme Limited'), 'acme')
+        self.assertEqual(normalize_vendor_name('The ACME Co., Ltd.'), 'acme')
+        self.assertEqual(normalize_vendor_name('Café Supplies GmbH'), 'cafe supplies')
+        self.assertEqual(normalize_vendor_name('Company'), 'company')
+        self.assertEqual(normalize_vendor_name(None), '')
+
+    def test_names_match(self):
+        self.assertTrue(vendor_names_match('ACME Ltd', 'Acme Limited'))
+        self.assertTrue(vendor_names_match('Acme Office Supplies Inc', 'ACME OFFICE SUPPLIES'))
+        self.assertFalse(vendor_names_match('Acme', 'Globex'))
+
+
+class ResolveVendorTest(TestCase):
+    """Test resolve_vendor"""
+
+    def setUp(self):
+        self.organization = OrganizationFactory.create()
+
+    def test_spellings_resolve_to_one_vendor(self):
+        first = resolve_vendor(self.organization.id, 'ACME Ltd')
+        second = resolve_vendor(self.organization.id, 'Acme Limited')
+        self.assertEqual(first, second)
+        self.assertEqual(first.name, 'ACME Ltd')
+        self.assertEqual(VendorAlias.objects.get(vendor=first).occurrences, 2)
+
+    def test_similar_name_is_recorded_as_alias(self):
+        vendor = resolve_vendor(self.organization.id, 'Acme Office Supplies')
+        self.assertEqual(resolve_vendor(self.organization.id, 'Acme Ofice Supplies'), vendor)
+        self.assertEqual(vendor.aliases.count(), 2)
+
+    def test_vendors_are_per_organization(self):
+        other = OrganizationFactory.create()
+        self.assertNotEqual(
+            resolve_vendor(self.organization.id, 'Acme'),
+            resolve_vendor(other.id, 'Acme')
+        )
+
+    def test_blank_and_create_false(self):
+        self.assertIsNone(resolve_vendor(self.organization.id, '  '))
+        self.assertIsNone(resolve_vendor(self.organization.id, 'Globex', create=False))
+        self.assertFalse(Vendor.objects.exists())
+
+    def test_distinct_suppliers_are_not_merged(self):
+        supplies = resolve_vendor(self.organization.id, 'Kigali Office Supplies')
+        solutions = resolve_vendor(self.organization.id, 'Kigali Office Solutions')
+        self.assertNotEqual(supplies, solutions)
+
+
+class SameConfirmedVendorTest(TestCase):
+    """Test same_confirmed_vendor"""
+
+    def setUp(self):
+        self.organization = OrganizationFactory.create()
+        self.vendor = resolve_vendor(self.organization.id, 'Acme Office Supplies')
+
+    def test_exact_spellings(self):
+        self.assertTrue(same_confirmed_vendor(self.organization.id, 'ACME Office Supplies Ltd', 'Acme Office Supplies'))
+        self.assertFalse(same_confirmed_vendor(self.organization.id, '', 'Acme Office Supplies'))
+
+    def test_similarity_alias_is_not_proof(self):
+        resolve_vendor(self.organization.id, 'Acme Ofice Supplies')
+        alias = VendorAlias.objects.get(normalized_alias='acme ofice supplies')
+        self.assertEqual(alias.source, VendorAlias.Source.SIMILARITY)
+        self.assertFalse(same_confirmed_vendor(self.organization.id, 'Acme Ofice Supplies', 'Acme Office Supplies'))
+
+    def test_curated_alias_is_proof(self):
+        VendorAlias.objects.create(
+            vendor=self.vendor, organization=self.organization,
+            alias='AOS Kigali', normalized_alias='aos kigali', source=VendorAlias.Source.CURATED
+        )
+        self.assertTrue(same_confirmed_vendor(self.organization.id, 'AOS Kigali', 'Acme Office Supplies'))
+        aliases = confirmed_aliases([(self.organization.id, 'AOS Kigali'), (self.organization.id, 'Acme Office Supplies')])
+        self.assertEqual(set(aliases.values()), {self.vendor.id})
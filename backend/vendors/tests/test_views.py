@@ -0,0 +1,60 @@
+"""Tests for vendor endpoints and vendor filtering of requests"""
+from io import StringIO
+from django.core.management import call_command
+from django.test import TestCase
+from rest_framework import status
+from purchase_requests.models import Document
+from purchase_requests.tests.factories import PurchaseRequestFactory
+from users.tests.factories import OrganizationFactory, UserFactory
+from users.tests.test_utils import get_authenticated_client
+from documents.tasks import store_receipt_result
+from ..services import resolve_vendor
+
+
+class VendorFilterTests(TestCase):
+    """Tests for GET /api/requests/?vendor= and GET /api/vendors/"""
+
+    def setUp(self):
+        self.organization = OrganizationFactory.create()
+        self.staff = UserFactory.create_staff(organization=self.organization)
+        self.acme = resolve_vendor(self.organization.id, 'ACME Ltd')
+        self.globex = resolve_vendor(self.organization.id, 'Globex')
+        self.acme_request = PurchaseRequestFactory.create(created_by=self.staff, organization=self.organization)
+        self.globex_request = PurchaseRequestFactory.create(created_by=self.staff, organization=self.organization)
+        for request, vendor in [(self.acme_request, self.acme), (self.globex_request, self.globex)]:
+            for document_type in (Document.DocumentType.PROFORMA, Document.DocumentType.PO):
+                Document.objects.create(
+                    request=request, document_type=document_type, vendor=vendor,
+                    file_url='https://files/doc.pdf', extracted_data={'vendor_name': vendor.name}
+                )
+
+    def test_filter_requests_by_vendor(self):
+        client, _ = get_authenticated_client(self.staff, self.organization)
+        response = client.get(f'/api/requests/?vendor={self.acme.id}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['id'] for r in response.data['results']], [str(self.acme_request.id)])
+
+    def test_invalid_vendor_filter(self):
+        client, _ = get_authenticated_client(self.staff, self.organization)
+        response = client.get('/api/requests/?vendor=acme')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_vendor_search(self):
+        client, _ = get_authenticated_client(self.staff, self.organization)
+        response = client.get('/api/vendors/?search=Acme Limited')
+        self.assertEqual([v['id'] for v in response.data['results']], [self.acme.id])
+
+    def test_receipt_from_vendor_alias_is_valid(self):
+        """Test that 'Acme Limited' on the receipt matches 'ACME Ltd' on the PO"""
+        document = store_receipt_result(
+            str(self.acme_request.id), 'https://files/receipt.pdf',
+            {'seller_name': 'Acme Limited', 'items': [], 'total_amount': 0}
+        )
+        self.assertEqual(document.vendor, self.acme)
+        self.assertNotIn('seller_mismatch', [d['type'] for d in document.extracted_data['validation']['discrepancies']])
+
+    def test_resolve_vendors_command_links_documents(self):
+        Document.objects.update(vendor=None)
+        call_command('resolve_vendors', '--chunk-size', '1', stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(Document.objects.filter(vendor=self.acme).count(), 2)
+        self.assertFalse(Document.objects.filter(vendor__isnull=True).exists())
@@ -0,0 +1,22 @@
+from rest_framework import viewsets
+from rest_framework.permissions import IsAuthenticated
+from .models import Vendor
+from .serializers import VendorSerializer
+from .services import normalize_vendor_name
+
+
+class VendorViewSet(viewsets.ReadOnlyModelViewSet):
+    """Vendors of the user's organization, for vendor filters and lookups"""
+    serializer_class = VendorSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        queryset = Vendor.objects.filter(
+            organization=self.request.user.organization
+        ).prefetch_related('aliases')
+        
+        search = self.request.query_params.get('search')
+        if search:
+            normalized = normalize_vendor_name(search)
+            queryset = queryset.filter(aliases__normalized_alias__startswith=normalized).distinct()
+        return queryset
@@ -197,7 +197,8 @@ export default function RequestDetailPage() {
                 <div>
                   <div className="font-medium">Purchase Order</div>
                   <div className="text-sm text-gray-500">
-                    PO-{request.id.slice(0, 8).toUpperCase()}
+                    {request.po_number ||
+                      `PO-${request.id.slice(0, 8).toUpperCase()}`}
                   </div>
                 </div>
               </div>
@@ -8,6 +8,7 @@ export interface User {
   last_name: string;
   role: EUserRole;
   approval_level: number | null;
+  notification_delivery: 'IMMEDIATE' | 'DIGEST';
   organization: string;
   organization_name: string;
   is_active: boolean;
@@ -39,9 +40,53 @@ export interface Document {
   document_type: EDocumentType;
   file_url: string;
   extracted_data: Record<string, unknown>;
+  vendor: number | null;
+  vendor_name: string | null;
+  match_report: Record<string, unknown>;
   created_at: string;
 }
 
+export interface Vendor {
+  id: number;
+  name: string;
+  normalized_name: string;
+  aliases: string[];
+  created_at: string;
+}
+
+export interface ExtractedLineItem {
+  id: number;
+  document: number;
+  request: string;
+  document_type: "PROFORMA" | "PO" | "RECEIPT";
+  position: number;
+  description: string;
+  normalized_description: string;
+  quantity: string | null;
+  unit_price: string | null;
+  total: string | null;
+  currency: string;
+  vendor: number | null;
+  vendor_name: string | null;
+  document_created_at: string;
+}
+
+export type ProformaExtractionStatus =
+  | "NONE"
+  | "PENDING"
+  | "PROCESSING"
+  | "COMPLETED"
+  | "FAILED";
+
+export interface DuplicateWarning {
+  kind: "exact" | "near" | "invoice_number" | "vendor_date_total";
+  request: string;
+  document_type: "PROFORMA" | "RECEIPT";
+  file_url: string;
+  distance: number | null;
+  uploaded_as: "PROFORMA" | "RECEIPT";
+}
+
 export interface PurchaseRequest {
   id: string;
   organization: string;
@@ -55,9 +100,13 @@ export interface PurchaseRequest {
   created_by_name: string;
   updated_by: string | null;
   current_approval_level: number;
+  po_number: string;
   proforma_file_url: string | null;
   purchase_order_file_url: string | null;
   receipt_file_url: string | null;
+  proforma_extraction_status: ProformaExtractionStatus;
+  proforma_extraction_error: string;
+  duplicate_warnings: DuplicateWarning[];
   items: RequestItem[];
   approvals: Approval[];
   documents: Document[];